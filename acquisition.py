@@ -0,0 +1,367 @@
+"""
+Simulated EEG acquisition for powered-on amplifiers.
+
+AcquisitionEngine turns the fleet of an EEGControlSystem into data sources: every
+powered-on amplifier with attached sensors produces blocks of samples, one channel per
+sensor, at its sampling rate and scaled by its gain. Samples go into a preallocated
+RingBuffer per amplifier, from which readers take zero-copy views of the latest samples.
+
+The engine runs on a clock: each tick produces, for every amplifier, the blocks that have
+become due since the last tick. If the engine falls more than max_lag seconds behind,
+the overdue blocks are dropped (and counted) rather than produced late, as a real
+amplifier overruns its buffer instead of stalling.
+
+Requires NumPy.
+
+    engine = AcquisitionEngine(control_system)
+    engine.start()
+    samples, end = engine.stream("A001").ring.latest(1024)
+"""
+import threading
+import time
+
+import numpy as np
+
+DTYPE = np.float32
+
+
+class RingBuffer:
+    """
+    Fixed-size multichannel sample buffer for one writer and any number of readers, without locks.
+
+    The storage holds every sample twice, at position i and i + capacity (a mirrored
+    double buffer), so any run of up to capacity consecutive samples is contiguous in
+    memory and can be handed out as a view without copying. The writer fills in the data
+    first and only then advances written, the total number of samples ever written, so
+    readers never see samples that are not complete. A view stays valid until the writer
+    laps it; check with intact() after using a view that must not have changed.
+
+    Attributes:
+        channels (int): Number of channels (rows).
+        capacity (int): Number of samples per channel kept.
+        written (int): Total number of samples written so far.
+    """
+    def __init__(self, channels, capacity, dtype=DTYPE):
+        self.channels = channels
+        self.capacity = capacity
+        self.written = 0
+        self._data = np.zeros((channels, 2 * capacity), dtype=dtype)
+
+    def write(self, samples):
+        """Appends a (channels, n) block, with n at most capacity."""
+        n = samples.shape[1]
+        capacity = self.capacity
+        if n > capacity:
+            raise ValueError(f"Block of {n} samples does not fit in a ring of {capacity}.")
+        start = self.written % capacity
+        first = min(n, capacity - start)
+        data = self._data
+        data[:, start:start + first] = samples[:, :first]
+        data[:, capacity + start:capacity + start + first] = samples[:, :first]
+        if first < n:
+            rest = n - first
+            data[:, :rest] = samples[:, first:]
+            data[:, capacity:capacity + rest] = samples[:, first:]
+        self.written += n
+
+    def latest(self, n):
+        """Returns (view, end): a (channels, n) view of the latest n samples (fewer if not yet written) and the sample count it ends at."""
+        end = self.written
+        n = min(n, end, self.capacity)
+        stop = end % self.capacity
+        if stop < n:
+            stop += self.capacity
+        return self._data[:, stop - n:stop], end
+
+    def read(self, since, limit=None):
+        """
+        Returns (view, end, lost): the samples written after sample number since, as a view.
+
+        If the writer has already overwritten some of them, reading starts at the oldest
+        sample still kept and lost says how many were skipped. limit caps the number of
+        samples returned.
+        """
+        end = self.written
+        lost = max(0, end - self.capacity - since)
+        since += lost
+        if limit is not None:
+            end = min(end, since + limit)
+        start = since % self.capacity
+        return self._data[:, start:start + end - since], end, lost
+
+    def intact(self, end, n):
+        """Returns True if the n samples ending at sample number end have not been overwritten yet."""
+        return self.written - (end - n) <= self.capacity
+
+
+def synthetic_signal(channels, sampling_rate, seed=0):
+    """
+    Returns one second of synthetic EEG, in microvolts, as a (channels, sampling_rate) array.
+
+    Each channel is a 10 Hz alpha rhythm of its own amplitude and phase plus white noise.
+    The alpha rhythm completes whole cycles in one second, so the table can be played in a loop.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(sampling_rate, dtype=np.float64) / sampling_rate
+    amplitude = rng.uniform(10.0, 50.0, size=(channels, 1))
+    phase = rng.uniform(0.0, 2 * np.pi, size=(channels, 1))
+    signal = amplitude * np.sin(2 * np.pi * 10.0 * t + phase) + rng.normal(0.0, 5.0, size=(channels, sampling_rate))
+    return signal.astype(DTYPE)
+
+
+class AmplifierStream:
+    """
+    The acquisition state of one amplifier.
+
+    Attributes:
+        serial_number (str): Serial number of the amplifier.
+        sampling_rate (int): Samples per second and channel.
+        gain (int): Gain applied to the signal.
+        gains (list): (first sample, gain) of the latest gain changes, oldest first, starting with (0, initial gain).
+        channels (list): (sensor serial number, tag) of every channel, in row order.
+        ring (RingBuffer): The latest samples.
+        started (float): Clock time of sample 0.
+        produced_blocks (int): Number of blocks written to the ring.
+        dropped_blocks (int): Number of blocks skipped because the engine fell behind.
+    """
+    GAIN_HISTORY = 16
+
+    def __init__(self, amplifier, block_size, ring_samples, max_blocks, table, started, ring=None):
+        self.serial_number = amplifier.serial_number
+        self.version = amplifier.version
+        self.sampling_rate = amplifier.sampling_rate
+        self.gain = amplifier.gain
+        self.gains = [(0, self.gain)]
+        self.channels = [(sensor.serial_number, sensor.tag) for sensor in amplifier.sensors]
+        self.block_size = block_size
+        self.ring = RingBuffer(len(self.channels), ring_samples) if ring is None else ring
+        self.started = started
+        self.produced_blocks = 0
+        self.dropped_blocks = 0
+        self._table = table
+        self._offset = hash(self.serial_number) % self.sampling_rate
+        self._scratch = np.empty((len(self.channels), max_blocks * block_size), dtype=DTYPE)
+
+    def set_gain(self, gain):
+        """Applies a new gain from the next block on, and remembers from which sample it applies."""
+        self.gains = (self.gains + [(self.next_sample, gain)])[-self.GAIN_HISTORY:]
+        self.gain = gain
+
+    def gain_at(self, sample):
+        """Returns the gain the given sample was produced with (the oldest remembered gain if it is older)."""
+        for first, gain in reversed(self.gains):
+            if first <= sample:
+                return gain
+        return self.gains[0][1]
+
+    @property
+    def next_sample(self):
+        """Sample number of the next block to produce, counting dropped blocks."""
+        return (self.produced_blocks + self.dropped_blocks) * self.block_size
+
+    def produce(self, blocks):
+        """Writes the given number of blocks to the ring buffer in one vectorized step."""
+        n = blocks * self.block_size
+        table = self._table
+        period = table.shape[1]
+        out = self._scratch[:, :n]
+        position = (self._offset + self.next_sample) % period
+        done = 0
+        while done < n:
+            count = min(n - done, period - position)
+            np.multiply(table[:, position:position + count], self.gain, out=out[:, done:done + count])
+            done += count
+            position = 0
+        self.ring.write(out)
+        self.produced_blocks += blocks
+
+
+class AcquisitionEngine:
+    """
+    Produces sample blocks for every powered-on amplifier of a control system.
+
+    The engine follows the control system, through its change feed: an amplifier starts
+    producing when it is powered on with sensors attached and stops when it is powered off
+    or removed. A gain change is applied from the next block on; a change of sampling rate
+    or sensors restarts the stream with a new ring buffer, since its shape changes.
+
+    Attributes:
+        control_system (EEGControlSystem): The fleet to acquire from.
+        block_size (int): Samples per block and channel.
+        ring_seconds (float): Seconds of samples kept per amplifier.
+        max_lag (float): How far (in seconds) production may fall behind before blocks are dropped.
+        tick (float): Seconds between two production rounds of the background thread.
+    """
+    def __init__(self, control_system, block_size=32, ring_seconds=1.0, max_lag=0.25, tick=0.01,
+                 clock=time.monotonic):
+        self.control_system = control_system
+        self.block_size = block_size
+        self.ring_seconds = ring_seconds
+        self.max_lag = max_lag
+        self.tick = tick
+        self.clock = clock
+        self._streams = {}
+        self._tables = {}
+        # Following the change feed, a sync looks only at the amplifiers named in the new events. A
+        # registry may be shared with other processes, whose changes never reach this process's
+        # feed, so with one the engine rescans the fleet whenever its state tag changes.
+        self._feed = getattr(control_system, "changes", None) if getattr(control_system, "registry", None) is None \
+            else None
+        self._synced_tag = None
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def stream(self, serial_number):
+        """Returns the AmplifierStream of an amplifier, or None if it is not acquiring."""
+        return self._streams.get(serial_number)
+
+    def streams(self):
+        """Returns the streams of every acquiring amplifier."""
+        return list(self._streams.values())
+
+    def _table(self, channels, sampling_rate):
+        table = self._tables.get((channels, sampling_rate))
+        if table is None:
+            table = self._tables[channels, sampling_rate] = synthetic_signal(channels, sampling_rate)
+        return table
+
+    def _max_blocks(self, sampling_rate):
+        """Returns the largest number of blocks produced in one round: the backlog allowed by max_lag."""
+        return int(self.max_lag * sampling_rate) // self.block_size + 1
+
+    def _ring_samples(self, sampling_rate):
+        # Whole blocks, and at least enough for the largest backlog produce() may write at once.
+        blocks = max(int(self.ring_seconds * sampling_rate) // self.block_size, self._max_blocks(sampling_rate))
+        return blocks * self.block_size
+
+    def sync(self, now=None):
+        """Starts, restarts and stops streams to match the control system. Cheap when nothing has changed."""
+        tag = self._feed.sequence if self._feed is not None else self.control_system.state_tag()
+        if tag == self._synced_tag:
+            return
+        with self._sync_lock:
+            if tag != self._synced_tag:
+                self._sync(tag, self.clock() if now is None else now)
+
+    def _sync(self, tag, now):
+        changed = self._changed_amplifiers()
+        if changed is None:
+            streams, seen = {}, set()
+            for amplifier in self.control_system.list_amplifiers():
+                seen.add(amplifier.serial_number)
+                self._resync(streams, amplifier.serial_number, amplifier, now)
+            for serial_number in self._streams.keys() - seen:
+                self._resync(streams, serial_number, None, now)
+        else:
+            streams = dict(self._streams)
+            for serial_number in changed:
+                self._resync(streams, serial_number, self.control_system.find_amplifier(serial_number), now)
+        self._streams = streams
+        self._synced_tag = tag
+
+    def _changed_amplifiers(self):
+        """Returns the serial numbers of the amplifiers in the change events since the last sync, or None to rescan the fleet."""
+        if self._feed is None or self._synced_tag is None:
+            return None
+        events, resync = self._feed.since(self._synced_tag)
+        if resync or any(event["op"] == "load" for event in events):
+            return None
+        return {event.get("amplifier_serial", event.get("serial_number")) for event in events}
+
+    def _resync(self, streams, serial_number, amplifier, now):
+        """Brings the stream of one amplifier (None if it was removed) in streams up to date."""
+        previous = self._streams.get(serial_number)
+        stream = None if amplifier is None else self._synced_stream(amplifier, now)
+        if stream is None:
+            streams.pop(serial_number, None)
+        else:
+            streams[serial_number] = stream
+        if previous is not None and previous is not stream:
+            self._drop_stream(previous, stream is not None)
+
+    def _synced_stream(self, amplifier, now):
+        """Returns the stream an amplifier should have: its current one, updated in place if it can be, a new one, or None."""
+        if not amplifier.is_on:
+            return None
+        stream = self._streams.get(amplifier.serial_number)
+        if stream is not None and stream.version == amplifier.version:
+            return stream
+        sensors = amplifier.sensors
+        if not sensors:
+            return None
+        channels = [(sensor.serial_number, sensor.tag) for sensor in sensors]
+        if (stream is not None and stream.sampling_rate == amplifier.sampling_rate and stream.channels == channels
+                and self._update_stream(stream, amplifier)):
+            return stream
+        return self._new_stream(amplifier, channels, now)
+
+    def _update_stream(self, stream, amplifier):
+        """Applies a change of gain only to a stream in place. Returns False if the stream must be restarted instead."""
+        if stream.gain != amplifier.gain:
+            stream.set_gain(amplifier.gain)
+        stream.version = amplifier.version
+        return True
+
+    def _drop_stream(self, stream, replaced):
+        """Called for a stream that stopped, or was replaced by a new one, in the last sync."""
+
+    def _new_stream(self, amplifier, channels, now):
+        rate = amplifier.sampling_rate
+        return AmplifierStream(amplifier, self.block_size, self._ring_samples(rate), self._max_blocks(rate),
+                               self._table(len(channels), rate), now)
+
+    def step(self, now=None):
+        """Runs one production round: writes every block that is due by now. Returns the number of blocks written."""
+        now = self.clock() if now is None else now
+        self.sync(now)
+        written = 0
+        for stream in self._streams.values():
+            due = int((now - stream.started) * stream.sampling_rate) // self.block_size \
+                - stream.produced_blocks - stream.dropped_blocks
+            if due <= 0:
+                continue
+            allowed = self._max_blocks(stream.sampling_rate)
+            if due > allowed:
+                stream.dropped_blocks += due - allowed
+                due = allowed
+            stream.produce(due)
+            written += due
+        return written
+
+    def start(self):
+        """Starts producing in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="acquisition", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_tick = self.clock()
+        while not self._stop.is_set():
+            self.step()
+            next_tick += self.tick
+            delay = next_tick - self.clock()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_tick = self.clock()
+
+    def stop(self):
+        """Stops the background thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        """Returns totals over every acquiring amplifier: amplifiers, channels, produced_blocks, dropped_blocks."""
+        streams = self.streams()
+        return {
+            "amplifiers": len(streams),
+            "channels": sum(len(stream.channels) for stream in streams),
+            "produced_blocks": sum(stream.produced_blocks for stream in streams),
+            "dropped_blocks": sum(stream.dropped_blocks for stream in streams),
+        }
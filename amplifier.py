@@ -11,7 +11,11 @@ class Amplifier:
         gain (int): The gain level of the amplifier, between 1 and 100.
         sensors (list): A list of sensors associated with this amplifier.
         is_on (bool): The power status of the amplifier, True if it's on, False otherwise.
+        version (int): Change counter, bumped whenever the settings, power state or sensors change.
     """
+    __slots__ = ("serial_number", "model_string", "manufacturer", "next_maintenance", "sampling_rate", "gain",
+                 "sensors", "is_on", "version")
+
     def __init__(self, serial_number, model_string, manufacturer, next_maintenance, sampling_rate, gain):
         self.serial_number = serial_number
         self.model_string = model_string
@@ -21,30 +25,55 @@ class Amplifier:
         self.gain = gain
         self.sensors = []
         self.is_on = False
+        self.version = 0
 
-    def set_gain(self, gain):
-        if 1 <= gain <= 100:
-            self.gain = gain
-        else:
+    @staticmethod
+    def validate_gain(gain):
+        if not 1 <= gain <= 100:
             raise ValueError("Gain level must be between 1 and 100 (including)")
 
-    def set_sampling_rate(self, sampling_rate):
-        if sampling_rate in [256, 512, 1024]:
-            self.sampling_rate = sampling_rate
-        else:
+    @staticmethod
+    def validate_sampling_rate(sampling_rate):
+        if sampling_rate not in [256, 512, 1024]:
             raise ValueError("Sampling rate is typically 256, 512, or 1024 Hz")
 
+    def set_gain(self, gain):
+        self.validate_gain(gain)
+        self.gain = gain
+        self.version += 1
+
+    def set_sampling_rate(self, sampling_rate):
+        self.validate_sampling_rate(sampling_rate)
+        self.sampling_rate = sampling_rate
+        self.version += 1
+
+    def set_next_maintenance(self, next_maintenance):
+        self.next_maintenance = next_maintenance
+        self.version += 1
+
+    def __setstate__(self, state):
+        # Accepts both slot state and the __dict__ state of snapshots pickled before __slots__.
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self.version = 0
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def power_on(self):
         self.is_on = True
+        self.version += 1
 
     def power_off(self):
         self.is_on = False
+        self.version += 1
 
     def add_sensor(self, sensor):
         self.sensors.append(sensor)
+        self.version += 1
 
     def remove_sensor(self, sensor):
         self.sensors.remove(sensor)
+        self.version += 1
 
     def __str__(self):
             status = "On" if self.is_on else "Off"
@@ -0,0 +1,261 @@
+"""
+Framework-independent parts of the control API.
+
+Shared by the Flask app (control_system_api) and the asyncio app (control_system_asgi), so
+that both set up the control system from the same environment variables and parse and
+answer requests the same way.
+"""
+import base64
+import binascii
+import json
+import os
+
+from amplifier import Amplifier
+from commands import CommandDispatcher
+from control_system import EEGControlSystem
+from drivers import SimulatedDriver
+from journal import Journal
+from metrics import Registry
+from sensor import Sensor
+from snapshots import AutoSave
+from sqlite_registry import SQLiteRegistry
+
+MAX_PAGE_SIZE = 1000
+
+# Seconds between keep-alive comments on an idle change stream, so that proxies and clients see a live connection.
+SSE_KEEPALIVE_SECONDS = 15.0
+SSE_KEEPALIVE = ": keep-alive\n\n"
+
+# Longest a request with ?wait=true waits for a command; it is then answered with the command as it stands.
+COMMAND_WAIT_SECONDS = 30.0
+
+HOME_PAGE = """
+    <h1>EEG Control System API</h1>
+    <p>Welcome to the EEG Control System API by Begum Yivli. Use the following endpoints to interact with the system:</p>
+    <ul>
+        <li><strong>GET /api/amplifiers</strong> - List all amplifiers (supports ?limit=&amp;cursor= pagination and ?format=ndjson streaming)</li>
+        <li><strong>POST /api/amplifiers</strong> - Add an amplifier</li>
+        <li><strong>DELETE /api/amplifiers/&lt;serial_number&gt;</strong> - Remove an amplifier</li>
+        <li><strong>PUT /api/amplifiers/&lt;serial_number&gt;/gain</strong> - Set amplifier gain</li>
+        <li><strong>PUT /api/amplifiers/&lt;serial_number&gt;/sampling_rate</strong> - Set amplifier sampling rate</li>
+        <li><strong>POST /api/amplifiers/&lt;serial_number&gt;/power</strong> - Toggle amplifier power (optionally only from an "expected" state)</li>
+        <li><strong>GET /api/amplifiers/&lt;serial_number&gt;/stream</strong> - Stream the samples of an acquiring amplifier as binary frames</li>
+        <li><strong>GET /api/amplifiers/search</strong> - Search for amplifiers by serial_number, model_string, or manufacturer</li>
+        <li><strong>POST /api/sensors</strong> - Add a sensor</li>
+        <li><strong>POST /api/amplifiers/&lt;amplifier_serial&gt;/sensors</strong> - Add a sensor to an amplifier (404 if either is missing, 409 if the sensor is attached already)</li>
+        <li><strong>DELETE /api/amplifiers/&lt;amplifier_serial&gt;/sensors/&lt;sensor_serial&gt;</strong> - Remove a sensor from an amplifier</li>
+        <li><strong>GET /api/sensors?tag=occipital&amp;assigned=false</strong> - List the sensors at a scalp position</li>
+        <li><strong>GET /api/sensors/&lt;serial_number&gt;</strong> - Get a sensor</li>
+        <li><strong>DELETE /api/sensors/&lt;serial_number&gt;</strong> - Remove a sensor, detaching it first</li>
+        <li><strong>GET /api/amplifiers/&lt;serial_number&gt;/layout</strong> - Get the channel layout of an amplifier by tag</li>
+        <li><strong>PUT /api/amplifiers/&lt;serial_number&gt;/montage</strong> - Attach a whole montage to an amplifier</li>
+        <li><strong>PUT /api/device/&lt;device_type&gt;/&lt;serial_number&gt;/maintenance</strong> - Update a device's maintenance date</li>
+        <li><strong>GET /api/maintenance/due</strong> - List devices due for maintenance (?before=&lt;date&gt; or ?within_days=N)</li>
+        <li><strong>POST /api/amplifiers/bulk</strong> - Add many amplifiers</li>
+        <li><strong>POST /api/sensors/bulk</strong> - Add many sensors</li>
+        <li><strong>POST /api/amplifiers/sensors/bulk</strong> - Attach many sensors to amplifiers</li>
+        <li><strong>PUT /api/amplifiers/bulk/settings</strong> - Set gain, sampling rate or power of many amplifiers</li>
+        <li><strong>GET /api/commands/&lt;command_id&gt;</strong> - Check on a command sent to an amplifier (?wait=true waits for it)</li>
+        <li><strong>POST /api/save</strong> - Save the current system state in the background (?wait=true waits for it)</li>
+        <li><strong>GET /api/save</strong> - Status of the latest snapshot</li>
+        <li><strong>POST /api/load</strong> - Load the saved system state</li>
+        <li><strong>GET /api/changes?since=N</strong> - Changes after a sequence number, to resume following the fleet</li>
+        <li><strong>GET /api/changes/stream</strong> - Follow changes as Server-Sent Events</li>
+        <li><strong>GET /metrics</strong> - Request, operation and fleet metrics in the Prometheus text format</li>
+    </ul>
+    """
+
+
+def create_control_system():
+    """
+    Builds the control system the API serves.
+
+    With EEG_DATABASE set, the fleet lives in that SQLite database, which every worker process shares.
+    Otherwise it is kept in memory, journaled, and loaded from the snapshot at startup; EEG_AUTOSAVE_CHANGES
+    and/or EEG_AUTOSAVE_SECONDS then save a snapshot in the background after that many changes or seconds.
+    """
+    database = os.environ.get("EEG_DATABASE")
+    if database:
+        return EEGControlSystem(registry=SQLiteRegistry(database))
+    control_system = EEGControlSystem(journal=Journal(fsync_interval=1.0, compact_after=100000))
+    control_system.load_state()
+    autosave_changes = os.environ.get("EEG_AUTOSAVE_CHANGES")
+    autosave_seconds = os.environ.get("EEG_AUTOSAVE_SECONDS")
+    if autosave_changes or autosave_seconds:
+        AutoSave(control_system, changes=int(autosave_changes) if autosave_changes else None,
+                 seconds=float(autosave_seconds) if autosave_seconds else None).start()
+    return control_system
+
+
+def create_dispatcher(control_system):
+    """
+    Builds the dispatcher that sends amplifier settings to the hardware, or returns None to apply them in memory.
+
+    With EEG_DRIVER=simulated, gain, sampling rate and power changes go to simulated amplifiers
+    whose round trip takes EEG_DRIVER_LATENCY seconds (default 0.02), and are answered with
+    202 and a command to poll. Without EEG_DRIVER, they are applied at once, as they always were.
+    """
+    driver = os.environ.get("EEG_DRIVER")
+    if not driver:
+        return None
+    if driver != "simulated":
+        raise ValueError(f"Unknown EEG_DRIVER: {driver} (the only driver is 'simulated').")
+    dispatcher = CommandDispatcher(control_system, SimulatedDriver(latency=float(os.environ.get("EEG_DRIVER_LATENCY", 0.02))))
+    dispatcher.start()
+    return dispatcher
+
+
+def command_response(command):
+    """Returns (body, status) for a command: 202 until it has finished, 200 once applied (or superseded), 502 if it failed."""
+    if command.state == "failed":
+        return {"error": command.error, "command": command.to_dict()}, 502
+    if not command.finished:
+        return {"message": f"Command {command.id} queued for Amplifier {command.serial_number}.",
+                "command": command.to_dict()}, 202
+    return {"message": f"Command {command.id} {command.state}.", "command": command.to_dict()}, 200
+
+
+def create_http_metrics():
+    """Returns (registry, request counter, request duration histogram) for an API's /metrics."""
+    registry = Registry()
+    requests = registry.counter(
+        "eeg_http_requests_total", "HTTP requests by method, route and status.", ("method", "route", "status"))
+    request_seconds = registry.histogram(
+        "eeg_http_request_duration_seconds",
+        "Time to produce a response by method and route (a streamed body is not included).", ("method", "route"))
+    return registry, requests, request_seconds
+
+
+def amplifier_from_json(data):
+    """Builds an Amplifier from a request body. Raises KeyError for a missing parameter."""
+    return Amplifier(
+        serial_number=data['serial_number'],
+        model_string=data['model_string'],
+        manufacturer=data['manufacturer'],
+        next_maintenance=data['next_maintenance'],
+        sampling_rate=data['sampling_rate'],
+        gain=data['gain']
+    )
+
+
+def sensor_from_json(data):
+    """Builds a Sensor from a request body. Raises KeyError for a missing parameter."""
+    return Sensor(
+        serial_number=data['serial_number'],
+        model_string=data['model_string'],
+        manufacturer=data['manufacturer'],
+        next_maintenance=data['next_maintenance'],
+        tag=data['tag']
+    )
+
+
+def bulk_settings_targets(data):
+    """
+    Returns (serial_numbers, criteria) from the body of a bulk settings change: one of them, the other None.
+
+    Raises ValueError, with the message for a 400 response, if the body is not an object,
+    serial_numbers is not a list of serial numbers, filter is not an object, or neither is given.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object.")
+    if 'serial_numbers' in data:
+        serial_numbers = data['serial_numbers']
+        if not isinstance(serial_numbers, list) or not all(isinstance(serial, str) for serial in serial_numbers):
+            raise ValueError("serial_numbers must be a list of serial numbers.")
+        return serial_numbers, None
+    if 'filter' in data:
+        if not isinstance(data['filter'], dict):
+            raise ValueError("filter must be an object of search fields.")
+        return None, data['filter']
+    raise ValueError("Missing parameter: 'serial_numbers' or 'filter'")
+
+
+def bulk_add(items, from_json, add_all):
+    """Parses every item, adds the valid ones in one batch and returns per-item results in request order."""
+    results = [None] * len(items)
+    devices, positions = [], []
+    for position, item in enumerate(items):
+        try:
+            devices.append(from_json(item))
+            positions.append(position)
+        except (KeyError, TypeError) as e:
+            results[position] = {"serial_number": item.get('serial_number') if isinstance(item, dict) else None,
+                                 "error": f"Missing parameter: {str(e)}"}
+    for position, result in zip(positions, add_all(devices)):
+        results[position] = result
+    return results
+
+
+def bulk_summary(results):
+    """Returns the body of a bulk response."""
+    failed = sum(1 for result in results if "error" in result)
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
+
+
+def encode_cursor(serial_number):
+    return base64.urlsafe_b64encode(serial_number.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the serial number a cursor points after. Raises ValueError for a malformed cursor."""
+    try:
+        return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def feed_position(feed, since=None, epoch=None, last_event_id=None):
+    """
+    Returns the sequence number a change feed client reads after, or None if it must resync.
+
+    A client resumes from the Last-Event-ID of a change stream ("epoch:sequence") or from
+    since (and optionally epoch); without either, it starts at the latest event. A position
+    from another epoch (another process, or before a restart) calls for a resync. Raises
+    ValueError for a malformed position.
+    """
+    if last_event_id:
+        epoch, _, since = last_event_id.partition(":")
+    if since is None or since == "":
+        return feed.sequence
+    try:
+        after = int(since)
+    except ValueError:
+        raise ValueError("since must be a sequence number.")
+    if after < 0:
+        raise ValueError("since must be a sequence number.")
+    if epoch and epoch != feed.epoch:
+        return None
+    return after
+
+
+def changes_since(feed, after, limit):
+    """Returns (body, status) for a changes-since request; 410 Gone if the client must resync."""
+    events, resync = feed.since(after, limit) if after is not None else ([], True)
+    if resync:
+        return {"error": "The requested changes are no longer available; reload the fleet and follow from 'latest'.",
+                "resync": True, "epoch": feed.epoch, "latest": feed.sequence}, 410
+    return {"epoch": feed.epoch, "events": events, "next_since": events[-1]["sequence"] if events else after,
+            "latest": feed.sequence}, 200
+
+
+def change_stream(feed, after):
+    """
+    Yields the Server-Sent Events text of a change stream, and the sequence number to wait after whenever it has caught up.
+
+    Each event is sent as "event: change" with its JSON as data and "epoch:sequence" as id,
+    so that a reconnecting EventSource resumes where it stopped. If the client must resync
+    (after is None, or it fell behind the feed), a single "event: resync" is sent and the
+    stream ends.
+    """
+    yield "retry: 1000\n\n"
+    while True:
+        events, resync = feed.since(after, MAX_PAGE_SIZE) if after is not None else ([], True)
+        if resync:
+            yield f"event: resync\ndata: {json.dumps({'epoch': feed.epoch, 'latest': feed.sequence})}\n\n"
+            return
+        if events:
+            yield "".join(f"id: {feed.epoch}:{event['sequence']}\nevent: change\ndata: {json.dumps(event)}\n\n"
+                          for event in events)
+            after = events[-1]["sequence"]
+        else:
+            yield after
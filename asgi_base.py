@@ -0,0 +1,198 @@
+"""
+The small ASGI layer under control_system_asgi and shard_router.
+
+A request is read in full and passed to the coroutine registered for its Flask-style rule
+in a Routes table. The Response it returns has a body of bytes, or an async iterator of
+bytes that is sent chunk by chunk and stops as soon as the client goes away.
+
+    routes = Routes()
+
+    @routes.route('/api/things/<name>', methods=['GET'])
+    async def get_thing(request, name):
+        return jsonify({"name": name})
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http":
+            await handle(routes, scope, receive, send, http_requests, http_request_seconds)
+"""
+import asyncio
+import json
+import re
+import time
+import traceback
+from urllib.parse import parse_qs, unquote
+
+
+class HTTPError(Exception):
+    """Raised while handling a request to answer it with an error status and the message."""
+    status = 500
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        if status is not None:
+            self.status = status
+
+
+class BadRequest(HTTPError):
+    """Raised while handling a request that cannot be understood; answered with 400 and the message."""
+    status = 400
+
+
+class Request:
+    """
+    An HTTP request, with its body read in full.
+
+    Attributes:
+        method (str): Request method, in upper case.
+        path (str): Decoded request path.
+        query_string (str): The raw query string.
+        args (dict): Query parameters, first value of each.
+        headers (dict): Request headers, with lower-case names.
+        body (bytes): Request body.
+    """
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query_string = scope.get("query_string", b"").decode("latin-1")
+        query = parse_qs(self.query_string, keep_blank_values=True)
+        self.args = {name: values[0] for name, values in query.items()}
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        self.body = body
+
+    @property
+    def json(self):
+        """The body parsed as JSON. Raises BadRequest if it is missing or not valid JSON."""
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise BadRequest("Invalid JSON body.")
+
+    def arg(self, name, default=None, type=None):
+        """Returns a query parameter, converted with type; default if it is missing or does not convert, as in Flask."""
+        if name not in self.args:
+            return default
+        if type is None:
+            return self.args[name]
+        try:
+            return type(self.args[name])
+        except ValueError:
+            return default
+
+
+class Response:
+    """
+    An HTTP response, whose body is bytes or an async iterator of bytes.
+
+    Attributes:
+        body (bytes | AsyncIterator[bytes]): Response body.
+        status (int): Status code.
+        headers (list): (name, value) header pairs, as bytes.
+    """
+    def __init__(self, body=b"", status=200, content_type="application/json", headers=()):
+        self.body = body
+        self.status = status
+        self.headers = [(b"content-type", content_type.encode())]
+        self.headers.extend((name.encode(), value.encode()) for name, value in headers)
+
+
+def jsonify(data, status=200):
+    return Response(json.dumps(data).encode() + b"\n", status)
+
+
+class Routes:
+    """A table of request handlers by Flask-style rule; <name> matches one path segment and is passed as a keyword."""
+    def __init__(self):
+        self._routes = []  # (pattern, rule, methods, handler)
+
+    def route(self, rule, methods=("GET",)):
+        """Registers a handler for a rule."""
+        pattern = re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", rule) + "$")
+
+        def register(handler):
+            self._routes.append((pattern, rule, set(methods), handler))
+            # Rules without variables are tried first, as in Flask, so /api/amplifiers/search is not a serial number.
+            self._routes.sort(key=lambda entry: entry[0].groups)
+            return handler
+        return register
+
+    def match(self, method, path):
+        """Returns (rule, handler, path variables), or (None, error response, None) if nothing matches."""
+        allowed = set()
+        for pattern, rule, methods, handler in self._routes:
+            found = pattern.match(path)
+            if found is None:
+                continue
+            if method in methods or (method == "HEAD" and "GET" in methods):
+                return rule, handler, {name: unquote(value) for name, value in found.groupdict().items()}
+            allowed |= methods
+        if allowed:
+            response = jsonify({"error": "Method not allowed."}, 405)
+            response.headers.append((b"allow", ", ".join(sorted(allowed)).encode()))
+            return None, response, None
+        return None, jsonify({"error": "Not found."}, 404), None
+
+
+async def handle(routes, scope, receive, send, http_requests, http_request_seconds):
+    """Answers one HTTP request from a Routes table, counting it in the request metrics."""
+    started = time.perf_counter()
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    request = Request(scope, b"".join(chunks))
+    rule, handler, variables = routes.match(request.method, request.path)
+    if rule is None:
+        response = handler
+    else:
+        try:
+            response = await handler(request, **variables)
+        except HTTPError as e:
+            response = jsonify({"error": str(e)}, e.status)
+        except Exception:
+            traceback.print_exc()
+            response = jsonify({"error": "Internal server error."}, 500)
+    # Labelled by route pattern, not path, so that serial numbers do not each make a new series.
+    http_requests.labels(request.method, rule or "unmatched", str(response.status)).inc()
+    if rule is not None:
+        http_request_seconds.labels(request.method, rule).observe(time.perf_counter() - started)
+    await respond(response, request.method == "HEAD", receive, send)
+
+
+async def respond(response, head, receive, send):
+    body = response.body
+    headers = response.headers
+    if isinstance(body, bytes):
+        headers = headers + [(b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    if isinstance(body, bytes) or head:
+        await send({"type": "http.response.body", "body": b"" if head else body})
+        if not isinstance(body, bytes):
+            await body.aclose()
+        return
+    # A streamed body may never end (sample streams), so it stops as soon as the client goes away.
+    sending = asyncio.ensure_future(send_stream(body, send))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    await asyncio.wait((sending, disconnect), return_when=asyncio.FIRST_COMPLETED)
+    for task in (sending, disconnect):
+        task.cancel()
+    await asyncio.gather(sending, disconnect, return_exceptions=True)
+    if sending.done() and not sending.cancelled() and sending.exception() is not None:
+        traceback.print_exception(sending.exception())
+
+
+async def send_stream(body, send):
+    try:
+        async for chunk in body:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        await body.aclose()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
@@ -0,0 +1,44 @@
+"""Helpers for benchmarking control_system_api with the Flask test client."""
+import importlib
+import os
+import sys
+import tempfile
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_api(module="control_system_api"):
+    """
+    Imports control_system_api (or another API module) inside a fresh temporary directory.
+
+    The API loads and journals its state in the working directory at import time, so
+    running it elsewhere keeps the benchmark away from the real amplifier_repository files.
+    Returns (module, temporary directory); keep the directory alive while benchmarking.
+    """
+    directory = tempfile.TemporaryDirectory()
+    if REPOSITORY not in sys.path:
+        sys.path.insert(0, REPOSITORY)
+    os.chdir(directory.name)
+    sys.modules.pop(module, None)
+    return importlib.import_module(module), directory
+
+
+def amplifier_json(amplifier):
+    return {
+        "serial_number": amplifier.serial_number,
+        "model_string": amplifier.model_string,
+        "manufacturer": amplifier.manufacturer,
+        "next_maintenance": amplifier.next_maintenance,
+        "sampling_rate": amplifier.sampling_rate,
+        "gain": amplifier.gain,
+    }
+
+
+def sensor_json(sensor):
+    return {
+        "serial_number": sensor.serial_number,
+        "model_string": sensor.model_string,
+        "manufacturer": sensor.manufacturer,
+        "next_maintenance": sensor.next_maintenance,
+        "tag": sensor.tag,
+    }
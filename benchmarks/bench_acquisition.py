@@ -0,0 +1,55 @@
+"""
+Runs the simulated acquisition engine in real time and reports whether it keeps up.
+
+Every amplifier is powered on with the given number of sensors at the given sampling
+rate, and the engine's background thread produces blocks for the given number of
+seconds. Dropped blocks are blocks the engine skipped because it fell more than
+max_lag behind real time; zero means the load is sustainable on this machine.
+
+Usage:
+    python -m benchmarks.bench_acquisition [--amplifiers 25 50 100] [--channels 256] [--rate 1024] [--seconds 5]
+"""
+import argparse
+import time
+
+from acquisition import AcquisitionEngine
+from benchmarks.fleet import make_control_system, quiet
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, nargs="+", default=[25, 50, 100])
+    parser.add_argument("--channels", type=int, default=256)
+    parser.add_argument("--rate", type=int, default=1024)
+    parser.add_argument("--block-size", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'amplifiers':>10} {'channels':>8} {'Msamples/s':>10} {'produced':>9} {'dropped':>8} {'busy %':>7}")
+    for count in args.amplifiers:
+        control_system = make_control_system(count, sensors_per_amplifier=args.channels)
+        with quiet():
+            control_system.update_amplifiers(list(control_system.amplifiers), sampling_rate=args.rate, power=True)
+        engine = AcquisitionEngine(control_system, block_size=args.block_size)
+        engine.sync()
+        busy = 0.0
+        step = engine.step
+
+        def timed_step(now=None):
+            nonlocal busy
+            start = time.perf_counter()
+            written = step(now)
+            busy += time.perf_counter() - start
+            return written
+        engine.step = timed_step
+        engine.start()
+        time.sleep(args.seconds)
+        engine.stop()
+        stats = engine.stats()
+        samples = stats["produced_blocks"] * args.block_size * args.channels
+        print(f"{count:>10} {stats['channels']:>8} {samples / args.seconds / 1e6:>10.1f} "
+              f"{stats['produced_blocks']:>9} {stats['dropped_blocks']:>8} {100 * busy / args.seconds:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Compares the Flask development server with the asyncio ASGI app under many concurrent clients.
+
+Each server runs in its own process on the loopback interface, over a fleet of the given
+size. For every concurrency level, that many connections are opened at once and each sends
+requests back to back for a fixed time: nine in ten look an amplifier up
+(GET /api/amplifiers/search?serial_number=...&limit=1) and one in ten sets a gain
+(PUT /api/amplifiers/<serial>/gain). A client reconnects whenever the server closes the
+connection after a response, as the Flask development server always does, and the time to
+reconnect counts towards that request. Reports requests per second, p50 and p99 latency
+and failed requests (including connections the server refused or dropped).
+
+The client runs on the same machine and takes its share of the CPU: compare the two
+servers with each other, not with numbers measured elsewhere.
+
+The ASGI app is served by uvicorn (pip install uvicorn).
+
+Usage:
+    python -m benchmarks.bench_asgi [--size 10000] [--concurrency 10,100,1000] [--seconds 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.api import REPOSITORY
+from benchmarks.fleet import make_amplifiers, quiet
+
+SERVERS = ("flask", "asgi")
+
+
+def serve(server, port, size):
+    """Runs one of the servers over a fresh fleet until killed (the --serve mode of this script)."""
+    from benchmarks.api import load_api
+    with quiet():
+        api, directory = load_api("control_system_api" if server == "flask" else "control_system_asgi")
+        api.control_system.add_amplifiers(make_amplifiers(size))
+    print("ready", flush=True)
+    # Every mutation prints a line; keep the terminal out of the measurement.
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    if server == "flask":
+        from werkzeug.serving import make_server
+        httpd = make_server("127.0.0.1", port, api.app, threaded=True)
+        # Clients connect all at once; the default backlog of 128 would refuse most of them.
+        httpd.socket.listen(4096)
+        httpd.serve_forever()
+    else:
+        import uvicorn
+        uvicorn.run(api.app, host="127.0.0.1", port=port, log_level="error", access_log=False, backlog=4096)
+
+
+def start_server(server, size):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_asgi", "--serve", server, "--port", str(port), "--size", str(size)],
+        stdout=subprocess.PIPE, text=True, cwd=REPOSITORY)
+    if process.stdout.readline().strip() != "ready":
+        raise RuntimeError(f"The {server} server did not start.")
+    # The socket is bound just after the fleet is built.
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError(f"The {server} server did not start listening.")
+            time.sleep(0.05)
+
+
+def make_request(rng, size):
+    serial_number = f"AMP-{rng.randrange(size):08d}"
+    if rng.random() < 0.9:
+        return (f"GET /api/amplifiers/search?serial_number={serial_number}&limit=1 HTTP/1.1\r\n"
+                f"Host: 127.0.0.1\r\n\r\n").encode()
+    body = json.dumps({"gain": rng.randint(1, 100)})
+    return (f"PUT /api/amplifiers/{serial_number}/gain HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n{body}").encode()
+
+
+async def read_response(reader):
+    """Reads one response with a Content-Length body. Returns (status code, whether the connection stays open)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    length, keep_alive = 0, True
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        name = name.lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "connection" and value.strip().lower() == "close":
+            keep_alive = False
+    await reader.readexactly(length)
+    return int(lines[0].split()[1]), keep_alive
+
+
+async def client(port, size, seed, connected, start, stop, latencies, errors, make_request=make_request):
+    rng = random.Random(seed)
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        errors.append("connect")
+        connected()
+        return
+    connected()
+    await start.wait()
+    try:
+        while not stop.is_set():
+            request = make_request(rng, size)
+            began = time.perf_counter()
+            if writer is None:
+                # The server closed the connection after the last response; reconnecting is part of this request.
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - began)
+            if status >= 400:
+                errors.append(status)
+            if not keep_alive:
+                writer.close()
+                writer = None
+    except (OSError, asyncio.IncompleteReadError):
+        errors.append("connection")
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def measure(port, size, concurrency, seconds, make_request=make_request):
+    """
+    Returns (requests per second, sorted latencies, errors) for concurrency connections over seconds.
+
+    make_request(rng, size) returns the bytes of each request; by default, the search and gain mix above.
+    """
+    start, stop = asyncio.Event(), asyncio.Event()
+    latencies, errors = [], []
+    pending = concurrency
+    all_connected = asyncio.Event()
+
+    def connected():
+        nonlocal pending
+        pending -= 1
+        if not pending:
+            all_connected.set()
+    tasks = [asyncio.ensure_future(client(port, size, seed, connected, start, stop, latencies, errors, make_request))
+             for seed in range(concurrency)]
+    await all_connected.wait()
+    start.set()
+    began = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    count = len(latencies)
+    elapsed = time.perf_counter() - began
+    await asyncio.wait(tasks, timeout=30)
+    for task in tasks:
+        task.cancel()
+    return count / elapsed, sorted(latencies[:count]), errors
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000 if latencies else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10_000)
+    parser.add_argument("--concurrency", default="10,100,1000", help="comma-separated numbers of connections")
+    parser.add_argument("--seconds", type=float, default=5.0, help="measurement time per concurrency level")
+    parser.add_argument("--servers", default=",".join(SERVERS), help="comma-separated: flask, asgi")
+    parser.add_argument("--serve", choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.size)
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    levels = [int(level) for level in args.concurrency.split(",")]
+    print(f"{args.size} amplifiers, {args.seconds:g} s per level, 90% searches and 10% gain changes")
+    print(f"{'server':<7} {'connections':>11} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for server in args.servers.split(","):
+        if server == "asgi":
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                print("asgi    skipped: uvicorn is not installed")
+                continue
+        process, port = start_server(server, args.size)
+        try:
+            for concurrency in levels:
+                rate, latencies, errors = asyncio.run(measure(port, args.size, concurrency, args.seconds))
+                print(f"{server:<7} {concurrency:>11} {rate:>9.0f} {percentile(latencies, 0.5):>9.2f} "
+                      f"{percentile(latencies, 0.99):>9.2f} {len(errors):>7}")
+        finally:
+            process.kill()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
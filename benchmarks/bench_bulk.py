@@ -0,0 +1,67 @@
+"""
+Compares provisioning a rack through the single-item REST endpoints with the bulk endpoints.
+
+For N amplifiers with 8 sensors each, the benchmark adds the amplifiers and sensors, attaches
+the sensors and sets the gain of every amplifier, once with one request per item and once
+with one bulk request per step, using the Flask test client.
+
+Usage:
+    python -m benchmarks.bench_bulk [--amplifiers 200 2000]
+"""
+import argparse
+import time
+
+from benchmarks.api import amplifier_json, load_api, sensor_json
+from benchmarks.fleet import make_amplifiers, make_sensors, quiet
+
+SENSORS_PER_AMPLIFIER = 8
+
+
+def single_requests(client, amplifiers, sensors):
+    for amplifier in amplifiers:
+        client.post("/api/amplifiers", json=amplifier_json(amplifier))
+    for sensor in sensors:
+        client.post("/api/sensors", json=sensor_json(sensor))
+    for i, sensor in enumerate(sensors):
+        amplifier = amplifiers[i // SENSORS_PER_AMPLIFIER]
+        client.post(f"/api/amplifiers/{amplifier.serial_number}/sensors", json={"sensor_serial": sensor.serial_number})
+    for amplifier in amplifiers:
+        client.put(f"/api/amplifiers/{amplifier.serial_number}/gain", json={"gain": 50})
+    return len(amplifiers) * 2 + len(sensors) * 2
+
+
+def bulk_requests(client, amplifiers, sensors):
+    client.post("/api/amplifiers/bulk", json={"amplifiers": [amplifier_json(amp) for amp in amplifiers]})
+    client.post("/api/sensors/bulk", json={"sensors": [sensor_json(sensor) for sensor in sensors]})
+    client.post("/api/amplifiers/sensors/bulk", json={"assignments": [
+        {"amplifier_serial": amplifiers[i // SENSORS_PER_AMPLIFIER].serial_number, "sensor_serial": sensor.serial_number}
+        for i, sensor in enumerate(sensors)]})
+    client.put("/api/amplifiers/bulk/settings", json={"serial_numbers": [amp.serial_number for amp in amplifiers],
+                                                      "gain": 50})
+    return len(amplifiers) * 2 + len(sensors) * 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, nargs="+", default=[200, 2000])
+    args = parser.parse_args()
+
+    print(f"{'amplifiers':>10} {'mode':<7} {'operations':>10} {'seconds':>8} {'ops/s':>10}")
+    for count in args.amplifiers:
+        amplifiers = make_amplifiers(count)
+        sensors = make_sensors(count * SENSORS_PER_AMPLIFIER)
+        for mode, run in (("single", single_requests), ("bulk", bulk_requests)):
+            api, directory = load_api()
+            client = api.app.test_client()
+            with quiet():
+                start = time.perf_counter()
+                operations = run(client, amplifiers, sensors)
+                elapsed = time.perf_counter() - start
+            assert len(api.control_system.amplifiers) == count
+            print(f"{count:>10} {mode:<7} {operations:>10} {elapsed:>8.3f} {operations / elapsed:>10.0f}")
+            api.control_system.journal.close()
+            directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
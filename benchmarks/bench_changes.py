@@ -0,0 +1,209 @@
+"""
+Compares polling the fleet with following the change feed.
+
+1. Cost of one dashboard poll through the Flask test client: GET /api/amplifiers (the
+   whole fleet, re-serialized when anything changed) against GET /api/changes?since=N.
+2. Cost the feed adds to every mutation (set_gain with and without publishing).
+3. Fan-out over loopback: a server process (the ASGI app under uvicorn, or the Flask
+   development server) with many Server-Sent Events subscribers, plus one subscriber that
+   never reads. A writer changes gains at a steady rate; reports the delay from each
+   request to each subscriber receiving its event, and the server's memory along the way,
+   which stays flat however far the stalled subscriber falls behind.
+
+Usage:
+    python -m benchmarks.bench_changes [--size 100000] [--subscribers 1000] [--changes 2000] [--rate 50]
+                                       [--server asgi]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+
+from benchmarks.api import load_api
+from benchmarks.bench_asgi import start_server
+from benchmarks.fleet import make_amplifiers, quiet
+
+
+def per_call(func, repeat, runs=1):
+    """Best of runs, in seconds per call."""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / repeat
+
+
+def polling(size):
+    cwd = os.getcwd()
+    with quiet():
+        api, directory = load_api()
+        api.control_system.add_amplifiers(make_amplifiers(size))
+        # Adding the fleet fills the journal, which compacts in the background.
+        api.control_system.wait_for_snapshot()
+    client = api.app.test_client()
+    serials = [f"AMP-{i:08d}" for i in range(size)]
+    state = {"gain": 1, "since": api.control_system.changes.sequence}
+
+    def change():
+        state["gain"] = state["gain"] % 100 + 1
+        with quiet():
+            api.control_system.set_gain(serials[state["gain"] * 7 % size], state["gain"])
+
+    def poll_fleet():
+        change()
+        return len(client.get("/api/amplifiers").get_data())
+
+    def poll_changes():
+        change()
+        body = client.get(f"/api/changes?since={state['since']}").get_json()
+        state["since"] = body["next_since"]
+        return len(json.dumps(body))
+
+    fleet_bytes, changes_bytes = poll_fleet(), poll_changes()
+    fleet_ms = per_call(poll_fleet, 20) * 1000
+    changes_ms = per_call(poll_changes, 1000) * 1000
+    print(f"poll after one change, {size} amplifiers:")
+    print(f"  GET /api/amplifiers        {fleet_ms:>9.2f} ms  {fleet_bytes:>11} bytes")
+    print(f"  GET /api/changes?since=N   {changes_ms:>9.3f} ms  {changes_bytes:>11} bytes")
+
+    control_system = api.control_system
+    feed = control_system.changes
+    publish = feed.publish
+    published_us = bare_us = float("inf")
+    with quiet():
+        # Interleaved, so that a journal compaction or a noisy neighbour hits both sides alike.
+        for _ in range(5):
+            published_us = min(published_us, per_call(lambda: control_system.set_gain(serials[0], 5), 10_000) * 1e6)
+            feed.publish = lambda op, args: None
+            bare_us = min(bare_us, per_call(lambda: control_system.set_gain(serials[0], 5), 10_000) * 1e6)
+            feed.publish = publish
+        control_system.wait_for_snapshot()
+    print(f"set_gain: {bare_us:.2f} us without the feed, {published_us:.2f} us with it "
+          f"({published_us - bare_us:+.2f} us)")
+    control_system.journal.close()
+    os.chdir(cwd)
+    directory.cleanup()
+
+
+async def read_head(reader):
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+    return "transfer-encoding: chunked" in head
+
+
+async def read_body(reader, chunked):
+    """Returns the next piece of a streamed body."""
+    if not chunked:
+        return await reader.read(65536)
+    size = int((await reader.readline()).strip(), 16)
+    data = await reader.readexactly(size)
+    await reader.readexactly(2)
+    return data
+
+
+async def subscriber(port, gate, sent, delays, ready):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /api/changes/stream HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+    chunked = await read_head(reader)
+    ready()
+    buffered, received = b"", 0
+    try:
+        while True:
+            buffered += await read_body(reader, chunked)
+            *messages, buffered = buffered.split(b"\n\n")
+            now = time.perf_counter()
+            for message in messages:
+                if b'"op": "gain"' in message:
+                    delays.append(now - sent[received])
+                    received += 1
+            if received == gate:
+                return
+    finally:
+        writer.close()
+
+
+async def stalled_subscriber(port):
+    """Subscribes and then never reads: the server must not buffer the events it cannot deliver."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /api/changes/stream HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+    return writer
+
+
+async def fan_out(port, size, subscribers, changes, rate, sample_memory):
+    delays, sent = [], []
+    pending = subscribers
+    all_ready = asyncio.Event()
+
+    def ready():
+        nonlocal pending
+        pending -= 1
+        if not pending:
+            all_ready.set()
+    stalled = await stalled_subscriber(port)
+    tasks = [asyncio.ensure_future(subscriber(port, changes, sent, delays, ready)) for _ in range(subscribers)]
+    await all_ready.wait()
+    memory = [sample_memory()]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"gain": 1}).encode()
+    for position in range(changes):
+        sent.append(time.perf_counter())
+        writer.write(f"PUT /api/amplifiers/AMP-{position % size:08d}/gain HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+        length = int(head.split("content-length:")[1].split("\r\n")[0])
+        await reader.readexactly(length)
+        if "connection: close" in head:
+            writer.close()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        if position == changes // 2:
+            memory.append(sample_memory())
+        await asyncio.sleep(1 / rate)
+    await asyncio.wait(tasks, timeout=60)
+    memory.append(sample_memory())
+    writer.close()
+    stalled.close()
+    return sorted(delays), memory
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--changes", type=int, default=2000, help="gain changes made during the fan-out test")
+    parser.add_argument("--rate", type=float, default=50, help="gain changes per second during the fan-out test")
+    parser.add_argument("--server", choices=("asgi", "flask"), default="asgi")
+    args = parser.parse_args()
+
+    polling(args.size)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    process, port = start_server(args.server, 1000)
+    try:
+        delays, memory = asyncio.run(fan_out(port, 1000, args.subscribers, args.changes, args.rate,
+                                             lambda: rss_mb(process.pid)))
+    finally:
+        process.kill()
+        process.wait()
+    expected = args.subscribers * args.changes
+    print(f"fan-out ({args.server}), {args.subscribers} subscribers + 1 stalled, {args.changes} changes "
+          f"at {args.rate:g}/s:")
+    print(f"  delivered {len(delays)}/{expected} events, delay p50 {delays[len(delays) // 2] * 1000:.1f} ms, "
+          f"p99 {delays[int(len(delays) * 0.99)] * 1000:.1f} ms")
+    print(f"  server memory with everyone subscribed {memory[0]:.1f} MB, halfway {memory[1]:.1f} MB, "
+          f"at the end {memory[2]:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
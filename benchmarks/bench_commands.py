@@ -0,0 +1,93 @@
+"""
+Compares sending amplifier settings through the command dispatcher with applying them one by one, blocking.
+
+Every command is a gain change, sent to simulated amplifiers whose round trip takes the
+given latency (5, 20 and 50 ms by default):
+
+- blocking: each command waits for its round trip before the next one is sent, as a request
+  thread calling a driver would (run for --seconds and extrapolated);
+- pipelined: the commands go to as many different amplifiers, so the dispatcher sends them
+  all concurrently, up to its max_in_flight round trips at once;
+- coalesced: the commands go to --amplifiers amplifiers, so most of them arrive while their
+  amplifier already has a round trip in flight and are coalesced into the next one.
+
+Commands are all submitted at once. Reports commands per second, round trips, superseded
+commands, and p50 and p99 time from submitting a command to its completion, and checks
+that every amplifier ends up with the last gain sent to it.
+
+Usage:
+    python -m benchmarks.bench_commands [--latencies 5,20,50] [--commands 5000] [--amplifiers 100] [--seconds 2]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.fleet import make_control_system, quiet
+from commands import CommandDispatcher
+from drivers import SimulatedDriver
+
+
+def blocking(control_system, commands, latency, seconds):
+    """Applies commands one at a time, each after a round trip, for up to seconds. Returns commands per second."""
+    done = 0
+    start = time.perf_counter()
+    for serial_number, gain in commands:
+        time.sleep(latency)
+        control_system.set_gain(serial_number, gain)
+        done += 1
+        if time.perf_counter() - start > seconds:
+            break
+    return done / (time.perf_counter() - start)
+
+
+def dispatched(control_system, commands, latency):
+    """Sends commands through a dispatcher and waits for all of them. Returns (commands per second, dispatcher, commands)."""
+    dispatcher = CommandDispatcher(control_system, SimulatedDriver(latency=latency))
+    dispatcher.start()
+    start = time.perf_counter()
+    sent = [dispatcher.set_gain(serial_number, gain) for serial_number, gain in commands]
+    for command in sent:
+        command.wait()
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+    return len(sent) / elapsed, dispatcher, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencies", default="5,20,50", help="comma-separated round trip times, in ms")
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--amplifiers", type=int, default=100, help="amplifiers the coalesced commands go to")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time the blocking baseline runs per latency")
+    args = parser.parse_args()
+
+    control_system = make_control_system(max(args.commands, args.amplifiers))
+    rng = random.Random(0)
+    workloads = {
+        "pipelined": [(f"AMP-{i:08d}", rng.randint(1, 100)) for i in range(args.commands)],
+        "coalesced": [(f"AMP-{rng.randrange(args.amplifiers):08d}", rng.randint(1, 100)) for _ in range(args.commands)],
+    }
+    print(f"{args.commands} gain changes per run; coalesced runs spread them over {args.amplifiers} amplifiers")
+    print(f"{'latency':>7} {'mode':<10} {'cmd/s':>9} {'speedup':>8} {'round trips':>11} {'superseded':>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for latency_ms in (float(latency) for latency in args.latencies.split(",")):
+        latency = latency_ms / 1000
+        with quiet():
+            baseline = blocking(control_system, workloads["coalesced"], latency, args.seconds)
+        print(f"{latency_ms:>5g}ms {'blocking':<10} {baseline:>9.0f} {1:>7.1f}x {'-':>11} {'-':>10} "
+              f"{latency_ms:>8.1f} {'-':>8}")
+        for mode, commands in workloads.items():
+            with quiet():
+                rate, dispatcher, sent = dispatched(control_system, commands, latency)
+            delays = sorted(command.completed - command.submitted for command in sent)
+            superseded = sum(command.state == "superseded" for command in sent)
+            failed = sum(command.state == "failed" for command in sent)
+            last = dict(commands)
+            wrong = sum(control_system.amplifiers[serial].gain != gain for serial, gain in last.items())
+            print(f"{latency_ms:>5g}ms {mode:<10} {rate:>9.0f} {rate / baseline:>7.1f}x {dispatcher.round_trips:>11} "
+                  f"{superseded:>10} {delays[len(delays) // 2] * 1000:>8.1f} {delays[int(len(delays) * 0.99)] * 1000:>8.1f}"
+                  + (f"  {failed} failed" if failed else "") + (f"  {wrong} amplifiers with a stale gain" if wrong else ""))
+
+
+if __name__ == "__main__":
+    main()
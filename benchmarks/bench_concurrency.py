@@ -0,0 +1,82 @@
+"""
+Measures read and write throughput of a shared EEGControlSystem as reader threads are added.
+
+Reader threads look up amplifiers and read a page of the ordered listing while one writer
+thread keeps changing gains. The same load is also run with every call funnelled through
+a single global mutex, the simplest way to make the old code thread-safe, for comparison.
+With the reader/writer lock, reads never wait for each other and the writer only waits
+for readers between turns. Pure-Python work is still bound by the interpreter lock, so the
+gain from more threads is largest when requests also wait on I/O.
+
+Usage:
+    python -m benchmarks.bench_concurrency [--amplifiers 100000] [--readers 1 2 4 8] [--seconds 2]
+"""
+import argparse
+import random
+import threading
+import time
+
+from benchmarks.fleet import make_control_system, quiet
+
+
+def measure(control_system, reader_count, seconds, global_lock=None):
+    serials = list(control_system.amplifiers)
+    stop = threading.Event()
+    counts = [0] * (reader_count + 1)
+    guard = global_lock or _NoLock()
+
+    def reader(slot):
+        rng = random.Random(slot)
+        while not stop.is_set():
+            serial = rng.choice(serials)
+            with guard:
+                control_system.find_amplifier(serial).gain
+            with guard:
+                control_system.page_amplifiers(10, after=serial)
+            counts[slot] += 2
+
+    def writer():
+        rng = random.Random(-1)
+        while not stop.is_set():
+            with guard:
+                control_system.set_gain(rng.choice(serials), rng.randint(1, 100))
+            counts[reader_count] += 1
+
+    threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(reader_count)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts[:reader_count]) / seconds, counts[reader_count] / seconds
+
+
+class _NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, default=100_000)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    control_system = make_control_system(args.amplifiers)
+    control_system._ensure_indexes()
+    print(f"{'readers':>7} {'locking':<14} {'reads/s':>10} {'writes/s':>10}")
+    for reader_count in args.readers:
+        for name, global_lock in (("global mutex", threading.Lock()), ("read/write", None)):
+            with quiet():
+                reads, writes = measure(control_system, reader_count, args.seconds, global_lock)
+            print(f"{reader_count:>7} {name:<14} {reads:>10.0f} {writes:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
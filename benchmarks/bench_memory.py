@@ -0,0 +1,126 @@
+"""
+Measures the memory held by a fleet of amplifiers and sensors with tracemalloc.
+
+Three layouts are compared, each holding N amplifiers and N sensors keyed by serial number,
+with every sensor attached to an amplifier (8 per amplifier):
+
+    dict       plain objects with a per-instance __dict__ (the layout before __slots__)
+    slots      the current Amplifier and Sensor classes
+    compact    CompactRegistry (typed arrays and interned strings)
+
+The search indexes of EEGControlSystem are not included, since they are the same for
+every layout.
+
+Usage:
+    python -m benchmarks.bench_memory [--sizes 100000 1000000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from amplifier import Amplifier
+from benchmarks.fleet import make_amplifiers, make_sensors
+from compact_registry import CompactRegistry
+from sensor import Sensor
+
+SENSORS_PER_AMPLIFIER = 8
+
+
+class DictAmplifier:
+    def __init__(self, serial_number, model_string, manufacturer, next_maintenance, sampling_rate, gain):
+        self.serial_number = serial_number
+        self.model_string = model_string
+        self.manufacturer = manufacturer
+        self.next_maintenance = next_maintenance
+        self.sampling_rate = sampling_rate
+        self.gain = gain
+        self.sensors = []
+        self.is_on = False
+
+
+class DictSensor:
+    def __init__(self, serial_number, model_string, manufacturer, next_maintenance, tag):
+        self.serial_number = serial_number
+        self.model_string = model_string
+        self.manufacturer = manufacturer
+        self.next_maintenance = next_maintenance
+        self.tag = tag
+
+
+def fresh(value):
+    """Returns an equal but distinct string, as a device loaded from disk or JSON would own."""
+    return (value + " ")[:-1]
+
+
+def amplifier_fields(amp):
+    return (fresh(amp.serial_number), fresh(amp.model_string), fresh(amp.manufacturer),
+            fresh(amp.next_maintenance), amp.sampling_rate, amp.gain)
+
+
+def sensor_fields(sensor):
+    return (fresh(sensor.serial_number), fresh(sensor.model_string), fresh(sensor.manufacturer),
+            fresh(sensor.next_maintenance), fresh(sensor.tag))
+
+
+def build_objects(amplifier_class, sensor_class, templates):
+    amplifier_templates, sensor_templates = templates
+    amplifiers, sensors = {}, {}
+    for template in sensor_templates:
+        sensor = sensor_class(*sensor_fields(template))
+        sensors[sensor.serial_number] = sensor
+    for i, template in enumerate(amplifier_templates):
+        amplifier = amplifier_class(*amplifier_fields(template))
+        amplifiers[amplifier.serial_number] = amplifier
+        for sensor in sensor_templates[i * SENSORS_PER_AMPLIFIER:(i + 1) * SENSORS_PER_AMPLIFIER]:
+            amplifier.sensors.append(sensors[sensor.serial_number])
+    return amplifiers, sensors
+
+
+def build_compact(templates):
+    amplifier_templates, sensor_templates = templates
+    registry = CompactRegistry()
+    for template in sensor_templates:
+        sensor = Sensor(*sensor_fields(template))
+        registry.sensors[sensor.serial_number] = sensor
+    for i, template in enumerate(amplifier_templates):
+        amplifier = Amplifier(*amplifier_fields(template))
+        registry.amplifiers[amplifier.serial_number] = amplifier
+        view = registry.amplifiers[amplifier.serial_number]
+        for sensor in sensor_templates[i * SENSORS_PER_AMPLIFIER:(i + 1) * SENSORS_PER_AMPLIFIER]:
+            view.add_sensor(sensor)
+            registry.sensor_owner[sensor.serial_number] = amplifier.serial_number
+    return registry
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'devices':>9} {'layout':<8} {'retained MB':>12} {'peak MB':>9} {'bytes/device':>13}")
+    for size in args.sizes:
+        amplifier_count = max(1, size // (SENSORS_PER_AMPLIFIER + 1))
+        templates = (make_amplifiers(amplifier_count), make_sensors(amplifier_count * SENSORS_PER_AMPLIFIER))
+        devices = amplifier_count * (SENSORS_PER_AMPLIFIER + 1)
+        layouts = [
+            ("dict", lambda: build_objects(DictAmplifier, DictSensor, templates)),
+            ("slots", lambda: build_objects(Amplifier, Sensor, templates)),
+            ("compact", lambda: build_compact(templates)),
+        ]
+        for name, build in layouts:
+            current, peak = measure(build)
+            print(f"{devices:>9} {name:<8} {current / 1e6:>12.1f} {peak / 1e6:>9.1f} {current / devices:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measures the cost of the built-in metrics.
+
+Times control system calls with their instrumentation against the same calls made through
+an uninstrumented copy of the lock wrapper, an API request with and without the request
+hooks, and rendering /metrics for a fleet of the given size.
+
+Usage:
+    python -m benchmarks.bench_metrics [--size 100000] [--repeat 100000]
+"""
+import argparse
+import functools
+import time
+
+from benchmarks.api import load_api
+from benchmarks.fleet import make_control_system, quiet
+from control_system import EEGControlSystem
+
+
+def per_call(func, repeat):
+    """Best of five runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / repeat * 1e6
+
+
+def uninstrumented(name):
+    """The method as it was before instrumentation: just the shared lock around the plain function."""
+    method = getattr(EEGControlSystem, name).__wrapped__
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._lock.read:
+            return method(self, *args, **kwargs)
+    return locked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=100_000)
+    args = parser.parse_args()
+
+    control_system = make_control_system(args.size, sensors_per_amplifier=2)
+    serial_number = control_system.list_amplifiers()[args.size // 2].serial_number
+    calls = [
+        ("find_amplifier", (serial_number,)),
+        ("find_sensor_owner", ("SEN-00000001",)),
+        ("search_amplifiers", (serial_number,)),
+    ]
+    print(f"{'operation':<20} {'plain us':>9} {'timed us':>9} {'overhead us':>12}")
+    for name, arguments in calls:
+        plain = uninstrumented(name)
+        timed = getattr(control_system, name)
+        plain_us = per_call(lambda: plain(control_system, *arguments), args.repeat)
+        timed_us = per_call(lambda: timed(*arguments), args.repeat)
+        print(f"{name:<20} {plain_us:>9.2f} {timed_us:>9.2f} {timed_us - plain_us:>12.2f}")
+
+    with quiet():
+        api, directory = load_api()
+        api.control_system.add_amplifiers(control_system.list_amplifiers()[:1000])
+    client = api.app.test_client()
+    path = f"/api/amplifiers/search?serial_number={serial_number}"
+    requests = args.repeat // 100
+    per_call(lambda: client.get(path), requests)  # warm up
+    hooked_us = per_call(lambda: client.get(path), requests)
+    hooks = api.app.before_request_funcs.pop(None), api.app.after_request_funcs.pop(None)
+    bare_us = per_call(lambda: client.get(path), requests)
+    api.app.before_request_funcs[None], api.app.after_request_funcs[None] = hooks
+    print(f"\nGET /api/amplifiers/search: {bare_us:.1f} us without request metrics, {hooked_us:.1f} us with "
+          f"({hooked_us - bare_us:+.1f} us)")
+
+    # /metrics reports the fleet of the module's control system; point it at the large one.
+    journal, api.control_system = api.control_system.journal, control_system
+    scrape_ms = per_call(lambda: client.get("/metrics"), 100) / 1000
+    print(f"GET /metrics for {args.size} amplifiers: {scrape_ms:.2f} ms")
+    journal.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compares wiring a cap sensor by sensor with applying it as one montage.
+
+Builds a journaled fleet with a number of caps' worth of sensors, tagged E1..E<channels>,
+then attaches each cap to its own amplifier, alternately with one add_sensor_to_amplifier
+call per sensor and with a single apply_montage call, both directly and through the Flask
+test client (one POST per sensor against one PUT of the montage). Also times the tag index
+query for the unassigned sensors at one position.
+
+Usage:
+    python -m benchmarks.bench_montage [--amplifiers 10000] [--channels 256] [--caps 20]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.api import load_api
+from benchmarks.fleet import make_amplifiers, quiet
+from control_system import EEGControlSystem
+from journal import Journal
+from sensor import Sensor
+
+
+def make_cap(cap, channels):
+    """Returns the sensors of one cap, one per position E1..E<channels>."""
+    return [Sensor(f"CAP{cap:04d}-{channel:03d}", "Ag/AgCl 1", "ANT Neuro", "01-01-2030", f"E{channel}")
+            for channel in range(1, channels + 1)]
+
+
+def per_sensor(control_system, amplifier_serial, cap):
+    for sensor in cap:
+        control_system.add_sensor_to_amplifier(amplifier_serial, sensor.serial_number)
+
+
+def montage(control_system, amplifier_serial, cap):
+    control_system.apply_montage(amplifier_serial, {sensor.tag: sensor.serial_number for sensor in cap})
+
+
+def per_sensor_requests(client, amplifier_serial, cap):
+    for sensor in cap:
+        client.post(f"/api/amplifiers/{amplifier_serial}/sensors", json={"sensor_serial": sensor.serial_number})
+
+
+def montage_request(client, amplifier_serial, cap):
+    response = client.put(f"/api/amplifiers/{amplifier_serial}/montage",
+                          json={"montage": {sensor.tag: sensor.serial_number for sensor in cap}})
+    assert response.status_code == 200, response.json
+
+
+def compare(target, control_system, amplifiers, caps, ways):
+    """Times every way of attaching a cap, on alternate caps. Returns {name: [milliseconds]}."""
+    timings = {name: [] for name, _ in ways}
+    for position, cap in enumerate(caps):
+        name, attach = ways[position % len(ways)]
+        amplifier_serial = amplifiers[position].serial_number
+        with quiet():
+            start = time.perf_counter()
+            attach(target, amplifier_serial, cap)
+            timings[name].append((time.perf_counter() - start) * 1000)
+        assert len(control_system.find_amplifier(amplifier_serial).sensors) == len(cap)
+    return timings
+
+
+def report(timings, channels):
+    for name, milliseconds in timings.items():
+        median = statistics.median(milliseconds)
+        print(f"  {name:<28} {median:>9.2f} ms per cap  {channels / median * 1000:>10.0f} sensors/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, default=10_000)
+    parser.add_argument("--channels", type=int, default=256)
+    parser.add_argument("--caps", type=int, default=20, help="caps attached per comparison (half each way)")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(directory.name)
+    caps = [make_cap(cap, args.channels) for cap in range(2 * args.caps)]
+    amplifiers = make_amplifiers(args.amplifiers)
+    control_system = EEGControlSystem(journal=Journal(fsync_interval=1.0))
+    with quiet():
+        control_system.load_state()
+        control_system.add_amplifiers(amplifiers)
+        control_system.add_sensors([sensor for cap in caps for sensor in cap])
+    print(f"{args.amplifiers} amplifiers, {len(caps)} caps of {args.channels} channels, journaled")
+    print("control system:")
+    report(compare(control_system, control_system, amplifiers, caps[:args.caps],
+                   [("add_sensor_to_amplifier", per_sensor), ("apply_montage", montage)]), args.channels)
+
+    start = time.perf_counter()
+    repeat = 1000
+    for _ in range(repeat):
+        unassigned = control_system.sensors_by_tag("E17", assigned=False)
+    print(f"  sensors_by_tag(E17, assigned=False): {(time.perf_counter() - start) / repeat * 1e6:.1f} us "
+          f"({len(unassigned)} sensors)")
+    control_system.journal.close()
+
+    with quiet():
+        api, api_directory = load_api()
+        api.control_system.add_amplifiers(make_amplifiers(args.amplifiers))
+        api.control_system.add_sensors([sensor for cap in caps[args.caps:] for sensor in cap])
+    print("API (Flask test client):")
+    report(compare(api.app.test_client(), api.control_system, amplifiers, caps[args.caps:],
+                   [("POST .../sensors per sensor", per_sensor_requests), ("PUT .../montage", montage_request)]),
+           args.channels)
+    api.control_system.journal.close()
+    os.chdir(cwd)
+    api_directory.cleanup()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
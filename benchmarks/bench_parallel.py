@@ -0,0 +1,64 @@
+"""
+Measures how acquisition throughput scales with worker processes.
+
+Runs the same fleet (every amplifier powered on, with the given number of sensors at the
+given sampling rate) with the in-process AcquisitionEngine and then with ParallelAcquisition
+at each number of workers, and reports the samples produced per second and the share of
+blocks dropped because production fell behind real time. Throughput can only grow with
+workers while there are idle cores; the CPU count is printed for reference.
+
+Usage:
+    python -m benchmarks.bench_parallel [--amplifiers 200] [--channels 256] [--rate 1024] [--workers 1 2 4]
+"""
+import argparse
+import os
+import time
+
+from acquisition import AcquisitionEngine
+from benchmarks.fleet import make_control_system, quiet
+from parallel_acquisition import ParallelAcquisition
+
+
+def measure(engine, seconds):
+    engine.start()
+    time.sleep(1.0)  # let every stream start and catch up
+    before = engine.stats()
+    time.sleep(seconds)
+    after = engine.stats()
+    engine.stop()
+    produced = after["produced_blocks"] - before["produced_blocks"]
+    dropped = after["dropped_blocks"] - before["dropped_blocks"]
+    return produced, dropped
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=256)
+    parser.add_argument("--rate", type=int, default=1024)
+    parser.add_argument("--block-size", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, cores} & set(range(1, cores + 1))) or [1])
+    args = parser.parse_args()
+
+    control_system = make_control_system(args.amplifiers, sensors_per_amplifier=args.channels)
+    with quiet():
+        control_system.update_amplifiers(list(control_system.amplifiers), sampling_rate=args.rate, power=True)
+    required = args.amplifiers * args.channels * args.rate
+    print(f"{args.amplifiers} amplifiers x {args.channels} channels at {args.rate} Hz: "
+          f"{required / 1e6:.1f} M samples/s needed, {cores} CPUs")
+    print(f"{'mode':>12} {'M samples/s':>12} {'real time %':>12} {'dropped %':>10}")
+    runs = [("in-process", lambda: AcquisitionEngine(control_system, block_size=args.block_size))]
+    runs += [(f"{workers} workers", lambda workers=workers: ParallelAcquisition(
+        control_system, workers=workers, block_size=args.block_size)) for workers in args.workers]
+    for label, make_engine in runs:
+        produced, dropped = measure(make_engine(), args.seconds)
+        samples = produced * args.block_size * args.channels / args.seconds
+        print(f"{label:>12} {samples / 1e6:>12.1f} {100 * samples / required:>12.1f} "
+              f"{100 * dropped / max(produced + dropped, 1):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
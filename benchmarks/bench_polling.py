@@ -0,0 +1,58 @@
+"""
+Measures dashboard-style polling of GET /api/amplifiers.
+
+For each fleet size the benchmark times a full listing with a cold fragment cache, a listing
+served from the warm cache, a listing after one amplifier changed, and a conditional poll with
+If-None-Match that is answered 304 Not Modified, using the Flask test client.
+
+Usage:
+    python -m benchmarks.bench_polling [--amplifiers 1000 10000 100000]
+"""
+import argparse
+import time
+
+from benchmarks.api import load_api
+from benchmarks.fleet import make_amplifiers, quiet
+
+
+def get(client, **kwargs):
+    response = client.get("/api/amplifiers", **kwargs)
+    response.get_data()
+    return response
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'amplifiers':>10} {'cold ms':>10} {'warm ms':>10} {'1 changed ms':>13} {'304 ms':>8}")
+    for count in args.amplifiers:
+        with quiet():
+            api, directory = load_api()
+        client = api.app.test_client()
+        with quiet():
+            api.control_system.add_amplifiers(make_amplifiers(count))
+        cold, cold_time = timed(lambda: get(client))
+        warm, warm_time = timed(lambda: get(client))
+        assert cold.get_data() == warm.get_data()
+        with quiet():
+            api.control_system.set_gain(next(iter(api.control_system.amplifiers)), 42)
+        response, changed_time = timed(lambda: get(client))
+        etag = response.headers["ETag"]
+        response, not_modified_time = timed(lambda: get(client, headers={"If-None-Match": etag}))
+        assert response.status_code == 304
+        print(f"{count:>10} {cold_time * 1000:>10.1f} {warm_time * 1000:>10.1f} {changed_time * 1000:>13.1f} "
+              f"{not_modified_time * 1000:>8.2f}")
+        api.control_system.journal.close()
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
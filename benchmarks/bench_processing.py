@@ -0,0 +1,76 @@
+"""
+Measures the throughput of the signal processing pipeline in channel-samples per second.
+
+Acquisition runs on a simulated clock, one second at a time, and only the processing of
+each second is timed. For comparison, the same filter cascade is run sample by sample
+(vectorized over channels only) on a short stretch of one amplifier's samples.
+
+Usage:
+    python -m benchmarks.bench_processing [--amplifiers 20] [--channels 256] [--rate 1024] [--seconds 5]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from acquisition import AcquisitionEngine
+from benchmarks.fleet import make_control_system, quiet
+from processing import FilterDesign, SignalPipeline
+
+
+def per_sample(sections, samples):
+    """The filter cascade as a loop over samples, vectorized over channels."""
+    state = [np.zeros(samples.shape[0], dtype=samples.dtype) for _ in range(2 * len(sections))]
+    output = np.empty_like(samples)
+    for n in range(samples.shape[1]):
+        x = samples[:, n]
+        for position, ((b0, b1, b2), (_, a1, a2)) in enumerate(sections):
+            y = b0 * x + state[2 * position]
+            state[2 * position] = b1 * x - a1 * y + state[2 * position + 1]
+            state[2 * position + 1] = b2 * x - a2 * y
+            x = y
+        output[:, n] = x
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=256)
+    parser.add_argument("--rate", type=int, default=1024)
+    parser.add_argument("--seconds", type=int, default=5)
+    args = parser.parse_args()
+
+    control_system = make_control_system(args.amplifiers, sensors_per_amplifier=args.channels)
+    with quiet():
+        control_system.update_amplifiers(list(control_system.amplifiers), sampling_rate=args.rate, power=True)
+    engine = AcquisitionEngine(control_system, ring_seconds=2.0, max_lag=1.5)
+    design = FilterDesign()
+    pipeline = SignalPipeline(engine, design)
+    engine.sync(0.0)
+    pipeline.process()
+
+    elapsed = 0.0
+    processed = 0
+    for second in range(1, args.seconds + 1):
+        engine.step(float(second))
+        start = time.perf_counter()
+        processed += pipeline.process()
+        elapsed += time.perf_counter() - start
+    channel_samples = processed * args.channels
+    print(f"{args.amplifiers} amplifiers x {args.channels} channels at {args.rate} Hz, "
+          f"{len(design.sections(args.rate))} filter sections, decimation {design.decimation}")
+    print(f"{'block state-space':>20}: {channel_samples / elapsed / 1e6:8.1f} M channel-samples/s "
+          f"(enough for {args.amplifiers * args.seconds / elapsed:.0f} amplifiers in real time)")
+
+    samples = engine.streams()[0].ring.latest(args.rate // 4)[0].astype(np.float32)
+    start = time.perf_counter()
+    per_sample(design.sections(args.rate), samples)
+    elapsed = time.perf_counter() - start
+    print(f"{'per-sample loop':>20}: {samples.size / elapsed / 1e6:8.1f} M channel-samples/s")
+    if engine.stats()["dropped_blocks"]:
+        print("warning: acquisition dropped blocks; raise max_lag")
+
+
+if __name__ == "__main__":
+    main()
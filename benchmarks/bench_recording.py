@@ -0,0 +1,93 @@
+"""
+Measures writing and slicing recordings in the memory-mapped recording format.
+
+Writes a recording of the given size (256 channels at 1024 Hz by default, one second per
+append) and reports write throughput against the real-time rate of one amplifier, then
+opens it and times random time window x channel slices: creating the view, and reading
+its samples. Finally records live acquisition from several amplifiers at once and reports
+lost samples.
+
+Usage:
+    python -m benchmarks.bench_recording [--megabytes 2048] [--channels 256] [--rate 1024] [--live-amplifiers 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from acquisition import AcquisitionEngine, synthetic_signal
+from benchmarks.fleet import make_control_system, quiet
+from recording import Recorder, Recording, RecordingWriter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=int, default=2048)
+    parser.add_argument("--channels", type=int, default=256)
+    parser.add_argument("--rate", type=int, default=1024)
+    parser.add_argument("--slices", type=int, default=1000)
+    parser.add_argument("--live-amplifiers", type=int, default=20)
+    parser.add_argument("--live-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    filename = os.path.join(directory.name, "recording.eegr")
+    second = np.ascontiguousarray(synthetic_signal(args.channels, args.rate).T)
+    seconds = args.megabytes * 1_000_000 // second.nbytes
+    metadata = {"serial_number": "AMP-BENCH", "model_string": "bench", "manufacturer": "bench",
+                "sampling_rate": args.rate, "gain": 1, "started": time.time(),
+                "channels": [{"serial_number": f"SEN-{i:08d}", "tag": "frontal"} for i in range(args.channels)]}
+    writer = RecordingWriter(filename, metadata)
+    start = time.perf_counter()
+    for position in range(seconds):
+        writer.append(second, position * args.rate)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(filename)
+    print(f"wrote {size / 1e6:.0f} MB ({seconds} s of {args.channels} channels at {args.rate} Hz) "
+          f"in {elapsed:.2f} s: {size / elapsed / 1e6:.0f} MB/s, {seconds / elapsed:.0f}x real time")
+
+    start = time.perf_counter()
+    recording = Recording(filename)
+    print(f"opened in {(time.perf_counter() - start) * 1000:.2f} ms")
+    rng = random.Random(0)
+    for label, length, channels in [("1 s x 8 channels", 1.0, slice(0, 8)),
+                                    ("10 s x all channels", 10.0, None),
+                                    ("1 s x every 4th channel", 1.0, list(range(0, args.channels, 4)))]:
+        view_time = read_time = 0.0
+        for _ in range(args.slices):
+            begin = rng.uniform(0, seconds - length)
+            start = time.perf_counter()
+            window = recording.window(begin, begin + length, channels)
+            view_time += time.perf_counter() - start
+            start = time.perf_counter()
+            window.sum()
+            read_time += time.perf_counter() - start
+        print(f"{label:>24}: view {view_time / args.slices * 1e6:.1f} us, "
+              f"read {read_time / args.slices * 1000:.2f} ms")
+    del recording, window
+
+    control_system = make_control_system(args.live_amplifiers, sensors_per_amplifier=args.channels)
+    with quiet():
+        control_system.update_amplifiers(list(control_system.amplifiers), sampling_rate=args.rate, power=True)
+    engine = AcquisitionEngine(control_system)
+    engine.start()
+    time.sleep(0.1)
+    recorders = [Recorder(engine, serial_number, os.path.join(directory.name, f"{serial_number}.eegr")).start()
+                 for serial_number in control_system.amplifiers]
+    time.sleep(args.live_seconds)
+    for recorder in recorders:
+        recorder.stop()
+    engine.stop()
+    recorded = sum(Recording(recorder.filename).duration for recorder in recorders)
+    print(f"live: {args.live_amplifiers} amplifiers recorded {recorded:.1f} s in {args.live_seconds:.1f} s, "
+          f"lost {sum(recorder.lost_samples for recorder in recorders)} samples, "
+          f"acquisition dropped {engine.stats()['dropped_blocks']} blocks")
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
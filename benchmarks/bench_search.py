@@ -0,0 +1,53 @@
+"""
+Compares trigram-indexed amplifier search against the previous linear scan.
+
+Usage:
+    python -m benchmarks.bench_search [--sizes 10000 100000 1000000] [--repeat 20]
+"""
+import argparse
+import time
+
+from benchmarks.fleet import make_control_system
+
+QUERIES = [
+    ("serial_number", "AMP-0000042"),
+    ("serial_number", "12345"),
+    ("model_string", "eego mini 7"),
+    ("model_string", "champ"),
+    ("manufacturer", "neuro"),
+    ("manufacturer", "g.tec"),
+]
+
+
+def linear_scan(amplifiers, field, query):
+    """The pre-index search: lower-case every field on every request."""
+    return [amp for amp in amplifiers if query.lower() in getattr(amp, field).lower()]
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'fleet':>9} {'field':<14} {'query':<13} {'matches':>8} {'linear ms':>10} {'index ms':>9} {'speedup':>8}")
+    for size in args.sizes:
+        control_system = make_control_system(size)
+        amplifiers = control_system.list_amplifiers()
+        for field, query in QUERIES:
+            linear, matches = timed(lambda: linear_scan(amplifiers, field, query), args.repeat)
+            indexed, indexed_matches = timed(lambda: control_system.filter_amplifiers(**{field: query}), args.repeat)
+            assert matches == indexed_matches
+            print(f"{size:>9} {field:<14} {query:<13} {matches:>8} {linear * 1e3:>10.3f} "
+                  f"{indexed * 1e3:>9.3f} {linear / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
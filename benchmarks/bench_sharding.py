@@ -0,0 +1,145 @@
+"""
+Measures how throughput grows with the number of shards behind the shard router.
+
+Every configuration serves a fresh fleet of the given size over the loopback interface:
+
+- direct: one control_system_asgi process, with clients connected straight to it (the
+  baseline: no router, no extra hop);
+- N shards: N shard processes (see sharding.py) behind shard_router, served by as many
+  router processes as shards unless --routers says otherwise.
+
+The fleet is added through the bulk endpoint, then --clients client processes each keep
+--concurrency connections busy for --seconds. Two request mixes are measured:
+
+- device: nine in ten requests read an amplifier's layout and one in ten sets its gain,
+  each answered by one shard;
+- search: lookups by model (GET /api/amplifiers/search?model_string=...&limit=10), which
+  the router sends to every shard and merges.
+
+Reports requests per second, p50 and p99 latency and failed requests. Shards only add
+throughput when there are CPU cores for them to run on: on a machine with fewer cores than
+processes, the router's extra hop makes every sharded configuration slower than direct.
+The core count is printed first.
+
+Needs uvicorn (pip install uvicorn).
+
+Usage:
+    python -m benchmarks.bench_sharding [--size 100000] [--shards 1,2,4] [--routers N] [--clients 2]
+                                        [--concurrency 64] [--seconds 5]
+"""
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import urllib.request
+
+from benchmarks.api import REPOSITORY
+from benchmarks.bench_asgi import measure, percentile
+from benchmarks.fleet import make_amplifiers, MODELS
+from serialization import amplifier_to_dict
+from sharding import start_shards, stop_shards, wait_until_listening
+
+MIXES = ("device", "search")
+
+
+def device_request(rng, size):
+    serial_number = f"AMP-{rng.randrange(size):08d}"
+    if rng.random() < 0.9:
+        return f"GET /api/amplifiers/{serial_number}/layout HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()
+    body = json.dumps({"gain": rng.randint(1, 100)})
+    return (f"PUT /api/amplifiers/{serial_number}/gain HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n{body}").encode()
+
+
+def search_request(rng, size):
+    model = f"{rng.choice(MODELS)} {rng.randint(1, 64)}".replace(" ", "%20")
+    return (f"GET /api/amplifiers/search?model_string={model}&limit=10 HTTP/1.1\r\n"
+            f"Host: 127.0.0.1\r\n\r\n").encode()
+
+
+def run_clients(port, size, concurrency, seconds, mix, seed):
+    """Runs one client process's share of the load. Returns (requests per second, latencies, error count)."""
+    make_request = device_request if mix == "device" else search_request
+    rng = random.Random(seed)
+    rate, latencies, errors = asyncio.run(measure(port, size, concurrency, seconds,
+                                                  lambda _, size: make_request(rng, size)))
+    return rate, latencies, len(errors)
+
+
+def populate(port, size):
+    """Adds the fleet through the bulk endpoint, a thousand amplifiers per request."""
+    amplifiers = [amplifier_to_dict(amp) for amp in make_amplifiers(size)]
+    for start in range(0, size, 1000):
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/api/amplifiers/bulk", method="POST",
+            data=json.dumps({"amplifiers": amplifiers[start:start + 1000]}).encode(),
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            if json.load(response)["failed"]:
+                raise RuntimeError("Some amplifiers were not added.")
+
+
+def start_router(urls, port, routers):
+    environment = dict(os.environ, EEG_SHARDS=",".join(urls))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "shard_router:app", "--app-dir", REPOSITORY, "--port", str(port),
+         "--workers", str(routers), "--backlog", "4096", "--log-level", "warning", "--no-access-log"],
+        env=environment, cwd=REPOSITORY, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_listening("127.0.0.1", port, process)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--shards", default="1,2,4", help="comma-separated numbers of shards")
+    parser.add_argument("--routers", type=int, help="router processes (default: one per shard)")
+    parser.add_argument("--clients", type=int, default=2, help="client processes")
+    parser.add_argument("--concurrency", type=int, default=64, help="connections per client process")
+    parser.add_argument("--seconds", type=float, default=5.0, help="measurement time per mix")
+    parser.add_argument("--port", type=int, default=5600, help="first port to use")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    print(f"{os.cpu_count()} CPU cores, {args.size} amplifiers, {args.clients} client processes x "
+          f"{args.concurrency} connections, {args.seconds:g} s per mix")
+    print(f"{'configuration':<22} {'mix':<7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    configurations = [("direct", 1)] + [(f"{count} shards", count) for count in map(int, args.shards.split(","))]
+    with ProcessPoolExecutor(args.clients) as pool:
+        for name, count in configurations:
+            routers = args.routers or count
+            if name != "direct":
+                name = f"{name}, {routers} routers"
+            with tempfile.TemporaryDirectory() as directory:
+                shards, urls = start_shards(count, directory, port=args.port + 1, output=subprocess.DEVNULL)
+                router = None
+                try:
+                    if name == "direct":
+                        port = args.port + 1
+                    else:
+                        router, port = start_router(urls, args.port, routers), args.port
+                    populate(port, args.size)
+                    for mix in MIXES:
+                        runs = [pool.submit(run_clients, port, args.size, args.concurrency, args.seconds, mix, seed)
+                                for seed in range(args.clients)]
+                        results = [run.result() for run in runs]
+                        latencies = sorted(latency for _, run_latencies, _ in results for latency in run_latencies)
+                        print(f"{name:<22} {mix:<7} {sum(rate for rate, _, _ in results):>9.0f} "
+                              f"{percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.99):>9.2f} "
+                              f"{sum(errors for _, _, errors in results):>7}")
+                finally:
+                    if router is not None:
+                        router.terminate()
+                        router.wait()
+                    stop_shards(shards)
+
+
+if __name__ == "__main__":
+    main()
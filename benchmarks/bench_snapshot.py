@@ -0,0 +1,106 @@
+"""
+Measures request latency while a snapshot is being saved, synchronously and in the background.
+
+Reader threads look up random amplifiers and a writer thread changes gains, all the time,
+while the fleet is saved once with save_state and once with save_state_in_background.
+For each, reports how long the snapshot took, how long the fleet lock was held, and the
+latency of the reads and writes made meanwhile.
+
+Usage:
+    python -m benchmarks.bench_snapshot [--size 1000000] [--readers 4]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.fleet import make_amplifiers, quiet
+from control_system import EEGControlSystem
+from journal import Journal
+
+
+def load(control_system, serials, stop, latencies, write=False, seed=0):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        serial_number = rng.choice(serials)
+        start = time.perf_counter()
+        if write:
+            control_system.set_gain(serial_number, rng.randint(1, 100))
+        else:
+            control_system.find_amplifier(serial_number)
+        latencies.append(time.perf_counter() - start)
+        if write:
+            time.sleep(0.001)
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return "no calls"
+    return (f"{len(latencies):>8} calls  p50 {latencies[len(latencies) // 2] * 1e6:>8.0f} us  "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:>8.0f} us  max {latencies[-1] * 1e3:>8.1f} ms")
+
+
+def measure(control_system, serials, readers, save):
+    stop = threading.Event()
+    reads, writes = [], []
+    threads = [threading.Thread(target=load, args=(control_system, serials, stop, reads), kwargs={"seed": i})
+               for i in range(readers)]
+    threads.append(threading.Thread(target=load, args=(control_system, serials, stop, writes), kwargs={"write": True}))
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    del reads[:], writes[:]
+    with quiet():
+        held, total = save()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"  snapshot {total:.2f} s, fleet lock held {held * 1000:.1f} ms")
+    print(f"  reads:  {summary(reads)}")
+    print(f"  writes: {summary(writes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.chdir(directory.name)
+    control_system = EEGControlSystem(journal=Journal())
+    with quiet():
+        control_system.load_state()
+        amplifiers = make_amplifiers(args.size)
+        control_system.add_amplifiers(amplifiers)
+    serials = [amplifier.serial_number for amplifier in amplifiers]
+    del amplifiers
+    print(f"{args.size} amplifiers, {args.readers} reader threads and one writer")
+
+    def synchronous():
+        start = time.perf_counter()
+        control_system.save_state()
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    def background():
+        start = time.perf_counter()
+        snapshot = control_system.save_state_in_background()
+        held = time.perf_counter() - start
+        snapshot.wait()
+        return held, time.perf_counter() - start
+
+    print("save_state:")
+    measure(control_system, serials, args.readers, synchronous)
+    print("save_state_in_background:")
+    measure(control_system, serials, args.readers, background)
+    control_system.journal.close()
+    os.chdir(os.path.dirname(directory.name))
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Compares cold-start cost of the pickle snapshot with the memory-mapped columnar snapshot.
+
+For each fleet size, both snapshot files are written once, then loaded into a fresh
+EEGControlSystem. The benchmark reports the load time, the time of the first lookup
+(which materializes a device for the columnar format) and the file sizes.
+
+Usage:
+    python -m benchmarks.bench_startup [--sizes 10000 100000 1000000] [--sensors-per-amplifier 8]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fleet import make_control_system, quiet
+from control_system import EEGControlSystem
+
+
+def measure(filename, serial_number):
+    control_system = EEGControlSystem()
+    start = time.perf_counter()
+    with quiet():
+        control_system.load_state(filename)
+    loaded = time.perf_counter()
+    amplifier = control_system.find_amplifier(serial_number)
+    found = time.perf_counter()
+    assert amplifier is not None
+    return loaded - start, found - loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--sensors-per-amplifier", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'fleet':>9} {'format':<9} {'size MB':>8} {'load ms':>10} {'first lookup ms':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            control_system = make_control_system(size, sensors_per_amplifier=args.sensors_per_amplifier)
+            serial_number = f"AMP-{size // 2:08d}"
+            for snapshot_format, extension in (("pickle", "pkl"), ("columnar", "eegc")):
+                filename = os.path.join(directory, f"fleet-{size}.{extension}")
+                with quiet():
+                    control_system.save_state(filename, snapshot_format=snapshot_format)
+                load_time, lookup_time = measure(filename, serial_number)
+                print(f"{size:>9} {snapshot_format:<9} {os.path.getsize(filename) / 1e6:>8.1f} "
+                      f"{load_time * 1e3:>10.2f} {lookup_time * 1e3:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares the in-memory backend with the SQLite backend (SQLiteRegistry).
+
+For each fleet size both backends are filled through add_amplifiers, then the benchmark
+times serial number lookups, substring searches, a page of the ordered listing and single
+gain updates. Every SQLite change is committed (WAL mode), while the in-memory backend
+runs without a journal, so the comparison shows the price of durable, shared state.
+
+Usage:
+    python -m benchmarks.bench_storage [--sizes 10000 100000] [--repeat 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fleet import make_amplifiers, quiet
+from control_system import EEGControlSystem
+from sqlite_registry import SQLiteRegistry
+
+
+def per_call(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        function(i)
+    return (time.perf_counter() - start) / repeat
+
+
+def run(control_system, size, repeat):
+    amplifiers = make_amplifiers(size)
+    serials = [amplifiers[(i * 7919) % size].serial_number for i in range(repeat)]
+    timings = {}
+    with quiet():
+        start = time.perf_counter()
+        control_system.add_amplifiers(amplifiers)
+        timings["add"] = time.perf_counter() - start
+        timings["lookup"] = per_call(lambda i: control_system.find_amplifier(serials[i]).gain, repeat)
+        timings["search"] = per_call(lambda i: control_system.filter_amplifiers(model_string="eego mini 7"),
+                                     max(1, repeat // 10))
+        timings["page"] = per_call(lambda i: control_system.page_amplifiers(100, after=serials[i]), repeat)
+        timings["update"] = per_call(lambda i: control_system.set_gain(serials[i], i % 100 + 1), repeat)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'fleet':>8} {'backend':<8} {'add s':>7} {'lookup us':>10} {'search ms':>10} {'page ms':>8} "
+          f"{'update us':>10}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            registry = SQLiteRegistry(os.path.join(directory, "fleet.db"))
+            for backend, control_system in (("memory", EEGControlSystem()),
+                                            ("sqlite", EEGControlSystem(registry=registry))):
+                timings = run(control_system, size, args.repeat)
+                print(f"{size:>8} {backend:<8} {timings['add']:>7.2f} {timings['lookup'] * 1e6:>10.1f} "
+                      f"{timings['search'] * 1e3:>10.2f} {timings['page'] * 1e3:>8.2f} "
+                      f"{timings['update'] * 1e6:>10.1f}")
+            registry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Measures sample streaming over GET /api/amplifiers/<serial_number>/stream.
+
+The API is served by a threaded local HTTP server with acquisition running. Each fast
+client streams one amplifier at full rate and reports throughput, end-to-end latency (from
+the moment the last sample of a frame was due until the frame is decoded) and lost samples.
+A slow client reads a trickle from the first amplifier at the same time; it falls behind
+(by the time it has read what the socket buffers hold, samples are lost) without costing
+the fast clients throughput or acquisition any blocks.
+
+Usage:
+    python -m benchmarks.bench_streaming [--amplifiers 4] [--channels 64] [--rate 1024] [--seconds 5]
+"""
+import argparse
+import http.client
+import logging
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from benchmarks.api import load_api
+from benchmarks.fleet import make_amplifiers, make_sensors, quiet
+from streaming import decode_frame, decode_header
+
+
+def stream_client(port, serial_number, seconds, engine, result, decimation=1, pause=0.0):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("GET", f"/api/amplifiers/{serial_number}/stream?decimation={decimation}&duration={seconds}")
+    response = connection.getresponse()
+    buffer = bytearray()
+    header = None
+    received = lost = 0
+    latencies = []
+    start = time.perf_counter()
+    # Socket buffers can hold many seconds of samples, so the slow client stops when the stream should have ended.
+    while time.perf_counter() - start < seconds + 1:
+        chunk = response.read1(4096 if pause else 1 << 20)
+        if not chunk:
+            break
+        received += len(chunk)
+        buffer += chunk
+        if header is None:
+            decoded = decode_header(bytes(buffer))
+            if decoded is None:
+                continue
+            header, offset = decoded
+            del buffer[:offset]
+            stream = engine.stream(serial_number)
+        data, offset = bytes(buffer), 0
+        while True:
+            frame = decode_frame(data, len(header["channels"]), offset)
+            if frame is None:
+                break
+            first, samples, frame_lost, offset = frame
+            due = stream.started + (first + len(samples) * decimation) / header["sampling_rate"]
+            latencies.append(engine.clock() - due)
+            lost += frame_lost
+        buffer = bytearray(data[offset:])
+        if pause:
+            time.sleep(pause)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    latencies.sort()
+    result.update(megabytes_per_second=received / elapsed / 1e6, lost=lost,
+                  p50=latencies[len(latencies) // 2] if latencies else float("nan"),
+                  p99=latencies[int(len(latencies) * 0.99)] if latencies else float("nan"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amplifiers", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=64)
+    parser.add_argument("--rate", type=int, default=1024)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with quiet():
+        api, directory = load_api()
+        control_system = api.control_system
+        amplifiers = make_amplifiers(args.amplifiers)
+        control_system.add_amplifiers(amplifiers)
+        serials = [amplifier.serial_number for amplifier in amplifiers]
+        sensors = make_sensors(args.amplifiers * args.channels)
+        control_system.add_sensors(sensors)
+        for position, serial_number in enumerate(serials):
+            for sensor in sensors[position * args.channels:(position + 1) * args.channels]:
+                control_system.add_sensor_to_amplifier(serial_number, sensor.serial_number)
+        control_system.update_amplifiers(serials, sampling_rate=args.rate, power=True)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    engine = api.acquisition_engine()
+    engine.sync()
+
+    results = [{} for _ in serials]
+    slow = {}
+    threads = [threading.Thread(target=stream_client, args=(server.port, serial_number, args.seconds, engine, result))
+               for serial_number, result in zip(serials, results)]
+    threads.append(threading.Thread(target=stream_client,
+                                    args=(server.port, serials[0], args.seconds, engine, slow), kwargs={"pause": 0.05}))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    expected = args.channels * args.rate * 4 / 1e6
+    print(f"{args.amplifiers} amplifiers x {args.channels} channels at {args.rate} Hz "
+          f"({expected:.2f} MB/s of samples per amplifier)")
+    print(f"{'client':>8} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'lost':>8}")
+    for name, result in [(f"fast {i}", result) for i, result in enumerate(results)] + [("slow", slow)]:
+        print(f"{name:>8} {result['megabytes_per_second']:>8.2f} {result['p50'] * 1000:>8.1f} "
+              f"{result['p99'] * 1000:>8.1f} {result['lost']:>8}")
+    print(f"acquisition dropped blocks: {engine.stats()['dropped_blocks']}")
+    engine.stop()
+    api.control_system.journal.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Synthetic fleet generators shared by the benchmark scripts."""
+import contextlib
+import os
+import random
+
+from amplifier import Amplifier
+from control_system import EEGControlSystem
+from sensor import Sensor
+
+MANUFACTURERS = ["ANT Neuro", "AMD", "Brain Products", "g.tec", "Neuroelectrics", "BioSemi"]
+MODELS = ["eego mini", "eego sports", "eego mylab", "actiCHamp", "LiveAmp", "g.HIamp", "Enobio", "ActiveTwo"]
+TAGS = ["frontal", "central", "parietal", "temporal", "occipital"]
+SAMPLING_RATES = [256, 512, 1024]
+
+
+def make_amplifiers(count, seed=0):
+    """Returns count amplifiers with unique serial numbers and realistic, repetitive model/manufacturer strings."""
+    rng = random.Random(seed)
+    return [Amplifier(
+        serial_number=f"AMP-{i:08d}",
+        model_string=f"{rng.choice(MODELS)} {rng.randint(1, 64)}",
+        manufacturer=rng.choice(MANUFACTURERS),
+        next_maintenance=f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(2025, 2035)}",
+        sampling_rate=rng.choice(SAMPLING_RATES),
+        gain=rng.randint(1, 100),
+    ) for i in range(count)]
+
+
+def make_sensors(count, seed=0):
+    """Returns count sensors with unique serial numbers."""
+    rng = random.Random(seed)
+    return [Sensor(
+        serial_number=f"SEN-{i:08d}",
+        model_string=f"Ag/AgCl {rng.randint(1, 8)}",
+        manufacturer=rng.choice(MANUFACTURERS),
+        next_maintenance=f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(2025, 2035)}",
+        tag=rng.choice(TAGS),
+    ) for i in range(count)]
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the per-operation messages EEGControlSystem prints to stdout."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def make_control_system(amplifier_count, sensor_count=0, sensors_per_amplifier=0, seed=0):
+    """
+    Builds an EEGControlSystem populated with a synthetic fleet.
+
+    The first amplifier_count * sensors_per_amplifier sensors are attached to the amplifiers
+    in order; the remaining sensors stay unassigned.
+    """
+    control_system = EEGControlSystem()
+    sensor_count = max(sensor_count, amplifier_count * sensors_per_amplifier)
+    with quiet():
+        amplifiers = make_amplifiers(amplifier_count, seed)
+        for amplifier in amplifiers:
+            control_system.add_amplifier(amplifier)
+        sensors = make_sensors(sensor_count, seed)
+        for sensor in sensors:
+            control_system.add_sensor(sensor)
+        for i in range(amplifier_count * sensors_per_amplifier):
+            control_system.add_sensor_to_amplifier(amplifiers[i // sensors_per_amplifier].serial_number,
+                                                   sensors[i].serial_number)
+    return control_system
@@ -0,0 +1,158 @@
+"""
+Multi-threaded stress test of EEGControlSystem.
+
+Toggler, compare-and-set, gain, structural (add/remove/attach/detach) and reader threads
+hammer one journaled control system at the same time. The journal is kept small, so
+compactions also run in the middle of the traffic. Afterwards the script checks that:
+
+- every amplifier's power state matches the number of successful toggles it received
+  (a lost read-then-write race would break the parity),
+- readers only ever saw listings in strict serial order,
+- the serial order, search and sensor owner indexes agree with the devices,
+- snapshot plus journal replay into a fresh system reproduce the same state.
+
+Exits with status 1 if any check fails.
+
+Usage:
+    python -m benchmarks.stress_concurrency [--threads 4] [--seconds 5]
+"""
+import argparse
+from collections import Counter
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fleet import make_amplifiers, make_sensors, quiet
+from control_system import EEGControlSystem
+from journal import Journal
+
+AMPLIFIERS = 200
+SENSORS_PER_AMPLIFIER = 4
+
+
+def run_threads(targets, seconds):
+    stop = threading.Event()
+    errors = []
+
+    def guarded(target, seed):
+        rng = random.Random(seed)
+        try:
+            while not stop.is_set():
+                target(rng)
+        except Exception as e:
+            errors.append(f"{target.__name__}: {e!r}")
+            stop.set()
+
+    threads = [threading.Thread(target=guarded, args=(target, seed)) for seed, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=4, help="threads of each kind")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    snapshot = os.path.join(directory.name, "state.pkl")
+    journal_file = os.path.join(directory.name, "state.journal")
+    control_system = EEGControlSystem(journal=Journal(journal_file, compact_after=2000))
+    amplifiers = make_amplifiers(AMPLIFIERS)
+    serials = [amp.serial_number for amp in amplifiers]
+    spare_sensors = [sensor.serial_number for sensor in make_sensors(AMPLIFIERS * SENSORS_PER_AMPLIFIER)]
+    with quiet():
+        control_system.load_state(snapshot)
+        control_system.add_amplifiers(amplifiers)
+        control_system.add_sensors(make_sensors(AMPLIFIERS * SENSORS_PER_AMPLIFIER))
+
+    toggles = Counter()
+    toggles_lock = threading.Lock()
+    failures = []
+
+    def toggle(rng):
+        serial = rng.choice(serials)
+        control_system.toggle_power(serial)
+        with toggles_lock:
+            toggles[serial] += 1
+
+    def compare_and_set(rng):
+        serial = rng.choice(serials)
+        expected = rng.random() < 0.5
+        if control_system.compare_and_set_power(serial, expected, not expected):
+            with toggles_lock:
+                toggles[serial] += 1
+
+    def set_gain(rng):
+        control_system.set_gain(rng.choice(serials), rng.randint(1, 100))
+
+    def restructure(rng):
+        if rng.random() < 0.5:
+            extra = make_amplifiers(1, seed=rng.randint(0, 1000))[0]
+            extra.serial_number = f"AMP-X{rng.randint(0, 50):04d}"
+            control_system.add_amplifiers([extra])
+            control_system.remove_amplifier(f"AMP-X{rng.randint(0, 50):04d}")
+        else:
+            amplifier, sensor = rng.choice(serials), rng.choice(spare_sensors)
+            control_system.add_sensor_to_amplifier(amplifier, sensor)
+            owner = control_system.find_sensor_owner(sensor)
+            if owner is not None and rng.random() < 0.7:
+                control_system.remove_sensor_from_amplifier(owner.serial_number, sensor)
+
+    def read(rng):
+        listing = [amp.serial_number for amp in control_system.iter_amplifiers(chunk_size=64)]
+        if listing != sorted(set(listing)):
+            failures.append("listing out of order or with duplicates")
+        control_system.filter_amplifiers(model_string=rng.choice(["eego", "amp", "live"]))
+        control_system.page_amplifiers(20, after=rng.choice(serials))
+        control_system.find_amplifier(rng.choice(serials)).gain
+
+    targets = [toggle, compare_and_set, set_gain, restructure, read]
+    with quiet():
+        errors = run_threads([target for target in targets for _ in range(args.threads)], args.seconds)
+    failures.extend(errors)
+
+    for serial, count in toggles.items():
+        if control_system.find_amplifier(serial).is_on != (count % 2 == 1):
+            failures.append(f"{serial}: power state does not match {count} toggles")
+    control_system._ensure_indexes()
+    if control_system._sorted_serials != sorted(control_system.amplifiers):
+        failures.append("serial order index does not match the amplifiers")
+    if control_system._matching_serials(serial_number="AMP") != set(control_system.amplifiers):
+        failures.append("search index does not match the amplifiers")
+    for amplifier in control_system.list_amplifiers():
+        for sensor in amplifier.sensors:
+            if control_system._sensor_owner.get(sensor.serial_number) != amplifier.serial_number:
+                failures.append(f"sensor {sensor.serial_number} owner index is wrong")
+
+    control_system.journal.close()
+    replayed = EEGControlSystem(journal=Journal(journal_file))
+    with quiet():
+        replayed.load_state(snapshot)
+
+    def state(system):
+        return {amp.serial_number: (amp.gain, amp.is_on, sorted(sensor.serial_number for sensor in amp.sensors))
+                for amp in system.list_amplifiers()}
+    if state(replayed) != state(control_system):
+        failures.append("snapshot plus journal replay does not reproduce the state")
+    replayed.journal.close()
+    directory.cleanup()
+
+    print(f"{sum(toggles.values())} toggles on {len(toggles)} amplifiers, "
+          f"{control_system.fleet_version} mutations in {args.seconds:g} s")
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    print("FAILED" if failures else "OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Reproducible benchmark suite for control-plane operations at fleet scale.
+
+For every fleet size, builds a synthetic fleet (seeded, so every run sees the same devices)
+and times the EEGControlSystem operations and the Flask routes (through the test client)
+one call at a time. Every case is then run again briefly under tracemalloc to find the
+extra memory it needs at its peak. Results are written as JSON:
+
+    {"meta": {...}, "results": [{"name", "size", "operations", "seconds", "ops_per_second",
+                                 "mean_us", "p50_us", "p95_us", "max_us", "peak_mb", "rss_mb"}, ...]}
+
+The compare mode matches the results of two runs by name and size and flags every case
+whose median time or memory peak grew by more than the threshold (the median, because a
+single slow call such as a garbage collection pause moves the mean), exiting with status 1 if
+there is any, so it can gate a change:
+
+    python -m benchmarks.suite run --output baseline.json
+    (make the change)
+    python -m benchmarks.suite run --output change.json
+    python -m benchmarks.suite compare baseline.json change.json
+
+Usage:
+    python -m benchmarks.suite run [--sizes 1000 10000 100000] [--operations 1000] [--output results.json]
+    python -m benchmarks.suite compare BASELINE CHANGE [--threshold 0.25] [--memory-threshold 0.25]
+"""
+import argparse
+from datetime import date, timedelta
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from amplifier import Amplifier
+from benchmarks.api import amplifier_json, load_api, sensor_json
+from benchmarks.fleet import MODELS, make_amplifiers, make_control_system, make_sensors, quiet
+from control_system import EEGControlSystem
+from sensor import Sensor
+
+MEMORY_OPERATIONS = 20
+# Montages attach a whole cap each, so fewer of them are timed.
+MONTAGE_OPERATIONS = 50
+MONTAGE_CHANNELS = 256
+# Memory growth below this many MB is noise, whatever the ratio.
+MEMORY_NOISE_MB = 1.0
+
+
+class Fleet:
+    """A control system of a given size and the inputs the cases draw from, seeded for reproducibility."""
+    def __init__(self, size, seed):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.serials = [f"AMP-{i:08d}" for i in range(size)]
+        self.attached = []  # (amplifier serial, sensor serial) pairs attached and not yet detached
+        self._new = itertools.count()
+        with quiet():
+            self.control_system = self.build(size, seed)
+
+    def build(self, size, seed):
+        return make_control_system(size, sensor_count=size, seed=seed)
+
+    def close(self):
+        pass
+
+    def new_amplifier(self):
+        return Amplifier(f"NEW-{next(self._new):08d}", "eego mini 1", "ANT Neuro", "01-01-2030", 512, 10)
+
+    def new_sensor(self):
+        return Sensor(f"NSN-{next(self._new):08d}", "Ag/AgCl 1", "ANT Neuro", "01-01-2030", "frontal")
+
+    def new_cap(self):
+        """Adds the sensors of a new cap, one per position, and returns its montage (tag -> sensor serial)."""
+        sensors = [Sensor(f"NSN-{next(self._new):08d}", "Ag/AgCl 1", "ANT Neuro", "01-01-2030", f"E{channel}")
+                   for channel in range(1, MONTAGE_CHANNELS + 1)]
+        self.control_system.add_sensors(sensors)
+        return {sensor.tag: sensor.serial_number for sensor in sensors}
+
+    def serial(self):
+        return self.rng.choice(self.serials)
+
+    def model_query(self):
+        return f"{self.rng.choice(MODELS)} {self.rng.randint(1, 64)}"
+
+    def future_date(self):
+        return (date.today() + timedelta(days=self.rng.randint(1, 3650))).strftime("%d-%m-%Y")
+
+
+# Each case takes the fleet and a number of operations and returns that many zero-argument
+# callables, one per operation; inputs are prepared up front so only the operation is timed.
+# Heavy cases (whole-fleet work) run a fixed small number of times instead.
+
+def find_amplifier(fleet, count):
+    control_system = fleet.control_system
+    return [lambda serial=fleet.serial(): control_system.find_amplifier(serial) for _ in range(count)]
+
+
+def search_amplifiers(fleet, count):
+    control_system = fleet.control_system
+    return [lambda query=fleet.model_query(): control_system.search_amplifiers(query, "model_string")
+            for _ in range(count)]
+
+
+def add_amplifier(fleet, count):
+    control_system = fleet.control_system
+    return [lambda amplifier=fleet.new_amplifier(): control_system.add_amplifier(amplifier) for _ in range(count)]
+
+
+def add_sensor_to_amplifier(fleet, count):
+    control_system = fleet.control_system
+    pairs = []
+    for _ in range(count):
+        sensor = fleet.new_sensor()
+        control_system.add_sensor(sensor)
+        pairs.append((fleet.serial(), sensor.serial_number))
+    fleet.attached.extend(pairs)
+    return [lambda pair=pair: control_system.add_sensor_to_amplifier(*pair) for pair in pairs]
+
+
+def remove_sensor_from_amplifier(fleet, count):
+    control_system = fleet.control_system
+    pairs, fleet.attached = fleet.attached[:count], fleet.attached[count:]
+    return [lambda pair=pair: control_system.remove_sensor_from_amplifier(*pair) for pair in pairs]
+
+
+def apply_montage(fleet, count):
+    control_system = fleet.control_system
+    return [lambda serial=fleet.serial(), montage=fleet.new_cap(): control_system.apply_montage(serial, montage)
+            for _ in range(min(count, MONTAGE_OPERATIONS))]
+
+
+def update_maintenance_date(fleet, count):
+    control_system = fleet.control_system
+    return [lambda amplifier=control_system.find_amplifier(fleet.serial()), new_date=fleet.future_date():
+            control_system.update_maintenance_date(amplifier, new_date) for _ in range(count)]
+
+
+def snapshot_cases(snapshot_format):
+    def save_state(fleet, count):
+        filename = os.path.join(fleet.directory, f"fleet.{snapshot_format}")
+        return [lambda: fleet.control_system.save_state(filename, snapshot_format) for _ in range(count)]
+
+    def load_state(fleet, count):
+        filename = os.path.join(fleet.directory, f"fleet.{snapshot_format}")
+        fleet.control_system.save_state(filename, snapshot_format)
+        # Loads into a separate system, so the fleet the other cases use stays as it is.
+        return [lambda: EEGControlSystem().load_state(filename) for _ in range(count)]
+    return save_state, load_state
+
+
+save_pickle, load_pickle = snapshot_cases("pickle")
+save_columnar, load_columnar = snapshot_cases("columnar")
+
+CORE_CASES = [
+    ("find_amplifier", find_amplifier, False),
+    ("search_amplifiers", search_amplifiers, False),
+    ("add_amplifier", add_amplifier, False),
+    ("add_sensor_to_amplifier", add_sensor_to_amplifier, False),
+    ("remove_sensor_from_amplifier", remove_sensor_from_amplifier, False),
+    ("update_maintenance_date", update_maintenance_date, False),
+    ("save_state[pickle]", save_pickle, True),
+    ("load_state[pickle]", load_pickle, True),
+    ("save_state[columnar]", save_columnar, True),
+    ("load_state[columnar]", load_columnar, True),
+    # Last, since every montage adds a cap of sensors that the snapshot cases would then carry.
+    (f"apply_montage[{MONTAGE_CHANNELS}]", apply_montage, False),
+]
+
+
+class ApiFleet(Fleet):
+    """A fleet loaded into a fresh copy of the API, with a test client."""
+    def build(self, size, seed):
+        self._cwd = os.getcwd()
+        self.api, self._directory = load_api()
+        self.client = self.api.app.test_client()
+        self.api.control_system.add_amplifiers(make_amplifiers(size, seed))
+        self.api.control_system.add_sensors(make_sensors(size, seed))
+        return self.api.control_system
+
+    def close(self):
+        self.control_system.journal.close()
+        os.chdir(self._cwd)
+        self._directory.cleanup()
+
+
+def request(client, method, url, **kwargs):
+    def call():
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        if response.status_code >= 500:
+            raise RuntimeError(f"{method} {url} failed with {response.status_code}")
+    return call
+
+
+def route_case(build):
+    def case(fleet, count):
+        return [build(fleet) for _ in range(count)]
+    return case
+
+
+def attach_route(fleet):
+    sensor = fleet.new_sensor()
+    fleet.control_system.add_sensor(sensor)
+    serial = fleet.serial()
+    fleet.attached.append((serial, sensor.serial_number))
+    return request(fleet.client, "POST", f"/api/amplifiers/{serial}/sensors", json={"sensor_serial": sensor.serial_number})
+
+
+def detach_route(fleet):
+    serial, sensor_serial = fleet.attached.pop()
+    return request(fleet.client, "DELETE", f"/api/amplifiers/{serial}/sensors/{sensor_serial}")
+
+
+def remove_route(fleet):
+    amplifier = fleet.new_amplifier()
+    fleet.control_system.add_amplifier(amplifier)
+    return request(fleet.client, "DELETE", f"/api/amplifiers/{amplifier.serial_number}")
+
+
+ROUTE_CASES = [
+    ("GET /api/amplifiers?limit=100", route_case(lambda fleet: request(
+        fleet.client, "GET", "/api/amplifiers?limit=100")), False),
+    ("GET /api/amplifiers", route_case(lambda fleet: request(fleet.client, "GET", "/api/amplifiers")), True),
+    ("GET /api/amplifiers/search", route_case(lambda fleet: request(
+        fleet.client, "GET", "/api/amplifiers/search", query_string={"model_string": fleet.model_query()})), False),
+    ("POST /api/amplifiers", route_case(lambda fleet: request(
+        fleet.client, "POST", "/api/amplifiers", json=amplifier_json(fleet.new_amplifier()))), False),
+    ("DELETE /api/amplifiers/<serial>", route_case(remove_route), False),
+    ("PUT /api/amplifiers/<serial>/gain", route_case(lambda fleet: request(
+        fleet.client, "PUT", f"/api/amplifiers/{fleet.serial()}/gain", json={"gain": fleet.rng.randint(1, 100)})),
+     False),
+    ("PUT /api/amplifiers/<serial>/sampling_rate", route_case(lambda fleet: request(
+        fleet.client, "PUT", f"/api/amplifiers/{fleet.serial()}/sampling_rate", json={"sampling_rate": 512})), False),
+    ("POST /api/amplifiers/<serial>/power", route_case(lambda fleet: request(
+        fleet.client, "POST", f"/api/amplifiers/{fleet.serial()}/power")), False),
+    ("POST /api/sensors", route_case(lambda fleet: request(
+        fleet.client, "POST", "/api/sensors", json=sensor_json(fleet.new_sensor()))), False),
+    ("POST /api/amplifiers/<serial>/sensors", route_case(attach_route), False),
+    ("DELETE /api/amplifiers/<serial>/sensors/<sensor>", route_case(detach_route), False),
+    ("PUT /api/device/amplifier/<serial>/maintenance", route_case(lambda fleet: request(
+        fleet.client, "PUT", f"/api/device/amplifier/{fleet.serial()}/maintenance",
+        json={"new_date": fleet.future_date()})), False),
+    ("GET /api/maintenance/due", route_case(lambda fleet: request(
+        fleet.client, "GET", "/api/maintenance/due", query_string={"within_days": 30})), True),
+    ("POST /api/amplifiers/bulk", route_case(lambda fleet: request(
+        fleet.client, "POST", "/api/amplifiers/bulk",
+        json={"amplifiers": [amplifier_json(fleet.new_amplifier()) for _ in range(100)]})), False),
+    # Waits for the background snapshot, so the case still times writing it.
+    ("POST /api/save", route_case(lambda fleet: request(fleet.client, "POST", "/api/save",
+                                                        query_string={"wait": "true"})), True),
+    ("POST /api/load", route_case(lambda fleet: request(fleet.client, "POST", "/api/load")), True),
+    (f"PUT /api/amplifiers/<serial>/montage[{MONTAGE_CHANNELS}]", lambda fleet, count: [request(
+        fleet.client, "PUT", f"/api/amplifiers/{fleet.serial()}/montage", json={"montage": fleet.new_cap()})
+        for _ in range(min(count, MONTAGE_OPERATIONS))], False),
+]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_case(name, case, fleet, count):
+    """Times count operations one by one, then measures the memory peak of a few more."""
+    with quiet():
+        operations = case(fleet, count)
+        timings = []
+        for operation in operations:
+            start = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - start)
+        operations = case(fleet, min(count, MEMORY_OPERATIONS))
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for operation in operations:
+            operation()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+    timings.sort()
+    total = sum(timings)
+    return {
+        "name": name,
+        "size": fleet.size,
+        "operations": len(timings),
+        "seconds": total,
+        "ops_per_second": len(timings) / total if total else None,
+        "mean_us": total / len(timings) * 1e6,
+        "p50_us": percentile(timings, 0.5) * 1e6,
+        "p95_us": percentile(timings, 0.95) * 1e6,
+        "max_us": timings[-1] * 1e6,
+        "peak_mb": max(peak, 0) / 1e6,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run(args):
+    output = os.path.abspath(args.output) if args.output else None
+    results = []
+    for size in args.sizes:
+        for label, make_fleet, cases in [("core", Fleet, CORE_CASES), ("api", ApiFleet, ROUTE_CASES)]:
+            if args.only and label != args.only:
+                continue
+            start = time.perf_counter()
+            fleet = make_fleet(size, args.seed)
+            print(f"{size:>9} {label} fleet built in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+            with tempfile.TemporaryDirectory() as directory:
+                fleet.directory = directory
+                for name, case, heavy in cases:
+                    result = run_case(name, case, fleet, args.heavy_operations if heavy else args.operations)
+                    results.append(result)
+                    print(f"{size:>9} {name:<48} {result['mean_us']:>12.1f} us {result['peak_mb']:>9.2f} MB",
+                          file=sys.stderr)
+            fleet.close()
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": args.seed,
+            "sizes": args.sizes,
+            "operations": args.operations,
+            "heavy_operations": args.heavy_operations,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {(result["name"], result["size"]): result for result in json.load(f)["results"]}
+    with open(args.change) as f:
+        change = {(result["name"], result["size"]): result for result in json.load(f)["results"]}
+    regressions = 0
+    print(f"{'size':>9} {'case':<48} {'median us':>22} {'time':>8} {'peak MB':>18} {'status'}")
+    for key in sorted(baseline.keys() & change.keys(), key=lambda key: (key[1], key[0])):
+        old, new = baseline[key], change[key]
+        time_change = new["p50_us"] / old["p50_us"] - 1
+        memory_growth = new["peak_mb"] - old["peak_mb"]
+        memory_change = memory_growth / old["peak_mb"] if old["peak_mb"] else 0.0
+        problems = []
+        if time_change > args.threshold:
+            problems.append("slower")
+        if memory_change > args.memory_threshold and memory_growth > MEMORY_NOISE_MB:
+            problems.append("more memory")
+        regressions += bool(problems)
+        print(f"{key[1]:>9} {key[0]:<48} {old['p50_us']:>10.1f} {new['p50_us']:>11.1f} {time_change:>+8.0%} "
+              f"{old['peak_mb']:>8.2f} {new['peak_mb']:>9.2f} {'REGRESSION: ' + ', '.join(problems) if problems else 'ok'}")
+    for key in sorted(baseline.keys() ^ change.keys()):
+        print(f"{key[1]:>9} {key[0]:<48} only in {'baseline' if key in baseline else 'change'}")
+    print(f"{regressions} regression{'s' if regressions != 1 else ''} "
+          f"(time threshold {args.threshold:.0%}, memory threshold {args.memory_threshold:.0%})")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the suite and write JSON results")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    run_parser.add_argument("--operations", type=int, default=1000, help="timed calls of each light case")
+    run_parser.add_argument("--heavy-operations", type=int, default=3, help="timed calls of whole-fleet cases")
+    run_parser.add_argument("--only", choices=["core", "api"], help="run only the core or the API cases")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="JSON file to write (default: standard output)")
+    compare_parser = commands.add_parser("compare", help="flag regressions between two JSON results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("change")
+    compare_parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative growth of median time")
+    compare_parser.add_argument("--memory-threshold", type=float, default=0.25,
+                                help="allowed relative growth of the memory peak")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+A bounded, in-memory log of fleet changes, for clients that follow the fleet instead of polling it.
+
+EEGControlSystem publishes every mutation to its ChangeFeed as an event with the next
+sequence number, and the feed keeps the latest `capacity` of them. Subscribers have no
+queue of their own: each remembers the last sequence number it has seen and reads on from
+there, so a slow subscriber costs no memory. One that falls so far behind that events it
+has not seen were already dropped (or that resumes with a sequence number from another
+feed, e.g. before a restart) is told to resync: fetch the fleet again, then follow from
+the current sequence number.
+
+    events, resync = control_system.changes.since(sequence)
+"""
+import collections
+import os
+import threading
+
+# Field names of the arguments of each kind of event (the journal records, plus "load").
+EVENT_FIELDS = {
+    "add_amplifier": ("serial_number", "model_string", "manufacturer", "next_maintenance", "sampling_rate", "gain"),
+    "remove_amplifier": ("serial_number",),
+    "add_sensor": ("serial_number", "model_string", "manufacturer", "next_maintenance", "tag"),
+    "remove_sensor": ("serial_number",),
+    "attach_sensor": ("amplifier_serial", "sensor_serial"),
+    "detach_sensor": ("amplifier_serial", "sensor_serial"),
+    "gain": ("serial_number", "gain"),
+    "sampling_rate": ("serial_number", "sampling_rate"),
+    "power": ("serial_number", "is_on"),
+    "maintenance": ("device_type", "serial_number", "next_maintenance"),
+    "load": ("filename",),
+}
+
+
+def event_dict(sequence, op, args):
+    """Returns an event as a JSON-ready dict: {"sequence", "op", then the op's fields}."""
+    event = {"sequence": sequence, "op": op}
+    event.update(zip(EVENT_FIELDS[op], args))
+    return event
+
+
+class ChangeFeed:
+    """
+    The latest change events of a control system, with monotonically increasing sequence numbers.
+
+    Attributes:
+        capacity (int): Number of events kept.
+        epoch (str): Identifies this feed; sequence numbers from another epoch mean nothing here.
+        sequence (int): Sequence number of the latest event (0 before the first).
+    """
+    def __init__(self, capacity=10000):
+        if capacity < 1:
+            raise ValueError("A change feed must keep at least one event.")
+        self.capacity = capacity
+        self.epoch = os.urandom(6).hex()
+        self.sequence = 0
+        self._events = collections.deque(maxlen=capacity)  # (sequence, op, args), oldest first
+        self._condition = threading.Condition(threading.Lock())
+        self._listeners = []
+
+    def publish(self, op, args):
+        """Appends an event, dropping the oldest if the feed is full, and wakes every waiter."""
+        with self._condition:
+            self.sequence += 1
+            self._events.append((self.sequence, op, args))
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener):
+        """Calls listener() after every event, in the thread that published it, so it must return at once."""
+        # The list is replaced, never changed in place, so publish() can call it without the lock.
+        with self._condition:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        with self._condition:
+            self._listeners = [other for other in self._listeners if other is not listener]
+
+    def since(self, sequence, limit=None):
+        """
+        Returns (events, resync): the events after a sequence number as dicts, oldest first, at most limit of them.
+
+        resync is True, and events empty, if events after that sequence number were already
+        dropped or the number is ahead of this feed.
+        """
+        with self._condition:
+            if sequence > self.sequence or (self._events and sequence < self._events[0][0] - 1):
+                return [], True
+            # New events are at the right end; walk only as far back as the subscriber has read.
+            new = []
+            for item in reversed(self._events):
+                if item[0] <= sequence:
+                    break
+                new.append(item)
+        new.reverse()
+        if limit is not None:
+            new = new[:limit]
+        return [event_dict(*item) for item in new], False
+
+    def wait(self, sequence, timeout=None):
+        """Blocks until there are events after a sequence number or the timeout expires. Returns True if there are."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.sequence > sequence, timeout)
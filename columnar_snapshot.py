@@ -0,0 +1,459 @@
+"""
+Memory-mapped columnar snapshot format for EEGControlSystem.
+
+Instead of pickling every Amplifier and Sensor object, the snapshot stores one fixed-width
+column per numeric field, a deduplicated string table and an offset-encoded array of sensor
+memberships. Opening a snapshot only maps the file; device objects are created lazily the
+first time they are looked up, so startup time no longer grows with the size of the fleet
+and no pickle code is executed.
+
+File layout (all integers in native byte order, checked against BYTE_ORDER_MARK):
+
+    magic                    8 bytes  b"EEGCOL1\\0"
+    header                   8 x u32  byte order mark, amplifier count, sensor count,
+                                      string count, membership count, journal generation,
+                                      2 reserved
+    string offsets           (strings + 1) x u64, byte offsets into the string blob
+    amplifier columns        u32 serial, model, manufacturer and maintenance string ids,
+                             u32 sampling rate, gain and power, i32 maintenance ordinal,
+                             (amplifiers + 1) x u32 membership start offsets
+    memberships              u32 sensor rows, grouped by amplifier
+    sensor columns           u32 serial, model, manufacturer, maintenance and tag string ids,
+                             i32 maintenance ordinal, i32 owning amplifier row (-1 if unassigned)
+    string blob              UTF-8 bytes of every distinct string
+
+Amplifier and sensor rows are sorted by serial number, so a device is found by binary search
+without building any per-device dictionary at startup.
+
+Usage (convert an existing pickle snapshot):
+    python columnar_snapshot.py amplifier_repository.pkl amplifier_repository.eegc
+"""
+import abc
+from array import array
+from collections import namedtuple
+from collections.abc import MutableMapping
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from amplifier import Amplifier
+from maintenance_index import maintenance_ordinal
+from sensor import Sensor
+
+MAGIC = b"EEGCOL1\0"
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct("=8I")
+AMPLIFIER_COLUMNS = ("serial_number", "model_string", "manufacturer", "next_maintenance",
+                     "sampling_rate", "gain", "is_on", "maintenance_ordinal")
+SENSOR_COLUMNS = ("serial_number", "model_string", "manufacturer", "next_maintenance", "tag",
+                  "maintenance_ordinal", "owner")
+SIGNED_COLUMNS = ("maintenance_ordinal", "owner")
+STRING_COLUMNS = ("serial_number", "model_string", "manufacturer", "next_maintenance", "tag")
+
+# A device as the snapshot stores it: its column values, and for an amplifier the serial numbers of its sensors.
+AmplifierRecord = namedtuple("AmplifierRecord", AMPLIFIER_COLUMNS + ("sensors",))
+SensorRecord = namedtuple("SensorRecord", SENSOR_COLUMNS[:-1])
+
+
+def is_columnar_snapshot(filename):
+    """Returns True if filename starts with the columnar snapshot magic bytes."""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def amplifier_record(amplifier):
+    """Returns the AmplifierRecord of an Amplifier."""
+    return AmplifierRecord(amplifier.serial_number, amplifier.model_string, amplifier.manufacturer,
+                           amplifier.next_maintenance, amplifier.sampling_rate, amplifier.gain, bool(amplifier.is_on),
+                           maintenance_ordinal(amplifier.next_maintenance),
+                           [sensor.serial_number for sensor in amplifier.sensors])
+
+
+def sensor_record(sensor):
+    """Returns the SensorRecord of a Sensor."""
+    return SensorRecord(sensor.serial_number, sensor.model_string, sensor.manufacturer, sensor.next_maintenance,
+                        sensor.tag, maintenance_ordinal(sensor.next_maintenance))
+
+
+def device_records(devices, kind):
+    """Yields a record per device of a serial-number-keyed mapping; a LazyDeviceMap's untouched rows come straight from its columns."""
+    if isinstance(devices, LazyDeviceMap):
+        return devices.records()
+    return map(amplifier_record if kind == "amplifier" else sensor_record, devices.values())
+
+
+def write_snapshot(filename, amplifiers, sensors, journal_generation=0):
+    """Writes amplifiers and sensors to filename in the columnar format, atomically."""
+    amplifiers = list(amplifiers)
+    sensors = {sensor.serial_number: sensor for sensor in sensors}
+    for amplifier in amplifiers:
+        for sensor in amplifier.sensors:
+            sensors.setdefault(sensor.serial_number, sensor)
+    write_records(filename, map(amplifier_record, amplifiers), map(sensor_record, sensors.values()), journal_generation)
+
+
+def write_records(filename, amplifiers, sensors, journal_generation=0):
+    """Writes AmplifierRecords and SensorRecords to filename in the columnar format, atomically."""
+    amplifiers = sorted(amplifiers, key=lambda record: record.serial_number.encode())
+    sensors = sorted(sensors, key=lambda record: record.serial_number.encode())
+    sensor_rows = {record.serial_number: row for row, record in enumerate(sensors)}
+
+    strings = {}
+
+    def string_id(value):
+        return strings.setdefault(value, len(strings))
+
+    amplifier_columns = {name: array('i' if name in SIGNED_COLUMNS else 'I') for name in AMPLIFIER_COLUMNS}
+    membership_starts = array('I', [0])
+    memberships = array('I')
+    owners = [-1] * len(sensors)
+    for row, record in enumerate(amplifiers):
+        for name in AMPLIFIER_COLUMNS:
+            value = getattr(record, name)
+            amplifier_columns[name].append(string_id(value) if name in STRING_COLUMNS else int(value))
+        for sensor_serial in record.sensors:
+            sensor_row = sensor_rows[sensor_serial]
+            memberships.append(sensor_row)
+            owners[sensor_row] = row
+        membership_starts.append(len(memberships))
+
+    sensor_columns = {name: array('i' if name in SIGNED_COLUMNS else 'I') for name in SENSOR_COLUMNS}
+    for record in sensors:
+        for name in SensorRecord._fields:
+            value = getattr(record, name)
+            sensor_columns[name].append(string_id(value) if name in STRING_COLUMNS else int(value))
+    sensor_columns["owner"].extend(owners)
+
+    string_offsets = array('Q', [0])
+    blob = bytearray()
+    for value in strings:
+        blob += value.encode()
+        string_offsets.append(len(blob))
+
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(BYTE_ORDER_MARK, len(amplifiers), len(sensors), len(strings), len(memberships),
+                            journal_generation, 0, 0))
+        f.write(string_offsets.tobytes())
+        for name in AMPLIFIER_COLUMNS:
+            f.write(amplifier_columns[name].tobytes())
+        f.write(membership_starts.tobytes())
+        f.write(memberships.tobytes())
+        for name in SENSOR_COLUMNS:
+            f.write(sensor_columns[name].tobytes())
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+
+
+class ColumnarSnapshot:
+    """
+    Read-only view of a columnar snapshot file opened with mmap.
+
+    Columns are exposed as memoryviews over the mapped file, so nothing is copied or
+    decoded until a row is actually requested.
+
+    Attributes:
+        amplifier_count (int): Number of amplifier rows.
+        sensor_count (int): Number of sensor rows.
+        journal_generation (int): Generation of the journal that follows this snapshot.
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else b""
+        view = memoryview(self._mmap)
+        self._views = [view]
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{filename} is not a columnar snapshot.")
+        (byte_order, self.amplifier_count, self.sensor_count, string_count, membership_count,
+         self.journal_generation, _, _) = HEADER.unpack_from(view, len(MAGIC))
+        if byte_order != BYTE_ORDER_MARK:
+            raise ValueError(f"{filename} was written on a machine with a different byte order.")
+
+        position = len(MAGIC) + HEADER.size
+
+        def column(fmt, count):
+            nonlocal position
+            start, position = position, position + count * struct.calcsize(fmt)
+            self._views.append(view[start:position].cast(fmt))
+            return self._views[-1]
+
+        self._string_offsets = column('Q', string_count + 1)
+        self.amplifier_columns = {name: column('i' if name in SIGNED_COLUMNS else 'I', self.amplifier_count)
+                                  for name in AMPLIFIER_COLUMNS}
+        self._membership_starts = column('I', self.amplifier_count + 1)
+        self._memberships = column('I', membership_count)
+        self.sensor_columns = {name: column('i' if name in SIGNED_COLUMNS else 'I', self.sensor_count)
+                               for name in SENSOR_COLUMNS}
+        self._blob = view[position:]
+        self._views.append(self._blob)
+
+    def close(self):
+        """Unmaps the file. Columns read from the snapshot cannot be used afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def string(self, string_id):
+        """Decodes one entry of the string table."""
+        return str(self._blob[self._string_offsets[string_id]:self._string_offsets[string_id + 1]], "utf-8")
+
+    def _string_bytes(self, string_id):
+        return self._blob[self._string_offsets[string_id]:self._string_offsets[string_id + 1]].tobytes()
+
+    def _find_row(self, serial_column, count, serial_number):
+        key = serial_number.encode()
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._string_bytes(serial_column[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count and self._string_bytes(serial_column[low]) == key:
+            return low
+        return None
+
+    def find_amplifier_row(self, serial_number):
+        """Returns the row of an amplifier by binary search over the sorted serial column, or None."""
+        return self._find_row(self.amplifier_columns["serial_number"], self.amplifier_count, serial_number)
+
+    def find_sensor_row(self, serial_number):
+        """Returns the row of a sensor by binary search over the sorted serial column, or None."""
+        return self._find_row(self.sensor_columns["serial_number"], self.sensor_count, serial_number)
+
+    def amplifier_serial(self, row):
+        return self.string(self.amplifier_columns["serial_number"][row])
+
+    def sensor_serial(self, row):
+        return self.string(self.sensor_columns["serial_number"][row])
+
+    def amplifier_sensor_rows(self, row):
+        """Returns the sensor rows attached to an amplifier row."""
+        return self._memberships[self._membership_starts[row]:self._membership_starts[row + 1]]
+
+    def sensor_owner_row(self, row):
+        """Returns the amplifier row a sensor row is attached to, or -1."""
+        return self.sensor_columns["owner"][row]
+
+    def make_amplifier(self, row):
+        """Creates an Amplifier object (without sensors) from a row."""
+        columns = self.amplifier_columns
+        amplifier = Amplifier(
+            serial_number=self.string(columns["serial_number"][row]),
+            model_string=self.string(columns["model_string"][row]),
+            manufacturer=self.string(columns["manufacturer"][row]),
+            next_maintenance=self.string(columns["next_maintenance"][row]),
+            sampling_rate=columns["sampling_rate"][row],
+            gain=columns["gain"][row]
+        )
+        amplifier.is_on = bool(columns["is_on"][row])
+        return amplifier
+
+    def amplifier_record(self, row):
+        """Returns the AmplifierRecord of a row, without creating an Amplifier."""
+        columns = self.amplifier_columns
+        return AmplifierRecord(*(self.string(columns[name][row]) if name in STRING_COLUMNS else columns[name][row]
+                                 for name in AMPLIFIER_COLUMNS),
+                               [self.sensor_serial(sensor_row) for sensor_row in self.amplifier_sensor_rows(row)])
+
+    def sensor_record(self, row):
+        """Returns the SensorRecord of a row, without creating a Sensor."""
+        columns = self.sensor_columns
+        return SensorRecord(*(self.string(columns[name][row]) if name in STRING_COLUMNS else columns[name][row]
+                              for name in SensorRecord._fields))
+
+    def make_sensor(self, row):
+        """Creates a Sensor object from a row."""
+        columns = self.sensor_columns
+        return Sensor(
+            serial_number=self.string(columns["serial_number"][row]),
+            model_string=self.string(columns["model_string"][row]),
+            manufacturer=self.string(columns["manufacturer"][row]),
+            next_maintenance=self.string(columns["next_maintenance"][row]),
+            tag=self.string(columns["tag"][row])
+        )
+
+
+class _SnapshotOverlay(MutableMapping):
+    """
+    Dictionary-like view of a snapshot plus the changes made since it was opened.
+
+    Values come from the snapshot until they are overwritten or cached (kept in _overrides)
+    or deleted (kept in _deleted). Keys that do not exist in the snapshot are tracked in
+    _added, so iteration and len() never have to scan the overrides against the snapshot.
+    Subclasses implement the snapshot lookups.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._overrides = {}
+        self._deleted = set()
+        self._added = {}
+
+    @abc.abstractmethod
+    def _base_lookup(self, key):
+        """Returns the snapshot's value for a key, or None if the snapshot does not have it."""
+
+    @abc.abstractmethod
+    def _base_keys(self):
+        """Returns an iterable of the snapshot's keys."""
+
+    @abc.abstractmethod
+    def _base_len(self):
+        """Returns the number of keys in the snapshot."""
+
+    def __getitem__(self, key):
+        try:
+            return self._overrides[key]
+        except KeyError:
+            pass
+        if key in self._deleted:
+            raise KeyError(key)
+        value = self._base_lookup(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self._overrides and key not in self._deleted and self._base_lookup(key) is None:
+            self._added[key] = None
+        self._overrides[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        self[key]
+        self._overrides.pop(key, None)
+        if key in self._added:
+            del self._added[key]
+        else:
+            self._deleted.add(key)
+
+    def __iter__(self):
+        for key in self._base_keys():
+            if key not in self._deleted:
+                yield key
+        yield from list(self._added)
+
+    def __len__(self):
+        return self._base_len() - len(self._deleted) + len(self._added)
+
+
+class LazyDeviceMap(_SnapshotOverlay):
+    """
+    Serial-number-keyed mapping of devices that materializes snapshot rows on first access.
+
+    Materialized devices are cached in the overrides, so every later access returns the
+    same object and mutations made on it are kept.
+    """
+    def __init__(self, snapshot, kind, sensors=None):
+        super().__init__(snapshot)
+        self.kind = kind
+        self.sensors = sensors
+        self._materialize_lock = threading.Lock()
+        if kind == "amplifier":
+            self._count, self._serial = snapshot.amplifier_count, snapshot.amplifier_serial
+            self._find_row = snapshot.find_amplifier_row
+        else:
+            self._count, self._serial = snapshot.sensor_count, snapshot.sensor_serial
+            self._find_row = snapshot.find_sensor_row
+
+    def _materialize(self, row):
+        if self.kind == "sensor":
+            return self.snapshot.make_sensor(row)
+        amplifier = self.snapshot.make_amplifier(row)
+        for sensor_row in self.snapshot.amplifier_sensor_rows(row):
+            amplifier.sensors.append(self.sensors[self.snapshot.sensor_serial(sensor_row)])
+        return amplifier
+
+    def _base_lookup(self, key):
+        row = self._find_row(key)
+        if row is None:
+            return None
+        # Concurrent readers of the same device must all get the one object that is kept.
+        with self._materialize_lock:
+            device = self._overrides.get(key)
+            if device is None:
+                device = self._overrides[key] = self._materialize(row)
+        return device
+
+    def _base_keys(self):
+        return (self._serial(row) for row in range(self._count))
+
+    def records(self):
+        """
+        Yields the AmplifierRecord or SensorRecord of every device.
+
+        Rows that were never looked up are read straight from the columns, and nothing is
+        materialized or cached, so writing a snapshot or building indexes keeps the map as lazy as it was.
+        """
+        if self.kind == "amplifier":
+            record, row_record = amplifier_record, self.snapshot.amplifier_record
+        else:
+            record, row_record = sensor_record, self.snapshot.sensor_record
+        for row in range(self._count):
+            serial_number = self._serial(row)
+            device = self._overrides.get(serial_number)
+            if device is not None:
+                yield record(device)
+            elif serial_number not in self._deleted:
+                yield row_record(row)
+        for serial_number in list(self._added):
+            yield record(self._overrides[serial_number])
+
+    def _base_len(self):
+        return self._count
+
+
+class LazySensorOwnerMap(_SnapshotOverlay):
+    """Sensor serial -> amplifier serial mapping answered from the snapshot's owner column."""
+    _owned_count = None
+
+    def _base_lookup(self, key):
+        row = self.snapshot.find_sensor_row(key)
+        if row is None:
+            return None
+        owner_row = self.snapshot.sensor_owner_row(row)
+        if owner_row < 0:
+            return None
+        return self.snapshot.amplifier_serial(owner_row)
+
+    def _base_keys(self):
+        owners = self.snapshot.sensor_columns["owner"]
+        return (self.snapshot.sensor_serial(row) for row in range(self.snapshot.sensor_count) if owners[row] >= 0)
+
+    def _base_len(self):
+        if self._owned_count is None:
+            self._owned_count = sum(1 for owner in self.snapshot.sensor_columns["owner"] if owner >= 0)
+        return self._owned_count
+
+
+def open_snapshot(filename):
+    """Opens a columnar snapshot and returns (amplifiers, sensors, sensor_owner, journal_generation) mappings."""
+    snapshot = ColumnarSnapshot(filename)
+    sensors = LazyDeviceMap(snapshot, "sensor")
+    amplifiers = LazyDeviceMap(snapshot, "amplifier", sensors)
+    return amplifiers, sensors, LazySensorOwnerMap(snapshot), snapshot.journal_generation
+
+
+def convert(pickle_filename, columnar_filename):
+    """Converts a pickle snapshot written by EEGControlSystem.save_state into the columnar format."""
+    from control_system import EEGControlSystem
+    control_system = EEGControlSystem()
+    control_system.load_state(pickle_filename)
+    control_system.save_state(columnar_filename, snapshot_format="columnar")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(f"Usage: python {sys.argv[0]} <input.pkl> <output.eegc>")
+    convert(sys.argv[1], sys.argv[2])
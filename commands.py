@@ -0,0 +1,292 @@
+"""
+Amplifier settings sent to the hardware as asynchronous commands, coalesced per amplifier.
+
+With a driver (drivers.py) between the control system and the amplifiers, a new gain,
+sampling rate or power state takes effect only once the amplifier has acknowledged it,
+milliseconds later. CommandDispatcher takes such changes without waiting for them: each
+call returns a Command with an id at once, and the command can be polled or waited for.
+
+Commands queue per amplifier, and each amplifier has at most one round trip in flight. The
+commands that arrive meanwhile go out together in the next round trip, where a later value
+of a setting replaces an earlier one: ten gain changes in a row cost one round trip, and
+the nine whose values never reached the amplifier finish as "superseded". Round trips to
+different amplifiers run concurrently, up to max_in_flight at once. Once the driver
+confirms a round trip, its settings are applied to the EEGControlSystem, which journals
+and publishes them like any other change.
+
+The dispatcher runs its own event loop in a background thread, so that the threaded Flask
+app and the ASGI app can both use it; its methods may be called from any thread.
+
+    dispatcher = CommandDispatcher(control_system, SimulatedDriver(latency=0.02))
+    dispatcher.start()
+    command = dispatcher.set_gain("A001", 10)
+    command.wait(timeout=5)  # or, on an event loop: await command.wait_async(timeout=5)
+    print(command.state)     # "applied"
+    dispatcher.stop()
+"""
+import asyncio
+from collections import deque
+import concurrent.futures
+import contextlib
+import itertools
+import os
+import threading
+import time
+
+from amplifier import Amplifier
+from drivers import DriverError
+
+# States a command ends in.
+FINISHED = ("applied", "superseded", "failed")
+
+
+class Command:
+    """
+    One change of settings for one amplifier.
+
+    Attributes:
+        id (str): Identifier, unique across dispatchers.
+        serial_number (str): The amplifier.
+        settings (dict): New values, by "gain", "sampling_rate" and/or "power".
+        state (str): "queued", "sending", or one of FINISHED ("superseded" when later commands
+            replaced every value before it was sent).
+        error (str): Why the command failed, or None.
+        submitted (float): When the command was taken, as time.time().
+        completed (float): When it finished, or None.
+    """
+    def __init__(self, command_id, serial_number, settings):
+        self.id = command_id
+        self.serial_number = serial_number
+        self.settings = settings
+        self.state = "queued"
+        self.error = None
+        self.submitted = time.time()
+        self.completed = None
+        self._done = concurrent.futures.Future()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED
+
+    def wait(self, timeout=None):
+        """Blocks until the command has finished or the timeout expires. Returns True if it has finished."""
+        try:
+            self._done.result(timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    async def wait_async(self, timeout=None):
+        """Waits on the running event loop until the command has finished or the timeout expires. Returns True if it has."""
+        try:
+            # Shielded, so that giving up waiting does not cancel the command.
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._done)), timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    def _finish(self, state, error=None):
+        self.state = state
+        self.error = error
+        self.completed = time.time()
+        self._done.set_result(None)
+
+    def to_dict(self):
+        command = {"id": self.id, "serial_number": self.serial_number, "settings": self.settings, "state": self.state,
+                   "submitted": self.submitted, "completed": self.completed}
+        if self.error is not None:
+            command["error"] = self.error
+        return command
+
+
+class CommandDispatcher:
+    """
+    Sends amplifier settings through a driver, one round trip per amplifier at a time.
+
+    Attributes:
+        control_system (EEGControlSystem): The fleet the confirmed settings are applied to.
+        driver (AmplifierDriver): The round trip to the amplifiers.
+        max_in_flight (int): Number of round trips in flight at once, across amplifiers.
+        retain (int): Number of finished commands kept for polling; older ones are forgotten.
+        submitted (int): Number of commands taken so far.
+        round_trips (int): Number of round trips sent so far.
+    """
+    def __init__(self, control_system, driver, max_in_flight=256, retain=10000):
+        self.control_system = control_system
+        self.driver = driver
+        self.max_in_flight = max_in_flight
+        self.retain = retain
+        self.submitted = 0
+        self.round_trips = 0
+        self._prefix = os.urandom(4).hex()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = {}  # serial number -> commands waiting for the next round trip
+        self._sending = {}  # serial number -> commands in the round trip in flight
+        self._commands = {}  # id -> command, unfinished and retained
+        self._finished = deque()  # ids of retained finished commands, oldest first
+        self._workers = set()
+        self._turns = None
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        """Starts the dispatcher's event loop thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="command-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=30):
+        """Waits up to timeout seconds for the commands taken so far to finish, then stops the event loop thread."""
+        if self._thread is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain_all(), self._loop).result(timeout)
+        except TimeoutError:
+            print(f"Stopped the command dispatcher with {len(self._commands) - len(self._finished)} commands unfinished.")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+
+    def get(self, command_id):
+        """Returns a command by id, or None if it is unknown or was forgotten."""
+        return self._commands.get(command_id)
+
+    def set_gain(self, serial_number, gain):
+        """Queues a gain change. Returns the Command, or None if the amplifier does not exist. Raises ValueError for a bad gain."""
+        Amplifier.validate_gain(gain)
+        if self.control_system.find_amplifier(serial_number) is None:
+            return None
+        return self._submit(serial_number, {"gain": gain})
+
+    def set_sampling_rate(self, serial_number, sampling_rate):
+        """Queues a sampling rate change. Returns the Command, or None if the amplifier does not exist. Raises ValueError for a bad rate."""
+        Amplifier.validate_sampling_rate(sampling_rate)
+        if self.control_system.find_amplifier(serial_number) is None:
+            return None
+        return self._submit(serial_number, {"sampling_rate": sampling_rate})
+
+    def toggle_power(self, serial_number, expected=None):
+        """
+        Queues flipping an amplifier's power state, as it will be once the commands before this one are applied.
+
+        With expected (True for on), only flips it if it will be in that state. Returns the
+        Command, False if the amplifier will not be in the expected state, or None if it does not exist.
+        """
+        amplifier = self.control_system.find_amplifier(serial_number)
+        if amplifier is None:
+            return None
+        with self._lock:
+            # Decided under the lock, so that two toggles at once turn the amplifier off and on again, not off twice.
+            on = self._target(serial_number, "power", amplifier.is_on)
+            if expected is not None and on != expected:
+                return False
+            return self._submit(serial_number, {"power": not on}, locked=True)
+
+    def update_amplifiers(self, serial_numbers, gain=None, sampling_rate=None, power=None):
+        """
+        Queues the same gain, sampling rate and/or power state for a batch of amplifiers, one command each.
+
+        The values are validated once, before anything is queued (ValueError). Returns one
+        result dict per serial number, with the command id or an error.
+        """
+        if gain is not None:
+            Amplifier.validate_gain(gain)
+        if sampling_rate is not None:
+            Amplifier.validate_sampling_rate(sampling_rate)
+        settings = {name: value for name, value in
+                    (("gain", gain), ("sampling_rate", sampling_rate), ("power", power)) if value is not None}
+        results = []
+        for serial_number in serial_numbers:
+            if self.control_system.find_amplifier(serial_number) is None:
+                results.append({"serial_number": serial_number, "error": "Amplifier not found."})
+            else:
+                command = self._submit(serial_number, dict(settings))
+                results.append({"serial_number": serial_number, "status": "queued", "command": command.id})
+        return results
+
+    def _target(self, serial_number, setting, current):
+        """Returns the value a setting will have once the queued and in-flight commands are applied."""
+        for command in reversed(self._sending.get(serial_number, []) + self._pending.get(serial_number, [])):
+            if setting in command.settings:
+                return command.settings[setting]
+        return current
+
+    def _submit(self, serial_number, settings, locked=False):
+        if self._thread is None:
+            raise RuntimeError("The command dispatcher has not been started.")
+        with contextlib.nullcontext() if locked else self._lock:
+            command = Command(f"{self._prefix}-{next(self._ids)}", serial_number, settings)
+            self.submitted += 1
+            self._commands[command.id] = command
+            queue = self._pending.setdefault(serial_number, [])
+            queue.append(command)
+            # An amplifier with a round trip in flight sends its new commands when that one is done.
+            idle = len(queue) == 1 and serial_number not in self._sending
+        if idle:
+            self._loop.call_soon_threadsafe(self._start_worker, serial_number)
+        return command
+
+    def _start_worker(self, serial_number):
+        if self._turns is None:
+            self._turns = asyncio.Semaphore(self.max_in_flight)
+        worker = self._loop.create_task(self._work(serial_number))
+        self._workers.add(worker)
+        worker.add_done_callback(self._workers.discard)
+
+    async def _work(self, serial_number):
+        """Sends an amplifier's queued commands, all that have come in at each turn in one round trip, until none are left."""
+        while True:
+            with self._lock:
+                batch = self._pending.pop(serial_number, None)
+                if batch is None:
+                    self._sending.pop(serial_number, None)
+                    return
+                self._sending[serial_number] = batch
+            # Each setting goes out with its latest value; a command none of whose values are latest is superseded.
+            settings, latest = {}, {}
+            for command in batch:
+                command.state = "sending"
+                settings.update(command.settings)
+                latest.update((setting, command) for setting in command.settings)
+            carriers = set(map(id, latest.values()))
+            try:
+                async with self._turns:
+                    self.round_trips += 1
+                    await self.driver.apply(serial_number, settings)
+            except DriverError as e:
+                error = str(e)
+            except Exception as e:
+                error = f"The driver failed: {e!r}"
+            else:
+                # Applying takes the fleet lock and may write to a database, so it runs off the event loop.
+                error = await self._loop.run_in_executor(None, self._apply, serial_number, settings)
+            with self._lock:
+                for command in batch:
+                    if error is not None:
+                        command._finish("failed", error)
+                    else:
+                        command._finish("applied" if id(command) in carriers else "superseded")
+                    self._finished.append(command.id)
+                while len(self._finished) > self.retain:
+                    self._commands.pop(self._finished.popleft(), None)
+
+    def _apply(self, serial_number, settings):
+        """Applies confirmed settings to the control system. Returns an error message, or None."""
+        control_system = self.control_system
+        if "gain" in settings and not control_system.set_gain(serial_number, settings["gain"]):
+            return "Amplifier not found."
+        if "sampling_rate" in settings and not control_system.set_sampling_rate(serial_number, settings["sampling_rate"]):
+            return "Amplifier not found."
+        if "power" in settings and not control_system.set_power(serial_number, settings["power"]):
+            return "Amplifier not found."
+        return None
+
+    async def _drain_all(self):
+        while self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        await self.driver.close()
@@ -0,0 +1,339 @@
+"""
+Array-backed storage for large fleets of amplifiers and sensors.
+
+CompactRegistry keeps every numeric field in a typed array and stores repeated strings such
+as model, manufacturer, maintenance date and tag once in an interning table, so a device
+costs a few bytes per field instead of a full Python object with its own attributes.
+Devices are handed out as AmplifierView and SensorView objects: thin views over a row that
+behave like Amplifier and Sensor (and are instances of them), reading and writing the
+arrays directly.
+
+Pass a registry to EEGControlSystem to use it for the fleet:
+
+    control_system = EEGControlSystem(registry=CompactRegistry())
+
+Gain and sampling rate are stored as doubles, so any value the amplifier accepts fits.
+Rows freed by removed devices are reused; each row has a generation that is bumped when it
+is freed, so a view kept from before raises KeyError instead of reading the new device.
+"""
+from array import array
+from collections.abc import MutableMapping
+import threading
+
+from amplifier import Amplifier
+from sensor import Sensor
+
+
+class StringTable:
+    """Interns strings so that every distinct value is stored once and referenced by an integer id."""
+    def __init__(self):
+        self._values = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, value):
+        string_id = self._ids.get(value)
+        if string_id is None:
+            # Devices can be changed from several threads at once; a new string must get exactly one id.
+            with self._lock:
+                string_id = self._ids.get(value)
+                if string_id is None:
+                    self._values.append(value)
+                    string_id = self._ids[value] = len(self._values) - 1
+        return string_id
+
+    def value(self, string_id):
+        return self._values[string_id]
+
+    def __len__(self):
+        return len(self._values)
+
+
+def _string_field(column):
+    def get(self):
+        registry = self._registry
+        return registry.strings.value(getattr(registry, column)[self._live_row()])
+
+    def set(self, value):
+        registry = self._registry
+        getattr(registry, column)[self._live_row()] = registry.strings.intern(value)
+    return property(get, set)
+
+
+def _serial_field(column):
+    # Serial numbers are unique, so they are kept in a plain list rather than interned.
+    def get(self):
+        return getattr(self._registry, column)[self._live_row()]
+
+    def set(self, value):
+        getattr(self._registry, column)[self._live_row()] = value
+    return property(get, set)
+
+
+def _number_field(column, convert=int):
+    def get(self):
+        return convert(getattr(self._registry, column)[self._live_row()])
+
+    def set(self, value):
+        getattr(self._registry, column)[self._live_row()] = value
+    return property(get, set)
+
+
+def _real(value):
+    # Whole numbers come back as int, so a device reads the same as one that was never stored.
+    return int(value) if value.is_integer() else value
+
+
+class _RowView:
+    """Methods shared by the views; the slots (_registry, _row, _generation) are declared by each view."""
+    __slots__ = ()
+    _generations = None  # name of the registry's generation column for this kind of device
+
+    def _live_row(self):
+        """Returns the row of this view. Raises KeyError if the device was removed since the view was made."""
+        if getattr(self._registry, self._generations)[self._row] != self._generation:
+            raise KeyError("The device was removed from the registry.")
+        return self._row
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return (self._registry is other._registry and self._row == other._row
+                    and self._generation == other._generation)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((id(self._registry), self._row, self._generation))
+
+
+class SensorView(_RowView, Sensor):
+    """A Sensor whose fields live in a row of a CompactRegistry."""
+    __slots__ = ("_registry", "_row", "_generation")
+    _generations = "_sensor_generation"
+
+    def __init__(self, registry, row):
+        self._registry = registry
+        self._row = row
+        self._generation = registry._sensor_generation[row]
+
+    serial_number = _serial_field("_sensor_serial")
+    model_string = _string_field("_sensor_model")
+    manufacturer = _string_field("_sensor_manufacturer")
+    next_maintenance = _string_field("_sensor_maintenance")
+    tag = _string_field("_sensor_tag")
+
+    def __reduce__(self):
+        # Pickles as a plain Sensor, so snapshots do not depend on the registry.
+        return Sensor, (self.serial_number, self.model_string, self.manufacturer, self.next_maintenance, self.tag)
+
+
+class AmplifierView(_RowView, Amplifier):
+    """An Amplifier whose fields and sensor list live in a row of a CompactRegistry."""
+    __slots__ = ("_registry", "_row", "_generation")
+    _generations = "_amp_generation"
+
+    def __init__(self, registry, row):
+        self._registry = registry
+        self._row = row
+        self._generation = registry._amp_generation[row]
+
+    serial_number = _serial_field("_amp_serial")
+    model_string = _string_field("_amp_model")
+    manufacturer = _string_field("_amp_manufacturer")
+    next_maintenance = _string_field("_amp_maintenance")
+    sampling_rate = _number_field("_amp_sampling_rate", _real)
+    gain = _number_field("_amp_gain", _real)
+    is_on = _number_field("_amp_on", bool)
+    version = _number_field("_amp_version")
+
+    @property
+    def sensors(self):
+        return [SensorView(self._registry, row) for row in self._registry._amp_sensors.get(self._live_row(), ())]
+
+    def add_sensor(self, sensor):
+        rows = self._registry._amp_sensors.setdefault(self._live_row(), array('I'))
+        rows.append(self._registry._sensor_rows[sensor.serial_number])
+        self.version += 1
+
+    def remove_sensor(self, sensor):
+        row = self._live_row()
+        rows = self._registry._amp_sensors.get(row, array('I'))
+        rows.remove(self._registry._sensor_rows[sensor.serial_number])
+        if not rows:
+            del self._registry._amp_sensors[row]
+        self.version += 1
+
+    def __reduce__(self):
+        # Pickles as a plain Amplifier, so snapshots do not depend on the registry.
+        return Amplifier, (self.serial_number, self.model_string, self.manufacturer, self.next_maintenance,
+                           self.sampling_rate, self.gain), {"sensors": self.sensors, "is_on": self.is_on,
+                                                     "version": self.version}
+
+
+class _DeviceTable(MutableMapping):
+    """Serial-number-keyed mapping over the rows of one device kind in a CompactRegistry."""
+    def __init__(self, registry, rows, free_rows, view_class, allocate, store, release):
+        self._registry = registry
+        self._rows = rows
+        self._free_rows = free_rows
+        self._view_class = view_class
+        self._allocate = allocate
+        self._store = store
+        self._release = release
+
+    def __getitem__(self, serial_number):
+        return self._view_class(self._registry, self._rows[serial_number])
+
+    def __setitem__(self, serial_number, device):
+        row = self._rows.get(serial_number)
+        if row is None:
+            row = self._free_rows.pop() if self._free_rows else self._allocate()
+            self._rows[serial_number] = row
+        elif device == self[serial_number]:
+            return
+        self._store(row, device)
+
+    def __delitem__(self, serial_number):
+        row = self._rows.pop(serial_number)
+        self._release(row)
+        self._free_rows.append(row)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, serial_number):
+        return serial_number in self._rows
+
+
+class _SensorOwnerTable(MutableMapping):
+    """Sensor serial -> amplifier serial mapping stored as one amplifier row per sensor row."""
+    def __init__(self, registry):
+        self._registry = registry
+        self._count = 0
+
+    def __getitem__(self, sensor_serial):
+        registry = self._registry
+        owner = registry._sensor_owner[registry._sensor_rows[sensor_serial]]
+        if owner < 0:
+            raise KeyError(sensor_serial)
+        return registry._amp_serial[owner]
+
+    def __setitem__(self, sensor_serial, amplifier_serial):
+        registry = self._registry
+        row = registry._sensor_rows[sensor_serial]
+        if registry._sensor_owner[row] < 0:
+            self._count += 1
+        registry._sensor_owner[row] = registry._amp_rows[amplifier_serial]
+
+    def __delitem__(self, sensor_serial):
+        registry = self._registry
+        row = registry._sensor_rows.get(sensor_serial)
+        if row is None or registry._sensor_owner[row] < 0:
+            raise KeyError(sensor_serial)
+        registry._sensor_owner[row] = -1
+        self._count -= 1
+
+    def __iter__(self):
+        registry = self._registry
+        return (serial for serial, row in list(registry._sensor_rows.items()) if registry._sensor_owner[row] >= 0)
+
+    def __len__(self):
+        return self._count
+
+
+class CompactRegistry:
+    """
+    Struct-of-arrays storage for amplifiers and sensors.
+
+    Attributes:
+        strings (StringTable): Interned models, manufacturers, dates and tags.
+        amplifiers (MutableMapping): Serial number -> AmplifierView.
+        sensors (MutableMapping): Serial number -> SensorView.
+        sensor_owner (MutableMapping): Sensor serial number -> amplifier serial number.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Removes every device from the registry."""
+        self.strings = StringTable()
+        self._amp_serial = []
+        self._amp_model = array('I')
+        self._amp_manufacturer = array('I')
+        self._amp_maintenance = array('I')
+        self._amp_sampling_rate = array('d')
+        self._amp_gain = array('d')
+        self._amp_on = array('B')
+        self._amp_version = array('Q')
+        self._amp_generation = array('I')
+        self._amp_sensors = {}  # amplifier row -> array of sensor rows, only for amplifiers with sensors
+        self._amp_rows = {}
+        self._amp_free_rows = []
+        self._sensor_serial = []
+        self._sensor_model = array('I')
+        self._sensor_manufacturer = array('I')
+        self._sensor_maintenance = array('I')
+        self._sensor_tag = array('I')
+        self._sensor_owner = array('i')
+        self._sensor_generation = array('I')
+        self._sensor_rows = {}
+        self._sensor_free_rows = []
+        self.amplifiers = _DeviceTable(self, self._amp_rows, self._amp_free_rows, AmplifierView,
+                                       self._allocate_amplifier, self._store_amplifier, self._release_amplifier)
+        self.sensors = _DeviceTable(self, self._sensor_rows, self._sensor_free_rows, SensorView,
+                                    self._allocate_sensor, self._store_sensor, self._release_sensor)
+        self.sensor_owner = _SensorOwnerTable(self)
+
+    def _allocate_amplifier(self):
+        self._amp_serial.append(None)
+        for column in (self._amp_model, self._amp_manufacturer, self._amp_maintenance,
+                       self._amp_sampling_rate, self._amp_gain, self._amp_on, self._amp_version,
+                       self._amp_generation):
+            column.append(0)
+        return len(self._amp_serial) - 1
+
+    def _store_amplifier(self, row, amplifier):
+        intern = self.strings.intern
+        self._amp_serial[row] = amplifier.serial_number
+        self._amp_model[row] = intern(amplifier.model_string)
+        self._amp_manufacturer[row] = intern(amplifier.manufacturer)
+        self._amp_maintenance[row] = intern(amplifier.next_maintenance)
+        self._amp_sampling_rate[row] = amplifier.sampling_rate
+        self._amp_gain[row] = amplifier.gain
+        self._amp_on[row] = amplifier.is_on
+        self._amp_version[row] = amplifier.version
+        sensor_rows = array('I', (self._sensor_rows[sensor.serial_number] for sensor in amplifier.sensors))
+        if sensor_rows:
+            self._amp_sensors[row] = sensor_rows
+        else:
+            self._amp_sensors.pop(row, None)
+
+    def _release_amplifier(self, row):
+        self._amp_serial[row] = None
+        self._amp_sensors.pop(row, None)
+        self._amp_generation[row] += 1
+
+    def _allocate_sensor(self):
+        self._sensor_serial.append(None)
+        for column in (self._sensor_model, self._sensor_manufacturer, self._sensor_maintenance,
+                       self._sensor_tag, self._sensor_generation):
+            column.append(0)
+        self._sensor_owner.append(-1)
+        return len(self._sensor_serial) - 1
+
+    def _store_sensor(self, row, sensor):
+        intern = self.strings.intern
+        self._sensor_serial[row] = sensor.serial_number
+        self._sensor_model[row] = intern(sensor.model_string)
+        self._sensor_manufacturer[row] = intern(sensor.manufacturer)
+        self._sensor_maintenance[row] = intern(sensor.next_maintenance)
+        self._sensor_tag[row] = intern(sensor.tag)
+
+    def _release_sensor(self, row):
+        self._sensor_serial[row] = None
+        self._sensor_generation[row] += 1
+        if self._sensor_owner[row] >= 0:
+            self._sensor_owner[row] = -1
+            self.sensor_owner._count -= 1
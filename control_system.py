@@ -1,126 +1,995 @@
-from datetime import datetime
+from bisect import bisect_left, bisect_right, insort
+import contextlib
+from datetime import date
+import functools
+from itertools import islice
+import os
 import pickle
+import threading
+from time import perf_counter
+import weakref
+from amplifier import Amplifier
+from change_feed import ChangeFeed
+from columnar_snapshot import device_records, is_columnar_snapshot, LazyDeviceMap, open_snapshot, write_records
+from locking import ReadWriteLock, StripedLock
+from maintenance_index import MaintenanceIndex, maintenance_ordinal
+from metrics import Registry, ObserverCache
+from search_index import TrigramIndex
+from sensor import Sensor
+from snapshots import BackgroundSnapshot, fork_snapshot
+
+SEARCH_FIELDS = ("serial_number", "model_string", "manufacturer")
+
+
+def _timed(method):
+    """Records the duration of every call of a method in the eeg_operation_seconds histogram, under its name."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def timed(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._operation_timers[name](perf_counter() - start)
+    return timed
+
+
+# _reading and _writing time their method themselves, rather than through _timed, to save a call on every lookup.
+def _reading(method):
+    """Runs a method under the shared side of the fleet lock."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            with self._lock.read:
+                return method(self, *args, **kwargs)
+        finally:
+            self._operation_timers[name](perf_counter() - start)
+    return locked
+
+
+def _writing(method):
+    """Runs a method under the exclusive side of the fleet lock."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            with self._lock.write:
+                result = method(self, *args, **kwargs)
+        finally:
+            self._operation_timers[name](perf_counter() - start)
+        self._compact_if_needed()
+        return result
+    return locked
+
+
 class EEGControlSystem:
-    """Initializes the EEG Control System with empty lists of amplifiers and sensors."""
-    def __init__(self):
-        self.amplifiers = []
-        self.sensors = []
+    """Initializes the EEG Control System with empty registries of amplifiers and sensors.
+
+    Amplifiers and sensors are kept in dictionaries keyed by serial number, so
+    lookups, additions and removals are O(1). A reverse index maps each attached
+    sensor's serial number to the serial number of the amplifier it belongs to.
+    Amplifier searches go through trigram indexes over the serial number, model
+    and manufacturer fields, a maintenance index orders every device by due date, and
+    a tag index groups sensors by scalp position.
+
+    If a Journal is given, every successful mutation is appended to it, load_state
+    replays it on top of the snapshot, and save_state folds it into a new snapshot.
+    save_state_in_background does the same from a forked child (see snapshots), holding
+    the fleet lock only for the fork, so requests keep being served while it writes.
+
+    Snapshots are either pickles or memory-mapped columnar files (see columnar_snapshot).
+    A columnar snapshot is opened lazily: devices are created on first lookup, and the
+    search indexes are only built the first time a search needs them.
+
+    If a CompactRegistry is given, devices are stored in its typed arrays instead of
+    individual objects. If a SQLiteRegistry is given, devices are stored in its database,
+    and searches and ordered listings are answered by SQL instead of the in-memory indexes.
+    A columnar snapshot bypasses the registry, since it already keeps devices out of memory
+    until they are used.
+
+    fleet_version is bumped by every mutation and state_epoch changes with every load,
+    so together they identify the state of the fleet (the API uses them as an ETag).
+    Every mutation is also published to changes, a bounded ChangeFeed that clients can
+    follow by sequence number instead of polling the fleet; a load publishes a "load" event.
+    Each amplifier's own version starts from the fleet version when it is added, so a
+    (serial number, version) pair never repeats within an epoch, even if an amplifier
+    is removed and added again.
+
+    The system is safe to share between threads. Reads (lookups, listings, searches) hold
+    the shared side of a reader/writer lock and run in parallel. Changes to one amplifier
+    (gain, sampling rate, power, maintenance date) also hold the shared side, plus the lock
+    of that amplifier, so they only wait for changes to the same device. Structural
+    changes (adding or removing devices and sensor assignments, batches, loading and
+    saving) hold the exclusive side.
+
+    metrics is a Registry of the system's own measurements, for a /metrics endpoint: the
+    duration of every public operation (lock wait included), the bytes and duration of
+    snapshots saved and loaded, and gauges of the fleet. The number of powered-on amplifiers
+    is kept up to date by the mutations themselves, so reading it never scans the fleet.
+    """
+    def __init__(self, journal=None, registry=None, change_capacity=10000):
+        self.registry = registry
+        self._bind_registries()
+        self._search_indexes = {field: TrigramIndex() for field in SEARCH_FIELDS}
+        self._maintenance_index = MaintenanceIndex()
+        self._tag_index = {}  # tag -> set of sensor serial numbers
+        self.journal = journal
+        self.state_filename = "amplifier_repository.pkl"
+        self.snapshot_format = "pickle"
+        self._replaying = False
+        self._sorted_serials = []
+        self._indexes_ready = True
+        self.fleet_version = 0
+        self.state_epoch = os.urandom(6).hex()
+        self._lock = ReadWriteLock()
+        self._device_lock = StripedLock()
+        self._record_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        # Powered-on amplifiers: those counted in a columnar snapshot's power column, plus the changes since.
+        self._powered = self._snapshot_powered = 0
+        self.snapshot = None
+        self.changes = ChangeFeed(change_capacity)
+        self._init_metrics()
+
+    def _init_metrics(self):
+        self.metrics = Registry()
+        self._operation_seconds = self.metrics.histogram(
+            "eeg_operation_seconds", "Duration of control system operations, including waiting for locks.",
+            ("operation",))
+        self._operation_timers = ObserverCache(self._operation_seconds)
+        self._snapshot_bytes = self.metrics.counter(
+            "eeg_snapshot_bytes_total", "Bytes of snapshots saved and loaded.", ("operation",))
+        # The gauges hold a proxy, not the system: a reference cycle would keep a dropped fleet alive until the next collection.
+        system = weakref.proxy(self)
+        self.metrics.gauge("eeg_amplifiers", "Amplifiers in the fleet.").set_function(lambda: len(system.amplifiers))
+        self.metrics.gauge("eeg_amplifiers_on", "Amplifiers powered on.").set_function(
+            lambda: system._powered_amplifiers())
+        self.metrics.gauge("eeg_sensors", "Sensors in the fleet.").set_function(lambda: len(system.sensors))
+        self.metrics.gauge("eeg_sensors_attached", "Sensors attached to an amplifier.").set_function(
+            lambda: len(system._sensor_owner))
+        self.metrics.gauge("eeg_fleet_version", "Version of the fleet state, bumped by every mutation.").set_function(
+            lambda: system.fleet_version)
+
+    def _powered_amplifiers(self):
+        """Returns the number of powered-on amplifiers."""
+        if self._registry_search() and hasattr(self.registry, "powered_count"):
+            # Other processes may change a shared registry; only it has the current count.
+            return self.registry.powered_count()
+        if not isinstance(self._snapshot_powered, int):
+            with self._lock.read:
+                if not isinstance(self._snapshot_powered, int):
+                    self._snapshot_powered = sum(self._snapshot_powered)
+        return self._snapshot_powered + self._powered
+
+    def _count_powered(self, change):
+        with self._record_lock:
+            self._powered += change
+
+    def _record(self, op, *args):
+        """Bumps the fleet version, appends a mutation to the journal and publishes it to the change feed."""
+        # Single-device changes run concurrently, so the counter, the journal file and the feed order need their own lock.
+        with self._record_lock:
+            self.fleet_version += 1
+            if self._replaying:
+                return
+            if self.journal is not None:
+                self.journal.append(op, *args)
+            self.changes.publish(op, args)
+
+    def _compact_if_needed(self):
+        """Compacts the journal once it has grown too long."""
+        # A snapshot being written already folds the journal; checking again would take the exclusive lock for nothing.
+        if self.snapshot is not None and self.snapshot.running:
+            return
+        # Compaction needs the exclusive lock, so it waits until the outermost locked call has returned.
+        if self.journal is not None and not self._lock.held() and self.journal.needs_compaction():
+            self.compact()
+
+    @contextlib.contextmanager
+    def _updating(self, serial_number):
+        """Holds the shared fleet lock and the lock of one device while that device is changed."""
+        with self._lock.read, self._device_lock(serial_number):
+            yield
+        self._compact_if_needed()
+
+    def _batch(self):
+        """Groups the journal records (and registry writes) of a batch operation into one write."""
+        stack = contextlib.ExitStack()
+        if self.journal:
+            stack.enter_context(self.journal.batch())
+        if self.registry is not None and hasattr(self.registry, "batch"):
+            stack.enter_context(self.registry.batch())
+        return stack
+
+    def _registry_search(self):
+        """Returns True if searches and ordered listings should be delegated to the registry."""
+        return hasattr(self.registry, "matching_serials") and self.amplifiers is self.registry.amplifiers
+
+    def state_tag(self):
+        """Returns a string that changes with every change of the fleet, for use as an ETag."""
+        if self._registry_search() and hasattr(self.registry, "state_tag"):
+            return self.registry.state_tag()
+        return f"{self.state_epoch}-{self.fleet_version}"
+
+    def _apply_record(self, op, args):
+        """Re-applies one journal record without journaling it again."""
+        if op == "add_amplifier":
+            self._insert_amplifier(Amplifier(*args))
+        elif op == "remove_amplifier":
+            self._delete_amplifier(args[0])
+        elif op == "add_sensor":
+            self._insert_sensor(Sensor(*args))
+        elif op == "remove_sensor":
+            self._delete_sensor(args[0])
+        elif op == "attach_sensor":
+            self._attach_sensor(self.amplifiers[args[0]], self.sensors[args[1]])
+        elif op == "detach_sensor":
+            self._detach_sensor(self.amplifiers[args[0]], self.sensors[args[1]])
+        elif op == "gain":
+            self.amplifiers[args[0]].set_gain(args[1])
+        elif op == "sampling_rate":
+            self.amplifiers[args[0]].set_sampling_rate(args[1])
+        elif op == "power":
+            self._power(self.amplifiers[args[0]], args[1])
+        elif op == "maintenance":
+            devices = self.amplifiers if args[0] == "amplifier" else self.sensors
+            self._set_maintenance(devices[args[1]], args[2])
+
+    def _set_maintenance(self, device, new_date):
+        device_type = "amplifier" if isinstance(device, Amplifier) else "sensor"
+        if device_type == "amplifier":
+            device.set_next_maintenance(new_date)
+        else:
+            device.next_maintenance = new_date
+        if not self._registry_search():
+            # Checked under the index lock: a build in progress has either read the new date or finished before this.
+            with self._index_lock:
+                if self._indexes_ready:
+                    self._maintenance_index.add(device_type, device.serial_number, new_date)
+
+    def _insert_amplifier(self, amplifier):
+        amplifier.version = self.fleet_version + 1
+        self.amplifiers[amplifier.serial_number] = amplifier
+        if amplifier.is_on:
+            self._count_powered(1)
+        self._index_amplifier(amplifier)
+        self._record("add_amplifier", amplifier.serial_number, amplifier.model_string, amplifier.manufacturer,
+                     amplifier.next_maintenance, amplifier.sampling_rate, amplifier.gain)
+
+    def _delete_amplifier(self, serial_number):
+        amplifier = self.amplifiers[serial_number]
+        self._unindex_amplifier(amplifier)
+        # Read before the delete: a registry's amplifier reads its row, which is gone afterwards.
+        was_on = amplifier.is_on
+        for sensor in amplifier.sensors:
+            self._sensor_owner.pop(sensor.serial_number, None)
+        del self.amplifiers[serial_number]
+        if was_on:
+            self._count_powered(-1)
+        self._record("remove_amplifier", serial_number)
+        return amplifier
+
+    def _insert_sensor(self, sensor):
+        self.sensors[sensor.serial_number] = sensor
+        if not self._registry_search():
+            with self._index_lock:
+                if self._indexes_ready:
+                    self._maintenance_index.add("sensor", sensor.serial_number, sensor.next_maintenance)
+                    self._tag_index.setdefault(sensor.tag, set()).add(sensor.serial_number)
+        self._record("add_sensor", sensor.serial_number, sensor.model_string, sensor.manufacturer,
+                     sensor.next_maintenance, sensor.tag)
+
+    def _delete_sensor(self, serial_number):
+        sensor = self.sensors[serial_number]
+        owner = self._sensor_owner.get(serial_number)
+        if owner is not None:
+            self._detach_sensor(self.amplifiers[owner], sensor)
+        if not self._registry_search():
+            with self._index_lock:
+                if self._indexes_ready:
+                    self._maintenance_index.remove("sensor", serial_number)
+                    self._tag_index.get(sensor.tag, set()).discard(serial_number)
+        del self.sensors[serial_number]
+        self._record("remove_sensor", serial_number)
+
+    def _attach_sensor(self, amplifier, sensor):
+        amplifier.add_sensor(sensor)
+        # A registry's amplifiers record the owner themselves, and refuse to record it twice.
+        if self._sensor_owner.get(sensor.serial_number) != amplifier.serial_number:
+            self._sensor_owner[sensor.serial_number] = amplifier.serial_number
+        self._record("attach_sensor", amplifier.serial_number, sensor.serial_number)
+
+    def _detach_sensor(self, amplifier, sensor):
+        amplifier.remove_sensor(sensor)
+        self._sensor_owner.pop(sensor.serial_number, None)
+        self._record("detach_sensor", amplifier.serial_number, sensor.serial_number)
+
+    def _index_amplifier(self, amplifier):
+        if self._registry_search():
+            return
+        with self._index_lock:
+            if not self._indexes_ready:
+                return
+            for field, index in self._search_indexes.items():
+                index.add(amplifier.serial_number, getattr(amplifier, field))
+            insort(self._sorted_serials, amplifier.serial_number)
+            self._maintenance_index.add("amplifier", amplifier.serial_number, amplifier.next_maintenance)
+
+    def _unindex_amplifier(self, amplifier):
+        if self._registry_search():
+            return
+        with self._index_lock:
+            if not self._indexes_ready:
+                return
+            for field, index in self._search_indexes.items():
+                index.remove(amplifier.serial_number, getattr(amplifier, field))
+            position = bisect_left(self._sorted_serials, amplifier.serial_number)
+            del self._sorted_serials[position]
+            self._maintenance_index.remove("amplifier", amplifier.serial_number)
+
+    def _invalidate_indexes(self):
+        """Drops the derived indexes; they are rebuilt in bulk by _ensure_indexes when next needed."""
+        with self._index_lock:
+            self._indexes_ready = False
+            self._sorted_serials = []
+            for index in self._search_indexes.values():
+                index.clear()
+            self._maintenance_index.clear()
+            self._tag_index = {}
+
+    def _ensure_indexes(self):
+        """Builds the derived indexes (search, serial order, maintenance, tags) after a bulk load or a lazy snapshot load."""
+        if self._indexes_ready or self._registry_search():
+            return
+        # Readers may get here together; the first one builds while the others wait.
+        with self._index_lock:
+            if self._indexes_ready:
+                return
+            # Built from records, so that the rows of a columnar snapshot are read from its columns
+            # (maintenance dates included, as stored ordinals) without materializing a device.
+            serials, maintenance, tag_index = [], [], {}
+            for amplifier in device_records(self.amplifiers, "amplifier"):
+                serials.append(amplifier.serial_number)
+                for field, index in self._search_indexes.items():
+                    index.add(amplifier.serial_number, getattr(amplifier, field))
+                maintenance.append(("amplifier", amplifier.serial_number, amplifier.maintenance_ordinal))
+            for sensor in device_records(self.sensors, "sensor"):
+                maintenance.append(("sensor", sensor.serial_number, sensor.maintenance_ordinal))
+                tag_index.setdefault(sensor.tag, set()).add(sensor.serial_number)
+            self._sorted_serials = sorted(serials)
+            self._maintenance_index.build(maintenance)
+            self._tag_index = tag_index
+            self._indexes_ready = True
+
+    def _reset_registries(self):
+        if self.registry is not None:
+            self.registry.clear()
+        self._bind_registries()
+
+    def _bind_registries(self):
+        if self.registry is not None:
+            self.amplifiers = self.registry.amplifiers
+            self.sensors = self.registry.sensors
+            self._sensor_owner = self.registry.sensor_owner
+        else:
+            self.amplifiers = {}
+            self.sensors = {}
+            self._sensor_owner = {}
+
+    def _rebuild_indexes(self, amplifiers, sensors):
+        """Rebuilds the serial number indexes from plain lists of devices."""
+        self._reset_registries()
+        self._invalidate_indexes()
+        self.fleet_version = 0
+        self._powered = self._snapshot_powered = 0
+        for sensor in sensors:
+            self.sensors.setdefault(sensor.serial_number, sensor)
+        for amplifier in amplifiers:
+            if amplifier.serial_number in self.amplifiers:
+                continue
+            # Attached sensors must be the very objects held in self.sensors.
+            amplifier.sensors = [self.sensors.setdefault(sensor.serial_number, sensor) for sensor in amplifier.sensors]
+            self.amplifiers[amplifier.serial_number] = amplifier
+            self.fleet_version = max(self.fleet_version, amplifier.version)
+            self._powered += bool(amplifier.is_on)
+            for sensor in amplifier.sensors:
+                self._sensor_owner.setdefault(sensor.serial_number, amplifier.serial_number)
+        self._ensure_indexes()
     
-    """ Save the current state of amplifiers and sensors to a file """
-    def save_state(self, filename="amplifier_repository.pkl"):
-        with open(filename, 'wb') as f:
-            pickle.dump({
-                "amplifiers": self.amplifiers,
-                "sensors": self.sensors
-            }, f)
+    def _open_columnar_snapshot(self, filename):
+        """Maps a columnar snapshot without materializing any device. Returns its journal generation."""
+        self.amplifiers, self.sensors, self._sensor_owner, generation = open_snapshot(filename)
+        self._invalidate_indexes()
+        self._powered = 0
+        # Counted on first use, so that opening a snapshot still reads none of its columns.
+        self._snapshot_powered = self.amplifiers.snapshot.amplifier_columns["is_on"]
+        # Columnar snapshots do not store versions: every amplifier starts again from 0.
+        self.fleet_version = 0
+        return generation
+
+    def _write_snapshot(self, filename, snapshot_format, generation):
+        # The snapshot is written to a temporary file and renamed into place, so a crash
+        # never leaves a torn snapshot. It records the generation of the journal that
+        # follows it; the journal it replaces is then never replayed on top of it.
+        if snapshot_format == "columnar":
+            # Records, not devices: the untouched rows of an open columnar snapshot are copied without being materialized.
+            write_records(filename, device_records(self.amplifiers, "amplifier"), device_records(self.sensors, "sensor"),
+                          generation)
+        else:
+            temp_filename = f"{filename}.tmp"
+            with open(temp_filename, 'wb') as f:
+                pickle.dump({
+                    "amplifiers": list(self.amplifiers.values()),
+                    "sensors": list(self.sensors.values()),
+                    "journal_generation": generation
+                }, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, filename)
+
+    """ Save the current state of amplifiers and sensors to a file, as a pickle or a columnar snapshot """
+    @_writing
+    def save_state(self, filename="amplifier_repository.pkl", snapshot_format=None):
+        self.wait_for_snapshot()
+        snapshot_format = snapshot_format or self.snapshot_format
+        generation = self.journal.generation + 1 if self.journal else 0
+        self._write_snapshot(filename, snapshot_format, generation)
+        self.state_filename = filename
+        self.snapshot_format = snapshot_format
+        if self.journal:
+            self.journal.reset(generation)
+            self.journal.discard_segments(generation)
+        self._snapshot_bytes.labels("save").inc(os.path.getsize(filename))
         print(f"State saved to {filename}")
 
-    """ Load the state of amplifiers and sensors from a file """
+    @_writing
+    def save_state_in_background(self, filename=None, snapshot_format=None):
+        """
+        Starts writing a snapshot of the current state from a forked child. Returns its BackgroundSnapshot.
+
+        Mutations made after this call are journaled for the next snapshot. If a snapshot is
+        already being written, that one is returned. Without fork, or with a database-backed
+        registry, the snapshot is written before returning.
+        """
+        if self.snapshot is not None and self.snapshot.running:
+            return self.snapshot
+        filename = filename or self.state_filename
+        snapshot_format = snapshot_format or self.snapshot_format
+        if not hasattr(os, "fork") or self._registry_search():
+            self.save_state(filename, snapshot_format)
+            self.snapshot = BackgroundSnapshot(filename, snapshot_format, self.journal.generation if self.journal else 0)
+            self.snapshot.finish(True)
+            return self.snapshot
+        generation = self.journal.generation + 1 if self.journal else 0
+        if self.journal:
+            # Changes from here on go to a new journal; the current one is kept until the snapshot is complete.
+            self.journal.rotate(generation)
+        self.snapshot = BackgroundSnapshot(filename, snapshot_format, generation)
+        print(f"Saving state to {filename} in the background")
+        return fork_snapshot(self.snapshot, lambda: self._write_snapshot(filename, snapshot_format, generation),
+                             self._snapshot_finished)
+
+    def _snapshot_finished(self, snapshot):
+        self._operation_timers["background_snapshot"](snapshot.seconds)
+        if not snapshot.succeeded:
+            print(f"Saving state to {snapshot.filename} failed; the journal still holds every change.")
+            return
+        self.state_filename = snapshot.filename
+        self.snapshot_format = snapshot.snapshot_format
+        if self.journal:
+            self.journal.discard_segments(snapshot.generation)
+        self._snapshot_bytes.labels("save").inc(os.path.getsize(snapshot.filename))
+        print(f"State saved to {snapshot.filename}")
+
+    def wait_for_snapshot(self):
+        """Waits until the snapshot being written in the background, if any, is finished."""
+        if self.snapshot is not None:
+            self.snapshot.wait()
+
+    """ Load the state of amplifiers and sensors from a file, then replay the journal on top of it """
+    @_writing
     def load_state(self, filename="amplifier_repository.pkl"):
-        try:
-            with open(filename, 'rb') as f:
-                data = pickle.load(f)
-                self.amplifiers = data.get("amplifiers", [])
-                self.sensors = data.get("sensors", [])
-            print(f"State loaded from {filename}")
-        except FileNotFoundError:
-            print(f"No saved state found. Starting fresh.")
-    
+        self.wait_for_snapshot()
+        previous = self.amplifiers if isinstance(self.amplifiers, LazyDeviceMap) else None
+        self.state_filename = filename
+        self.state_epoch = os.urandom(6).hex()
+        generation = 0
+        # A database-backed registry is cleared and refilled in one transaction, so that other
+        # processes sharing it see either the old fleet or the loaded one, never an empty one.
+        with self._batch():
+            try:
+                if is_columnar_snapshot(filename):
+                    generation = self._open_columnar_snapshot(filename)
+                    self.snapshot_format = "columnar"
+                else:
+                    with open(filename, 'rb') as f:
+                        data = pickle.load(f)
+                        self._rebuild_indexes(data.get("amplifiers", []), data.get("sensors", []))
+                        generation = data.get("journal_generation", 0)
+                    self.snapshot_format = "pickle"
+                self._snapshot_bytes.labels("load").inc(os.path.getsize(filename))
+                print(f"State loaded from {filename}")
+            except FileNotFoundError:
+                print(f"No saved state found. Starting fresh.")
+                if self.journal:
+                    self._rebuild_indexes([], [])
+            if self.journal:
+                self._replaying = True
+                try:
+                    replayed = self.journal.replay(self._apply_record, min_generation=generation)
+                finally:
+                    self._replaying = False
+                self.journal.open(generation)
+                self.journal.discard_segments(generation)
+                if replayed:
+                    print(f"Replayed {replayed} journal records from {self.journal.filename}")
+        if previous is not None and self.amplifiers is not previous:
+            # The devices of the previous columnar snapshot have been replaced, so its file can be unmapped.
+            previous.snapshot.close()
+        self.changes.publish("load", (filename,))
+
+    @_writing
+    def compact(self):
+        """Folds the journal into a new snapshot of the current state, written in the background."""
+        self.save_state_in_background(self.state_filename)
+
+    @_reading
     def find_amplifier(self, serial_number):
         """Finds and returns an amplifier by its serial number."""
-        for amp in self.amplifiers:
-            if amp.serial_number == serial_number:
-                return amp
-        return None
+        return self.amplifiers.get(serial_number)
 
+    @_reading
     def find_sensor(self, serial_number):
         """Finds and returns a sensor by its serial number."""
-        for sensor in self.sensors:
-            if sensor.serial_number == serial_number:
-                return sensor
-        return None
+        return self.sensors.get(serial_number)
+
+    @_reading
+    def find_sensor_owner(self, sensor_serial):
+        """Returns the amplifier a sensor is attached to, or None if it is unassigned."""
+        amplifier_serial = self._sensor_owner.get(sensor_serial)
+        if amplifier_serial is None:
+            return None
+        return self.amplifiers.get(amplifier_serial)
 
+    @_writing
     def add_amplifier(self, amplifier):
-        """Adds a new amplifier to the system."""
-        self.amplifiers.append(amplifier)
+        """Adds a new amplifier to the system. Raises ValueError if the serial number is already in use."""
+        if amplifier.serial_number in self.amplifiers:
+            raise ValueError(f"Amplifier with serial number {amplifier.serial_number} already exists.")
+        self._insert_amplifier(amplifier)
         print(f"Amplifier with serial number {amplifier.serial_number} added.")
 
+    @_writing
     def remove_amplifier(self, serial_number):
         """Removes an amplifier from the system by its serial number."""
-        amplifier_to_remove = None
-        for amplifier in self.amplifiers:
-            if amplifier.serial_number == serial_number:
-                amplifier_to_remove = amplifier
-                break
-        
-        if amplifier_to_remove:
-            self.amplifiers.remove(amplifier_to_remove)
+        if serial_number in self.amplifiers:
+            self._delete_amplifier(serial_number)
             print(f"Amplifier with serial number {serial_number} removed.")
         else:
             print(f"Amplifier with serial number {serial_number} not found.")
 
+    @_timed
+    def set_gain(self, serial_number, gain):
+        """Sets the gain of an amplifier. Returns the amplifier, or None if it does not exist."""
+        with self._updating(serial_number):
+            amplifier = self.amplifiers.get(serial_number)
+            if amplifier:
+                amplifier.set_gain(gain)
+                self._record("gain", serial_number, gain)
+        return amplifier
+
+    @_timed
+    def set_sampling_rate(self, serial_number, sampling_rate):
+        """Sets the sampling rate of an amplifier. Returns the amplifier, or None if it does not exist."""
+        with self._updating(serial_number):
+            amplifier = self.amplifiers.get(serial_number)
+            if amplifier:
+                amplifier.set_sampling_rate(sampling_rate)
+                self._record("sampling_rate", serial_number, sampling_rate)
+        return amplifier
+
+    def _power(self, amplifier, on):
+        if bool(on) != bool(amplifier.is_on):
+            self._count_powered(1 if on else -1)
+        if on:
+            amplifier.power_on()
+        else:
+            amplifier.power_off()
+        self._record("power", amplifier.serial_number, on)
+
+    @_timed
+    def set_power(self, serial_number, on):
+        """Powers an amplifier on or off. Returns the amplifier, or None if it does not exist."""
+        with self._updating(serial_number):
+            amplifier = self.amplifiers.get(serial_number)
+            if amplifier:
+                self._power(amplifier, on)
+        return amplifier
+
+    @_timed
+    def toggle_power(self, serial_number):
+        """Atomically flips the power state of an amplifier. Returns the amplifier, or None if it does not exist."""
+        with self._updating(serial_number):
+            amplifier = self.amplifiers.get(serial_number)
+            if amplifier:
+                self._power(amplifier, not amplifier.is_on)
+        return amplifier
+
+    @_timed
+    def compare_and_set_power(self, serial_number, expected, on):
+        """
+        Powers an amplifier on or off, but only if its power state is still expected.
+
+        Returns True if the state was set, False if the amplifier was not in the expected
+        state (and was left alone), or None if it does not exist.
+        """
+        with self._updating(serial_number):
+            amplifier = self.amplifiers.get(serial_number)
+            if amplifier is None:
+                return None
+            if amplifier.is_on != expected:
+                return False
+            self._power(amplifier, on)
+        return True
+
+    @_reading
     def list_amplifiers(self):
         """Returns a list of all amplifiers in the system."""
-        return self.amplifiers
+        return list(self.amplifiers.values())
 
+    @_reading
     def search_amplifiers(self, query, search_by="serial_number"):
         """Searches amplifiers based on serial number, model, or manufacturer and returns the founding amplifiers."""
         results = []
         if search_by == "serial_number":
-            results = [amp for amp in self.amplifiers if amp.serial_number == query]
-        elif search_by == "model_string":
-            results = [amp for amp in self.amplifiers if query.lower() in amp.model_string.lower()]
-        elif search_by == "manufacturer":
-            results = [amp for amp in self.amplifiers if query.lower() in amp.manufacturer.lower()]
-        
+            amplifier = self.amplifiers.get(query)
+            results = [amplifier] if amplifier else []
+        elif search_by in ("model_string", "manufacturer"):
+            results = self.filter_amplifiers(**{search_by: query})
+
         return results
+
+    def _matching_serials(self, serial_number=None, model_string=None, manufacturer=None):
+        """Returns the set of serial numbers matching every given substring, or None if no criterion is given."""
+        if self._registry_search():
+            return self.registry.matching_serials(serial_number, model_string, manufacturer)
+        criteria = {"serial_number": serial_number, "model_string": model_string, "manufacturer": manufacturer}
+        self._ensure_indexes()
+        matches = None
+        for field, query in criteria.items():
+            if not query:
+                continue
+            found = self._search_indexes[field].search(query)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return set()
+        return matches
+
+    @_reading
+    def filter_amplifiers(self, serial_number=None, model_string=None, manufacturer=None):
+        """Returns the amplifiers whose fields contain every given substring, ignoring case, ordered by serial number."""
+        matches = self._matching_serials(serial_number, model_string, manufacturer)
+        if matches is None:
+            return self.list_amplifiers()
+        return [self.amplifiers[serial] for serial in sorted(matches)]
+
+    def iter_amplifiers(self, after=None, serial_number=None, model_string=None, manufacturer=None, chunk_size=1000):
+        """
+        Yields amplifiers in serial number order, starting after the serial number given as after.
+
+        Optional substring criteria work as in filter_amplifiers. Without criteria, the serial
+        order index is read one chunk at a time and re-positioned by binary search before each
+        chunk, so iteration uses constant memory and stays valid while amplifiers are added
+        or removed concurrently.
+        """
+        with self._lock.read:
+            matches = self._matching_serials(serial_number, model_string, manufacturer)
+        matches = None if matches is None else sorted(matches)
+        while True:
+            # The lock is held per chunk, never across a yield, so a slow consumer does not block writers.
+            with self._lock.read:
+                if matches is None and self._registry_search():
+                    chunk = self.registry.serials_after(after, chunk_size)
+                else:
+                    serials = self._sorted_serials if matches is None else matches
+                    start = 0 if after is None else bisect_right(serials, after)
+                    chunk = serials[start:start + chunk_size]
+                amplifiers = [self.amplifiers.get(serial) for serial in chunk]
+            if not chunk:
+                return
+            for amplifier in amplifiers:
+                if amplifier is not None:
+                    yield amplifier
+            after = chunk[-1]
+
+    @_reading
+    def page_amplifiers(self, limit, after=None, **criteria):
+        """Returns (amplifiers, next_after): at most limit amplifiers after the given serial number, in serial order.
+
+        next_after is the serial number to continue from, or None on the last page.
+        """
+        page = list(islice(self.iter_amplifiers(after, **criteria), limit + 1))
+        if len(page) > limit:
+            return page[:limit], page[limit - 1].serial_number
+        return page, None
     
+    @_writing
     def add_sensor(self, sensor):
-        """Adds a new sensor to the system."""
-        self.sensors.append(sensor)
-        print(f"Amplifier with serial number {sensor.serial_number} added.")
+        """Adds a new sensor to the system. Raises ValueError if the serial number is already in use."""
+        if sensor.serial_number in self.sensors:
+            raise ValueError(f"Sensor with serial number {sensor.serial_number} already exists.")
+        self._insert_sensor(sensor)
+        print(f"Sensor with serial number {sensor.serial_number} added.")
 
-    def add_sensor_to_amplifier(self, amplifier_serial, sensor_serial):
-        """Adds an existing sensor to an amplifier. If there is not such sensor, raises error."""
-        amplifier = self.find_amplifier(amplifier_serial)
-        if amplifier:
-            sensor = self.find_sensor(sensor_serial)
-            if sensor:
-                amplifier.add_sensor(sensor)
-                print(f"Sensor {sensor_serial} added to Amplifier {amplifier_serial}")
-            else:
-                print(f"Sensor {sensor_serial} not found in the system. Please add it first.")
+    def _assign_sensor(self, amplifier_serial, sensor_serial):
+        """Attaches a sensor to an amplifier if both exist and the sensor is unassigned. Returns a result dict."""
+        result = {"amplifier_serial": amplifier_serial, "sensor_serial": sensor_serial}
+        amplifier = self.amplifiers.get(amplifier_serial)
+        sensor = self.sensors.get(sensor_serial)
+        owner = self._sensor_owner.get(sensor_serial)
+        if amplifier is None:
+            result["error"] = "Amplifier not found."
+        elif sensor is None:
+            result["error"] = "Sensor not found."
+        elif owner is not None:
+            result["error"] = f"Sensor is already attached to Amplifier {owner}."
         else:
+            try:
+                self._attach_sensor(amplifier, sensor)
+                result["status"] = "attached"
+            except ValueError:  # attached by another process sharing the registry
+                result["error"] = f"Sensor is already attached to Amplifier {self._sensor_owner.get(sensor_serial)}."
+        return result
+
+    @_writing
+    def remove_sensor(self, serial_number):
+        """Removes a sensor from the system by its serial number, detaching it first if it is attached. Returns True if it existed."""
+        if serial_number not in self.sensors:
+            print(f"Sensor with serial number {serial_number} not found.")
+            return False
+        with self._batch():
+            self._delete_sensor(serial_number)
+        print(f"Sensor with serial number {serial_number} removed.")
+        return True
+
+    @_writing
+    def add_sensor_to_amplifier(self, amplifier_serial, sensor_serial):
+        """
+        Adds an existing sensor to an amplifier, unless it is attached already.
+
+        Returns a result dict with "status": "attached", or with an "error" if the amplifier or
+        the sensor does not exist or the sensor is attached to an amplifier already.
+        """
+        result = self._assign_sensor(amplifier_serial, sensor_serial)
+        if "status" in result:
+            print(f"Sensor {sensor_serial} added to Amplifier {amplifier_serial}")
+        elif result["error"] == "Amplifier not found.":
             print(f"Amplifier {amplifier_serial} not found.")
+        elif result["error"] == "Sensor not found.":
+            print(f"Sensor {sensor_serial} not found in the system. Please add it first.")
+        else:
+            print(f"Sensor {sensor_serial} {result['error'][len('Sensor '):]}")
+        return result
 
+    @_writing
     def remove_sensor_from_amplifier(self, amplifier_serial, sensor_serial):
         """Removes a sensor from an amplifier."""
         amplifier = self.find_amplifier(amplifier_serial)
         if amplifier:
-            sensor_to_remove = None
-            for sensor in amplifier.sensors:
-                if sensor.serial_number == sensor_serial:
-                    sensor_to_remove = sensor
-                    break
-            
-            if sensor_to_remove:
-                amplifier.remove_sensor(sensor_to_remove)
+            if self._sensor_owner.get(sensor_serial) == amplifier_serial:
+                self._detach_sensor(amplifier, self.sensors[sensor_serial])
                 print(f"Sensor {sensor_serial} removed from Amplifier {amplifier_serial}")
             else:
                 print(f"Sensor {sensor_serial} not found in this amplifier.")
         else:
             print(f"Amplifier {amplifier_serial} not found.")
     
+    @_reading
+    def sensors_by_tag(self, tag, assigned=None):
+        """
+        Returns the sensors at a scalp position (tag), in serial number order.
+
+        With assigned=True only sensors attached to an amplifier are returned, with
+        assigned=False only unattached ones.
+        """
+        if self._registry_search():
+            serials = self.registry.sensor_serials_by_tag(tag, assigned)
+        else:
+            self._ensure_indexes()
+            serials = sorted(self._tag_index.get(tag, ()))
+            if assigned is not None:
+                serials = [serial for serial in serials if (serial in self._sensor_owner) == assigned]
+        return [self.sensors[serial] for serial in serials]
+
+    @_reading
+    def amplifier_layout(self, amplifier_serial):
+        """Returns the sensors of an amplifier grouped by tag, {tag: [sensor serials in channel order]}, or None if it does not exist."""
+        amplifier = self.amplifiers.get(amplifier_serial)
+        if amplifier is None:
+            return None
+        layout = {}
+        for sensor in amplifier.sensors:
+            layout.setdefault(sensor.tag, []).append(sensor.serial_number)
+        return layout
+
+    @_writing
+    def apply_montage(self, amplifier_serial, montage, replace=False):
+        """
+        Attaches a whole montage to an amplifier in one validated pass.
+
+        montage maps each tag to the serial number of a sensor, or to a list of them. Every
+        entry is checked before anything changes: the sensor must exist, carry that tag, be
+        listed only once and not be attached to another amplifier. Sensors already attached
+        to this amplifier stay attached; with replace=True, those missing from the montage are
+        detached. Raises ValueError naming every invalid entry, in which case nothing changes.
+        Returns {"attached": [...], "detached": [...]} (sensor serials), or None if the amplifier does not exist.
+        """
+        amplifier = self.amplifiers.get(amplifier_serial)
+        if amplifier is None:
+            print(f"Amplifier {amplifier_serial} not found.")
+            return None
+        sensors, errors, listed = [], [], set()
+        for tag, serials in montage.items():
+            for sensor_serial in [serials] if isinstance(serials, str) else serials:
+                sensor = self.sensors.get(sensor_serial)
+                owner = self._sensor_owner.get(sensor_serial)
+                if sensor_serial in listed:
+                    errors.append(f"Sensor {sensor_serial} is listed more than once.")
+                elif sensor is None:
+                    errors.append(f"Sensor {sensor_serial} not found.")
+                elif sensor.tag != tag:
+                    errors.append(f"Sensor {sensor_serial} is tagged {sensor.tag}, not {tag}.")
+                elif owner is not None and owner != amplifier_serial:
+                    errors.append(f"Sensor {sensor_serial} is already attached to Amplifier {owner}.")
+                elif owner is None:
+                    sensors.append(sensor)
+                listed.add(sensor_serial)
+        if errors:
+            raise ValueError(" ".join(errors))
+        detached = [sensor for sensor in amplifier.sensors if sensor.serial_number not in listed] if replace else []
+        with self._batch():
+            for sensor in detached:
+                self._detach_sensor(amplifier, sensor)
+            for sensor in sensors:
+                self._attach_sensor(amplifier, sensor)
+        print(f"Montage applied to Amplifier {amplifier_serial}: {len(sensors)} attached, {len(detached)} detached.")
+        return {"attached": [sensor.serial_number for sensor in sensors],
+                "detached": [sensor.serial_number for sensor in detached]}
+
+    @_writing
+    def add_amplifiers(self, amplifiers):
+        """Adds a batch of amplifiers in one pass. Returns one result dict per amplifier, in order."""
+        results = []
+        with self._batch():
+            for amplifier in amplifiers:
+                if amplifier.serial_number in self.amplifiers:
+                    results.append({"serial_number": amplifier.serial_number, "error": "Serial number already exists."})
+                    continue
+                try:
+                    self._insert_amplifier(amplifier)
+                except ValueError:  # added by another process sharing the registry
+                    results.append({"serial_number": amplifier.serial_number, "error": "Serial number already exists."})
+                    continue
+                results.append({"serial_number": amplifier.serial_number, "status": "added"})
+        self._print_batch_summary("Added", "amplifiers", results)
+        return results
+
+    @_writing
+    def add_sensors(self, sensors):
+        """Adds a batch of sensors in one pass. Returns one result dict per sensor, in order."""
+        results = []
+        with self._batch():
+            for sensor in sensors:
+                if sensor.serial_number in self.sensors:
+                    results.append({"serial_number": sensor.serial_number, "error": "Serial number already exists."})
+                    continue
+                try:
+                    self._insert_sensor(sensor)
+                except ValueError:  # added by another process sharing the registry
+                    results.append({"serial_number": sensor.serial_number, "error": "Serial number already exists."})
+                    continue
+                results.append({"serial_number": sensor.serial_number, "status": "added"})
+        self._print_batch_summary("Added", "sensors", results)
+        return results
+
+    @_writing
+    def assign_sensors(self, assignments):
+        """Attaches sensors to amplifiers from (amplifier_serial, sensor_serial) pairs. Returns one result dict per pair."""
+        results = []
+        with self._batch():
+            for amplifier_serial, sensor_serial in assignments:
+                results.append(self._assign_sensor(amplifier_serial, sensor_serial))
+        self._print_batch_summary("Attached", "sensors", results)
+        return results
+
+    @_writing
+    def update_amplifiers(self, serial_numbers, gain=None, sampling_rate=None, power=None):
+        """
+        Applies the same gain, sampling rate and/or power state to a batch of amplifiers.
+
+        The new values are validated once, before anything is changed, so a batch is either
+        rejected as a whole (ValueError) or applied to every amplifier that exists. Returns
+        one result dict per serial number.
+        """
+        if gain is not None:
+            Amplifier.validate_gain(gain)
+        if sampling_rate is not None:
+            Amplifier.validate_sampling_rate(sampling_rate)
+        results = []
+        with self._batch():
+            for serial_number in serial_numbers:
+                amplifier = self.amplifiers.get(serial_number)
+                if amplifier is None:
+                    results.append({"serial_number": serial_number, "error": "Amplifier not found."})
+                    continue
+                if gain is not None:
+                    amplifier.set_gain(gain)
+                    self._record("gain", serial_number, gain)
+                if sampling_rate is not None:
+                    amplifier.set_sampling_rate(sampling_rate)
+                    self._record("sampling_rate", serial_number, sampling_rate)
+                if power is not None:
+                    self._power(amplifier, power)
+                results.append({"serial_number": serial_number, "status": "updated"})
+        self._print_batch_summary("Updated", "amplifiers", results)
+        return results
+
+    def _print_batch_summary(self, verb, noun, results):
+        failed = sum(1 for result in results if "error" in result)
+        print(f"{verb} {len(results) - failed} {noun} ({failed} rejected).")
+
+    @_timed
     def update_maintenance_date(self, device, new_date):
-        """Updates the next maintenance date for a given device."""
-        try:
-            # Parse the new date and check if it's in the future
-            parsed_date = datetime.strptime(new_date, "%d-%m-%Y")
-            if parsed_date > datetime.now():
-                device.next_maintenance = new_date
-                print(f"Maintenance date updated to {new_date}.")
-            else:
-                print("Error: Maintenance date must be in the future.")
-        except ValueError:
-            print("Error: Invalid date format. Use DD-MM-YYYY.")
+        """Updates the next maintenance date for a given device. Returns True if the date was accepted."""
+        # Parse the new date and check if it's in the future
+        ordinal = maintenance_ordinal(new_date)
+        if not ordinal:
+            print("Error: Invalid date format. Use DD-MM-YYYY or YYYY-MM-DD.")
+        elif ordinal > date.today().toordinal():
+            device_type = "amplifier" if isinstance(device, Amplifier) else "sensor"
+            with self._updating(device.serial_number):
+                devices = self.amplifiers if device_type == "amplifier" else self.sensors
+                if device.serial_number not in devices:
+                    print(f"Error: {device_type.capitalize()} {device.serial_number} no longer exists.")
+                    return False
+                self._set_maintenance(device, new_date)
+                self._record("maintenance", device_type, device.serial_number, new_date)
+            print(f"Maintenance date updated to {new_date}.")
+            return True
+        else:
+            print("Error: Maintenance date must be in the future.")
+        return False
+
+    @_reading
+    def maintenance_due(self, before=None, within_days=None):
+        """
+        Returns (due date, device type, device) for every device due for maintenance before a date, soonest first.
+
+        before is a date or a DD-MM-YYYY / YYYY-MM-DD string; within_days instead counts days
+        from today, today's date plus within_days included. Raises ValueError for an invalid date.
+        Devices whose maintenance date cannot be parsed are never reported.
+        """
+        if within_days is not None:
+            cutoff = date.today().toordinal() + within_days + 1
+        elif isinstance(before, date):
+            cutoff = before.toordinal()
+        else:
+            cutoff = maintenance_ordinal(before)
+            if not cutoff:
+                raise ValueError("Invalid date format. Use DD-MM-YYYY or YYYY-MM-DD.")
+        if self._registry_search():
+            entries = self.registry.maintenance_due_before(cutoff)
+        else:
+            self._ensure_indexes()
+            with self._index_lock:
+                entries = self._maintenance_index.due_before(cutoff)
+        return [(date.fromordinal(ordinal), device_type,
+                 (self.amplifiers if device_type == "amplifier" else self.sensors)[serial_number])
+                for ordinal, device_type, serial_number in entries]
 
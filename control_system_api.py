@@ -1,114 +1,233 @@
-from flask import Flask, request, jsonify
-from control_system import EEGControlSystem
-from amplifier import Amplifier
-from sensor import Sensor
+import json
+from itertools import chain, islice
+import threading
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from api_common import (COMMAND_WAIT_SECONDS, HOME_PAGE, MAX_PAGE_SIZE, SSE_KEEPALIVE, SSE_KEEPALIVE_SECONDS,
+                        amplifier_from_json, bulk_add, bulk_settings_targets, bulk_summary, change_stream, changes_since,
+                        command_response, create_control_system, create_dispatcher, create_http_metrics, decode_cursor,
+                        encode_cursor, feed_position, sensor_from_json)
+from serialization import FragmentCache, sensor_to_dict
+try:
+    from acquisition import AcquisitionEngine
+    from streaming import stream_samples
+except ImportError:  # sample streaming needs NumPy; the rest of the API does not
+    AcquisitionEngine = None
 
 app = Flask(__name__)
-control_system = EEGControlSystem()
+# See create_control_system for the environment variables that choose storage and autosave.
+control_system = create_control_system()
+fragments = FragmentCache(control_system)
+# Sends gain, sampling rate and power changes to the hardware when EEG_DRIVER is set; None applies them in memory.
+dispatcher = create_dispatcher(control_system)
+# Started by the first sample stream request, so an API that never streams does no acquisition.
+acquisition = None
+acquisition_lock = threading.Lock()
 
-control_system.load_state()
+# Request counts and latencies, served with the control system's own metrics on /metrics.
+http_metrics, http_requests, http_request_seconds = create_http_metrics()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Labelled by route pattern, not path, so that serial numbers do not each make a new series.
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    http_requests.labels(request.method, route, str(response.status_code)).inc()
+    started = g.get("request_started")
+    if started is not None:
+        http_request_seconds.labels(request.method, route).observe(time.perf_counter() - started)
+    return response
 
 # simple welcome message
 @app.route('/')
 def home():
-    return """
-    <h1>EEG Control System API</h1>
-    <p>Welcome to the EEG Control System API by Begum Yivli. Use the following endpoints to interact with the system:</p>
-    <ul>
-        <li><strong>GET /api/amplifiers</strong> - List all amplifiers</li>
-        <li><strong>POST /api/amplifiers</strong> - Add an amplifier</li>
-        <li><strong>DELETE /api/amplifiers/&lt;serial_number&gt;</strong> - Remove an amplifier</li>
-        <li><strong>PUT /api/amplifiers/&lt;serial_number&gt;/gain</strong> - Set amplifier gain</li>
-        <li><strong>PUT /api/amplifiers/&lt;serial_number&gt;/sampling_rate</strong> - Set amplifier sampling rate</li>
-        <li><strong>POST /api/amplifiers/&lt;serial_number&gt;/power</strong> - Toggle amplifier power</li>
-        <li><strong>GET /api/amplifiers/search</strong> - Search for amplifiers by serial_number, model_string, or manufacturer</li>
-        <li><strong>POST /api/sensors</strong> - Add a sensor</li>
-        <li><strong>POST /api/amplifiers/&lt;amplifier_serial&gt;/sensors</strong> - Add a sensor to an amplifier</li>
-        <li><strong>DELETE /api/amplifiers/&lt;amplifier_serial&gt;/sensors/&lt;sensor_serial&gt;</strong> - Remove a sensor from an amplifier</li>
-        <li><strong>PUT /api/device/&lt;device_type&gt;/&lt;serial_number&gt;/maintenance</strong> - Update a device's maintenance date</li>
-        <li><strong>POST /api/save</strong> - Save the current system state</li>
-        <li><strong>POST /api/load</strong> - Load the saved system state</li>
-    </ul>
-    """
+    return HOME_PAGE
+
+def bulk_response(results):
+    return jsonify(bulk_summary(results)), 200
 
 # API Endpoint to add an amplifier
 @app.route('/api/amplifiers', methods=['POST'])
 def add_amplifier():
     data = request.json
     try:
-        amplifier = Amplifier(
-            serial_number=data['serial_number'],
-            model_string=data['model_string'],
-            manufacturer=data['manufacturer'],
-            next_maintenance=data['next_maintenance'],
-            sampling_rate=data['sampling_rate'],
-            gain=data['gain']
-        )
+        amplifier = amplifier_from_json(data)
         control_system.add_amplifier(amplifier)
         return jsonify({"message": f"Amplifier {amplifier.serial_number} added successfully."}), 201
     except KeyError as e:
         return jsonify({"error": f"Missing parameter: {str(e)}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+
+def list_amplifiers_response(not_found_message=None, **criteria):
+    """
+    Lists amplifiers in serial number order, in one of three shapes:
+
+    - ?limit=N[&cursor=C]: one page, {"amplifiers": [...], "next_cursor": C or null}
+    - ?format=ndjson (or Accept: application/x-ndjson): a stream of one JSON object per line,
+      starting after the optional cursor
+    - otherwise: a JSON array, streamed as the amplifiers are serialized
+
+    Only one page or one amplifier is held in memory at a time, whatever the fleet size.
+    Amplifiers are written from the fragment cache, and every response carries an ETag of
+    the fleet state: a request whose If-None-Match still matches gets 304 Not Modified
+    without touching a single amplifier.
+    """
+    try:
+        after = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+        limit = request.args.get('limit', type=int)
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ndjson = request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+    # The ETag is taken before listing, so a change made while streaming only makes it stale.
+    etag = fragments.etag("ndjson" if ndjson else "")
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    amplifiers = control_system.iter_amplifiers(after, **criteria)
+    first = next(amplifiers, None)
+    if first is None and not_found_message and after is None:
+        return jsonify({"message": not_found_message}), 404
+    amplifiers = chain([first], amplifiers) if first is not None else iter(())
+
+    if ndjson:
+        if limit is not None:
+            amplifiers = islice(amplifiers, limit)
+        lines = (fragments.fragment(amp) + "\n" for amp in amplifiers)
+        response = Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    elif limit is not None:
+        page = list(islice(amplifiers, limit + 1))
+        next_cursor = encode_cursor(page[limit - 1].serial_number) if len(page) > limit else None
+        body = '{"amplifiers": [%s], "next_cursor": %s}' % (
+            ", ".join(fragments.fragment(amp) for amp in page[:limit]), json.dumps(next_cursor))
+        response = Response(body, mimetype='application/json')
+    else:
+        def json_array():
+            yield "["
+            for position, amp in enumerate(amplifiers):
+                yield ("," if position else "") + fragments.fragment(amp)
+            yield "]"
+        response = Response(stream_with_context(json_array()), mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 # API Endpoint to get all amplifiers
 @app.route('/api/amplifiers', methods=['GET'])
 def get_amplifiers():
-    amplifiers = control_system.list_amplifiers()
-    return jsonify([{
-        "serial_number": amp.serial_number,
-        "model_string": amp.model_string,
-        "manufacturer": amp.manufacturer,
-        "next_maintenance": amp.next_maintenance,
-        "sampling_rate": amp.sampling_rate,
-        "gain": amp.gain,
-        "status": "On" if amp.is_on else "Off",
-        "sensors": [sensor.serial_number for sensor in amp.sensors]
-    } for amp in amplifiers]), 200
+    return list_amplifiers_response()
 
 # API Endpoint to remove an amplifier
 @app.route('/api/amplifiers/<serial_number>', methods=['DELETE'])
 def remove_amplifier(serial_number):
     control_system.remove_amplifier(serial_number)
+    fragments.discard(serial_number)
     return jsonify({"message": f"Amplifier {serial_number} removed."}), 200
 
 # API Endpoint to set amplifier gain
 @app.route('/api/amplifiers/<serial_number>/gain', methods=['PUT'])
 def set_amplifier_gain(serial_number):
-    amplifier = control_system.find_amplifier(serial_number)
-    if amplifier:
-        new_gain = request.json['gain']
-        try:
-            amplifier.set_gain(new_gain)
+    new_gain = request.json['gain']
+    try:
+        if dispatcher is not None:
+            return command_reply(dispatcher.set_gain(serial_number, new_gain))
+        if control_system.set_gain(serial_number, new_gain):
             return jsonify({"message": f"Amplifier {serial_number} gain set to {new_gain}."}), 200
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({"error": "Amplifier not found."}), 404
 
 # API Endpoint to set amplifier sampling rate
 @app.route('/api/amplifiers/<serial_number>/sampling_rate', methods=['PUT'])
 def set_amplifier_sampling_rate(serial_number):
-    amplifier = control_system.find_amplifier(serial_number)
-    if amplifier:
-        new_sampling_rate = request.json['sampling_rate']
-        try:
-            amplifier.set_sampling_rate(new_sampling_rate)
+    new_sampling_rate = request.json['sampling_rate']
+    try:
+        if dispatcher is not None:
+            return command_reply(dispatcher.set_sampling_rate(serial_number, new_sampling_rate))
+        if control_system.set_sampling_rate(serial_number, new_sampling_rate):
             return jsonify({"message": f"Amplifier {serial_number} sampling rate set to {new_sampling_rate} Hz."}), 200
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({"error": "Amplifier not found."}), 404
 
 # API Endpoint to toggle amplifier power
 @app.route('/api/amplifiers/<serial_number>/power', methods=['POST'])
 def toggle_amplifier_power(serial_number):
-    amplifier = control_system.find_amplifier(serial_number)
+    # With {"expected": "On"} (or "Off") the toggle only happens if the amplifier is still in that state.
+    data = request.get_json(silent=True) or {}
+    if 'expected' in data:
+        expected = str(data['expected']).lower() in ("on", "true")
+        if dispatcher is not None:
+            changed = dispatcher.toggle_power(serial_number, expected)
+        else:
+            changed = control_system.compare_and_set_power(serial_number, expected, not expected)
+        if changed is None:
+            return jsonify({"error": "Amplifier not found."}), 404
+        if not changed:
+            return jsonify({"error": f"Amplifier {serial_number} is not {'on' if expected else 'off'}."}), 409
+        if dispatcher is not None:
+            return command_reply(changed)
+        return jsonify({"message": f"Amplifier {serial_number} powered {'off' if expected else 'on'}."}), 200
+    if dispatcher is not None:
+        return command_reply(dispatcher.toggle_power(serial_number))
+    amplifier = control_system.toggle_power(serial_number)
     if amplifier:
         if amplifier.is_on:
-            amplifier.power_off()
-            return jsonify({"message": f"Amplifier {serial_number} powered off."}), 200
-        else:
-            amplifier.power_on()
             return jsonify({"message": f"Amplifier {serial_number} powered on."}), 200
+        else:
+            return jsonify({"message": f"Amplifier {serial_number} powered off."}), 200
     return jsonify({"error": "Amplifier not found."}), 404
 
+def command_reply(command):
+    """Answers a request that queued a command (None if the amplifier does not exist); ?wait=true waits for it to finish."""
+    if command is None:
+        return jsonify({"error": "Amplifier not found."}), 404
+    if request.args.get('wait', 'false').lower() == 'true':
+        command.wait(COMMAND_WAIT_SECONDS)
+    body, status = command_response(command)
+    return jsonify(body), status
+
+# API Endpoint to check on a command sent to an amplifier (?wait=true waits for it to finish)
+@app.route('/api/commands/<command_id>', methods=['GET'])
+def get_command(command_id):
+    command = dispatcher.get(command_id) if dispatcher is not None else None
+    if command is None:
+        return jsonify({"error": "Command not found."}), 404
+    return command_reply(command)
+
+def acquisition_engine():
+    global acquisition
+    with acquisition_lock:
+        if acquisition is None:
+            acquisition = AcquisitionEngine(control_system)
+            acquisition.start()
+    return acquisition
+
+# API Endpoint to stream the samples of an acquiring amplifier as binary frames (see streaming.py)
+@app.route('/api/amplifiers/<serial_number>/stream', methods=['GET'])
+def stream_amplifier(serial_number):
+    if AcquisitionEngine is None:
+        return jsonify({"error": "Sample streaming requires NumPy."}), 501
+    decimation = request.args.get('decimation', 1, type=int)
+    duration = request.args.get('duration', type=float)
+    if decimation < 1:
+        return jsonify({"error": "decimation must be a positive integer."}), 400
+    if control_system.find_amplifier(serial_number) is None:
+        return jsonify({"error": "Amplifier not found."}), 404
+    engine = acquisition_engine()
+    engine.sync()
+    if engine.stream(serial_number) is None:
+        return jsonify({"error": f"Amplifier {serial_number} is not acquiring (it is off or has no sensors)."}), 409
+    frames = stream_samples(engine, serial_number, decimation, duration=duration)
+    return Response(frames, mimetype='application/octet-stream', headers={"Cache-Control": "no-store"})
+
 # API Endpoint to search for amplifiers based on query parameters
 @app.route('/api/amplifiers/search', methods=['GET'])
 def search_amplifiers():
@@ -116,28 +235,8 @@ def search_amplifiers():
     model_string = request.args.get('model_string')
     manufacturer = request.args.get('manufacturer')
 
-    results = control_system.amplifiers
-
-    if serial_number:
-        results = [amp for amp in results if serial_number.lower() in amp.serial_number.lower()]
-    if model_string:
-        results = [amp for amp in results if model_string.lower() in amp.model_string.lower()]
-    if manufacturer:
-        results = [amp for amp in results if manufacturer.lower() in amp.manufacturer.lower()]
-
-    if not results:
-        return jsonify({"message": "No amplifiers found."}), 404
-
-    return jsonify([{
-        "serial_number": amp.serial_number,
-        "model_string": amp.model_string,
-        "manufacturer": amp.manufacturer,
-        "next_maintenance": amp.next_maintenance,
-        "sampling_rate": amp.sampling_rate,
-        "gain": amp.gain,
-        "status": "On" if amp.is_on else "Off",
-        "sensors": [sensor.serial_number for sensor in amp.sensors]
-    } for amp in results]), 200
+    return list_amplifiers_response("No amplifiers found.", serial_number=serial_number,
+                                    model_string=model_string, manufacturer=manufacturer)
 
 # API Endpoint to add a sensor to an amplifier
 @app.route('/api/amplifiers/<amplifier_serial>/sensors', methods=['POST'])
@@ -145,21 +244,22 @@ def add_sensor_to_amplifier(amplifier_serial):
     data = request.json
     sensor_serial = data['sensor_serial']
     
-    control_system.add_sensor_to_amplifier(amplifier_serial, sensor_serial)
+    result = control_system.add_sensor_to_amplifier(amplifier_serial, sensor_serial)
+    if "error" in result:
+        return jsonify({"error": result["error"]}), 404 if result["error"].endswith("not found.") else 409
     return jsonify({"message": f"Sensor {sensor_serial} added to Amplifier {amplifier_serial}."}), 201
 
 # API Endpoint to add a sensor
 @app.route('/api/sensors', methods=['POST'])
 def add_sensor():
     data = request.json
-    sensor = Sensor(
-        serial_number=data['serial_number'],
-        model_string=data['model_string'],
-        manufacturer=data['manufacturer'],
-        next_maintenance=data['next_maintenance'],
-        tag=data['tag']
-    )
-    control_system.add_sensor(sensor)
+    try:
+        sensor = sensor_from_json(data)
+        control_system.add_sensor(sensor)
+    except KeyError as e:
+        return jsonify({"error": f"Missing parameter: {str(e)}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
     return jsonify({"message": f"Sensor {sensor.serial_number} added successfully."}), 201
 
 # API Endpoint to remove a sensor from an amplifier
@@ -168,11 +268,123 @@ def remove_sensor_from_amplifier(amplifier_serial, sensor_serial):
     control_system.remove_sensor_from_amplifier(amplifier_serial, sensor_serial)
     return jsonify({"message": f"Sensor {sensor_serial} removed from Amplifier {amplifier_serial}."}), 200
 
-# API Endpoint to save the current state
+# API Endpoint to list the sensors at a scalp position (?tag=occipital), optionally only unassigned (&assigned=false) or assigned ones
+@app.route('/api/sensors', methods=['GET'])
+def get_sensors_by_tag():
+    tag = request.args.get('tag')
+    if tag is None:
+        return jsonify({"error": "Missing parameter: 'tag'"}), 400
+    assigned = request.args.get('assigned')
+    if assigned is not None:
+        assigned = assigned.lower() == 'true'
+    return jsonify({"sensors": [sensor_to_dict(sensor) for sensor in control_system.sensors_by_tag(tag, assigned)]}), 200
+
+# API Endpoint to get a sensor
+@app.route('/api/sensors/<serial_number>', methods=['GET'])
+def get_sensor(serial_number):
+    sensor = control_system.find_sensor(serial_number)
+    if sensor is None:
+        return jsonify({"error": "Sensor not found."}), 404
+    return jsonify(sensor_to_dict(sensor)), 200
+
+# API Endpoint to remove a sensor, detaching it from its amplifier first
+@app.route('/api/sensors/<serial_number>', methods=['DELETE'])
+def remove_sensor(serial_number):
+    if not control_system.remove_sensor(serial_number):
+        return jsonify({"error": "Sensor not found."}), 404
+    return jsonify({"message": f"Sensor {serial_number} removed."}), 200
+
+# API Endpoint to get the channel layout of an amplifier by tag
+@app.route('/api/amplifiers/<serial_number>/layout', methods=['GET'])
+def get_amplifier_layout(serial_number):
+    layout = control_system.amplifier_layout(serial_number)
+    if layout is None:
+        return jsonify({"error": "Amplifier not found."}), 404
+    return jsonify({"serial_number": serial_number, "layout": layout}), 200
+
+# API Endpoint to attach a whole montage (tag -> sensor serial or list of serials) to an amplifier in one step
+@app.route('/api/amplifiers/<serial_number>/montage', methods=['PUT'])
+def apply_montage(serial_number):
+    data = request.json
+    montage = data.get('montage')
+    if not isinstance(montage, dict):
+        return jsonify({"error": "Missing parameter: 'montage' (an object mapping tags to sensor serial numbers)"}), 400
+    try:
+        result = control_system.apply_montage(serial_number, montage, replace=bool(data.get('replace', False)))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "Amplifier not found."}), 404
+    return jsonify({"message": f"Montage applied to Amplifier {serial_number}.", **result}), 200
+
+# API Endpoint to add many amplifiers in one request
+@app.route('/api/amplifiers/bulk', methods=['POST'])
+def bulk_add_amplifiers():
+    if not isinstance(request.json, dict):
+        return jsonify({"error": "Expected a JSON object."}), 400
+    items = request.json.get('amplifiers', [])
+    return bulk_response(bulk_add(items, amplifier_from_json, control_system.add_amplifiers))
+
+# API Endpoint to add many sensors in one request
+@app.route('/api/sensors/bulk', methods=['POST'])
+def bulk_add_sensors():
+    if not isinstance(request.json, dict):
+        return jsonify({"error": "Expected a JSON object."}), 400
+    items = request.json.get('sensors', [])
+    return bulk_response(bulk_add(items, sensor_from_json, control_system.add_sensors))
+
+# API Endpoint to attach many sensors to amplifiers in one request
+@app.route('/api/amplifiers/sensors/bulk', methods=['POST'])
+def bulk_assign_sensors():
+    if not isinstance(request.json, dict):
+        return jsonify({"error": "Expected a JSON object."}), 400
+    try:
+        assignments = [(item['amplifier_serial'], item['sensor_serial'])
+                       for item in request.json.get('assignments', [])]
+    except (KeyError, TypeError) as e:
+        return jsonify({"error": f"Missing parameter: {str(e)}"}), 400
+    return bulk_response(control_system.assign_sensors(assignments))
+
+# API Endpoint to change gain, sampling rate and/or power of many amplifiers, chosen by serial numbers or a search filter
+@app.route('/api/amplifiers/bulk/settings', methods=['PUT'])
+def bulk_update_amplifiers():
+    data = request.json
+    try:
+        serial_numbers, criteria = bulk_settings_targets(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if criteria is not None:
+        serial_numbers = [amp.serial_number for amp in control_system.filter_amplifiers(
+            criteria.get('serial_number'), criteria.get('model_string'), criteria.get('manufacturer'))]
+    power = data.get('power')
+    if isinstance(power, str):
+        power = power.lower() in ("on", "true")
+    try:
+        # With a driver, each amplifier gets a command; its result holds the command id.
+        update = dispatcher.update_amplifiers if dispatcher is not None else control_system.update_amplifiers
+        results = update(serial_numbers, gain=data.get('gain'), sampling_rate=data.get('sampling_rate'), power=power)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return bulk_response(results)
+
+# API Endpoint to save the current state; the snapshot is written in the background (?wait=true waits for it)
 @app.route('/api/save', methods=['POST'])
 def save_state():
-    control_system.save_state()
-    return jsonify({"message": "System state saved successfully."}), 200
+    snapshot = control_system.save_state_in_background()
+    if request.args.get('wait', 'false').lower() == 'true':
+        snapshot.wait()
+    if snapshot.running:
+        return jsonify({"message": "Saving system state in the background.", "snapshot": snapshot.status()}), 202
+    if not snapshot.succeeded:
+        return jsonify({"error": "Saving system state failed.", "snapshot": snapshot.status()}), 500
+    return jsonify({"message": "System state saved successfully.", "snapshot": snapshot.status()}), 200
+
+# API Endpoint to check on the latest snapshot
+@app.route('/api/save', methods=['GET'])
+def save_status():
+    if control_system.snapshot is None:
+        return jsonify({"error": "No snapshot has been saved since startup."}), 404
+    return jsonify({"snapshot": control_system.snapshot.status()}), 200
 
 # API Endpoint to load the saved state
 @app.route('/api/load', methods=['POST'])
@@ -187,17 +399,75 @@ def update_maintenance(device_type, serial_number):
     if device_type == "amplifier":
         amplifier = control_system.find_amplifier(serial_number)
         if amplifier:
-            control_system.update_maintenance_date(amplifier, new_date)
+            if not control_system.update_maintenance_date(amplifier, new_date):
+                return jsonify({"error": "Maintenance date must be a future date as DD-MM-YYYY or YYYY-MM-DD."}), 400
             return jsonify({"message": f"Maintenance date updated for Amplifier {serial_number}."}), 200
         return jsonify({"error": "Amplifier not found."}), 404
     elif device_type == "sensor":
         sensor = control_system.find_sensor(serial_number)
         if sensor:
-            control_system.update_maintenance_date(sensor, new_date)
+            if not control_system.update_maintenance_date(sensor, new_date):
+                return jsonify({"error": "Maintenance date must be a future date as DD-MM-YYYY or YYYY-MM-DD."}), 400
             return jsonify({"message": f"Maintenance date updated for Sensor {serial_number}."}), 200
         return jsonify({"error": "Sensor not found."}), 404
     else:
         return jsonify({"error": "Invalid device type."}), 400
 
+# API Endpoint to list the devices due for maintenance before a date or within a number of days
+@app.route('/api/maintenance/due', methods=['GET'])
+def maintenance_due():
+    before = request.args.get('before')
+    within_days = request.args.get('within_days', type=int)
+    if before is None and within_days is None:
+        return jsonify({"error": "Missing parameter: 'before' or 'within_days'"}), 400
+    try:
+        due = control_system.maintenance_due(before, within_days)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"devices": [{
+        "device_type": device_type,
+        "serial_number": device.serial_number,
+        "next_maintenance": device.next_maintenance,
+        "due": due_date.isoformat()
+    } for due_date, device_type, device in due]}), 200
+
+# API Endpoint to get the changes after a sequence number (?since=N&epoch=E), to catch up without re-reading the fleet
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    try:
+        after = feed_position(control_system.changes, request.args.get('since'), request.args.get('epoch'))
+        limit = request.args.get('limit', MAX_PAGE_SIZE, type=int)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    body, status = changes_since(control_system.changes, after, limit)
+    return jsonify(body), status
+
+# API Endpoint to follow the changes as Server-Sent Events (resumes from Last-Event-ID or ?since=N&epoch=E)
+@app.route('/api/changes/stream', methods=['GET'])
+def stream_changes():
+    feed = control_system.changes
+    try:
+        after = feed_position(feed, request.args.get('since'), request.args.get('epoch'),
+                              request.headers.get('Last-Event-ID'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        for item in change_stream(feed, after):
+            if isinstance(item, str):
+                yield item
+            elif not feed.wait(item, SSE_KEEPALIVE_SECONDS):
+                yield SSE_KEEPALIVE
+    return Response(events(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+# Metrics endpoint for Prometheus
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(control_system.metrics.render() + http_metrics.render(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,595 @@
+"""
+The control API as an asyncio ASGI application.
+
+Serves the same routes, bodies and status codes as control_system_api, over the same kind
+of EEGControlSystem, but from one event loop instead of a thread per connection, so that
+thousands of clients can stay connected (sample streams, keep-alive pollers) at once.
+Run it with any ASGI server, for example:
+
+    pip install uvicorn
+    uvicorn control_system_asgi:app --port 5000
+
+Control system calls take microseconds, so they run on the event loop when the fleet lock
+can be taken without waiting (the shared side for reads, the exclusive side for changes),
+and are handed to the default thread pool when another thread holds or waits for it. Work
+that blocks for longer (bulk changes, saving and loading snapshots, every call into an
+SQLite registry) always runs in the thread pool. Listings are read and sent one chunk at a
+time, and sample streams wait for new samples with asyncio.sleep.
+"""
+import asyncio
+import functools
+from itertools import islice
+import json
+import threading
+
+from api_common import (COMMAND_WAIT_SECONDS, HOME_PAGE, MAX_PAGE_SIZE, SSE_KEEPALIVE, SSE_KEEPALIVE_SECONDS,
+                        amplifier_from_json, bulk_add, bulk_settings_targets, bulk_summary, change_stream, changes_since,
+                        command_response, create_control_system, create_dispatcher, create_http_metrics, decode_cursor,
+                        encode_cursor, feed_position, sensor_from_json)
+from asgi_base import BadRequest, Response, Routes, handle, jsonify
+from serialization import FragmentCache, sensor_to_dict
+try:
+    from acquisition import AcquisitionEngine
+    from streaming import stream_samples_async
+except ImportError:  # sample streaming needs NumPy; the rest of the API does not
+    AcquisitionEngine = None
+
+# See create_control_system for the environment variables that choose storage and autosave.
+control_system = create_control_system()
+fragments = FragmentCache(control_system)
+# Sends gain, sampling rate and power changes to the hardware when EEG_DRIVER is set; None applies them in memory.
+dispatcher = create_dispatcher(control_system)
+# Started by the first sample stream request, so an API that never streams does no acquisition.
+acquisition = None
+acquisition_lock = threading.Lock()
+
+# Request counts and latencies, served with the control system's own metrics on /metrics.
+http_metrics, http_requests, http_request_seconds = create_http_metrics()
+
+# Amplifiers read from the control system per step of a streamed listing.
+LISTING_CHUNK = 1000
+
+
+async def call(func, *args, **kwargs):
+    """Runs a control system change on the event loop if the fleet lock can be taken at once, or in the thread pool if not."""
+    # Holding the exclusive side, whatever locks the call takes inside are free, so it cannot
+    # block the loop on another thread.
+    lock = control_system._lock
+    if control_system.registry is None and lock.try_write():
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            lock.release_write()
+        # The call skips the compaction check while the lock is held here, so it is made now.
+        control_system._compact_if_needed()
+        return result
+    return await offload(func, *args, **kwargs)
+
+
+async def read(func, *args, **kwargs):
+    """Runs a control system read on the event loop if the shared side of the fleet lock can be taken at once."""
+    lock = control_system._lock
+    if control_system.registry is None and lock.try_read():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            lock.release_read()
+    return await offload(func, *args, **kwargs)
+
+
+async def offload(func, *args, **kwargs):
+    """Runs a blocking call in the thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+routes = Routes()
+route = routes.route
+
+
+async def app(scope, receive, send):
+    """The ASGI 3 application."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        await handle(routes, scope, receive, send, http_requests, http_request_seconds)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if acquisition is not None:
+                acquisition.stop()
+            if dispatcher is not None:
+                await offload(dispatcher.stop)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+class ChangeWaiters:
+    """
+    Wakes the change streams waiting on the event loop when the change feed gets a new event.
+
+    The feed calls wake() in whichever thread made the change. One wake-up is scheduled on the
+    loop per burst of events, however many streams are waiting, so following the feed costs
+    no thread per client and almost nothing per change.
+    """
+    def __init__(self, feed):
+        self.feed = feed
+        self._loop = None
+        self._futures = set()
+        self._scheduled = False
+
+    async def wait(self, sequence, timeout):
+        """Waits until the feed has events after a sequence number or the timeout expires. Returns True if it has."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self.feed.add_listener(self.wake)
+        future = self._loop.create_future()
+        self._futures.add(future)
+        try:
+            # Checked after registering, so an event published in between still wakes this waiter.
+            if self.feed.sequence > sequence:
+                return True
+            await asyncio.wait((future,), timeout=timeout)
+            return self.feed.sequence > sequence
+        finally:
+            self._futures.discard(future)
+
+    def wake(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self._wake_all)
+
+    def _wake_all(self):
+        self._scheduled = False
+        futures, self._futures = self._futures, set()
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+
+change_waiters = ChangeWaiters(control_system.changes)
+
+
+def if_none_match(request, etag):
+    """Returns True if the request's If-None-Match header matches etag."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = {tag.strip().removeprefix("W/").strip('"') for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+# simple welcome message
+@route('/')
+async def home(request):
+    return Response(HOME_PAGE.encode(), content_type="text/html; charset=utf-8")
+
+
+async def list_amplifiers_response(request, not_found_message=None, **criteria):
+    """Lists amplifiers as control_system_api.list_amplifiers_response does, reading one chunk at a time."""
+    try:
+        after = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+        limit = request.arg('limit', type=int)
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+
+    accept = request.headers.get("accept", "").split(",")[0].split(";")[0].strip()
+    ndjson = request.args.get('format') == 'ndjson' or accept == 'application/x-ndjson'
+    # The ETag is taken before listing, so a change made while streaming only makes it stale.
+    etag = fragments.etag("ndjson" if ndjson else "")
+    etag_header = [("etag", f'"{etag}"')]
+    if if_none_match(request, etag):
+        return Response(status=304, headers=etag_header)
+
+    amplifiers = control_system.iter_amplifiers(after, **criteria)
+    first = await read(list, islice(amplifiers, limit + 1 if limit is not None and not ndjson else LISTING_CHUNK))
+    if not first and not_found_message and after is None:
+        return jsonify({"message": not_found_message}, 404)
+
+    if limit is not None and not ndjson:
+        next_cursor = encode_cursor(first[limit - 1].serial_number) if len(first) > limit else None
+        body = '{"amplifiers": [%s], "next_cursor": %s}' % (
+            ", ".join(fragments.fragment(amp) for amp in first[:limit]), json.dumps(next_cursor))
+        return Response(body.encode(), headers=etag_header)
+
+    async def chunks():
+        chunk, rest = first, amplifiers
+        remaining = limit
+        while chunk:
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            yield chunk
+            if remaining == 0:
+                return
+            chunk = await read(list, islice(rest, LISTING_CHUNK))
+
+    if ndjson:
+        async def lines():
+            async for chunk in chunks():
+                yield "".join(fragments.fragment(amp) + "\n" for amp in chunk).encode()
+        return Response(lines(), content_type='application/x-ndjson', headers=etag_header)
+
+    async def json_array():
+        separator = "["
+        async for chunk in chunks():
+            yield (separator + ",".join(fragments.fragment(amp) for amp in chunk)).encode()
+            separator = ","
+        yield b"[]" if separator == "[" else b"]"
+    return Response(json_array(), headers=etag_header)
+
+
+# API Endpoint to add an amplifier
+@route('/api/amplifiers', methods=['POST'])
+async def add_amplifier(request):
+    data = request.json
+    try:
+        amplifier = amplifier_from_json(data)
+        await call(control_system.add_amplifier, amplifier)
+        return jsonify({"message": f"Amplifier {amplifier.serial_number} added successfully."}, 201)
+    except KeyError as e:
+        return jsonify({"error": f"Missing parameter: {str(e)}"}, 400)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 409)
+
+# API Endpoint to get all amplifiers
+@route('/api/amplifiers', methods=['GET'])
+async def get_amplifiers(request):
+    return await list_amplifiers_response(request)
+
+# API Endpoint to remove an amplifier
+@route('/api/amplifiers/<serial_number>', methods=['DELETE'])
+async def remove_amplifier(request, serial_number):
+    await call(control_system.remove_amplifier, serial_number)
+    fragments.discard(serial_number)
+    return jsonify({"message": f"Amplifier {serial_number} removed."}, 200)
+
+# API Endpoint to set amplifier gain
+@route('/api/amplifiers/<serial_number>/gain', methods=['PUT'])
+async def set_amplifier_gain(request, serial_number):
+    new_gain = request.json['gain']
+    try:
+        if dispatcher is not None:
+            return await command_reply(request, await call(dispatcher.set_gain, serial_number, new_gain))
+        if await call(control_system.set_gain, serial_number, new_gain):
+            return jsonify({"message": f"Amplifier {serial_number} gain set to {new_gain}."}, 200)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    return jsonify({"error": "Amplifier not found."}, 404)
+
+# API Endpoint to set amplifier sampling rate
+@route('/api/amplifiers/<serial_number>/sampling_rate', methods=['PUT'])
+async def set_amplifier_sampling_rate(request, serial_number):
+    new_sampling_rate = request.json['sampling_rate']
+    try:
+        if dispatcher is not None:
+            return await command_reply(request, await call(dispatcher.set_sampling_rate, serial_number, new_sampling_rate))
+        if await call(control_system.set_sampling_rate, serial_number, new_sampling_rate):
+            return jsonify({"message": f"Amplifier {serial_number} sampling rate set to {new_sampling_rate} Hz."}, 200)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    return jsonify({"error": "Amplifier not found."}, 404)
+
+# API Endpoint to toggle amplifier power
+@route('/api/amplifiers/<serial_number>/power', methods=['POST'])
+async def toggle_amplifier_power(request, serial_number):
+    # With {"expected": "On"} (or "Off") the toggle only happens if the amplifier is still in that state.
+    try:
+        data = request.json if request.body else {}
+    except BadRequest:
+        data = {}
+    if isinstance(data, dict) and 'expected' in data:
+        expected = str(data['expected']).lower() in ("on", "true")
+        if dispatcher is not None:
+            changed = await call(dispatcher.toggle_power, serial_number, expected)
+        else:
+            changed = await call(control_system.compare_and_set_power, serial_number, expected, not expected)
+        if changed is None:
+            return jsonify({"error": "Amplifier not found."}, 404)
+        if not changed:
+            return jsonify({"error": f"Amplifier {serial_number} is not {'on' if expected else 'off'}."}, 409)
+        if dispatcher is not None:
+            return await command_reply(request, changed)
+        return jsonify({"message": f"Amplifier {serial_number} powered {'off' if expected else 'on'}."}, 200)
+    if dispatcher is not None:
+        return await command_reply(request, await call(dispatcher.toggle_power, serial_number))
+    amplifier = await call(control_system.toggle_power, serial_number)
+    if amplifier:
+        if amplifier.is_on:
+            return jsonify({"message": f"Amplifier {serial_number} powered on."}, 200)
+        else:
+            return jsonify({"message": f"Amplifier {serial_number} powered off."}, 200)
+    return jsonify({"error": "Amplifier not found."}, 404)
+
+async def command_reply(request, command):
+    """Answers a request that queued a command (None if the amplifier does not exist); ?wait=true waits for it to finish."""
+    if command is None:
+        return jsonify({"error": "Amplifier not found."}, 404)
+    if request.args.get('wait', 'false').lower() == 'true':
+        await command.wait_async(COMMAND_WAIT_SECONDS)
+    return jsonify(*command_response(command))
+
+# API Endpoint to check on a command sent to an amplifier (?wait=true waits for it to finish)
+@route('/api/commands/<command_id>', methods=['GET'])
+async def get_command(request, command_id):
+    command = dispatcher.get(command_id) if dispatcher is not None else None
+    if command is None:
+        return jsonify({"error": "Command not found."}, 404)
+    return await command_reply(request, command)
+
+def acquisition_engine():
+    global acquisition
+    with acquisition_lock:
+        if acquisition is None:
+            acquisition = AcquisitionEngine(control_system)
+            acquisition.start()
+    return acquisition
+
+# API Endpoint to stream the samples of an acquiring amplifier as binary frames (see streaming.py)
+@route('/api/amplifiers/<serial_number>/stream', methods=['GET'])
+async def stream_amplifier(request, serial_number):
+    if AcquisitionEngine is None:
+        return jsonify({"error": "Sample streaming requires NumPy."}, 501)
+    decimation = request.arg('decimation', 1, type=int)
+    duration = request.arg('duration', type=float)
+    if decimation < 1:
+        return jsonify({"error": "decimation must be a positive integer."}, 400)
+    if await read(control_system.find_amplifier, serial_number) is None:
+        return jsonify({"error": "Amplifier not found."}, 404)
+    engine = acquisition_engine()
+    await read(engine.sync)
+    if engine.stream(serial_number) is None:
+        return jsonify({"error": f"Amplifier {serial_number} is not acquiring (it is off or has no sensors)."}, 409)
+    frames = stream_samples_async(engine, serial_number, decimation, duration=duration)
+    return Response(frames, content_type='application/octet-stream', headers=[("cache-control", "no-store")])
+
+# API Endpoint to search for amplifiers based on query parameters
+@route('/api/amplifiers/search', methods=['GET'])
+async def search_amplifiers(request):
+    serial_number = request.args.get('serial_number')
+    model_string = request.args.get('model_string')
+    manufacturer = request.args.get('manufacturer')
+
+    return await list_amplifiers_response(request, "No amplifiers found.", serial_number=serial_number,
+                                          model_string=model_string, manufacturer=manufacturer)
+
+# API Endpoint to add a sensor to an amplifier
+@route('/api/amplifiers/<amplifier_serial>/sensors', methods=['POST'])
+async def add_sensor_to_amplifier(request, amplifier_serial):
+    data = request.json
+    sensor_serial = data['sensor_serial']
+
+    result = await call(control_system.add_sensor_to_amplifier, amplifier_serial, sensor_serial)
+    if "error" in result:
+        return jsonify({"error": result["error"]}, 404 if result["error"].endswith("not found.") else 409)
+    return jsonify({"message": f"Sensor {sensor_serial} added to Amplifier {amplifier_serial}."}, 201)
+
+# API Endpoint to add a sensor
+@route('/api/sensors', methods=['POST'])
+async def add_sensor(request):
+    data = request.json
+    try:
+        sensor = sensor_from_json(data)
+        await call(control_system.add_sensor, sensor)
+    except KeyError as e:
+        return jsonify({"error": f"Missing parameter: {str(e)}"}, 400)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 409)
+    return jsonify({"message": f"Sensor {sensor.serial_number} added successfully."}, 201)
+
+# API Endpoint to remove a sensor from an amplifier
+@route('/api/amplifiers/<amplifier_serial>/sensors/<sensor_serial>', methods=['DELETE'])
+async def remove_sensor_from_amplifier(request, amplifier_serial, sensor_serial):
+    await call(control_system.remove_sensor_from_amplifier, amplifier_serial, sensor_serial)
+    return jsonify({"message": f"Sensor {sensor_serial} removed from Amplifier {amplifier_serial}."}, 200)
+
+# API Endpoint to list the sensors at a scalp position (?tag=occipital), optionally only unassigned (&assigned=false) or assigned ones
+@route('/api/sensors', methods=['GET'])
+async def get_sensors_by_tag(request):
+    tag = request.args.get('tag')
+    if tag is None:
+        return jsonify({"error": "Missing parameter: 'tag'"}, 400)
+    assigned = request.args.get('assigned')
+    if assigned is not None:
+        assigned = assigned.lower() == 'true'
+    sensors = await read(control_system.sensors_by_tag, tag, assigned)
+    return jsonify({"sensors": [sensor_to_dict(sensor) for sensor in sensors]}, 200)
+
+# API Endpoint to get a sensor
+@route('/api/sensors/<serial_number>', methods=['GET'])
+async def get_sensor(request, serial_number):
+    sensor = await read(control_system.find_sensor, serial_number)
+    if sensor is None:
+        return jsonify({"error": "Sensor not found."}, 404)
+    return jsonify(sensor_to_dict(sensor), 200)
+
+# API Endpoint to remove a sensor, detaching it from its amplifier first
+@route('/api/sensors/<serial_number>', methods=['DELETE'])
+async def remove_sensor(request, serial_number):
+    if not await call(control_system.remove_sensor, serial_number):
+        return jsonify({"error": "Sensor not found."}, 404)
+    return jsonify({"message": f"Sensor {serial_number} removed."}, 200)
+
+# API Endpoint to get the channel layout of an amplifier by tag
+@route('/api/amplifiers/<serial_number>/layout', methods=['GET'])
+async def get_amplifier_layout(request, serial_number):
+    layout = await read(control_system.amplifier_layout, serial_number)
+    if layout is None:
+        return jsonify({"error": "Amplifier not found."}, 404)
+    return jsonify({"serial_number": serial_number, "layout": layout}, 200)
+
+# API Endpoint to attach a whole montage (tag -> sensor serial or list of serials) to an amplifier in one step
+@route('/api/amplifiers/<serial_number>/montage', methods=['PUT'])
+async def apply_montage(request, serial_number):
+    data = request.json
+    montage = data.get('montage')
+    if not isinstance(montage, dict):
+        return jsonify({"error": "Missing parameter: 'montage' (an object mapping tags to sensor serial numbers)"}, 400)
+    try:
+        result = await call(control_system.apply_montage, serial_number, montage,
+                            replace=bool(data.get('replace', False)))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}, 400)
+    if result is None:
+        return jsonify({"error": "Amplifier not found."}, 404)
+    return jsonify({"message": f"Montage applied to Amplifier {serial_number}.", **result}, 200)
+
+# API Endpoint to add many amplifiers in one request
+@route('/api/amplifiers/bulk', methods=['POST'])
+async def bulk_add_amplifiers(request):
+    if not isinstance(request.json, dict):
+        return jsonify({"error": "Expected a JSON object."}, 400)
+    items = request.json.get('amplifiers', [])
+    return jsonify(bulk_summary(await offload(bulk_add, items, amplifier_from_json, control_system.add_amplifiers)))
+
+# API Endpoint to add many sensors in one request
+@route('/api/sensors/bulk', methods=['POST'])
+async def bulk_add_sensors(request):
+    if not isinstance(request.json, dict):
+        return jsonify({"error": "Expected a JSON object."}, 400)
+    items = request.json.get('sensors', [])
+    return jsonify(bulk_summary(await offload(bulk_add, items, sensor_from_json, control_system.add_sensors)))
+
+# API Endpoint to attach many sensors to amplifiers in one request
+@route('/api/amplifiers/sensors/bulk', methods=['POST'])
+async def bulk_assign_sensors(request):
+    if not isinstance(request.json, dict):
+        return jsonify({"error": "Expected a JSON object."}, 400)
+    try:
+        assignments = [(item['amplifier_serial'], item['sensor_serial'])
+                       for item in request.json.get('assignments', [])]
+    except (KeyError, TypeError) as e:
+        return jsonify({"error": f"Missing parameter: {str(e)}"}, 400)
+    return jsonify(bulk_summary(await offload(control_system.assign_sensors, assignments)))
+
+# API Endpoint to change gain, sampling rate and/or power of many amplifiers, chosen by serial numbers or a search filter
+@route('/api/amplifiers/bulk/settings', methods=['PUT'])
+async def bulk_update_amplifiers(request):
+    data = request.json
+    try:
+        serial_numbers, criteria = bulk_settings_targets(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    if criteria is not None:
+        serial_numbers = [amp.serial_number for amp in await offload(
+            control_system.filter_amplifiers,
+            criteria.get('serial_number'), criteria.get('model_string'), criteria.get('manufacturer'))]
+    power = data.get('power')
+    if isinstance(power, str):
+        power = power.lower() in ("on", "true")
+    try:
+        # With a driver, each amplifier gets a command; its result holds the command id.
+        update = dispatcher.update_amplifiers if dispatcher is not None else control_system.update_amplifiers
+        results = await offload(update, serial_numbers, gain=data.get('gain'), sampling_rate=data.get('sampling_rate'),
+                                power=power)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}, 400)
+    return jsonify(bulk_summary(results))
+
+# API Endpoint to save the current state; the snapshot is written in the background (?wait=true waits for it)
+@route('/api/save', methods=['POST'])
+async def save_state(request):
+    snapshot = await offload(control_system.save_state_in_background)
+    if request.args.get('wait', 'false').lower() == 'true':
+        await offload(snapshot.wait)
+    if snapshot.running:
+        return jsonify({"message": "Saving system state in the background.", "snapshot": snapshot.status()}, 202)
+    if not snapshot.succeeded:
+        return jsonify({"error": "Saving system state failed.", "snapshot": snapshot.status()}, 500)
+    return jsonify({"message": "System state saved successfully.", "snapshot": snapshot.status()}, 200)
+
+# API Endpoint to check on the latest snapshot
+@route('/api/save', methods=['GET'])
+async def save_status(request):
+    if control_system.snapshot is None:
+        return jsonify({"error": "No snapshot has been saved since startup."}, 404)
+    return jsonify({"snapshot": control_system.snapshot.status()}, 200)
+
+# API Endpoint to load the saved state
+@route('/api/load', methods=['POST'])
+async def load_state(request):
+    await offload(control_system.load_state)
+    return jsonify({"message": "System state loaded successfully."}, 200)
+
+# API Endpoint to update maintenance date for a device
+@route('/api/device/<device_type>/<serial_number>/maintenance', methods=['PUT'])
+async def update_maintenance(request, device_type, serial_number):
+    new_date = request.json['new_date']
+    if device_type == "amplifier":
+        amplifier = await read(control_system.find_amplifier, serial_number)
+        if amplifier:
+            if not await call(control_system.update_maintenance_date, amplifier, new_date):
+                return jsonify({"error": "Maintenance date must be a future date as DD-MM-YYYY or YYYY-MM-DD."}, 400)
+            return jsonify({"message": f"Maintenance date updated for Amplifier {serial_number}."}, 200)
+        return jsonify({"error": "Amplifier not found."}, 404)
+    elif device_type == "sensor":
+        sensor = await read(control_system.find_sensor, serial_number)
+        if sensor:
+            if not await call(control_system.update_maintenance_date, sensor, new_date):
+                return jsonify({"error": "Maintenance date must be a future date as DD-MM-YYYY or YYYY-MM-DD."}, 400)
+            return jsonify({"message": f"Maintenance date updated for Sensor {serial_number}."}, 200)
+        return jsonify({"error": "Sensor not found."}, 404)
+    else:
+        return jsonify({"error": "Invalid device type."}, 400)
+
+# API Endpoint to list the devices due for maintenance before a date or within a number of days
+@route('/api/maintenance/due', methods=['GET'])
+async def maintenance_due(request):
+    before = request.args.get('before')
+    within_days = request.arg('within_days', type=int)
+    if before is None and within_days is None:
+        return jsonify({"error": "Missing parameter: 'before' or 'within_days'"}, 400)
+    try:
+        due = await read(control_system.maintenance_due, before, within_days)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    return jsonify({"devices": [{
+        "device_type": device_type,
+        "serial_number": device.serial_number,
+        "next_maintenance": device.next_maintenance,
+        "due": due_date.isoformat()
+    } for due_date, device_type, device in due]}, 200)
+
+# API Endpoint to get the changes after a sequence number (?since=N&epoch=E), to catch up without re-reading the fleet
+@route('/api/changes', methods=['GET'])
+async def get_changes(request):
+    try:
+        after = feed_position(control_system.changes, request.args.get('since'), request.args.get('epoch'))
+        limit = request.arg('limit', MAX_PAGE_SIZE, type=int)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    return jsonify(*changes_since(control_system.changes, after, limit))
+
+# API Endpoint to follow the changes as Server-Sent Events (resumes from Last-Event-ID or ?since=N&epoch=E)
+@route('/api/changes/stream', methods=['GET'])
+async def stream_changes(request):
+    feed = control_system.changes
+    try:
+        after = feed_position(feed, request.args.get('since'), request.args.get('epoch'),
+                              request.headers.get('last-event-id'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+
+    async def events():
+        for item in change_stream(feed, after):
+            if isinstance(item, str):
+                yield item.encode()
+            elif not await change_waiters.wait(item, SSE_KEEPALIVE_SECONDS):
+                yield SSE_KEEPALIVE.encode()
+    return Response(events(), content_type='text/event-stream',
+                    headers=[("cache-control", "no-store"), ("x-accel-buffering", "no")])
+
+# Metrics endpoint for Prometheus
+@route('/metrics', methods=['GET'])
+async def metrics(request):
+    # Rendering reads the fleet gauges, which take the fleet lock.
+    body = await read(lambda: control_system.metrics.render() + http_metrics.render())
+    return Response(body.encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,75 @@
+"""
+Drivers that carry amplifier settings to the hardware.
+
+EEGControlSystem changes a gain, sampling rate or power state in memory at once, but a real
+amplifier only takes a new setting over a round trip on USB or the network. A driver is that
+round trip: the command dispatcher (commands.py) sends each amplifier's pending settings
+through apply() and changes the fleet only once the driver has confirmed them.
+
+SimulatedDriver stands in for the hardware with a configurable latency, so that the API and
+the benchmarks run without devices.
+
+    driver = SimulatedDriver(latency=0.02)
+    await driver.apply("A001", {"gain": 10, "power": True})
+"""
+import abc
+import asyncio
+import random
+
+
+class DriverError(Exception):
+    """Raised by a driver when an amplifier refuses a command or does not answer it."""
+
+
+class AmplifierDriver(abc.ABC):
+    """
+    The interface between the command dispatcher and the amplifiers.
+
+    apply() runs on the dispatcher's event loop and must not block it; a driver built on a
+    blocking library should hand each call to a thread. The dispatcher never has two round
+    trips to the same amplifier in flight, but talks to different amplifiers concurrently.
+    """
+    @abc.abstractmethod
+    async def apply(self, serial_number, settings):
+        """
+        Sends settings to an amplifier and returns once the amplifier has applied them.
+
+        settings maps "gain", "sampling_rate" and/or "power" (True for on) to new values, which
+        have already been validated. Raises DriverError if the amplifier does not apply them.
+        """
+
+    async def close(self):
+        """Releases the driver's connections to the amplifiers."""
+
+
+class SimulatedDriver(AmplifierDriver):
+    """
+    A driver for simulated amplifiers, whose round trip takes a set time.
+
+    Attributes:
+        latency (float): Seconds each round trip takes.
+        jitter (float): Up to this many seconds are added to each round trip at random.
+        failure_rate (float): Fraction of round trips that fail with a DriverError.
+        round_trips (int): Number of round trips made so far.
+        in_flight (int): Number of round trips in progress.
+        max_in_flight (int): Largest number of round trips that were in progress at once.
+    """
+    def __init__(self, latency=0.02, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.round_trips = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+
+    async def apply(self, serial_number, settings):
+        self.round_trips += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                raise DriverError(f"Amplifier {serial_number} did not acknowledge the command.")
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,198 @@
+import contextlib
+import glob
+import json
+import os
+import time
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of EEGControlSystem mutations.
+
+    Every mutation is appended as one compact JSON array line, ``[op, arg1, arg2, ...]``,
+    and flushed to the operating system immediately, so a crash of the process never
+    loses an acknowledged change. Calls to fsync are grouped: the file is synced after
+    ``fsync_every`` records or once ``fsync_interval`` seconds have passed since the last
+    sync, whichever comes first. With neither set, durability against power loss is
+    left to the operating system.
+
+    The first line of the file is a header holding the journal generation. A snapshot
+    records the generation the next journal will have, so after a compaction the old
+    journal (whose generation is now too low) is never replayed twice, even if the
+    process died between writing the snapshot and resetting the journal.
+
+    A snapshot written in the background (see snapshots.py) rotates the journal instead:
+    the current file is kept as a segment named ``<filename>.<generation>`` and appending
+    continues in a new file of the next generation. Until the snapshot is complete the
+    segments still hold changes that only the previous snapshot lacks, so replay applies
+    every segment of a high enough generation, oldest first, before the current file.
+    Segments are deleted once a snapshot covers them.
+
+    Attributes:
+        filename (str): Path of the journal file.
+        fsync_every (int | None): Number of records per group commit.
+        fsync_interval (float | None): Maximum number of seconds between fsync calls.
+        compact_after (int | None): Number of records after which the owner should compact.
+        generation (int): Generation of the journal currently being appended to.
+        records (int): Number of records in the current journal file.
+    """
+    def __init__(self, filename="amplifier_repository.journal", fsync_every=None, fsync_interval=None,
+                 compact_after=None):
+        self.filename = filename
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+        self.generation = 0
+        self.records = 0
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._valid_size = None
+        self._batch_depth = 0
+
+    def replay(self, apply, min_generation=0):
+        """Calls apply(op, args) for every intact record of the segments and the journal of min_generation or later.
+
+        Returns the number of records replayed. A torn final line left by a crash is ignored
+        and cut off the next time the journal is opened for appending.
+        """
+        replayed = 0
+        for generation, filename in self.segments():
+            if generation >= min_generation:
+                replayed += _replay_file(filename, apply, min_generation)[1]
+        self._valid_size = 0
+        generation, records, valid_size = _replay_file(self.filename, apply, min_generation)
+        if generation is None:
+            return replayed
+        self._valid_size = valid_size
+        self.generation = generation
+        self.records = records
+        return replayed + records
+
+    def segments(self):
+        """Returns (generation, filename) of every segment kept by rotate, oldest first."""
+        segments = []
+        for filename in glob.glob(glob.escape(self.filename) + ".*"):
+            suffix = filename[len(self.filename) + 1:]
+            if suffix.isdigit():
+                segments.append((int(suffix), filename))
+        return sorted(segments)
+
+    def rotate(self, generation):
+        """Keeps the current journal as a segment and continues in an empty journal of a newer generation."""
+        self.close()
+        if os.path.exists(self.filename):
+            os.replace(self.filename, f"{self.filename}.{self.generation}")
+        self.reset(generation)
+
+    def discard_segments(self, before):
+        """Deletes the segments older than generation before, once a snapshot of that generation covers them."""
+        for generation, filename in self.segments():
+            if generation < before:
+                os.remove(filename)
+
+    def open(self, generation=None):
+        """Opens the journal for appending, starting a fresh file if it belongs to an older generation."""
+        self.close()
+        if self._valid_size is None:
+            generation, self.records, self._valid_size = _replay_file(self.filename, lambda op, args: None, 0)
+            if generation is not None:
+                self.generation = generation
+        if generation is not None and generation > self.generation:
+            self.reset(generation)
+            return
+        if self._valid_size:
+            with open(self.filename, 'r+b') as f:
+                f.truncate(self._valid_size)
+            self._file = open(self.filename, 'ab')
+        else:
+            self.reset(self.generation)
+
+    def reset(self, generation):
+        """Atomically replaces the journal with an empty one of the given generation."""
+        self.close()
+        temp_filename = f"{self.filename}.tmp"
+        with open(temp_filename, 'wb') as f:
+            f.write(json.dumps({"generation": generation}).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+        self.generation = generation
+        self.records = 0
+        self._valid_size = None
+        self._file = open(self.filename, 'ab')
+
+    def append(self, op, *args):
+        """Appends one mutation record to the journal."""
+        if self._file is None:
+            self.open()
+        self._file.write(json.dumps([op, *args], separators=(",", ":")).encode() + b"\n")
+        self.records += 1
+        self._unsynced += 1
+        if not self._batch_depth:
+            self._commit()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups every record appended inside the block into a single flush (and fsync check) at the end."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._file is not None:
+                self._commit()
+
+    def _commit(self):
+        self._file.flush()
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            self.sync()
+        elif self.fsync_interval is not None and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Forces every appended record to stable storage."""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def needs_compaction(self):
+        """Returns True once the journal has grown past compact_after records."""
+        return self.compact_after is not None and self.records >= self.compact_after
+
+    def close(self):
+        """Syncs and closes the journal file."""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+def _replay_file(filename, apply, min_generation):
+    """Replays one journal file. Returns (generation, records replayed, size of the intact part), or (None, 0, 0)."""
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        return None, 0, 0
+    replayed = 0
+    with f:
+        header = f.readline()
+        try:
+            generation = json.loads(header)["generation"]
+        except (ValueError, KeyError, TypeError):
+            return None, 0, 0
+        if generation < min_generation:
+            return None, 0, 0
+        valid_size = len(header)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                op, *args = json.loads(line)
+            except ValueError:
+                break
+            apply(op, args)
+            replayed += 1
+            valid_size += len(line)
+    return generation, replayed, valid_size
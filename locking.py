@@ -0,0 +1,147 @@
+import threading
+
+
+class _Guard:
+    """Context manager calling acquire on entry and release on exit."""
+    __slots__ = ("_acquire", "_release")
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+
+
+class ReadWriteLock:
+    """
+    Lock that lets any number of readers in at once, or a single writer.
+
+    Readers and writers take turns: once a writer is waiting, new readers queue behind
+    it, and when a writer releases the lock every queued reader is let in before the
+    next writer. A steady stream of reads cannot starve mutations, and a steady stream
+    of mutations cannot starve reads. Both sides are reentrant, and a thread holding the
+    write lock may also take the read lock. Upgrading a read lock to a write lock would
+    deadlock against other readers and raises RuntimeError.
+
+    Use the read and write attributes as context managers:
+
+        with lock.read:
+            ...
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._waiting_readers = 0
+        self._read_turns = 0
+        self._local = threading.local()
+        self.read = _Guard(self.acquire_read, self.release_read)
+        self.write = _Guard(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.depth = depth + 1
+            return
+        with self._condition:
+            if self._writer is None and not self._waiting_writers:
+                self._readers += 1
+            else:
+                # Queued readers are counted in by the writer that releases the lock next.
+                self._waiting_readers += 1
+                turn = self._read_turns
+                while self._read_turns == turn:
+                    self._condition.wait()
+        self._local.depth = 1
+
+    def release_read(self):
+        self._local.depth -= 1
+        if self._local.depth or self._writer == threading.get_ident():
+            return
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._writer_depth += 1
+            return
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("Cannot upgrade a read lock to a write lock.")
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        self._writer_depth -= 1
+        if self._writer_depth:
+            return
+        with self._condition:
+            self._writer = None
+            if self._waiting_readers:
+                self._readers += self._waiting_readers
+                self._waiting_readers = 0
+                self._read_turns += 1
+            self._condition.notify_all()
+
+    def held(self):
+        """Returns True if the calling thread holds the lock, for reading or writing."""
+        return bool(getattr(self._local, "depth", 0)) or self._writer == threading.get_ident()
+
+    def try_read(self):
+        """Takes the read lock if that needs no waiting. Returns True if it did; release it with release_read()."""
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.depth = depth + 1
+            return True
+        with self._condition:
+            if self._writer is not None or self._waiting_writers:
+                return False
+            self._readers += 1
+        self._local.depth = 1
+        return True
+
+    def try_write(self):
+        """Takes the write lock if that needs no waiting. Returns True if it did; release it with release_write()."""
+        me = threading.get_ident()
+        if self._writer == me:
+            self._writer_depth += 1
+            return True
+        if getattr(self._local, "depth", 0):
+            return False
+        with self._condition:
+            if self._writer is not None or self._readers or self._waiting_writers:
+                return False
+            self._writer = me
+            self._writer_depth = 1
+        return True
+
+
+class StripedLock:
+    """
+    A fixed set of mutexes shared out among keys by hash.
+
+    Gives every device its own lock in effect, without allocating one per device:
+    two keys only contend when they land on the same stripe.
+    """
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        """Returns the lock guarding key."""
+        return self._locks[hash(key) % len(self._locks)]
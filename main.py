@@ -1,5 +1,6 @@
 from amplifier import Amplifier
 from control_system import EEGControlSystem
+from journal import Journal
 from sensor import Sensor
 
 def main():
@@ -18,9 +19,10 @@ def main():
     9. Add an existing sensor to an amplifier by their serial numbers.
     10. Remove a sensor from an amplifier.
     11. Update the next maintenance date of either an amplifier or a sensor.
-    12. Exit the system, saving the current state of amplifiers and sensors to a file.
+    12. List the devices due for maintenance before a date or within a number of days.
+    13. Exit the system, saving the current state of amplifiers and sensors to a file.
     """
-    control_system = EEGControlSystem()
+    control_system = EEGControlSystem(journal=Journal())
     # Load the state on startup
     control_system.load_state()
 
@@ -36,7 +38,8 @@ def main():
         print("9. Add Sensor to Amplifier")
         print("10. Remove Sensor from Amplifier")
         print("11. Update Maintenance Date")
-        print("12. Exit from the System")
+        print("12. List Devices Due for Maintenance")
+        print("13. Exit from the System")
         choice = input("Please enter your choice: ")
 
         if choice == "1":
@@ -65,7 +68,10 @@ def main():
                     print(e)
 
             amplifier = Amplifier(serial_number, model_string, manufacturer, next_maintenance, sampling_rate, gain)
-            control_system.add_amplifier(amplifier)
+            try:
+                control_system.add_amplifier(amplifier)
+            except ValueError as e:
+                print(e)
 
         elif choice == "2":
             # Remove an amplifier
@@ -85,7 +91,7 @@ def main():
             if amplifier:
                 gain = int(input("Enter new gain [1-100]: "))
                 try:
-                    amplifier.set_gain(gain)
+                    control_system.set_gain(serial_number, gain)
                     print(f"Gain set to {gain}")
                 except ValueError as e:
                     print(e)
@@ -99,7 +105,7 @@ def main():
             if amplifier:
                 sampling_rate = int(input("Enter new sampling rate (256, 512, 1024 Hz): "))
                 try:
-                    amplifier.set_sampling_rate(sampling_rate)
+                    control_system.set_sampling_rate(serial_number, sampling_rate)
                     print(f"Sampling rate set to {sampling_rate}")
                 except ValueError as e:
                     print(e)
@@ -109,14 +115,12 @@ def main():
         elif choice == "6":
             # Power on/off an amplifier
             serial_number = input("Enter serial number of the amplifier: ")
-            amplifier = control_system.find_amplifier(serial_number)
+            amplifier = control_system.toggle_power(serial_number)
             if amplifier:
                 if amplifier.is_on:
-                    amplifier.power_off()
-                    print("Amplifier powered off")
-                else:
-                    amplifier.power_on()
                     print("Amplifier powered on")
+                else:
+                    print("Amplifier powered off")
             else:
                 print("Amplifier not found")
 
@@ -155,7 +159,10 @@ def main():
             tag = input("Enter sensor position on the scalp (e.g., 'frontal', 'occipital'): ")
 
             sensor = Sensor(serial_number, model_string, manufacturer, next_maintenance, tag)
-            control_system.add_sensor(sensor)
+            try:
+                control_system.add_sensor(sensor)
+            except ValueError as e:
+                print(e)
 
         elif choice == "9":
             # Add a sensor to an amplifier
@@ -192,6 +199,22 @@ def main():
                 print("Invalid option. Please select 'A' for Amplifier or 'S' for Sensor.")
         
         elif choice == "12":
+            # List the devices due for maintenance
+            answer = input("Enter a date (DD-MM-YYYY) or a number of days from today: ")
+            try:
+                if answer.isdigit():
+                    due = control_system.maintenance_due(within_days=int(answer))
+                else:
+                    due = control_system.maintenance_due(answer)
+            except ValueError as e:
+                print(e)
+                continue
+            if not due:
+                print("No devices are due for maintenance.")
+            for due_date, device_type, device in due:
+                print(f"{due_date.strftime('%d-%m-%Y')} - {device_type.capitalize()} {device.serial_number}")
+
+        elif choice == "13":
             print("Exiting and saving state...")
             control_system.save_state()  # Save state on exit
             break
@@ -0,0 +1,62 @@
+from bisect import bisect_left, insort
+from datetime import date
+
+
+def maintenance_ordinal(date_string):
+    """Returns the proleptic Gregorian ordinal of a DD-MM-YYYY or YYYY-MM-DD date, or 0 if it cannot be parsed."""
+    # Both formats are in use (the README shows each), so the year is found by its width.
+    try:
+        first, month, last = date_string.split("-")
+        year, day = (first, last) if len(first) == 4 else (last, first)
+        return date(int(year), int(month), int(day)).toordinal()
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+class MaintenanceIndex:
+    """
+    Devices ordered by next maintenance date.
+
+    Every date is parsed once, when a device is indexed, into a day ordinal, and the
+    entries are kept sorted as (ordinal, device type, serial number) tuples. The devices
+    due before a date are then a prefix of the list, found by binary search, so a query
+    costs O(log n + k) for k results. Devices whose date cannot be parsed are not indexed.
+    """
+    def __init__(self):
+        self._entries = []  # sorted (ordinal, device type, serial number)
+        self._ordinals = {}  # (device type, serial number) -> ordinal
+
+    def add(self, device_type, serial_number, next_maintenance):
+        """Indexes a device under its maintenance date, replacing any previous entry."""
+        self.remove(device_type, serial_number)
+        ordinal = maintenance_ordinal(next_maintenance)
+        if ordinal:
+            self._ordinals[device_type, serial_number] = ordinal
+            insort(self._entries, (ordinal, device_type, serial_number))
+
+    def remove(self, device_type, serial_number):
+        """Removes a device from the index, if it is indexed."""
+        ordinal = self._ordinals.pop((device_type, serial_number), None)
+        if ordinal is not None:
+            del self._entries[bisect_left(self._entries, (ordinal, device_type, serial_number))]
+
+    def build(self, devices):
+        """Replaces the index with (device type, serial number, maintenance ordinal) triples, sorting once."""
+        self._ordinals = {}
+        for device_type, serial_number, ordinal in devices:
+            if ordinal:
+                self._ordinals[device_type, serial_number] = ordinal
+        self._entries = sorted((ordinal, device_type, serial_number)
+                               for (device_type, serial_number), ordinal in self._ordinals.items())
+
+    def clear(self):
+        """Removes every entry from the index."""
+        self._entries = []
+        self._ordinals = {}
+
+    def due_before(self, ordinal):
+        """Returns (ordinal, device type, serial number) entries due before the given day ordinal, soonest first."""
+        return self._entries[:bisect_left(self._entries, (ordinal,))]
+
+    def __len__(self):
+        return len(self._entries)
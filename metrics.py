@@ -0,0 +1,239 @@
+"""
+Counters, gauges and histograms rendered in the Prometheus text exposition format.
+
+A Registry holds metrics and renders them all for a /metrics endpoint:
+
+    registry = Registry()
+    requests = registry.counter("eeg_http_requests_total", "HTTP requests.", ("method", "route", "status"))
+    requests.labels("GET", "/api/amplifiers", "200").inc()
+    print(registry.render())
+
+Recording a value is cheap enough for hot paths: a dictionary lookup for the label values
+(which can also be done once, up front, by keeping the child that labels() returns), a
+bisection over the bucket bounds for histograms, and one uncontended lock. Nothing is
+aggregated or formatted until the registry is rendered.
+
+A gauge can also be given a function, which is called at render time instead of being set
+whenever its value changes.
+"""
+import abc
+from bisect import bisect_left
+import math
+import threading
+
+# Seconds, from a dictionary lookup to a snapshot of a large fleet.
+LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Adds a non-negative amount."""
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, label_names, label_values):
+        yield f"{name}{_format_labels(label_names, label_values)} {_format_value(self.value)}"
+
+
+class _GaugeValue:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Reports function() at render time instead of the value last set."""
+        self.function = function
+
+    def samples(self, name, label_names, label_values):
+        value = self.function() if self.function is not None else self.value
+        yield f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}"
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket, plus one for the values above the last bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        bucket = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+
+    def samples(self, name, label_names, label_values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        names = label_names + ("le",)
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(names, label_values + (_format_value(bound),))} {cumulative}"
+        labels = _format_labels(label_names, label_values)
+        yield f"{name}_sum{labels} {_format_value(total)}"
+        yield f"{name}_count{labels} {cumulative}"
+
+
+class Metric(abc.ABC):
+    """
+    A named metric with zero or more labels.
+
+    Without labels, the metric itself records values (inc, set, observe...). With labels,
+    labels(*values) returns the child that records values for those label values, which
+    must be strings.
+
+    Attributes:
+        name (str): Metric name.
+        documentation (str): One line of help text.
+        label_names (tuple): Names of the labels, in the order labels() takes their values.
+    """
+    type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_value(self):
+        """Returns the object that records the values of one label combination."""
+
+    def labels(self, *values):
+        """Returns the child for the given label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}, got {values}.")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_value())
+        return child
+
+    def __getattr__(self, attribute):
+        # An unlabelled metric forwards inc, set, observe... to its only child.
+        if attribute.startswith("_") or self.label_names:
+            raise AttributeError(attribute)
+        return getattr(self.labels(), attribute)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.samples(self.name, self.label_names, values))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up (requests, bytes written)."""
+    type = "counter"
+
+    def _new_value(self):
+        return _CounterValue()
+
+
+class Gauge(Metric):
+    """A value that goes up and down (amplifiers powered on)."""
+    type = "gauge"
+
+    def _new_value(self):
+        return _GaugeValue()
+
+
+class Histogram(Metric):
+    """Counts of observed values (latencies) in cumulative buckets, with their sum."""
+    type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+
+class ObserverCache(dict):
+    """
+    Maps label values to the observe method of a single-label histogram's child, creating it on first use.
+
+    For the hottest paths: cache[value](seconds) costs one dictionary lookup instead of a
+    labels() call.
+    """
+    def __init__(self, histogram):
+        super().__init__()
+        self.histogram = histogram
+
+    def __missing__(self, value):
+        observe = self[value] = self.histogram.labels(value).observe
+        return observe
+
+
+class Registry:
+    """A set of metrics, rendered together in the Prometheus text format."""
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Adds a metric. Raises ValueError if another metric has the same name."""
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        return "".join(metric.render() + "\n" for metric in self._metrics.values())
@@ -0,0 +1,346 @@
+"""
+Acquisition sharded across worker processes.
+
+ParallelAcquisition spreads the amplifiers of an EEGControlSystem over a pool of worker
+processes by a stable hash of their serial numbers, so that producing samples for hundreds
+of amplifiers is not limited to the one core a single Python process can use.
+
+Samples never pass through a pipe: the ring buffer of every stream is a
+multiprocessing.shared_memory segment, created by the main process and written by the
+owning worker, so readers in the main process (streaming clients, recorders, the signal
+processing pipeline) read it exactly like a local ring. Each segment starts with a small
+header, also shared, holding the sample count, the block counters and the latest gain changes.
+
+Only the control plane crosses the pipes. The main process follows the control system like
+AcquisitionEngine does (its change feed, then amplifier versions) and sends each worker small
+messages for its own amplifiers: start a stream (sampling rate, channels, segment name),
+change its gain, stop it. A worker applies them between two production rounds, so gain,
+sampling rate, power and sensor changes take effect without restarting anything.
+
+Requires NumPy.
+
+    acquisition = ParallelAcquisition(control_system, workers=4)
+    acquisition.start()
+    samples, end = acquisition.stream("A001").ring.latest(1024)
+    acquisition.stop()
+"""
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
+import queue
+import zlib
+
+import numpy as np
+
+from acquisition import DTYPE, AcquisitionEngine, AmplifierStream, RingBuffer
+
+# Header layout, as uint64 slots: 0 samples written, 1 produced blocks, 2 dropped blocks,
+# 3 gain changes recorded; as a float64 slot: 4 started; then, from slot 8, a ring of the
+# latest GAIN_HISTORY gain changes, each a (first sample as uint64, gain as float64) pair.
+WRITTEN, PRODUCED, DROPPED, GAIN_COUNT = range(4)
+STARTED = 4
+GAINS = 8
+GAIN_HISTORY = AmplifierStream.GAIN_HISTORY
+HEADER_SIZE = (GAINS + 2 * GAIN_HISTORY) * 8
+
+
+class SharedRingBuffer(RingBuffer):
+    """A RingBuffer, with its sample count, in a shared memory segment."""
+    def __init__(self, shm, channels, capacity):
+        self.channels = channels
+        self.capacity = capacity
+        self.counters = np.ndarray((HEADER_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        self.values = np.ndarray((HEADER_SIZE // 8,), dtype=np.float64, buffer=shm.buf)
+        self._data = np.ndarray((channels, 2 * capacity), dtype=DTYPE, buffer=shm.buf, offset=HEADER_SIZE)
+        # Set last, so that when the ring is collected the arrays are released before the segment is closed.
+        self.shm = shm
+
+    @staticmethod
+    def size(channels, capacity):
+        return HEADER_SIZE + channels * 2 * capacity * np.dtype(DTYPE).itemsize
+
+    @property
+    def written(self):
+        return int(self.counters[WRITTEN])
+
+    @written.setter
+    def written(self, value):
+        self.counters[WRITTEN] = value
+
+    def record_gain(self, first, gain):
+        """
+        Records that the samples from first on have the given gain.
+
+        A change from a sample older than the latest one recorded is ignored (it is already
+        in the ring); one from the same sample replaces it. The pair is written before the
+        count that makes it visible, and is lost to readers only after GAIN_HISTORY more changes.
+        """
+        count = int(self.counters[GAIN_COUNT])
+        if count:
+            slot = GAINS + 2 * ((count - 1) % GAIN_HISTORY)
+            latest = int(self.counters[slot])
+            if first < latest:
+                return
+            if first == latest:
+                self.values[slot + 1] = gain
+                return
+        slot = GAINS + 2 * (count % GAIN_HISTORY)
+        self.counters[slot] = first
+        self.values[slot + 1] = gain
+        self.counters[GAIN_COUNT] = count + 1
+
+    def latest_gain(self):
+        """Returns the latest recorded (first sample, gain) pair."""
+        slot = GAINS + 2 * ((int(self.counters[GAIN_COUNT]) - 1) % GAIN_HISTORY)
+        return int(self.counters[slot]), float(self.values[slot + 1])
+
+    def gains(self):
+        """Returns the recorded (first sample, gain) pairs, oldest first."""
+        count = int(self.counters[GAIN_COUNT])
+        slots = (GAINS + 2 * (i % GAIN_HISTORY) for i in range(max(0, count - GAIN_HISTORY), count))
+        return [(int(self.counters[slot]), float(self.values[slot + 1])) for slot in slots]
+
+    def close(self):
+        """Unmaps the segment, unless views of it are still in use (then it is unmapped when they go)."""
+        self.counters = self.values = self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+
+class SharedStream:
+    """
+    The main process's view of a stream produced by a worker, with the interface of AmplifierStream.
+
+    Attributes:
+        serial_number (str): Serial number of the amplifier.
+        version (int): Amplifier version the stream was last updated to.
+        sampling_rate (int): Samples per second and channel.
+        channels (list): (sensor serial number, tag) of every channel, in row order.
+        block_size (int): Samples per block and channel.
+        ring (SharedRingBuffer): The latest samples.
+        worker (int): Number of the worker producing the stream.
+    """
+    def __init__(self, amplifier, channels, block_size, capacity, started, worker):
+        self.serial_number = amplifier.serial_number
+        self.version = amplifier.version
+        self.sampling_rate = amplifier.sampling_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.worker = worker
+        shm = shared_memory.SharedMemory(create=True, size=SharedRingBuffer.size(len(channels), capacity))
+        self.ring = SharedRingBuffer(shm, len(channels), capacity)
+        self.ring.values[STARTED] = started
+        self.ring.record_gain(0, amplifier.gain)
+
+    @property
+    def started(self):
+        return float(self.ring.values[STARTED])
+
+    @property
+    def gain(self):
+        return self.ring.latest_gain()[1]
+
+    @property
+    def gains(self):
+        return self.ring.gains()
+
+    gain_at = AmplifierStream.gain_at
+
+    @property
+    def produced_blocks(self):
+        return int(self.ring.counters[PRODUCED])
+
+    @property
+    def dropped_blocks(self):
+        return int(self.ring.counters[DROPPED])
+
+    @property
+    def next_sample(self):
+        return (self.produced_blocks + self.dropped_blocks) * self.block_size
+
+    def spec(self):
+        """Returns the message that starts this stream in its worker."""
+        return {"serial_number": self.serial_number, "version": self.version, "sampling_rate": self.sampling_rate,
+                "gain": self.gain, "channels": self.channels, "segment": self.ring.shm.name,
+                "capacity": self.ring.capacity, "started": self.started}
+
+
+class _WorkerAmplifier:
+    """An amplifier as a worker knows it, from a start message, shaped for AcquisitionEngine."""
+    is_on = True
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.serial_number = spec["serial_number"]
+        self.version = spec["version"]
+        self.sampling_rate = spec["sampling_rate"]
+        self.gain = spec["gain"]
+        self.sensors = [_WorkerSensor(serial_number, tag) for serial_number, tag in spec["channels"]]
+
+
+class _WorkerSensor:
+    __slots__ = ("serial_number", "tag")
+
+    def __init__(self, serial_number, tag):
+        self.serial_number = serial_number
+        self.tag = tag
+
+
+class _WorkerFleet:
+    """The amplifiers assigned to one worker, with the part of the control system interface the engine uses."""
+    def __init__(self):
+        self.amplifiers = {}
+        self.version = 0
+
+    def state_tag(self):
+        return self.version
+
+    def list_amplifiers(self):
+        return list(self.amplifiers.values())
+
+    def apply(self, message):
+        command, serial_number, *arguments = message
+        if command == "start":
+            self.amplifiers[serial_number] = _WorkerAmplifier(arguments[0])
+        elif command == "gain":
+            amplifier = self.amplifiers.get(serial_number)
+            if amplifier is not None:
+                amplifier.version, amplifier.gain = arguments
+        elif command == "stop":
+            self.amplifiers.pop(serial_number, None)
+        self.version += 1
+
+
+class _WorkerEngine(AcquisitionEngine):
+    """An AcquisitionEngine writing to the shared memory rings named in the start messages."""
+    def _new_stream(self, amplifier, channels, now):
+        spec = amplifier.spec
+        shm = shared_memory.SharedMemory(name=spec["segment"])
+        ring = SharedRingBuffer(shm, len(channels), spec["capacity"])
+        rate = amplifier.sampling_rate
+        return AmplifierStream(amplifier, self.block_size, spec["capacity"], self._max_blocks(rate),
+                               self._table(len(channels), rate), spec["started"], ring=ring)
+
+    def _drop_stream(self, stream, replaced):
+        stream.ring.close()
+
+    def publish(self):
+        """Copies the block counters and gain changes of every stream into its shared header."""
+        for stream in self._streams.values():
+            ring = stream.ring
+            ring.counters[PRODUCED] = stream.produced_blocks
+            ring.counters[DROPPED] = stream.dropped_blocks
+            if stream.gains[-1] != ring.latest_gain():
+                for first, gain in stream.gains:
+                    ring.record_gain(first, gain)
+
+
+def _worker_main(messages, block_size, ring_seconds, max_lag, tick):
+    """Applies control messages as they arrive and runs a production round every tick, until it receives None."""
+    fleet = _WorkerFleet()
+    engine = _WorkerEngine(fleet, block_size, ring_seconds, max_lag, tick)
+    next_tick = engine.clock()
+    while True:
+        try:
+            message = messages.get(timeout=max(0.0, next_tick - engine.clock()))
+        except queue.Empty:
+            engine.step()
+            engine.publish()
+            next_tick = max(next_tick + tick, engine.clock())
+            continue
+        if message is None:
+            break
+        fleet.apply(message)
+    for stream in engine.streams():
+        stream.ring.close()
+
+
+class ParallelAcquisition(AcquisitionEngine):
+    """
+    Produces sample blocks for every powered-on amplifier of a control system in worker processes.
+
+    Has the interface of AcquisitionEngine, so streams, recorders and the processing pipeline
+    work with either. In this process, step() only forwards control-plane changes to the
+    workers; the workers produce the samples.
+
+    Attributes:
+        workers (int): Number of worker processes.
+    """
+    def __init__(self, control_system, workers=None, block_size=32, ring_seconds=1.0, max_lag=0.25, tick=0.01,
+                 context=None):
+        super().__init__(control_system, block_size, ring_seconds, max_lag, tick)
+        self.workers = workers or os.cpu_count() or 1
+        self._context = context or multiprocessing.get_context()
+        self._queues = []
+        self._processes = []
+
+    def worker_of(self, serial_number):
+        """Returns the number of the worker that owns an amplifier."""
+        return zlib.crc32(serial_number.encode()) % self.workers
+
+    def start(self):
+        """Starts the worker processes and the thread that forwards control-plane changes to them."""
+        if self._processes:
+            return
+        # Workers must share the resource tracker of this process, or each would unlink the
+        # segments it attached to when it exits.
+        resource_tracker.ensure_running()
+        for _ in range(self.workers):
+            messages = self._context.Queue()
+            process = self._context.Process(target=_worker_main, name="acquisition-worker", daemon=True,
+                                            args=(messages, self.block_size, self.ring_seconds, self.max_lag,
+                                                  self.tick))
+            process.start()
+            self._queues.append(messages)
+            self._processes.append(process)
+        for stream in self._streams.values():
+            self._queues[stream.worker].put(("start", stream.serial_number, stream.spec()))
+        super().start()
+
+    def _send(self, worker, message):
+        if self._queues:
+            self._queues[worker].put(message)
+
+    def _update_stream(self, stream, amplifier):
+        # Before the workers start, a changed stream is simply replaced: it has no samples yet.
+        if not self._queues:
+            return False
+        stream.version = amplifier.version
+        self._send(stream.worker, ("gain", stream.serial_number, amplifier.version, amplifier.gain))
+        return True
+
+    def _new_stream(self, amplifier, channels, now):
+        stream = SharedStream(amplifier, channels, self.block_size, self._ring_samples(amplifier.sampling_rate), now,
+                              self.worker_of(amplifier.serial_number))
+        self._send(stream.worker, ("start", stream.serial_number, stream.spec()))
+        return stream
+
+    def _drop_stream(self, stream, replaced):
+        if not replaced:
+            self._send(stream.worker, ("stop", stream.serial_number))
+        self._retire(stream)
+
+    def _retire(self, stream):
+        # The name goes now; the memory stays until every process has unmapped it, so
+        # readers still holding the old stream can finish with it.
+        stream.ring.shm.unlink()
+
+    def step(self, now=None):
+        """Forwards control-plane changes to the workers. Returns 0: the workers write the blocks."""
+        self.sync(now)
+        return 0
+
+    def stop(self):
+        """Stops the workers and releases every shared memory segment."""
+        super().stop()
+        for messages in self._queues:
+            messages.put(None)
+        for process in self._processes:
+            process.join()
+        self._queues, self._processes = [], []
+        for stream in self._streams.values():
+            self._retire(stream)
+        self._streams = {}
+        self._synced_tag = None
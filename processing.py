@@ -0,0 +1,308 @@
+"""
+Vectorized signal processing of acquired samples.
+
+SignalPipeline runs every acquiring amplifier's samples through the same chain of stages:
+
+    gain normalization   samples are divided by the gain they were produced with, giving
+                         input-referred microvolts whatever the amplifier's setting
+    DC removal           a one-pole DC blocker
+    notch                a second-order IIR notch at the mains frequency
+    band-pass            second-order Butterworth high-pass and low-pass sections
+    decimation           every decimation-th sample is kept; the low-pass edge is held below
+                         the new Nyquist frequency so the kept samples are not aliased
+
+All filters are linear and time invariant, so the whole chain is folded into one state-space
+system per block length: for a (channels, n) block x and the (channels, d) filter state s,
+
+    y  = x @ Mxy + s @ Msy
+    s' = x @ Mxs + s @ Mss
+
+which processes every channel and every sample of a block in two matrix products instead of
+a Python loop over samples or channels. The matrices are derived from the impulse response
+of the cascade, once per sampling rate.
+
+The filter state is carried from block to block, and across changes: a new gain applies
+from the exact sample it was set at, and a new sampling rate rebuilds the filters while the
+state carries on, so no sample is dropped. The output of every amplifier goes into its own
+RingBuffer at the decimated rate.
+
+Requires NumPy.
+"""
+import math
+import threading
+
+import numpy as np
+
+from acquisition import DTYPE, RingBuffer
+
+
+def dc_blocker(sampling_rate, cutoff):
+    """Returns the (b, a) coefficients of a one-pole DC blocker with the given -3 dB cutoff."""
+    pole = math.exp(-2 * math.pi * cutoff / sampling_rate)
+    return (1.0, -1.0, 0.0), (1.0, -pole, 0.0)
+
+
+def biquad(kind, sampling_rate, frequency, q=1 / math.sqrt(2)):
+    """Returns the normalized (b, a) coefficients of a 'lowpass', 'highpass' or 'notch' biquad (RBJ audio EQ cookbook)."""
+    w0 = 2 * math.pi * frequency / sampling_rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * q)
+    if kind == "lowpass":
+        b = ((1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2)
+    elif kind == "highpass":
+        b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+    elif kind == "notch":
+        b = (1.0, -2 * cos_w0, 1.0)
+    else:
+        raise ValueError(f"Unknown filter kind: {kind}")
+    a0 = 1 + alpha
+    return tuple(coefficient / a0 for coefficient in b), (1.0, -2 * cos_w0 / a0, (1 - alpha) / a0)
+
+
+class FilterDesign:
+    """
+    The filter settings of a pipeline. Frequencies are in Hz; None disables a stage.
+
+    Attributes:
+        dc_cutoff (float): Cutoff of the DC blocker.
+        notch (float): Mains frequency to remove.
+        notch_q (float): Quality factor of the notch (higher is narrower).
+        band (tuple): (low, high) edges of the band-pass; either may be None.
+        decimation (int): Keep every decimation-th sample.
+    """
+    def __init__(self, dc_cutoff=0.1, notch=50.0, notch_q=30.0, band=(1.0, 40.0), decimation=4):
+        if int(decimation) != decimation or decimation < 1:
+            raise ValueError("Decimation must be a positive integer.")
+        self.dc_cutoff = dc_cutoff
+        self.notch = notch
+        self.notch_q = notch_q
+        self.band = band or (None, None)
+        self.decimation = int(decimation)
+
+    def sections(self, sampling_rate):
+        """Returns the (b, a) coefficients of every second-order section for a sampling rate, in order."""
+        nyquist = sampling_rate / 2
+        low, high = self.band
+        if self.decimation > 1:
+            # Anti-aliasing: nothing may pass above 90% of the decimated Nyquist frequency.
+            limit = 0.9 * nyquist / self.decimation
+            high = limit if high is None else min(high, limit)
+        sections = []
+        if self.dc_cutoff:
+            sections.append(dc_blocker(sampling_rate, self.dc_cutoff))
+        if self.notch and self.notch < nyquist:
+            sections.append(biquad("notch", sampling_rate, self.notch, self.notch_q))
+        if low:
+            sections.append(biquad("highpass", sampling_rate, low))
+        if high and high < nyquist:
+            sections.append(biquad("lowpass", sampling_rate, high))
+        return sections
+
+
+def _run_sections(sections, state, samples):
+    """Runs a cascade of transposed direct form II sections over scalar samples; returns outputs and the state after each sample."""
+    state = list(state)
+    outputs, states = [], []
+    for x in samples:
+        for position, ((b0, b1, b2), (_, a1, a2)) in enumerate(sections):
+            s1, s2 = state[2 * position], state[2 * position + 1]
+            y = b0 * x + s1
+            state[2 * position] = b1 * x - a1 * y + s2
+            state[2 * position + 1] = b2 * x - a2 * y
+            x = y
+        outputs.append(x)
+        states.append(list(state))
+    return outputs, states
+
+
+class BlockFilter:
+    """
+    A cascade of second-order sections applied to (channels, n) blocks as a state-space system.
+
+    Attributes:
+        sections (list): (b, a) coefficients of every section, in order.
+        length (int): Number of samples per block the matrices are built for.
+    """
+    def __init__(self, sections, length):
+        self.sections = sections
+        self.length = length
+        order = 2 * len(sections)
+        # Row j of Mxy and Mxs: the output and the final state for an impulse at sample j,
+        # which by time invariance are the impulse response started length - j samples late.
+        response, trajectory = _run_sections(sections, [0.0] * order, [1.0] + [0.0] * (length - 1))
+        self.mxy = np.zeros((length, length))
+        self.mxs = np.zeros((length, order))
+        for j in range(length):
+            self.mxy[j, j:] = response[:length - j]
+            self.mxs[j] = trajectory[length - 1 - j]
+        self.msy = np.zeros((order, length))
+        self.mss = np.zeros((order, order))
+        for i in range(order):
+            outputs, states = _run_sections(sections, [float(i == k) for k in range(order)], [0.0] * length)
+            self.msy[i] = outputs
+            self.mss[i] = states[-1]
+        self.mxy, self.mxs, self.msy, self.mss = (matrix.astype(DTYPE) for matrix in
+                                                  (self.mxy, self.mxs, self.msy, self.mss))
+
+    @property
+    def order(self):
+        return self.mss.shape[0]
+
+    def __call__(self, block, state):
+        """Filters a (channels, length) block; returns (output, new state)."""
+        return block @ self.mxy + state @ self.msy, block @ self.mxs + state @ self.mss
+
+
+class AmplifierPipeline:
+    """
+    Processes the samples of one amplifier, following its stream across restarts.
+
+    Attributes:
+        serial_number (str): Serial number of the amplifier.
+        stream (AmplifierStream): The acquisition stream being read.
+        output (RingBuffer): The processed, decimated samples.
+        processed_samples (int): Input samples processed so far, per channel.
+        lost_samples (int): Input samples overwritten in the ring before they were processed.
+    """
+    def __init__(self, design, stream, output_seconds=2.0):
+        self.design = design
+        self.serial_number = stream.serial_number
+        self.output_seconds = output_seconds
+        self.output = None
+        self.processed_samples = 0
+        self.lost_samples = 0
+        self._state = None
+        self._filter = None
+        self._phase = 0
+        self.attach(stream)
+
+    def attach(self, stream):
+        """
+        Continues with a new stream of the amplifier, rebuilding the filters for its sampling rate.
+
+        The filter state is kept if the channels are the same, so the output continues
+        without a jump; otherwise (or on the first call) processing starts from rest.
+        """
+        previous = getattr(self, "stream", None)
+        self.stream = stream
+        self._position = stream.ring.written
+        self._filter = BlockFilter(self.design.sections(stream.sampling_rate), stream.block_size)
+        channels = len(stream.channels)
+        if previous is None or previous.channels != stream.channels or self._state.shape[1] != self._filter.order:
+            self._state = np.zeros((channels, self._filter.order), dtype=DTYPE)
+        if previous is None or previous.channels != stream.channels or previous.sampling_rate != stream.sampling_rate:
+            output_rate = stream.sampling_rate // self.design.decimation
+            self.output = RingBuffer(channels, max(int(self.output_seconds * output_rate), stream.block_size))
+        self._phase = 0
+
+    def process_available(self):
+        """Processes every block in the ring beyond the pipeline's cursor. Returns the number of input samples processed."""
+        ring = self.stream.ring
+        length = self._filter.length
+        view, end, lost = ring.read(self._position)
+        start = self._position + lost
+        # Whole filter blocks only; the ring holds whole acquisition blocks, which are the same length.
+        count = (end - start) // length * length
+        if not count:
+            return 0
+        block = view[:, :count].copy()
+        if not ring.intact(start + count, count):
+            return self.process_available()
+        self._normalize(block, start)
+        filtered = np.empty_like(block)
+        state = self._state
+        for offset in range(0, count, length):
+            filtered[:, offset:offset + length], state = self._filter(block[:, offset:offset + length], state)
+        self._state = state
+        decimation = self.design.decimation
+        kept = filtered[:, self._phase::decimation]
+        self._phase = (self._phase - count) % decimation
+        if kept.shape[1]:
+            for offset in range(0, kept.shape[1], self.output.capacity):
+                self.output.write(kept[:, offset:offset + self.output.capacity])
+        self._position = start + count
+        self.lost_samples += lost
+        self.processed_samples += count
+        return count
+
+    def _normalize(self, block, start):
+        """Divides a block by the gain every sample was produced with."""
+        stream = self.stream
+        gains = stream.gains
+        if gains[-1][0] <= start:
+            block /= gains[-1][1]
+            return
+        scale = np.empty(block.shape[1], dtype=DTYPE)
+        for offset in range(block.shape[1]):
+            scale[offset] = 1.0 / stream.gain_at(start + offset)
+        block *= scale
+
+
+class SignalPipeline:
+    """
+    Runs the processing chain on every acquiring amplifier of an AcquisitionEngine.
+
+    Amplifiers are picked up as they start acquiring and dropped when they stop. When an
+    amplifier's stream restarts with a new sampling rate, the rest of the old stream is
+    processed first and the filters are then rebuilt for the new rate.
+
+    Attributes:
+        engine (AcquisitionEngine): The source of samples.
+        design (FilterDesign): The filter settings.
+        tick (float): Seconds between two processing rounds of the background thread.
+    """
+    def __init__(self, engine, design=None, tick=0.05, output_seconds=2.0):
+        self.engine = engine
+        self.design = design or FilterDesign()
+        self.tick = tick
+        self.output_seconds = output_seconds
+        self._pipelines = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def pipeline(self, serial_number):
+        """Returns the AmplifierPipeline of an amplifier, or None if it is not being processed."""
+        return self._pipelines.get(serial_number)
+
+    def output(self, serial_number):
+        """Returns the RingBuffer of processed samples of an amplifier, or None."""
+        pipeline = self._pipelines.get(serial_number)
+        return pipeline.output if pipeline is not None else None
+
+    def process(self):
+        """Runs one processing round over every acquiring amplifier. Returns the number of input samples processed."""
+        self.engine.sync()
+        processed = 0
+        pipelines = {}
+        for stream in self.engine.streams():
+            pipeline = self._pipelines.get(stream.serial_number)
+            if pipeline is None:
+                pipeline = AmplifierPipeline(self.design, stream, self.output_seconds)
+            elif pipeline.stream is not stream:
+                processed += pipeline.process_available()
+                pipeline.attach(stream)
+            processed += pipeline.process_available()
+            pipelines[stream.serial_number] = pipeline
+        self._pipelines = pipelines
+        return processed
+
+    def start(self):
+        """Starts processing in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="processing", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.process()
+            self._stop.wait(self.tick)
+
+    def stop(self):
+        """Stops the background thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,283 @@
+"""
+Append-only, memory-mapped recordings of amplifier samples.
+
+A recording is two files written strictly by appending:
+
+    <name>       magic b"EEGREC1\\0", header, UTF-8 JSON metadata, zero padding up to the next
+                 4096-byte boundary, then float32 samples, sample by sample, channels in
+                 metadata order (a (samples, channels) array)
+    <name>.idx   one uint64 per block of block_size samples: the stream sample number of the
+                 block's first sample
+
+Everything is little-endian. The header holds the format version, channel count, block size,
+data offset, metadata length and sampling rate; the metadata records the amplifier (serial
+number, model, manufacturer, sampling rate, gain), the channels by sensor serial number and
+tag, and the wall clock time the recording started.
+
+Samples are written before their index entries, so a block only counts once its index entry
+exists: a reader (or a crash) never sees a partly written block. The index also records gaps
+(blocks the acquisition dropped or the recorder lost); without gaps, finding a time is plain
+arithmetic, and with gaps a binary search over the index.
+
+Requires NumPy.
+
+    recording = Recording("A001.eegr")
+    window = recording.window(10.0, 11.0, channels=slice(0, 8))  # (1024, 8) view, nothing read yet
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"EEGREC1\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<5Id")
+PAGE_SIZE = 4096
+SAMPLE_DTYPE = np.dtype("<f4")
+INDEX_DTYPE = np.dtype("<u8")
+
+
+def recording_metadata(amplifier, channels=None):
+    """Returns the metadata of a recording of an amplifier; channels defaults to its sensors as (serial number, tag) pairs."""
+    if channels is None:
+        channels = [(sensor.serial_number, sensor.tag) for sensor in amplifier.sensors]
+    return {
+        "serial_number": amplifier.serial_number,
+        "model_string": amplifier.model_string,
+        "manufacturer": amplifier.manufacturer,
+        "sampling_rate": amplifier.sampling_rate,
+        "gain": amplifier.gain,
+        "channels": [{"serial_number": serial_number, "tag": tag} for serial_number, tag in channels],
+        "started": time.time(),
+    }
+
+
+class RecordingWriter:
+    """
+    Appends whole blocks of samples to a new recording.
+
+    Attributes:
+        filename (str): The sample file; the index is filename + ".idx".
+        metadata (dict): The recording metadata (see recording_metadata).
+        block_size (int): Samples per block.
+        blocks (int): Number of blocks written.
+    """
+    def __init__(self, filename, metadata, block_size=32):
+        self.filename = filename
+        self.metadata = metadata
+        self.channels = len(metadata["channels"])
+        self.block_size = block_size
+        self.blocks = 0
+        self._last_sample = None
+        info = json.dumps(metadata).encode()
+        data_offset = -(-(len(MAGIC) + HEADER.size + len(info)) // PAGE_SIZE) * PAGE_SIZE
+        header = MAGIC + HEADER.pack(FORMAT_VERSION, self.channels, block_size, data_offset, len(info),
+                                     metadata["sampling_rate"]) + info
+        self._data = open(filename, 'wb')
+        self._data.write(header.ljust(data_offset, b"\0"))
+        self._data.flush()
+        self._index = open(filename + ".idx", 'wb')
+
+    def append(self, samples, first_sample):
+        """
+        Appends a (samples, channels) array of whole blocks starting at stream sample number first_sample.
+
+        first_sample must be past the samples already written; skipping ahead records a gap.
+        """
+        count, channels = samples.shape
+        if channels != self.channels:
+            raise ValueError(f"Expected {self.channels} channels, got {channels}.")
+        if count % self.block_size:
+            raise ValueError(f"Samples must come in whole blocks of {self.block_size}.")
+        if self._last_sample is not None and first_sample < self._last_sample:
+            raise ValueError("Samples must be appended in order.")
+        if not count:
+            return
+        self._data.write(memoryview(np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE)).cast("B"))
+        self._data.flush()
+        starts = np.arange(first_sample, first_sample + count, self.block_size, dtype=INDEX_DTYPE)
+        self._index.write(starts.tobytes())
+        self._index.flush()
+        self.blocks += len(starts)
+        self._last_sample = first_sample + count
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+class Recording:
+    """
+    Read-only view of a recording opened with mmap.
+
+    Samples are exposed as a (samples, channels) NumPy array over the mapped file, so
+    opening a recording and slicing it read nothing but the header and the index; the
+    operating system pages in only the samples that are actually used.
+
+    Attributes:
+        metadata (dict): The recording metadata.
+        sampling_rate (int): Samples per second and channel.
+        block_size (int): Samples per block.
+        channels (list): (sensor serial number, tag) of every channel, in column order.
+        index (numpy.ndarray): Stream sample number of the first sample of every block.
+        samples (numpy.ndarray): Every recorded sample, as a (samples, channels) array.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._index_file = open(filename + ".idx", 'rb')
+        head = self._file.read(len(MAGIC) + HEADER.size)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{filename} is not a recording.")
+        version, _, self.block_size, self._data_offset, metadata_length, _ = HEADER.unpack_from(head, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{filename} has unsupported recording format version {version}.")
+        self.metadata = json.loads(self._file.read(metadata_length))
+        self.sampling_rate = self.metadata["sampling_rate"]
+        self.channels = [(channel["serial_number"], channel["tag"]) for channel in self.metadata["channels"]]
+        self.refresh()
+
+    def refresh(self):
+        """Maps the file again to take in blocks appended since it was opened (or last refreshed)."""
+        channels = len(self.channels)
+        index_size = os.fstat(self._index_file.fileno()).st_size // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize
+        if index_size:
+            self._index_mmap = mmap.mmap(self._index_file.fileno(), index_size, access=mmap.ACCESS_READ)
+            self.index = np.frombuffer(self._index_mmap, dtype=INDEX_DTYPE)
+        else:
+            self.index = np.empty(0, dtype=INDEX_DTYPE)
+        # Only blocks with an index entry are complete; a block still being written is left out.
+        blocks = min(len(self.index), (os.fstat(self._file.fileno()).st_size - self._data_offset)
+                     // (self.block_size * channels * SAMPLE_DTYPE.itemsize))
+        self.index = self.index[:blocks]
+        if blocks:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.samples = np.frombuffer(self._mmap, dtype=SAMPLE_DTYPE, count=blocks * self.block_size * channels,
+                                         offset=self._data_offset).reshape(-1, channels)
+        else:
+            self.samples = np.empty((0, channels), dtype=SAMPLE_DTYPE)
+
+    @property
+    def duration(self):
+        """Seconds from the first to the end of the last recorded sample, including gaps."""
+        if not len(self.index):
+            return 0.0
+        return (int(self.index[-1]) + self.block_size - int(self.index[0])) / self.sampling_rate
+
+    def row(self, sample):
+        """Returns the row of the first recorded sample at or after stream sample number sample."""
+        index, block_size = self.index, self.block_size
+        if not len(index):
+            return 0
+        first = int(index[0])
+        block = (sample - first) // block_size
+        # Without a gap before the block, its position is known; otherwise search the index.
+        if not 0 <= block < len(index) or int(index[block]) != first + block * block_size:
+            block = int(np.searchsorted(index, sample, side="right")) - 1
+        if block < 0:
+            return 0
+        offset = sample - int(index[block])
+        if offset >= block_size:  # the sample falls into a gap after this block
+            return (block + 1) * block_size
+        return block * block_size + offset
+
+    def channel_indices(self, tag):
+        """Returns the columns of the channels whose sensor has the given tag."""
+        return [column for column, (_, channel_tag) in enumerate(self.channels) if channel_tag == tag]
+
+    def window(self, start, stop, channels=None):
+        """
+        Returns the samples recorded from start to stop seconds after the first sample, as a (samples, channels) array.
+
+        channels selects columns: None for all, a slice, or a list of column numbers or
+        sensor serial numbers. The result is a view of the mapped file unless channels is a
+        list that is not evenly spaced, which NumPy can only gather into a copy.
+        """
+        if not len(self.index):
+            return self.samples
+        first = int(self.index[0])
+        rows = self.samples[self.row(first + round(start * self.sampling_rate)):
+                            self.row(first + round(stop * self.sampling_rate))]
+        if channels is None:
+            return rows
+        if isinstance(channels, slice):
+            return rows[:, channels]
+        serials = {serial_number: column for column, (serial_number, _) in enumerate(self.channels)}
+        columns = [serials[channel] if isinstance(channel, str) else channel for channel in channels]
+        if len(columns) < 2:
+            return rows[:, columns[0]:columns[0] + 1] if columns else rows[:, :0]
+        step = columns[1] - columns[0]
+        if step > 0 and columns == list(range(columns[0], columns[-1] + 1, step)):
+            return rows[:, columns[0]:columns[-1] + 1:step]
+        return rows[:, columns]
+
+
+class Recorder:
+    """
+    Records an amplifier's acquisition to a file in a background thread.
+
+    The recorder reads the amplifier's ring buffer through its own cursor, like a streaming
+    client, so it never holds up acquisition. Samples it could not save before the ring
+    overwrote them are recorded as a gap and counted in lost_samples. Recording ends when
+    stop() is called or when the amplifier stops acquiring or its stream restarts.
+
+    Attributes:
+        filename (str): The recording file.
+        lost_samples (int): Samples lost because the recorder fell a whole ring behind.
+    """
+    def __init__(self, engine, serial_number, filename, poll=None):
+        self.engine = engine
+        self.serial_number = serial_number
+        self.filename = filename
+        self.lost_samples = 0
+        self._stream = engine.stream(serial_number)
+        if self._stream is None:
+            raise ValueError(f"Amplifier {serial_number} is not acquiring.")
+        amplifier = engine.control_system.find_amplifier(serial_number)
+        metadata = recording_metadata(amplifier, self._stream.channels)
+        metadata["sampling_rate"] = self._stream.sampling_rate
+        metadata["gain"] = self._stream.gain
+        self.writer = RecordingWriter(filename, metadata, self._stream.block_size)
+        self._poll = self._stream.block_size / self._stream.sampling_rate if poll is None else poll
+        self._position = self._stream.ring.written
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"recorder-{serial_number}", daemon=True)
+
+    def start(self):
+        """Starts recording."""
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while not self._stop.is_set() and self.engine.stream(self.serial_number) is self._stream:
+                if not self.record_available():
+                    self._stop.wait(self._poll)
+            self.record_available()
+        finally:
+            self.writer.close()
+
+    def record_available(self):
+        """Writes every sample the ring holds beyond the recorder's cursor. Returns the number of samples written."""
+        ring = self._stream.ring
+        view, end, lost = ring.read(self._position)
+        start = self._position + lost
+        if end == start:
+            return 0
+        rows = np.ascontiguousarray(view.T)
+        if not ring.intact(end, end - start):
+            # The writer lapped the copy; read again from what is still in the ring.
+            return self.record_available()
+        self.writer.append(rows, start)
+        self.lost_samples += lost
+        self._position = end
+        return end - start
+
+    def stop(self):
+        """Stops recording, saving what the ring still holds, and closes the file."""
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,73 @@
+class TrigramIndex:
+    """
+    Incrementally maintained n-gram inverted index for case-insensitive substring search.
+
+    Every distinct lower-cased value is split into overlapping n-grams, and each n-gram
+    maps to the set of values containing it. A query intersects the posting sets of its
+    own n-grams (smallest first) and only verifies the surviving candidates with a plain
+    substring test, so the cost depends on the number of matches rather than on the size
+    of the fleet. Values are indexed once per distinct string, which keeps low-cardinality
+    fields such as manufacturer and model tiny no matter how many devices share them.
+
+    Attributes:
+        n (int): The n-gram length (3 for trigrams).
+    """
+    def __init__(self, n=3):
+        self.n = n
+        self._postings = {}  # n-gram -> set of lower-cased values
+        self._keys = {}  # lower-cased value -> set of keys (serial numbers)
+
+    def _grams(self, value):
+        return {value[i:i + self.n] for i in range(len(value) - self.n + 1)}
+
+    def add(self, key, text):
+        """Indexes text under the given key."""
+        value = text.lower()
+        keys = self._keys.get(value)
+        if keys is None:
+            keys = self._keys[value] = set()
+            for gram in self._grams(value):
+                self._postings.setdefault(gram, set()).add(value)
+        keys.add(key)
+
+    def remove(self, key, text):
+        """Removes the key that was indexed under text."""
+        value = text.lower()
+        keys = self._keys.get(value)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._keys[value]
+            for gram in self._grams(value):
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard(value)
+                    if not posting:
+                        del self._postings[gram]
+
+    def clear(self):
+        """Removes every entry from the index."""
+        self._postings.clear()
+        self._keys.clear()
+
+    def search(self, query):
+        """Returns the set of keys whose text contains query, ignoring case."""
+        query = query.lower()
+        if len(query) < self.n:
+            candidates = self._keys
+        else:
+            postings = []
+            for gram in self._grams(query):
+                posting = self._postings.get(gram)
+                if not posting:
+                    return set()
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+
+        results = set()
+        for value in candidates:
+            if query in value:
+                results.update(self._keys[value])
+        return results
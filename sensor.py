@@ -10,6 +10,8 @@ class Sensor:
         next_maintenance (str): The date of the next maintenance in 'YYYY-MM-DD' format.
         tag (str): The position on the scalp (e.g., 'frontal', 'occipital').
     """
+    __slots__ = ("serial_number", "model_string", "manufacturer", "next_maintenance", "tag")
+
     def __init__(self, serial_number, model_string, manufacturer, next_maintenance, tag):
         self.serial_number = serial_number
         self.model_string = model_string
@@ -17,5 +19,12 @@ class Sensor:
         self.next_maintenance = next_maintenance
         self.tag = tag  # position on the scalp
 
+    def __setstate__(self, state):
+        # Accepts both slot state and the __dict__ state of snapshots pickled before __slots__.
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
         return f"Sensor {self.serial_number} ({self.tag}) - Model: {self.model_string}, Manufacturer: {self.manufacturer}, Next Maintenance: {self.next_maintenance}"
@@ -0,0 +1,84 @@
+import json
+
+
+def amplifier_to_dict(amp):
+    return {
+        "serial_number": amp.serial_number,
+        "model_string": amp.model_string,
+        "manufacturer": amp.manufacturer,
+        "next_maintenance": amp.next_maintenance,
+        "sampling_rate": amp.sampling_rate,
+        "gain": amp.gain,
+        "status": "On" if amp.is_on else "Off",
+        "sensors": [sensor.serial_number for sensor in amp.sensors]
+    }
+
+
+def sensor_to_dict(sensor):
+    return {
+        "serial_number": sensor.serial_number,
+        "model_string": sensor.model_string,
+        "manufacturer": sensor.manufacturer,
+        "next_maintenance": sensor.next_maintenance,
+        "tag": sensor.tag
+    }
+
+
+# The cache is never swept while it holds fewer fragments than this.
+SWEEP_MINIMUM = 1024
+
+
+class FragmentCache:
+    """
+    Caches the JSON text of every amplifier, keyed by serial number and amplifier version.
+
+    An amplifier is serialized again only after its version has changed, so a listing of
+    an unchanged fleet just joins cached strings. The cache is dropped whenever the control
+    system loads a new state (its state_epoch changes), because versions restart there.
+    Fragments of amplifiers removed in any other way (bulk changes, a replayed journal, another
+    API process sharing the database) are swept once the cache has doubled since the last sweep.
+
+    Attributes:
+        control_system (EEGControlSystem): The system whose amplifiers are serialized.
+    """
+    def __init__(self, control_system):
+        self.control_system = control_system
+        self._epoch = control_system.state_epoch
+        self._fragments = {}  # serial number -> (version, JSON text)
+        self._sweep_at = SWEEP_MINIMUM
+
+    def etag(self, variant=""):
+        """Returns an ETag that changes with every mutation of the fleet (optionally per representation)."""
+        tag = self.control_system.state_tag()
+        return f"{tag}-{variant}" if variant else tag
+
+    def fragment(self, amp):
+        """Returns the JSON text of an amplifier, serializing it only if it changed since the last call."""
+        if self._epoch != self.control_system.state_epoch:
+            self._fragments = {}
+            self._epoch = self.control_system.state_epoch
+        # The version is read first: if the amplifier changes while it is serialized, the
+        # fragment is stored under the old version and replaced on the next call.
+        version = amp.version
+        cached = self._fragments.get(amp.serial_number)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        text = json.dumps(amplifier_to_dict(amp))
+        self._fragments[amp.serial_number] = (version, text)
+        if len(self._fragments) > self._sweep_at:
+            self._sweep()
+        return text
+
+    def _sweep(self):
+        """Drops the fragments of amplifiers that are no longer in the fleet."""
+        amplifiers = self.control_system.amplifiers
+        for serial_number in [serial for serial in list(self._fragments) if serial not in amplifiers]:
+            self._fragments.pop(serial_number, None)
+        self._sweep_at = max(SWEEP_MINIMUM, 2 * len(self._fragments))
+
+    def discard(self, serial_number):
+        """Forgets the fragment of an amplifier that was removed."""
+        self._fragments.pop(serial_number, None)
+
+    def __len__(self):
+        return len(self._fragments)
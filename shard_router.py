@@ -0,0 +1,833 @@
+"""
+The control API over a fleet split across several shard processes.
+
+Every amplifier and sensor lives on one shard, chosen by a hash of its serial number (see
+sharding.py). The shards are ordinary control_system_asgi processes, each with its own
+EEGControlSystem, snapshot and journal; this router holds no fleet state of its own, so
+several router processes can serve the same shards. It answers the routes of
+control_system_api:
+
+- a request about one device is forwarded unchanged to that device's shard;
+- searches, listings, sensors by tag and maintenance queries go to every shard at once,
+  and the answers are merged into the order a single process gives;
+- bulk requests are split by shard, and the results put back in request order;
+- saving and loading go to every shard; the change feed merges the shards' feeds.
+
+A sensor may be attached to an amplifier on another shard. Both shards then record the
+attachment, each through a shadow of the other device: the amplifier's shard attaches a
+shadow of the sensor (its serial number and tag, for layouts and montages), and the sensor's
+shard attaches the sensor to a shadow of the amplifier, so that it still knows the sensor
+is assigned and refuses to attach it anywhere else. The sensor's shard is claimed first and
+released again if the amplifier's shard then refuses, and shadows added for an attachment
+that did not happen are removed again. Shadows are never shown: merged
+answers only keep the devices each shard is home to, and nothing switches a shadow on.
+
+Run it in front of running shards, listed in placement order:
+
+    EEG_SHARDS=http://127.0.0.1:5001,http://127.0.0.1:5002 uvicorn shard_router:app --port 5000
+
+or start shards and router together (shard i keeps its state in shards/shard-<i>):
+
+    python shard_router.py --shards 4 --routers 2 --port 5000
+
+The number and order of the shards decide where every device lives; changing them needs
+the fleet to be moved first, which the router does not do.
+"""
+import argparse
+import asyncio
+from collections import deque
+import heapq
+import json
+import os
+from urllib.parse import quote, urlencode
+
+from amplifier import Amplifier
+from api_common import (HOME_PAGE, MAX_PAGE_SIZE, SSE_KEEPALIVE, bulk_settings_targets, bulk_summary,
+                        create_http_metrics, decode_cursor, encode_cursor)
+from asgi_base import BadRequest, HTTPError, Response, Routes, handle, jsonify
+from control_system import SEARCH_FIELDS
+from sharding import REPOSITORY, ShardClient, shard_of, start_shards, stop_shards
+
+# Clients of the shards, in placement order.
+shards = [ShardClient(url.strip()) for url in os.environ.get("EEG_SHARDS", "").split(",") if url.strip()]
+
+# Counts and latencies of the router's own requests; each shard serves its own /metrics.
+http_metrics, http_requests, http_request_seconds = create_http_metrics()
+
+# Amplifiers sent per step of a streamed listing.
+LISTING_CHUNK = 1000
+
+# Response headers of a shard that are passed on with a forwarded response.
+FORWARDED_HEADERS = ("etag", "cache-control", "allow")
+
+routes = Routes()
+route = routes.route
+
+
+async def app(scope, receive, send):
+    """The ASGI 3 application."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        await handle(routes, scope, receive, send, http_requests, http_request_seconds)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if shards:
+                await send({"type": "lifespan.startup.complete"})
+            else:
+                await send({"type": "lifespan.startup.failed",
+                            "message": "Set EEG_SHARDS to the base URLs of the shards, in placement order."})
+        elif message["type"] == "lifespan.shutdown":
+            for shard in shards:
+                shard.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def home_shard(serial_number):
+    """Returns the index of the shard a device lives on."""
+    return shard_of(serial_number, len(shards))
+
+
+def device_path(serial_number):
+    return quote(serial_number, safe="")
+
+
+def target(request):
+    """Returns the path and query string of a request, to send it on as it is."""
+    path = quote(request.path)
+    return f"{path}?{request.query_string}" if request.query_string else path
+
+
+def shard_response(status, headers, body):
+    """Returns a shard's response as the router's."""
+    return Response(body, status, content_type=headers.get("content-type", "application/json"),
+                    headers=[(name, headers[name]) for name in FORWARDED_HEADERS if name in headers])
+
+
+async def forward(request, index):
+    """Sends a request on to a shard unchanged and returns the shard's response."""
+    return shard_response(*await shards[index].request(request.method, target(request), request.body or None))
+
+
+async def everywhere(method, target, body=None):
+    """Sends the same request to every shard at once. Returns [(status, body parsed as JSON)] in shard order."""
+    return await asyncio.gather(*(shard.request_json(method, target, body) for shard in shards))
+
+
+def group_by_shard(positions, serial_number_of):
+    """Groups positions by the shard of the serial number at each. Returns {shard index: [positions]}."""
+    groups = {}
+    for position in positions:
+        groups.setdefault(home_shard(serial_number_of(position)), []).append(position)
+    return groups
+
+
+def serial_of(item):
+    """Returns the serial number of a device in a request body, or None if it has none."""
+    serial_number = item.get('serial_number') if isinstance(item, dict) else None
+    return serial_number if isinstance(serial_number, str) else None
+
+
+def shadow_amplifier(serial_number):
+    """A shadow of an amplifier, for the shard of a sensor attached to it: only the serial number is real."""
+    return {"serial_number": serial_number, "model_string": "", "manufacturer": "", "next_maintenance": "",
+            "sampling_rate": 256, "gain": 1}
+
+
+def shadow_sensor(serial_number, tag):
+    """A shadow of a sensor, for the shard of the amplifier it is attached to: the serial number and tag are real."""
+    return {"serial_number": serial_number, "model_string": "", "manufacturer": "", "next_maintenance": "",
+            "tag": tag}
+
+
+class ShardListing:
+    """
+    Reads the amplifiers one shard is home to, in serial number order, one page at a time.
+
+    Attributes:
+        index (int): The shard.
+        buffer (deque): Amplifiers read and not yet taken, as dicts.
+        done (bool): True once the shard has no more pages.
+    """
+    def __init__(self, index, path, criteria, after, page_size):
+        self.index = index
+        self.path = path
+        self.criteria = criteria
+        self.page_size = page_size
+        self.buffer = deque()
+        self.cursor = encode_cursor(after) if after is not None else None
+        self.done = False
+
+    async def fill(self):
+        """Reads the next page."""
+        query = {**self.criteria, "limit": self.page_size}
+        if self.cursor is not None:
+            query["cursor"] = self.cursor
+        status, body = await shards[self.index].request_json("GET", f"{self.path}?{urlencode(query)}")
+        if status == 404:  # a search that matched nothing on this shard
+            self.done = True
+            return
+        if status != 200:
+            raise HTTPError(body.get("error", "A shard could not list its amplifiers."), status)
+        # The cursor is the last amplifier of the page, shadow or not, so the next page starts after it.
+        self.buffer.extend(amp for amp in body["amplifiers"] if home_shard(amp["serial_number"]) == self.index)
+        self.cursor = body["next_cursor"]
+        self.done = self.cursor is None
+
+
+async def merged_amplifiers(path, criteria, after, page_size):
+    """Yields the amplifiers of every shard (as dicts) in serial number order, after a serial number."""
+    listings = [ShardListing(index, path, criteria, after, page_size) for index in range(len(shards))]
+    while True:
+        # An amplifier is only next once every shard with more to read has shown what comes next on it.
+        empty = [listing for listing in listings if not listing.buffer and not listing.done]
+        if empty:
+            await asyncio.gather(*(listing.fill() for listing in empty))
+            continue
+        remaining = [listing for listing in listings if listing.buffer]
+        if not remaining:
+            return
+        yield min(remaining, key=lambda listing: listing.buffer[0]["serial_number"]).buffer.popleft()
+
+
+async def list_amplifiers_response(request, path, not_found_message=None, **criteria):
+    """Lists the amplifiers of every shard in the shapes of control_system_api.list_amplifiers_response."""
+    try:
+        after = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+        limit = request.arg('limit', type=int)
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    criteria = {name: value for name, value in criteria.items() if value is not None}
+    accept = request.headers.get("accept", "").split(",")[0].split(";")[0].strip()
+    ndjson = request.args.get('format') == 'ndjson' or accept == 'application/x-ndjson'
+
+    if limit is not None and not ndjson:
+        amplifiers = merged_amplifiers(path, criteria, after, limit + 1)
+        page = []
+        async for amplifier in amplifiers:
+            page.append(amplifier)
+            if len(page) > limit:
+                break
+        await amplifiers.aclose()
+        if not page and not_found_message and after is None:
+            return jsonify({"message": not_found_message}, 404)
+        next_cursor = encode_cursor(page[limit - 1]["serial_number"]) if len(page) > limit else None
+        return jsonify({"amplifiers": page[:limit], "next_cursor": next_cursor})
+
+    amplifiers = merged_amplifiers(path, criteria, after, MAX_PAGE_SIZE)
+    first = await anext(amplifiers, None)
+    if first is None and not_found_message and after is None:
+        await amplifiers.aclose()
+        return jsonify({"message": not_found_message}, 404)
+
+    async def chunks():
+        chunk, count, amplifier = [], 0, first
+        try:
+            while amplifier is not None:
+                chunk.append(amplifier)
+                count += 1
+                if len(chunk) == LISTING_CHUNK:
+                    yield chunk
+                    chunk = []
+                amplifier = await anext(amplifiers, None) if limit is None or count < limit else None
+            yield chunk
+        finally:
+            await amplifiers.aclose()
+
+    if ndjson:
+        async def lines():
+            async for chunk in chunks():
+                yield "".join(json.dumps(amp) + "\n" for amp in chunk).encode()
+        return Response(lines(), content_type='application/x-ndjson')
+
+    async def json_array():
+        separator = "["
+        async for chunk in chunks():
+            if chunk:
+                yield (separator + ",".join(json.dumps(amp) for amp in chunk)).encode()
+                separator = ","
+        yield b"[]" if separator == "[" else b"]"
+    return Response(json_array())
+
+
+async def assign_across_shards(assignments):
+    """
+    Attaches sensors to amplifiers on other shards, from (amplifier_serial, sensor_serial) pairs. Returns one result dict per pair.
+
+    Both devices must exist before anything changes. Each sensor's shard is claimed first, by
+    attaching the sensor to a shadow of the amplifier there, which fails if the sensor is
+    attached anywhere else. Then a shadow of the sensor is attached to the amplifier on the
+    amplifier's shard; if that fails, the claim is released. Shadows added for pairs that did
+    not end up attached are removed again.
+    """
+    results = [{"amplifier_serial": amplifier_serial, "sensor_serial": sensor_serial}
+               for amplifier_serial, sensor_serial in assignments]
+
+    # A shadow of a sensor needs its tag, from the sensor's shard.
+    async def tag_of(sensor_serial):
+        status, body = await shards[home_shard(sensor_serial)].request_json(
+            "GET", f"/api/sensors/{device_path(sensor_serial)}")
+        return body["tag"] if status == 200 else None
+
+    async def amplifier_exists(amplifier_serial):
+        status, _ = await shards[home_shard(amplifier_serial)].request_json(
+            "GET", f"/api/amplifiers/{device_path(amplifier_serial)}/layout")
+        return status == 200
+    sensor_serials = list({sensor_serial for _, sensor_serial in assignments})
+    amplifier_serials = list({amplifier_serial for amplifier_serial, _ in assignments})
+    tags, exists = await asyncio.gather(asyncio.gather(*(tag_of(serial) for serial in sensor_serials)),
+                                        asyncio.gather(*(amplifier_exists(serial) for serial in amplifier_serials)))
+    tags, exists = dict(zip(sensor_serials, tags)), dict(zip(amplifier_serials, exists))
+    found = []
+    for position, (amplifier_serial, sensor_serial) in enumerate(assignments):
+        if not exists[amplifier_serial]:
+            results[position]["error"] = "Amplifier not found."
+        elif tags[sensor_serial] is None:
+            results[position]["error"] = "Sensor not found."
+        else:
+            found.append(position)
+
+    async def attach(index, positions, shadows):
+        """Adds the shadows to a shard, then attaches the pairs there. Returns (index, positions, results, shadows added)."""
+        key = "amplifiers" if "gain" in shadows[0] else "sensors"
+        _, body = await shards[index].request_json("POST", f"/api/{key}/bulk", {key: shadows})
+        # A shadow that was there already belongs to an earlier attachment and is left alone.
+        added = [result["serial_number"] for result in body["results"] if result.get("status") == "added"]
+        status, body = await shards[index].request_json("POST", "/api/amplifiers/sensors/bulk", {"assignments": [
+            {"amplifier_serial": assignments[position][0], "sensor_serial": assignments[position][1]}
+            for position in positions]})
+        return index, positions, body["results"], added
+
+    claims = group_by_shard(found, lambda position: assignments[position][1])
+    claimed, shadow_amplifiers = [], []
+    for index, positions, claim_results, added in await asyncio.gather(*(
+            attach(index, positions, [shadow_amplifier(serial) for serial in
+                                      dict.fromkeys(assignments[position][0] for position in positions)])
+            for index, positions in claims.items())):
+        shadow_amplifiers.extend((index, serial) for serial in added)
+        for position, result in zip(positions, claim_results):
+            if "error" in result:
+                results[position]["error"] = result["error"]
+            else:
+                claimed.append(position)
+
+    attachments = group_by_shard(claimed, lambda position: assignments[position][0])
+    released, shadow_sensors = [], []
+    for index, positions, attach_results, added in await asyncio.gather(*(
+            attach(index, positions, [shadow_sensor(serial, tags[serial]) for serial in
+                                      dict.fromkeys(assignments[position][1] for position in positions)])
+            for index, positions in attachments.items())):
+        shadow_sensors.extend((index, serial) for serial in added)
+        for position, result in zip(positions, attach_results):
+            if "error" in result:
+                results[position]["error"] = result["error"]
+                released.append(assignments[position])
+            else:
+                results[position]["status"] = "attached"
+    await asyncio.gather(*(shards[home_shard(sensor_serial)].request(
+        "DELETE", f"/api/amplifiers/{device_path(amplifier_serial)}/sensors/{device_path(sensor_serial)}")
+        for amplifier_serial, sensor_serial in released))
+
+    attached = [assignments[position] for position, result in enumerate(results) if result.get("status") == "attached"]
+    kept_amplifiers = {(home_shard(sensor_serial), amplifier_serial) for amplifier_serial, sensor_serial in attached}
+    kept_sensors = {(home_shard(amplifier_serial), sensor_serial) for amplifier_serial, sensor_serial in attached}
+    await asyncio.gather(
+        *(remove_shadow_amplifier(index, serial) for index, serial in shadow_amplifiers
+          if (index, serial) not in kept_amplifiers),
+        *(shards[index].request("DELETE", f"/api/sensors/{device_path(serial)}") for index, serial in shadow_sensors
+          if (index, serial) not in kept_sensors))
+    return results
+
+
+async def remove_shadow_amplifier(index, serial_number):
+    """Removes a shadow amplifier from a shard, unless a sensor has been attached to it meanwhile."""
+    status, body = await shards[index].request_json("GET", f"/api/amplifiers/{device_path(serial_number)}/layout")
+    if status == 200 and not body["layout"]:
+        await shards[index].request("DELETE", f"/api/amplifiers/{device_path(serial_number)}")
+
+
+async def undo_montage(index, amplifier_serial, result):
+    """Reverts a montage applied on one shard, given its {"attached", "detached"} result."""
+    shard = shards[index]
+    await asyncio.gather(*(shard.request(
+        "DELETE", f"/api/amplifiers/{device_path(amplifier_serial)}/sensors/{device_path(sensor_serial)}")
+        for sensor_serial in result["attached"]))
+    if result["detached"]:
+        await shard.request("POST", "/api/amplifiers/sensors/bulk", {"assignments": [
+            {"amplifier_serial": amplifier_serial, "sensor_serial": sensor_serial}
+            for sensor_serial in result["detached"]]})
+
+
+def feed_positions(since=None, epoch=None, last_event_id=None):
+    """
+    Returns the (epoch, sequence) each shard's change feed is followed from, or None to start at the latest events.
+
+    A position across shards lists one value per shard, in shard order: since as
+    "sequence,sequence,...", epoch as "epoch,epoch,..." and a Last-Event-ID as
+    "epoch:sequence,epoch:sequence,...". Raises BadRequest for a malformed position.
+    """
+    if last_event_id:
+        pairs = [pair.partition(":") for pair in last_event_id.split(",")]
+        epochs, sequences = [epoch for epoch, _, _ in pairs], [sequence for _, _, sequence in pairs]
+    elif since:
+        sequences = since.split(",")
+        epochs = epoch.split(",") if epoch else [""] * len(sequences)
+    else:
+        return None
+    if len(sequences) != len(shards) or len(epochs) != len(shards):
+        raise BadRequest(f"A change feed position must hold one value per shard ({len(shards)}).")
+    if not all(sequence.isdigit() for sequence in sequences):
+        raise BadRequest("since must be a list of sequence numbers.")
+    return list(zip(epochs, (int(sequence) for sequence in sequences)))
+
+
+def shown(event, index):
+    """Returns False for an event of a shard about a device it only holds a shadow of."""
+    serial_number = event.get("amplifier_serial", event.get("serial_number"))
+    return serial_number is None or home_shard(serial_number) == index
+
+
+async def sse_messages(body):
+    """Yields the messages of a Server-Sent Events body as {field: value} dicts (a comment has the field "")."""
+    buffered = b""
+    try:
+        async for piece in body:
+            buffered += piece
+            *messages, buffered = buffered.split(b"\n\n")
+            for message in messages:
+                fields = {}
+                for line in message.decode().split("\n"):
+                    name, _, value = line.partition(":")
+                    fields[name] = value[1:] if value.startswith(" ") else value
+                yield fields
+    finally:
+        await body.aclose()
+
+
+# simple welcome message
+@route('/')
+async def home(request):
+    return Response(HOME_PAGE.encode(), content_type="text/html; charset=utf-8")
+
+# API Endpoint to add an amplifier, on its shard
+@route('/api/amplifiers', methods=['POST'])
+async def add_amplifier(request):
+    if serial_of(request.json) is None:
+        return jsonify({"error": "Missing parameter: 'serial_number'"}, 400)
+    return await forward(request, home_shard(serial_of(request.json)))
+
+# API Endpoint to add a sensor, on its shard
+@route('/api/sensors', methods=['POST'])
+async def add_sensor(request):
+    if serial_of(request.json) is None:
+        return jsonify({"error": "Missing parameter: 'serial_number'"}, 400)
+    return await forward(request, home_shard(serial_of(request.json)))
+
+# API Endpoints about a single amplifier or sensor, answered by its shard
+@route('/api/amplifiers/<serial_number>/gain', methods=['PUT'])
+@route('/api/amplifiers/<serial_number>/sampling_rate', methods=['PUT'])
+@route('/api/amplifiers/<serial_number>/power', methods=['POST'])
+@route('/api/amplifiers/<serial_number>/layout', methods=['GET'])
+@route('/api/sensors/<serial_number>', methods=['GET'])
+async def forward_to_device(request, serial_number):
+    return await forward(request, home_shard(serial_number))
+
+# API Endpoint to update maintenance date for a device, on its shard
+@route('/api/device/<device_type>/<serial_number>/maintenance', methods=['PUT'])
+async def update_maintenance(request, device_type, serial_number):
+    return await forward(request, home_shard(serial_number))
+
+# API Endpoint to stream the samples of an acquiring amplifier, relayed from its shard
+@route('/api/amplifiers/<serial_number>/stream', methods=['GET'])
+async def stream_amplifier(request, serial_number):
+    status, headers, body = await shards[home_shard(serial_number)].stream("GET", target(request))
+    if status != 200:
+        return shard_response(status, headers, b"".join([piece async for piece in body]))
+    return Response(body, content_type=headers.get("content-type", "application/octet-stream"),
+                    headers=[("cache-control", "no-store")])
+
+# API Endpoint to get all amplifiers, merged from every shard
+@route('/api/amplifiers', methods=['GET'])
+async def get_amplifiers(request):
+    return await list_amplifiers_response(request, "/api/amplifiers")
+
+# API Endpoint to search for amplifiers on every shard
+@route('/api/amplifiers/search', methods=['GET'])
+async def search_amplifiers(request):
+    return await list_amplifiers_response(request, "/api/amplifiers/search", "No amplifiers found.",
+                                          **{field: request.args.get(field) for field in SEARCH_FIELDS})
+
+# API Endpoint to remove an amplifier, and its shadows on the shards of its sensors
+@route('/api/amplifiers/<serial_number>', methods=['DELETE'])
+async def remove_amplifier(request, serial_number):
+    index = home_shard(serial_number)
+    status, body = await shards[index].request_json("GET", f"/api/amplifiers/{device_path(serial_number)}/layout")
+    response = await forward(request, index)
+    if status == 200:
+        # Removing a shadow detaches the sensors from it, so their shards know they are free.
+        others = {home_shard(sensor_serial) for sensor_serials in body["layout"].values()
+                  for sensor_serial in sensor_serials} - {index}
+        await asyncio.gather(*(shards[other].request("DELETE", f"/api/amplifiers/{device_path(serial_number)}")
+                               for other in others))
+    return response
+
+# API Endpoint to remove a sensor, and its shadow on the shard of the amplifier it is attached to
+@route('/api/sensors/<serial_number>', methods=['DELETE'])
+async def remove_sensor(request, serial_number):
+    index = home_shard(serial_number)
+    response = await forward(request, index)
+    if response.status == 200:
+        # Any other shard can only hold a shadow of the sensor; removing it detaches it there too.
+        await asyncio.gather(*(shard.request("DELETE", target(request))
+                               for other, shard in enumerate(shards) if other != index))
+    return response
+
+# API Endpoint to add a sensor to an amplifier, across shards if need be
+@route('/api/amplifiers/<amplifier_serial>/sensors', methods=['POST'])
+async def add_sensor_to_amplifier(request, amplifier_serial):
+    data = request.json
+    sensor_serial = data.get('sensor_serial') if isinstance(data, dict) else None
+    if not isinstance(sensor_serial, str):
+        return jsonify({"error": "Missing parameter: 'sensor_serial'"}, 400)
+    if home_shard(sensor_serial) == home_shard(amplifier_serial):
+        return await forward(request, home_shard(amplifier_serial))
+    result, = await assign_across_shards([(amplifier_serial, sensor_serial)])
+    if result.get("status") == "attached":
+        return jsonify({"message": f"Sensor {sensor_serial} added to Amplifier {amplifier_serial}."}, 201)
+    if result["error"] in ("Amplifier not found.", "Sensor not found."):
+        return jsonify({"error": result["error"]}, 404)
+    return jsonify({"error": result["error"]}, 409 if "already attached" in result["error"] else 400)
+
+# API Endpoint to remove a sensor from an amplifier, across shards if need be
+@route('/api/amplifiers/<amplifier_serial>/sensors/<sensor_serial>', methods=['DELETE'])
+async def remove_sensor_from_amplifier(request, amplifier_serial, sensor_serial):
+    response = await forward(request, home_shard(amplifier_serial))
+    if home_shard(sensor_serial) != home_shard(amplifier_serial):
+        # Released after the amplifier lets go, so the sensor is never free while still attached.
+        await shards[home_shard(sensor_serial)].request("DELETE", target(request))
+    return response
+
+# API Endpoint to list the sensors at a scalp position, merged from every shard
+@route('/api/sensors', methods=['GET'])
+async def get_sensors_by_tag(request):
+    if request.args.get('tag') is None:
+        return jsonify({"error": "Missing parameter: 'tag'"}, 400)
+    answers = await everywhere("GET", target(request))
+    for status, body in answers:
+        if status != 200:
+            return jsonify(body, status)
+    sensors = heapq.merge(*([sensor for sensor in body["sensors"] if home_shard(sensor["serial_number"]) == index]
+                            for index, (_, body) in enumerate(answers)), key=lambda sensor: sensor["serial_number"])
+    return jsonify({"sensors": list(sensors)}, 200)
+
+# API Endpoint to attach a whole montage to an amplifier, claiming the sensors of other shards first
+@route('/api/amplifiers/<serial_number>/montage', methods=['PUT'])
+async def apply_montage(request, serial_number):
+    data = request.json
+    montage = data.get('montage') if isinstance(data, dict) else None
+    if not isinstance(montage, dict):
+        return jsonify({"error": "Missing parameter: 'montage' (an object mapping tags to sensor serial numbers)"}, 400)
+    replace = bool(data.get('replace', False))
+    index = home_shard(serial_number)
+    parts = {}  # shard index -> {tag: [sensor serials]}
+    for tag, sensor_serials in montage.items():
+        for sensor_serial in [sensor_serials] if isinstance(sensor_serials, str) else sensor_serials:
+            if not isinstance(sensor_serial, str):
+                return jsonify({"error": "Sensor serial numbers must be strings."}, 400)
+            parts.setdefault(home_shard(sensor_serial), {}).setdefault(tag, []).append(sensor_serial)
+    if not replace and set(parts) <= {index}:
+        return await forward(request, index)
+
+    amplifier_path = f"/api/amplifiers/{device_path(serial_number)}"
+    status, body = await shards[index].request_json("GET", f"{amplifier_path}/layout")
+    if status != 200:
+        return jsonify(body, status)
+    others = set(parts) - {index}
+    if replace:
+        # Sensors of other shards that the montage leaves out are detached there too.
+        others |= {home_shard(sensor_serial) for sensor_serials in body["layout"].values()
+                   for sensor_serial in sensor_serials} - {index}
+
+    async def claim(other):
+        await shards[other].request("POST", "/api/amplifiers/bulk", {"amplifiers": [shadow_amplifier(serial_number)]})
+        status, body = await shards[other].request_json(
+            "PUT", f"{amplifier_path}/montage", {"montage": parts.get(other, {}), "replace": replace})
+        return other, status, body
+    claims = await asyncio.gather(*(claim(other) for other in sorted(others)))
+    errors = [body["error"] for _, status, body in claims if status != 200]
+    if not errors:
+        shadows = [shadow_sensor(sensor_serial, tag) for other in others for tag, sensor_serials in
+                   parts.get(other, {}).items() for sensor_serial in sensor_serials]
+        if shadows:
+            await shards[index].request("POST", "/api/sensors/bulk", {"sensors": shadows})
+        whole = {}
+        for part in parts.values():
+            for tag, sensor_serials in part.items():
+                whole.setdefault(tag, []).extend(sensor_serials)
+        status, body = await shards[index].request_json(
+            "PUT", f"{amplifier_path}/montage", {"montage": whole, "replace": replace})
+        if status == 200:
+            return jsonify(body, 200)
+        if status != 400:
+            errors = None
+        else:
+            errors.append(body["error"])
+    await asyncio.gather(*(undo_montage(other, serial_number, claimed)
+                           for other, claim_status, claimed in claims if claim_status == 200))
+    if errors is None:
+        return jsonify(body, status)
+    return jsonify({"error": " ".join(errors)}, 400)
+
+async def bulk_add_devices(request, key):
+    """Adds the devices of a bulk request on their shards. Returns the response."""
+    data = request.json
+    items = data.get(key, []) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": f"Missing parameter: '{key}'"}, 400)
+    results = [None] * len(items)
+
+    async def add(index, positions):
+        status, body = await shards[index].request_json("POST", request.path, {key: [items[p] for p in positions]})
+        for position, result in zip(positions, body["results"]):
+            results[position] = result
+    # Items without a serial number go to the first shard, which reports them like any API would.
+    await asyncio.gather(*(add(index, positions) for index, positions in group_by_shard(
+        range(len(items)), lambda position: serial_of(items[position]) or "").items()))
+    return jsonify(bulk_summary(results))
+
+# API Endpoint to add many amplifiers in one request, split by shard
+@route('/api/amplifiers/bulk', methods=['POST'])
+async def bulk_add_amplifiers(request):
+    return await bulk_add_devices(request, 'amplifiers')
+
+# API Endpoint to add many sensors in one request, split by shard
+@route('/api/sensors/bulk', methods=['POST'])
+async def bulk_add_sensors(request):
+    return await bulk_add_devices(request, 'sensors')
+
+# API Endpoint to attach many sensors to amplifiers in one request, across shards if need be
+@route('/api/amplifiers/sensors/bulk', methods=['POST'])
+async def bulk_assign_sensors(request):
+    try:
+        assignments = [(item['amplifier_serial'], item['sensor_serial'])
+                       for item in request.json.get('assignments', [])]
+        if not all(isinstance(serial, str) for pair in assignments for serial in pair):
+            raise TypeError("serial numbers must be strings")
+    except (AttributeError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Missing parameter: {str(e)}"}, 400)
+    results = [None] * len(assignments)
+    local = [position for position, (amplifier_serial, sensor_serial) in enumerate(assignments)
+             if home_shard(amplifier_serial) == home_shard(sensor_serial)]
+
+    async def assign(index, positions):
+        status, body = await shards[index].request_json("POST", request.path, {"assignments": [
+            {"amplifier_serial": assignments[p][0], "sensor_serial": assignments[p][1]} for p in positions]})
+        for position, result in zip(positions, body["results"]):
+            results[position] = result
+    await asyncio.gather(*(assign(index, positions) for index, positions in
+                           group_by_shard(local, lambda position: assignments[position][0]).items()))
+    across = [position for position, result in enumerate(results) if result is None]
+    for position, result in zip(across, await assign_across_shards([assignments[p] for p in across])):
+        results[position] = result
+    return jsonify(bulk_summary(results))
+
+# API Endpoint to change gain, sampling rate and/or power of many amplifiers, split by shard
+@route('/api/amplifiers/bulk/settings', methods=['PUT'])
+async def bulk_update_amplifiers(request):
+    data = request.json
+    try:
+        serial_numbers, criteria = bulk_settings_targets(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    if criteria is not None:
+        criteria = {field: criteria.get(field) for field in SEARCH_FIELDS if criteria.get(field) is not None}
+        serial_numbers = [amp["serial_number"] async for amp in
+                          merged_amplifiers("/api/amplifiers/search", criteria, None, MAX_PAGE_SIZE)]
+    # Validated here as well, so that a bad value is rejected before any shard has changed anything.
+    try:
+        if data.get('gain') is not None:
+            Amplifier.validate_gain(data['gain'])
+        if data.get('sampling_rate') is not None:
+            Amplifier.validate_sampling_rate(data['sampling_rate'])
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}, 400)
+    settings = {name: data[name] for name in ("gain", "sampling_rate", "power") if name in data}
+    results = [None] * len(serial_numbers)
+
+    async def update(index, positions):
+        status, body = await shards[index].request_json(
+            "PUT", request.path, {"serial_numbers": [serial_numbers[p] for p in positions], **settings})
+        if status != 200:
+            raise HTTPError(body["error"], status)
+        for position, result in zip(positions, body["results"]):
+            results[position] = result
+    await asyncio.gather(*(update(index, positions) for index, positions in
+                           group_by_shard(range(len(serial_numbers)), lambda position: serial_numbers[position]).items()))
+    return jsonify(bulk_summary(results))
+
+# API Endpoint to check on a command sent to an amplifier, asked of every shard (only the one that took it knows it)
+@route('/api/commands/<command_id>', methods=['GET'])
+async def get_command(request, command_id):
+    answers = await asyncio.gather(*(shard.request("GET", target(request)) for shard in shards))
+    for status, headers, body in answers:
+        if status != 404:
+            return shard_response(status, headers, body)
+    return jsonify({"error": "Command not found."}, 404)
+
+# API Endpoint to save the state of every shard; each writes its snapshot in the background (?wait=true waits for them)
+@route('/api/save', methods=['POST'])
+async def save_state(request):
+    answers = await everywhere("POST", target(request))
+    snapshots = [body.get("snapshot") for _, body in answers]
+    if any(status >= 500 for status, _ in answers):
+        return jsonify({"error": "Saving system state failed on some shards.", "snapshots": snapshots}, 500)
+    if any(status == 202 for status, _ in answers):
+        return jsonify({"message": "Saving system state in the background.", "snapshots": snapshots}, 202)
+    return jsonify({"message": "System state saved successfully.", "snapshots": snapshots}, 200)
+
+# API Endpoint to check on the latest snapshot of every shard
+@route('/api/save', methods=['GET'])
+async def save_status(request):
+    answers = await everywhere("GET", "/api/save")
+    if all(status == 404 for status, _ in answers):
+        return jsonify({"error": "No snapshot has been saved since startup."}, 404)
+    return jsonify({"snapshots": [body.get("snapshot") for _, body in answers]}, 200)
+
+# API Endpoint to load the saved state of every shard
+@route('/api/load', methods=['POST'])
+async def load_state(request):
+    answers = await everywhere("POST", "/api/load")
+    failed = [{"shard": index, "status": status, **body} for index, (status, body) in enumerate(answers) if status != 200]
+    if failed:
+        return jsonify({"error": "Loading system state failed on some shards.", "shards": failed}, 500)
+    return jsonify({"message": "System state loaded successfully."}, 200)
+
+# API Endpoint to list the devices due for maintenance, merged from every shard
+@route('/api/maintenance/due', methods=['GET'])
+async def maintenance_due(request):
+    answers = await everywhere("GET", target(request))
+    for status, body in answers:
+        if status != 200:
+            return jsonify(body, status)
+    devices = heapq.merge(*([device for device in body["devices"] if home_shard(device["serial_number"]) == index]
+                            for index, (_, body) in enumerate(answers)),
+                          key=lambda device: (device["due"], device["device_type"], device["serial_number"]))
+    return jsonify({"devices": list(devices)}, 200)
+
+# API Endpoint to get the changes of every shard after a position (?since=N,N,...&epoch=E,E,...)
+@route('/api/changes', methods=['GET'])
+async def get_changes(request):
+    positions = feed_positions(request.args.get('since'), request.args.get('epoch'))
+    limit = request.args.get('limit')
+
+    def query(index):
+        parameters = {"since": positions[index][1], "epoch": positions[index][0]} if positions else {}
+        if limit is not None:
+            parameters["limit"] = limit
+        return f"/api/changes?{urlencode(parameters)}"
+    answers = await asyncio.gather(*(shard.request_json("GET", query(index)) for index, shard in enumerate(shards)))
+    for status, body in answers:
+        if status == 400:
+            return jsonify(body, 400)
+    epoch = ",".join(body["epoch"] for _, body in answers)
+    latest = ",".join(str(body["latest"]) for _, body in answers)
+    if any(status == 410 for status, _ in answers):
+        return jsonify({"error": "The requested changes are no longer available; reload the fleet and follow from 'latest'.",
+                        "resync": True, "epoch": epoch, "latest": latest}, 410)
+    # Sequence numbers belong to a shard's own feed, so each event says which shard it came from.
+    events = [{"shard": index, **event} for index, (_, body) in enumerate(answers)
+              for event in body["events"] if shown(event, index)]
+    return jsonify({"epoch": epoch, "events": events, "next_since": ",".join(str(body["next_since"]) for _, body in answers),
+                    "latest": latest}, 200)
+
+# API Endpoint to follow the changes of every shard as one stream of Server-Sent Events
+@route('/api/changes/stream', methods=['GET'])
+async def stream_changes(request):
+    positions = feed_positions(request.args.get('since'), request.args.get('epoch'), request.headers.get('last-event-id'))
+    if positions is None:
+        # Every event id names a position on every shard, so the current ones are needed from the start.
+        answers = await everywhere("GET", "/api/changes?limit=1")
+        positions = [(body["epoch"], body["latest"]) for _, body in answers]
+    upstreams = await asyncio.gather(*(shard.stream(
+        "GET", "/api/changes/stream", [("Last-Event-ID", f"{epoch}:{sequence}")])
+        for shard, (epoch, sequence) in zip(shards, positions)))
+    for status, headers, body in upstreams:
+        if status != 200:
+            content = b"".join([piece async for piece in body])
+            for _, _, other in upstreams:
+                await other.aclose()
+            return shard_response(status, headers, content)
+
+    async def events():
+        readers = [sse_messages(body) for _, _, body in upstreams]
+        reads = {asyncio.ensure_future(anext(reader, None)): index for index, reader in enumerate(readers)}
+        try:
+            yield b"retry: 1000\n\n"
+            while True:
+                done, _ = await asyncio.wait(reads, return_when=asyncio.FIRST_COMPLETED)
+                out = []
+                for read in done:
+                    index = reads.pop(read)
+                    message = read.result()
+                    if message is None:  # the shard went away; the client reconnects from its last id
+                        return
+                    if message.get("event") == "resync":
+                        out.append(f"event: resync\ndata: {json.dumps({'shard': index, **json.loads(message['data'])})}\n\n")
+                        yield "".join(out).encode()
+                        return
+                    if message.get("event") == "change":
+                        epoch, _, sequence = message["id"].partition(":")
+                        positions[index] = (epoch, int(sequence))
+                        event = json.loads(message["data"])
+                        if shown(event, index):
+                            position = ",".join(f"{epoch}:{sequence}" for epoch, sequence in positions)
+                            out.append(f"id: {position}\nevent: change\ndata: {json.dumps({'shard': index, **event})}\n\n")
+                    elif "" in message and len(message) == 1:
+                        out.append(SSE_KEEPALIVE)
+                    reads[asyncio.ensure_future(anext(readers[index], None))] = index
+                if out:
+                    yield "".join(out).encode()
+        finally:
+            for read in reads:
+                read.cancel()
+            await asyncio.gather(*reads, return_exceptions=True)
+            for reader in readers:
+                await reader.aclose()
+    return Response(events(), content_type='text/event-stream',
+                    headers=[("cache-control", "no-store"), ("x-accel-buffering", "no")])
+
+# Metrics endpoint for Prometheus: the router's own requests (every shard serves its own /metrics)
+@route('/metrics', methods=['GET'])
+async def metrics(request):
+    return Response(http_metrics.render().encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Starts shard processes and a router in front of them.")
+    parser.add_argument("--shards", type=int, default=2, help="number of shard processes")
+    parser.add_argument("--routers", type=int, default=1, help="number of router processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000, help="port of the router; the shards take the next ones")
+    parser.add_argument("--directory", default="shards", help="shard i keeps its state in <directory>/shard-<i>")
+    args = parser.parse_args()
+
+    import uvicorn
+    processes, urls = start_shards(args.shards, os.path.abspath(args.directory), args.host, args.port + 1)
+    print(f"Shards: {', '.join(urls)}")
+    os.environ["EEG_SHARDS"] = ",".join(urls)
+    try:
+        uvicorn.run("shard_router:app", host=args.host, port=args.port, workers=args.routers, app_dir=REPOSITORY,
+                    log_level="warning")
+    finally:
+        stop_shards(processes)
+
+
+if __name__ == '__main__':
+    main()
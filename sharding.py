@@ -0,0 +1,249 @@
+"""
+Placement of devices on shards, and the plumbing between the shard router and its shards.
+
+A sharded deployment runs several ordinary control_system_asgi processes, the shards, each
+with its own EEGControlSystem, snapshot and journal in its own directory, behind the
+router in shard_router. Every amplifier and sensor lives on the shard chosen by a stable
+hash of its serial number, the same CRC-32 that ParallelAcquisition uses to pick a worker,
+so any router process finds any device without asking anyone.
+
+The router talks to each shard over HTTP/1.1 through a ShardClient, which keeps a pool of
+connections open so that forwarding a request costs no TCP handshake.
+
+    processes, urls = start_shards(4, "shards", port=5001)
+    client = ShardClient(urls[shard_of("A001", len(urls))])
+    status, headers, body = await client.request("GET", "/api/amplifiers/A001/layout")
+    stop_shards(processes)
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+import zlib
+
+from asgi_base import HTTPError
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def shard_of(serial_number, shards):
+    """Returns the index of the shard a device lives on."""
+    return zlib.crc32(serial_number.encode()) % shards
+
+
+class ShardUnavailable(HTTPError):
+    """Raised when a shard cannot be reached or breaks off a response; answered with 502."""
+    status = 502
+
+
+async def read_head(reader):
+    """Reads the status line and headers of a response. Returns (status, headers with lower-case names)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    return int(lines[0].split()[1]), headers
+
+
+async def read_body(reader, headers):
+    """Yields the body of a response in pieces, framed by its Content-Length or chunked encoding."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Skip any trailers, up to the empty line that ends the message.
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            piece = await reader.read(min(remaining, 65536))
+            if not piece:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(piece)
+            yield piece
+    else:
+        while piece := await reader.read(65536):
+            yield piece
+
+
+class ShardClient:
+    """
+    An HTTP/1.1 client for one shard, over a pool of keep-alive connections.
+
+    Connections are opened as concurrent requests need them and kept for the next request
+    when the response allows it. A request that finds its pooled connection closed by the
+    shard (the shard's keep-alive timeout ran out) is sent again on a new one.
+
+    Attributes:
+        url (str): Base URL of the shard, e.g. http://127.0.0.1:5001.
+        host (str): Host name of the shard.
+        port (int): Port of the shard.
+        max_requests (int): Number of requests sent to the shard at once; more wait for a turn. Streams do not count.
+        max_idle (int): Number of idle connections kept open.
+    """
+    def __init__(self, url, max_requests=64, max_idle=256):
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"Invalid shard URL: {url} (expected http://host:port).")
+        self.url = url.rstrip("/")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.max_requests = max_requests
+        self.max_idle = max_idle
+        self._turns = asyncio.Semaphore(max_requests)
+        self._idle = []  # (reader, writer)
+
+    async def _send(self, method, target, body, headers):
+        """Sends a request and reads the head of its response. Returns (reader, writer, status, headers)."""
+        payload = json.dumps(body).encode() if body is not None and not isinstance(body, bytes) else body
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        if payload is not None:
+            lines += ["Content-Type: application/json", f"Content-Length: {len(payload)}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode() + (payload or b"")
+        while True:
+            reused = bool(self._idle)
+            try:
+                reader, writer = self._idle.pop() if reused else await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                raise ShardUnavailable(f"Shard {self.url} is unavailable: {e}")
+            try:
+                writer.write(request)
+                status, response_headers = await read_head(reader)
+                return reader, writer, status, response_headers
+            except (OSError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if not reused:
+                    raise ShardUnavailable(f"Shard {self.url} is unavailable: {e!r}")
+
+    def _release(self, reader, writer, headers):
+        if headers.get("connection", "").lower() == "close" or len(self._idle) >= self.max_idle:
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+
+    async def request(self, method, target, body=None, headers=()):
+        """
+        Sends a request and reads the whole response. Returns (status, headers, body bytes).
+
+        body is bytes, or any other value to send as JSON; target is the path and query string.
+        """
+        async with self._turns:
+            reader, writer, status, response_headers = await self._send(method, target, body, headers)
+            try:
+                content = b"".join([piece async for piece in read_body(reader, response_headers)]
+                                   if method != "HEAD" and status not in (204, 304) else [])
+            except (OSError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                raise ShardUnavailable(f"Shard {self.url} broke off a response: {e!r}")
+            except BaseException:
+                writer.close()
+                raise
+            self._release(reader, writer, response_headers)
+        return status, response_headers, content
+
+    async def request_json(self, method, target, body=None):
+        """Sends a request and returns (status, body parsed as JSON)."""
+        status, _, content = await self.request(method, target, body)
+        try:
+            return status, json.loads(content)
+        except ValueError:
+            raise ShardUnavailable(f"Shard {self.url} answered {method} {target} with {status} and no JSON body.")
+
+    async def stream(self, method, target, headers=()):
+        """
+        Sends a request and returns (status, headers, body), where body is an async iterator of its pieces.
+
+        The connection goes back to the pool once the body has been read to the end, and is
+        closed if the iterator is closed before that.
+        """
+        reader, writer, status, response_headers = await self._send(method, target, None, headers)
+
+        async def body():
+            finished = False
+            try:
+                async for piece in read_body(reader, response_headers):
+                    yield piece
+                finished = True
+            except (OSError, asyncio.IncompleteReadError):
+                return
+            finally:
+                if finished:
+                    self._release(reader, writer, response_headers)
+                else:
+                    writer.close()
+        return status, response_headers, body()
+
+    def close(self):
+        """Closes the idle connections."""
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+def wait_until_listening(host, port, process, timeout=60):
+    """Waits until a server process accepts connections. Raises RuntimeError if it exits or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"The server on port {port} did not start.")
+            time.sleep(0.05)
+
+
+def start_shards(count, directory="shards", host="127.0.0.1", port=5001, output=None):
+    """
+    Starts count shard processes, control_system_asgi under uvicorn, on consecutive ports. Returns (processes, urls).
+
+    Shard i keeps its snapshot and journal in <directory>/shard-<i>, and loads them at start,
+    so starting the same number of shards over the same directory brings the fleet back.
+    The shards keep their fleet in memory: EEG_DATABASE is not passed on, since shards
+    sharing one database would not be shards. output is where their output goes
+    (e.g. subprocess.DEVNULL); by default, this process's.
+    """
+    environment = {name: value for name, value in os.environ.items() if name != "EEG_DATABASE"}
+    processes, urls = [], []
+    try:
+        for index in range(count):
+            shard_directory = os.path.join(directory, f"shard-{index}")
+            os.makedirs(shard_directory, exist_ok=True)
+            # The router keeps connections open for as long as it runs; the default keep-alive of 5 s would close them.
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "control_system_asgi:app", "--app-dir", REPOSITORY,
+                 "--host", host, "--port", str(port + index), "--timeout-keep-alive", "600", "--log-level", "warning",
+                 "--no-access-log"],
+                cwd=shard_directory, env=environment, stdout=output, stderr=output))
+            urls.append(f"http://{host}:{port + index}")
+        for index, process in enumerate(processes):
+            wait_until_listening(host, port + index, process)
+    except BaseException:
+        stop_shards(processes)
+        raise
+    return processes, urls
+
+
+def stop_shards(processes):
+    """Stops shard processes and waits for them to exit."""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
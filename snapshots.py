@@ -0,0 +1,179 @@
+"""
+Snapshots written in the background, and a policy that takes them automatically.
+
+EEGControlSystem.save_state_in_background takes the exclusive fleet lock only long enough
+to rotate the journal and fork. The forked child holds a copy-on-write image of the
+process at that instant, so it sees the fleet exactly as it was, with no change half made,
+while the parent goes on serving requests and mutating its own copy. The child writes the
+snapshot (temporary file, fsync, rename) and exits; a thread in the parent waits for it
+and then deletes the journal segments the snapshot covers. If the child fails, nothing is
+lost: the old snapshot and the kept segments still replay to the current state.
+
+Where fork is not available, or the fleet lives in a database that a child must not share,
+the snapshot is written synchronously instead.
+
+    snapshot = control_system.save_state_in_background()
+    snapshot.wait()
+
+    autosave = AutoSave(control_system, changes=100000, seconds=300).start()
+"""
+import gc
+import os
+import threading
+import time
+
+
+class BackgroundSnapshot:
+    """
+    A snapshot being written by a child process.
+
+    Attributes:
+        filename (str): The snapshot file.
+        snapshot_format (str): "pickle" or "columnar".
+        generation (int): Journal generation recorded in the snapshot.
+        pid (int | None): Process ID of the child, or None if the snapshot was written in this process.
+        seconds (float | None): Time from the fork until the child finished, once it has.
+        succeeded (bool | None): None while the child is running, then whether the snapshot was written.
+    """
+    def __init__(self, filename, snapshot_format, generation):
+        self.filename = filename
+        self.snapshot_format = snapshot_format
+        self.generation = generation
+        self.pid = None
+        self.seconds = None
+        self.succeeded = None
+        self._started = time.monotonic()
+        self._done = threading.Event()
+
+    @property
+    def running(self):
+        return not self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Waits for the snapshot to be finished. Returns succeeded (None if the timeout expired first)."""
+        self._done.wait(timeout)
+        return self.succeeded
+
+    def status(self):
+        """Returns the state of the snapshot as a dict, for the API."""
+        state = "running" if self.running else "saved" if self.succeeded else "failed"
+        return {"state": state, "filename": self.filename, "format": self.snapshot_format,
+                "generation": self.generation, "seconds": self.seconds}
+
+    def finish(self, succeeded):
+        """Records the outcome and wakes every waiter."""
+        self._record(succeeded)
+        self._done.set()
+
+    def _record(self, succeeded):
+        self.seconds = time.monotonic() - self._started
+        self.succeeded = succeeded
+
+
+def fork_snapshot(snapshot, write, finished):
+    """
+    Runs write() in a forked child and returns at once; finished(snapshot) is called in this process when the child exits.
+
+    The caller must hold whatever keeps the state write() reads from changing, so that
+    the fork happens between two changes. The child only runs write(): it never touches
+    a lock another thread may have held at the moment of the fork.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            # Collections would touch (and so copy) every page of the parent's objects for nothing.
+            gc.disable()
+            write()
+            status = 0
+        finally:
+            # Skip interpreter shutdown: it would flush buffers and run handlers belonging to the parent.
+            os._exit(status)
+    snapshot.pid = pid
+
+    def wait():
+        _, status = os.waitpid(pid, 0)
+        # Waiters are woken only once finished() has run, so they see its effects.
+        snapshot._record(os.waitstatus_to_exitcode(status) == 0)
+        try:
+            finished(snapshot)
+        finally:
+            snapshot._done.set()
+
+    threading.Thread(target=wait, name=f"snapshot-{pid}", daemon=True).start()
+    return snapshot
+
+
+class AutoSave:
+    """
+    Saves a control system in the background after a number of changes or an interval.
+
+    A snapshot is started once `changes` mutations have happened since the last one, or
+    once `seconds` have passed since the last one and anything has changed, whichever comes
+    first. Either may be None. The policy polls the fleet version from its own thread, so
+    it adds nothing to the mutations themselves.
+
+    Attributes:
+        changes (int | None): Mutations that trigger a snapshot.
+        seconds (float | None): Maximum age of the latest snapshot while there are changes.
+        snapshots (int): Snapshots started by the policy.
+    """
+    def __init__(self, control_system, changes=None, seconds=None, poll=0.5):
+        if changes is None and seconds is None:
+            raise ValueError("AutoSave needs a number of changes, a number of seconds, or both.")
+        self.control_system = control_system
+        self.changes = changes
+        self.seconds = seconds
+        self.poll = poll if seconds is None else min(poll, seconds)
+        self.snapshots = 0
+        self._saved = (control_system.state_epoch, control_system.fleet_version)
+        self._saved_at = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pending_changes(self):
+        """Returns the number of mutations since the last snapshot (all of them after a load)."""
+        epoch, version = self._saved
+        control_system = self.control_system
+        if control_system.state_epoch != epoch:
+            return control_system.fleet_version or 1
+        return control_system.fleet_version - version
+
+    def due(self, now=None):
+        """Returns True if the policy calls for a snapshot now."""
+        pending = self.pending_changes()
+        if not pending:
+            return False
+        if self.changes is not None and pending >= self.changes:
+            return True
+        now = time.monotonic() if now is None else now
+        return self.seconds is not None and now - self._saved_at >= self.seconds
+
+    def check(self, now=None):
+        """Starts a snapshot if one is due and none is running. Returns the BackgroundSnapshot, or None."""
+        snapshot = self.control_system.snapshot
+        if (snapshot is not None and snapshot.running) or not self.due(now):
+            return None
+        self._saved = (self.control_system.state_epoch, self.control_system.fleet_version)
+        self._saved_at = time.monotonic() if now is None else now
+        self.snapshots += 1
+        return self.control_system.save_state_in_background()
+
+    def start(self):
+        """Starts applying the policy in a background thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            self.check()
+
+    def stop(self):
+        """Stops the background thread."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,493 @@
+"""
+SQLite storage for amplifiers, sensors and sensor assignments.
+
+SQLiteRegistry keeps the fleet in a SQLite database (stdlib sqlite3, WAL mode) instead of
+in process memory. Every change is committed as it happens, so the state is durable without
+save_state, and several processes (for example API workers) can open the same database
+file and share one consistent fleet. Devices are handed out as SQLAmplifier and SQLSensor
+objects: views that behave like Amplifier and Sensor (and are instances of them). A view
+reads its whole row once, on first use, and writes every change straight through to the
+database (reading the row again afterwards), so it is meant for one operation: look the
+device up again to see what other processes have changed since.
+
+Pass a registry to EEGControlSystem to use it for the fleet:
+
+    control_system = EEGControlSystem(registry=SQLiteRegistry("amplifiers.db"))
+
+Lookups use the serial number primary keys, listings walk the primary key index, and
+substring searches run in SQL: through an FTS5 trigram index where the SQLite build has
+one, and as a LIKE scan otherwise (and for queries shorter than three characters).
+Manufacturer, model and maintenance date are indexed as well; maintenance dates are also
+stored as day ordinals so that they can be compared in SQL.
+"""
+from collections.abc import MutableMapping
+import contextlib
+import os
+import sqlite3
+import threading
+
+from amplifier import Amplifier
+from maintenance_index import maintenance_ordinal
+from sensor import Sensor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS amplifiers (
+    serial_number TEXT PRIMARY KEY,
+    model_string TEXT NOT NULL,
+    manufacturer TEXT NOT NULL,
+    next_maintenance TEXT NOT NULL,
+    maintenance_ordinal INTEGER NOT NULL,
+    sampling_rate INTEGER NOT NULL,
+    gain INTEGER NOT NULL,
+    is_on INTEGER NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sensors (
+    serial_number TEXT PRIMARY KEY,
+    model_string TEXT NOT NULL,
+    manufacturer TEXT NOT NULL,
+    next_maintenance TEXT NOT NULL,
+    maintenance_ordinal INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sensor_assignments (
+    sensor_serial TEXT PRIMARY KEY REFERENCES sensors ON DELETE CASCADE,
+    amplifier_serial TEXT NOT NULL REFERENCES amplifiers ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS amplifiers_manufacturer ON amplifiers (manufacturer);
+CREATE INDEX IF NOT EXISTS amplifiers_model_string ON amplifiers (model_string);
+CREATE INDEX IF NOT EXISTS amplifiers_next_maintenance ON amplifiers (maintenance_ordinal);
+CREATE INDEX IF NOT EXISTS amplifiers_powered ON amplifiers (is_on) WHERE is_on;
+CREATE INDEX IF NOT EXISTS sensors_next_maintenance ON sensors (maintenance_ordinal);
+CREATE INDEX IF NOT EXISTS sensors_tag ON sensors (tag);
+CREATE INDEX IF NOT EXISTS sensor_assignments_amplifier ON sensor_assignments (amplifier_serial);
+INSERT OR IGNORE INTO meta VALUES ('version', 0);
+"""
+
+# Every change to a table bumps the shared version counter, so that all processes see one ETag.
+VERSION_TRIGGERS = "".join(
+    f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} BEGIN "
+    f"UPDATE meta SET value = value + 1 WHERE key = 'version'; END;\n"
+    for table in ("amplifiers", "sensors", "sensor_assignments") for event in ("INSERT", "UPDATE", "DELETE"))
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS amplifier_search USING fts5(
+    serial_number, model_string, manufacturer, content='amplifiers', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS amplifier_search_insert AFTER INSERT ON amplifiers BEGIN
+    INSERT INTO amplifier_search (rowid, serial_number, model_string, manufacturer)
+    VALUES (new.rowid, new.serial_number, new.model_string, new.manufacturer);
+END;
+CREATE TRIGGER IF NOT EXISTS amplifier_search_delete AFTER DELETE ON amplifiers BEGIN
+    INSERT INTO amplifier_search (amplifier_search, rowid, serial_number, model_string, manufacturer)
+    VALUES ('delete', old.rowid, old.serial_number, old.model_string, old.manufacturer);
+END;
+CREATE TRIGGER IF NOT EXISTS amplifier_search_update AFTER UPDATE OF serial_number, model_string, manufacturer
+ON amplifiers BEGIN
+    INSERT INTO amplifier_search (amplifier_search, rowid, serial_number, model_string, manufacturer)
+    VALUES ('delete', old.rowid, old.serial_number, old.model_string, old.manufacturer);
+    INSERT INTO amplifier_search (rowid, serial_number, model_string, manufacturer)
+    VALUES (new.rowid, new.serial_number, new.model_string, new.manufacturer);
+END;
+"""
+
+
+# Columns of each device table, in the order of SELECT *.
+COLUMNS = {
+    "amplifiers": ("serial_number", "model_string", "manufacturer", "next_maintenance", "maintenance_ordinal",
+                   "sampling_rate", "gain", "is_on", "version"),
+    "sensors": ("serial_number", "model_string", "manufacturer", "next_maintenance", "maintenance_ordinal", "tag"),
+}
+
+
+def _column(table, column, convert=None):
+    index = COLUMNS[table].index(column)
+
+    def get(self):
+        value = self._fields()[index]
+        return value if convert is None else convert(value)
+
+    def set(self, value):
+        self._update({column: value})
+    return property(get, set)
+
+
+def _maintenance_column(table):
+    # The ordinal is kept next to the date string so that due dates can be compared in SQL.
+    get = _column(table, "next_maintenance").fget
+
+    def set(self, value):
+        self._update({"next_maintenance": value, "maintenance_ordinal": maintenance_ordinal(value)})
+    return property(get, set)
+
+
+class _SQLView:
+    """Row access shared by the views; the slots (_registry, _serial, _row) are declared by each view."""
+    __slots__ = ()
+    _table = None
+
+    def _fields(self):
+        """Returns the row of this device, reading it on first use. Raises KeyError if the device is gone."""
+        if self._row is None:
+            row = self._registry._query_one(f"SELECT * FROM {self._table} WHERE serial_number = ?", (self._serial,))
+            if row is None:
+                raise KeyError(self._serial)
+            self._row = row
+        return self._row
+
+    def _update(self, columns, extra=""):
+        """Writes columns (plus any extra SQL assignments) to the row. Raises KeyError if the device is gone."""
+        assignments = ", ".join([f"{column} = ?" for column in columns] + ([extra] if extra else []))
+        if not self._registry._execute(f"UPDATE {self._table} SET {assignments} WHERE serial_number = ?",
+                                       (*columns.values(), self._serial)):
+            raise KeyError(self._serial)
+        # Read again on next use: the statement may change more than it was given (the version).
+        self._row = None
+
+
+class SQLSensor(_SQLView, Sensor):
+    """A Sensor whose fields live in a row of a SQLiteRegistry."""
+    __slots__ = ("_registry", "_serial", "_row")
+    _table = "sensors"
+
+    def __init__(self, registry, serial_number, row=None):
+        self._registry = registry
+        self._serial = serial_number
+        self._row = row
+
+    @property
+    def serial_number(self):
+        return self._serial
+
+    model_string = _column("sensors", "model_string")
+    manufacturer = _column("sensors", "manufacturer")
+    next_maintenance = _maintenance_column("sensors")
+    tag = _column("sensors", "tag")
+
+    def __eq__(self, other):
+        if isinstance(other, SQLSensor):
+            return self._registry is other._registry and self._serial == other._serial
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((id(self._registry), self._serial))
+
+    def __reduce__(self):
+        # Pickles as a plain Sensor, so snapshots do not depend on the database.
+        return Sensor, (self.serial_number, self.model_string, self.manufacturer, self.next_maintenance, self.tag)
+
+
+class SQLAmplifier(_SQLView, Amplifier):
+    """An Amplifier whose fields and sensor list live in the tables of a SQLiteRegistry."""
+    __slots__ = ("_registry", "_serial", "_row")
+    _table = "amplifiers"
+
+    def __init__(self, registry, serial_number, row=None):
+        self._registry = registry
+        self._serial = serial_number
+        self._row = row
+
+    @property
+    def serial_number(self):
+        return self._serial
+
+    model_string = _column("amplifiers", "model_string")
+    manufacturer = _column("amplifiers", "manufacturer")
+    next_maintenance = _maintenance_column("amplifiers")
+    sampling_rate = _column("amplifiers", "sampling_rate")
+    gain = _column("amplifiers", "gain")
+    is_on = _column("amplifiers", "is_on", bool)
+    version = _column("amplifiers", "version")
+
+    def _set(self, **columns):
+        # The version is bumped by the same statement that writes the fields, so that processes
+        # changing one amplifier at once never lose a bump.
+        self._update(columns, "version = version + 1")
+
+    def set_gain(self, gain):
+        self.validate_gain(gain)
+        self._set(gain=gain)
+
+    def set_sampling_rate(self, sampling_rate):
+        self.validate_sampling_rate(sampling_rate)
+        self._set(sampling_rate=sampling_rate)
+
+    def set_next_maintenance(self, next_maintenance):
+        self._set(next_maintenance=next_maintenance, maintenance_ordinal=maintenance_ordinal(next_maintenance))
+
+    def power_on(self):
+        self._set(is_on=True)
+
+    def power_off(self):
+        self._set(is_on=False)
+
+    @property
+    def sensors(self):
+        rows = self._registry._query(
+            "SELECT sensors.* FROM sensor_assignments JOIN sensors ON serial_number = sensor_serial "
+            "WHERE amplifier_serial = ? ORDER BY sensor_assignments.rowid", (self._serial,))
+        return [SQLSensor(self._registry, row[0], row) for row in rows]
+
+    def add_sensor(self, sensor):
+        with self._registry.batch():
+            self._registry.sensor_owner[sensor.serial_number] = self._serial
+            self._set()
+
+    def remove_sensor(self, sensor):
+        with self._registry.batch():
+            self._registry._execute("DELETE FROM sensor_assignments WHERE sensor_serial = ? AND amplifier_serial = ?",
+                                    (sensor.serial_number, self._serial))
+            self._set()
+
+    def __eq__(self, other):
+        if isinstance(other, SQLAmplifier):
+            return self._registry is other._registry and self._serial == other._serial
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((id(self._registry), self._serial))
+
+    def __reduce__(self):
+        # Pickles as a plain Amplifier, so snapshots do not depend on the database.
+        return Amplifier, (self.serial_number, self.model_string, self.manufacturer, self.next_maintenance,
+                           self.sampling_rate, self.gain), {"sensors": self.sensors, "is_on": self.is_on,
+                                                            "version": self.version}
+
+
+class _SQLTable(MutableMapping):
+    """Serial-number-keyed mapping over one device table of a SQLiteRegistry."""
+    def __init__(self, registry, table, view_class, store):
+        self._registry = registry
+        self._table = table
+        self._view_class = view_class
+        self._store = store
+
+    def __getitem__(self, serial_number):
+        row = self._registry._query_one(f"SELECT * FROM {self._table} WHERE serial_number = ?", (serial_number,))
+        if row is None:
+            raise KeyError(serial_number)
+        return self._view_class(self._registry, serial_number, row)
+
+    def __setitem__(self, serial_number, device):
+        if isinstance(device, self._view_class) and device._registry is self._registry \
+                and device._serial == serial_number:
+            return
+        self._store(device)
+
+    def __delitem__(self, serial_number):
+        if not self._registry._execute(f"DELETE FROM {self._table} WHERE serial_number = ?", (serial_number,)):
+            raise KeyError(serial_number)
+
+    def __iter__(self):
+        return (serial for serial, in self._registry._query(
+            f"SELECT serial_number FROM {self._table} ORDER BY serial_number"))
+
+    def __len__(self):
+        return self._registry._query_one(f"SELECT COUNT(*) FROM {self._table}")[0]
+
+    def __contains__(self, serial_number):
+        return self._registry._query_one(
+            f"SELECT 1 FROM {self._table} WHERE serial_number = ?", (serial_number,)) is not None
+
+
+class _SQLSensorOwnerTable(MutableMapping):
+    """Sensor serial -> amplifier serial mapping over the sensor_assignments table."""
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getitem__(self, sensor_serial):
+        row = self._registry._query_one(
+            "SELECT amplifier_serial FROM sensor_assignments WHERE sensor_serial = ?", (sensor_serial,))
+        if row is None:
+            raise KeyError(sensor_serial)
+        return row[0]
+
+    def __setitem__(self, sensor_serial, amplifier_serial):
+        """Attaches an unassigned sensor. Raises ValueError if it is attached to another amplifier, KeyError if either device is gone."""
+        try:
+            self._registry._execute("INSERT INTO sensor_assignments (sensor_serial, amplifier_serial) VALUES (?, ?)",
+                                    (sensor_serial, amplifier_serial))
+        except sqlite3.IntegrityError:
+            # Another process may have attached the sensor (or removed a device) since the caller checked.
+            owner = self.get(sensor_serial)
+            if owner is None:
+                raise KeyError(sensor_serial)
+            raise ValueError(f"Sensor {sensor_serial} is already attached to Amplifier {owner}.")
+
+    def __delitem__(self, sensor_serial):
+        if not self._registry._execute("DELETE FROM sensor_assignments WHERE sensor_serial = ?", (sensor_serial,)):
+            raise KeyError(sensor_serial)
+
+    def __iter__(self):
+        return (serial for serial, in self._registry._query("SELECT sensor_serial FROM sensor_assignments"))
+
+    def __len__(self):
+        return self._registry._query_one("SELECT COUNT(*) FROM sensor_assignments")[0]
+
+
+class SQLiteRegistry:
+    """
+    SQLite storage for amplifiers and sensors.
+
+    Attributes:
+        filename (str): Path of the database file.
+        amplifiers (MutableMapping): Serial number -> SQLAmplifier.
+        sensors (MutableMapping): Serial number -> SQLSensor.
+        sensor_owner (MutableMapping): Sensor serial number -> amplifier serial number.
+        full_text_search (bool): True if substring searches use an FTS5 trigram index.
+    """
+    def __init__(self, filename="amplifier_repository.db"):
+        self.filename = filename
+        # One connection is shared by the threads of a process; the lock keeps statements
+        # and transactions of different threads from interleaving on it.
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._connection = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.execute("PRAGMA busy_timeout = 5000")
+        self._connection.executescript(SCHEMA + VERSION_TRIGGERS)
+        self._connection.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)", (os.urandom(6).hex(),))
+        try:
+            self._connection.executescript(SEARCH_SCHEMA)
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or without its trigram tokenizer.
+            self.full_text_search = False
+        self.amplifiers = _SQLTable(self, "amplifiers", SQLAmplifier, self._store_amplifier)
+        self.sensors = _SQLTable(self, "sensors", SQLSensor, self._store_sensor)
+        self.sensor_owner = _SQLSensorOwnerTable(self)
+
+    def _execute(self, sql, parameters=()):
+        """Runs one statement and returns the number of rows it changed."""
+        with self._lock:
+            return self._connection.execute(sql, parameters).rowcount
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _query_one(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchone()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Runs every statement inside the block in one transaction, committed at the end.
+
+        A batch inside another one is a savepoint: if it raises, only its own statements are
+        rolled back, and the outer batch carries on.
+        """
+        with self._lock:
+            self._batch_depth += 1
+            savepoint = f"batch_{self._batch_depth}"
+            self._connection.execute("BEGIN IMMEDIATE" if self._batch_depth == 1 else f"SAVEPOINT {savepoint}")
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth:
+                    self._connection.execute(f"ROLLBACK TO {savepoint}")
+                    self._connection.execute(f"RELEASE {savepoint}")
+                else:
+                    self._connection.execute("ROLLBACK")
+                raise
+            self._batch_depth -= 1
+            self._connection.execute(f"RELEASE {savepoint}" if self._batch_depth else "COMMIT")
+
+    def clear(self):
+        """Removes every device from the database. The version counter keeps counting."""
+        with self.batch():
+            for table in ("sensor_assignments", "amplifiers", "sensors"):
+                self._connection.execute(f"DELETE FROM {table}")
+            self._connection.execute("UPDATE meta SET value = ? WHERE key = 'epoch'", (os.urandom(6).hex(),))
+
+    # Devices are written with plain INSERTs: storing a serial number that another process has
+    # added meanwhile raises ValueError, as adding it twice in one process does.
+
+    def _store_amplifier(self, amplifier):
+        with self.batch():
+            try:
+                # A stored amplifier starts from the shared version counter, so a serial number that is
+                # removed and added again never reuses a version another process may have cached.
+                self._connection.execute(
+                    "INSERT INTO amplifiers VALUES (?, ?, ?, ?, ?, ?, ?, ?, (SELECT value + 1 FROM meta WHERE key = 'version'))",
+                    (amplifier.serial_number, amplifier.model_string, amplifier.manufacturer, amplifier.next_maintenance,
+                     maintenance_ordinal(amplifier.next_maintenance), amplifier.sampling_rate, amplifier.gain,
+                     bool(amplifier.is_on)))
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Amplifier with serial number {amplifier.serial_number} already exists.")
+            for sensor in amplifier.sensors:
+                self.sensor_owner[sensor.serial_number] = amplifier.serial_number
+
+    def _store_sensor(self, sensor):
+        try:
+            self._execute("INSERT INTO sensors VALUES (?, ?, ?, ?, ?, ?)",
+                          (sensor.serial_number, sensor.model_string, sensor.manufacturer, sensor.next_maintenance,
+                           maintenance_ordinal(sensor.next_maintenance), sensor.tag))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Sensor with serial number {sensor.serial_number} already exists.")
+
+    def matching_serials(self, serial_number=None, model_string=None, manufacturer=None):
+        """Returns the set of amplifier serial numbers matching every given substring, or None if no criterion is given."""
+        criteria = {"serial_number": serial_number, "model_string": model_string, "manufacturer": manufacturer}
+        conditions, parameters, phrases = [], [], []
+        for field, query in criteria.items():
+            if not query:
+                continue
+            if self.full_text_search and len(query) >= 3:
+                phrases.append(f'{field} : "{query.replace(chr(34), chr(34) * 2)}"')
+            else:
+                escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                conditions.append(f"{field} LIKE ? ESCAPE '\\'")
+                parameters.append(f"%{escaped}%")
+        if not conditions and not phrases:
+            return None
+        if phrases:
+            conditions.append("rowid IN (SELECT rowid FROM amplifier_search WHERE amplifier_search MATCH ?)")
+            parameters.append(" AND ".join(phrases))
+        return {serial for serial, in self._query(
+            f"SELECT serial_number FROM amplifiers WHERE {' AND '.join(conditions)}", parameters)}
+
+    def serials_after(self, after, limit):
+        """Returns up to limit amplifier serial numbers in order, starting after the given one (or from the first)."""
+        if after is None:
+            rows = self._query("SELECT serial_number FROM amplifiers ORDER BY serial_number LIMIT ?", (limit,))
+        else:
+            rows = self._query("SELECT serial_number FROM amplifiers WHERE serial_number > ? "
+                               "ORDER BY serial_number LIMIT ?", (after, limit))
+        return [serial for serial, in rows]
+
+    def maintenance_due_before(self, ordinal):
+        """Returns (ordinal, device type, serial number) for devices due before a day ordinal, soonest first."""
+        return self._query(
+            "SELECT maintenance_ordinal, 'amplifier', serial_number FROM amplifiers "
+            "WHERE maintenance_ordinal > 0 AND maintenance_ordinal < ?1 UNION ALL "
+            "SELECT maintenance_ordinal, 'sensor', serial_number FROM sensors "
+            "WHERE maintenance_ordinal > 0 AND maintenance_ordinal < ?1 ORDER BY 1, 2, 3", (ordinal,))
+
+    def sensor_serials_by_tag(self, tag, assigned=None):
+        """Returns the serial numbers of the sensors with a tag, in order; assigned=True/False keeps only attached/unattached ones."""
+        condition = {None: "", True: " AND sensor_serial IS NOT NULL", False: " AND sensor_serial IS NULL"}[assigned]
+        return [serial for serial, in self._query(
+            "SELECT serial_number FROM sensors LEFT JOIN sensor_assignments ON sensor_serial = serial_number "
+            f"WHERE tag = ?{condition} ORDER BY serial_number", (tag,))]
+
+    def powered_count(self):
+        """Returns the number of powered-on amplifiers (counted over a partial index of them)."""
+        return self._query_one("SELECT COUNT(*) FROM amplifiers WHERE is_on")[0]
+
+    def state_tag(self):
+        """Returns a string that changes with every committed change, in any process sharing the database."""
+        return "-".join(str(value) for value, in self._query(
+            "SELECT value FROM meta WHERE key IN ('epoch', 'version') ORDER BY key"))
+
+    def close(self):
+        """Closes the database connection."""
+        self._connection.close()
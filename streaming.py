@@ -0,0 +1,151 @@
+"""
+Binary sample streaming from an AcquisitionEngine.
+
+A stream starts with a header and continues with frames, all little-endian:
+
+    header: b"EEGS", uint16 format version, uint32 JSON length, then UTF-8 JSON
+            {"serial_number", "sampling_rate", "decimation", "channels": [{"serial_number", "tag"}, ...]}
+    frame:  uint64 first sample, uint32 sample count n, uint32 lost samples,
+            then n * len(channels) float32 values, sample by sample, channels in header order
+
+Sample numbers count at the amplifier's sampling rate from the start of its stream; with
+decimation k only samples whose number is a multiple of k are sent. Lost samples are
+samples the acquisition overwrote before this client read them.
+
+Every client reads the amplifier's ring buffer through its own cursor and is never waited
+for: a slow client falls behind, loses the oldest samples and is told so in the next frame,
+while acquisition and other clients carry on.
+"""
+import asyncio
+import json
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"EEGS"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHI")
+FRAME = struct.Struct("<QII")
+SAMPLE_DTYPE = np.dtype("<f4")
+
+
+def encode_header(stream, decimation):
+    """Returns the header bytes for a stream of an AmplifierStream."""
+    info = json.dumps({
+        "serial_number": stream.serial_number,
+        "sampling_rate": stream.sampling_rate,
+        "decimation": decimation,
+        "channels": [{"serial_number": serial_number, "tag": tag} for serial_number, tag in stream.channels],
+    }).encode()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, len(info)) + info
+
+
+def decode_header(data):
+    """Returns (header dict, header size in bytes) from the start of a stream, or None if data holds no whole header."""
+    if len(data) < HEADER.size:
+        return None
+    magic, version, length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not an EEG sample stream.")
+    if len(data) < HEADER.size + length:
+        return None
+    return json.loads(data[HEADER.size:HEADER.size + length]), HEADER.size + length
+
+
+def decode_frame(data, channels, offset=0):
+    """Returns (first sample, (n, channels) samples, lost, offset after the frame), or None if data holds no whole frame."""
+    if len(data) - offset < FRAME.size:
+        return None
+    first, count, lost = FRAME.unpack_from(data, offset)
+    end = offset + FRAME.size + count * channels * SAMPLE_DTYPE.itemsize
+    if len(data) < end:
+        return None
+    samples = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=count * channels, offset=offset + FRAME.size)
+    return first, samples.reshape(count, channels), lost, end
+
+
+class StreamReader:
+    """
+    One client's cursor over an amplifier's ring buffer.
+
+    Attributes:
+        stream (AmplifierStream): The stream being read.
+        decimation (int): Only every decimation-th sample is sent.
+        position (int): Number of the next sample to read.
+        lost (int): Total number of samples overwritten before they could be read.
+    """
+    def __init__(self, stream, decimation=1, max_frame_samples=1024):
+        if decimation < 1:
+            raise ValueError("Decimation must be a positive integer.")
+        self.stream = stream
+        self.decimation = decimation
+        self.max_frame_samples = max_frame_samples
+        # Start at the newest sample, aligned to the decimation grid.
+        self.position = -(-stream.ring.written // decimation) * decimation
+        self.lost = 0
+
+    def read_frame(self):
+        """Returns the next frame as bytes, or None if no new samples have been written."""
+        ring = self.stream.ring
+        while True:
+            view, end, lost = ring.read(self.position, self.max_frame_samples * self.decimation)
+            start = self.position + lost
+            if lost:
+                # Skip to the next sample on the decimation grid.
+                skip = -start % self.decimation
+                view, start, lost = view[:, skip:], start + skip, lost + skip
+            view = view[:, ::self.decimation]
+            channels, count = view.shape
+            if not count and not lost:
+                return None
+            # The samples are interleaved straight into the frame. The copy is only valid if
+            # the writer did not lap the view meanwhile; otherwise the frame is read again.
+            frame = bytearray(FRAME.size + count * channels * SAMPLE_DTYPE.itemsize)
+            np.copyto(np.frombuffer(frame, dtype=SAMPLE_DTYPE, offset=FRAME.size).reshape(count, channels), view.T)
+            if ring.intact(end, end - start):
+                break
+        FRAME.pack_into(frame, 0, start, count, lost)
+        self.position = start + count * self.decimation
+        self.lost += lost
+        return bytes(frame)
+
+
+def _stream_items(engine, serial_number, decimation, max_frame_samples, poll, duration):
+    """Yields the header, then frames as bytes, with the number of seconds to wait (a float) whenever no frame is ready."""
+    stream = engine.stream(serial_number)
+    if stream is None:
+        return
+    reader = StreamReader(stream, decimation, max_frame_samples)
+    poll = stream.block_size / stream.sampling_rate if poll is None else poll
+    deadline = None if duration is None else time.monotonic() + duration
+    yield encode_header(stream, decimation)
+    while engine.stream(serial_number) is stream:
+        if deadline is not None and time.monotonic() >= deadline:
+            return
+        frame = reader.read_frame()
+        yield poll if frame is None else frame
+
+
+def stream_samples(engine, serial_number, decimation=1, max_frame_samples=1024, poll=None, duration=None):
+    """
+    Yields the header and then frames of an amplifier's samples as they are produced.
+
+    Ends when the amplifier stops acquiring or its stream restarts with a new shape
+    (clients reconnect to get the new header), or after duration seconds if given.
+    Yields nothing if the amplifier is not acquiring.
+    """
+    for item in _stream_items(engine, serial_number, decimation, max_frame_samples, poll, duration):
+        if isinstance(item, bytes):
+            yield item
+        else:
+            time.sleep(item)
+
+
+async def stream_samples_async(engine, serial_number, decimation=1, max_frame_samples=1024, poll=None, duration=None):
+    """stream_samples for an event loop: waits for new samples with asyncio.sleep instead of blocking its thread."""
+    for item in _stream_items(engine, serial_number, decimation, max_frame_samples, poll, duration):
+        if isinstance(item, bytes):
+            yield item
+        else:
+            await asyncio.sleep(item)
@@ -0,0 +1,34 @@
+"""Devices and fleets shared by the tests."""
+from amplifier import Amplifier
+from sensor import Sensor
+
+
+def make_amplifier(serial_number, sampling_rate=256, gain=10, next_maintenance="01-01-2030"):
+    return Amplifier(serial_number, "eego mini", "ANT Neuro", next_maintenance, sampling_rate, gain)
+
+
+def make_sensor(serial_number, tag="frontal", next_maintenance="01-01-2030"):
+    return Sensor(serial_number, "Ag/AgCl", "ANT Neuro", next_maintenance, tag)
+
+
+def populate(control_system, amplifiers=3, sensors_per_amplifier=2):
+    """Adds amplifiers A0..An-1, each with its sensors S<i>-<j> attached, and powers the even ones on."""
+    for i in range(amplifiers):
+        control_system.add_amplifier(make_amplifier(f"A{i}", gain=i + 1))
+        for j in range(sensors_per_amplifier):
+            control_system.add_sensor(make_sensor(f"S{i}-{j}", tag=f"T{j}"))
+            control_system.add_sensor_to_amplifier(f"A{i}", f"S{i}-{j}")
+        if i % 2 == 0:
+            control_system.set_power(f"A{i}", True)
+    return control_system
+
+
+def fleet_state(control_system):
+    """Returns everything a snapshot must keep, in plain values, for comparing two control systems."""
+    return (
+        sorted((amp.serial_number, amp.model_string, amp.manufacturer, amp.next_maintenance, amp.sampling_rate,
+                amp.gain, bool(amp.is_on), [sensor.serial_number for sensor in amp.sensors])
+               for amp in control_system.list_amplifiers()),
+        sorted((sensor.serial_number, sensor.model_string, sensor.manufacturer, sensor.next_maintenance, sensor.tag)
+               for sensor in control_system.sensors.values()),
+    )
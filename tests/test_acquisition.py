@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from acquisition import AcquisitionEngine, RingBuffer
+from control_system import EEGControlSystem
+from tests.conftest import make_amplifier, populate
+
+
+def test_ring_hands_out_the_latest_samples_contiguously():
+    ring = RingBuffer(channels=2, capacity=8)
+    for start in range(0, 12, 3):
+        block = np.arange(start, start + 3, dtype=np.float32)
+        ring.write(np.vstack([block, -block]))
+    view, end = ring.latest(5)
+    assert end == 12
+    assert view.tolist() == [[7, 8, 9, 10, 11], [-7, -8, -9, -10, -11]]
+    # Samples 0..3 were overwritten: a reader that was behind is told how many it missed.
+    view, end, lost = ring.read(2)
+    assert (lost, view[0].tolist()) == (2, list(range(4, 12)))
+    assert ring.intact(12, 8) and not ring.intact(11, 8)
+    with pytest.raises(ValueError):
+        ring.write(np.zeros((2, 9), dtype=np.float32))
+
+
+@pytest.fixture
+def engine():
+    control_system = populate(EEGControlSystem(), amplifiers=3)
+    control_system.add_amplifier(make_amplifier("EMPTY"))
+    control_system.set_power("EMPTY", True)
+    return AcquisitionEngine(control_system, block_size=32, clock=lambda: 0.0)
+
+
+def test_only_powered_amplifiers_with_sensors_acquire(engine):
+    engine.sync(now=0.0)
+    # A0 and A2 are on; A1 is off and EMPTY has no sensors.
+    assert sorted(stream.serial_number for stream in engine.streams()) == ["A0", "A2"]
+    assert [channel for channel, _ in engine.stream("A0").channels] == ["S0-0", "S0-1"]
+
+    engine.control_system.set_power("A0", False)
+    engine.control_system.set_power("A1", True)
+    engine.sync(now=0.0)
+    assert sorted(stream.serial_number for stream in engine.streams()) == ["A1", "A2"]
+
+
+def test_blocks_are_produced_on_the_clock_and_scaled_by_gain(engine):
+    engine.sync(now=0.0)
+    stream = engine.stream("A0")
+    # A0 and A2 each owe 64 samples (two blocks) after a quarter of a second at 256 Hz.
+    assert engine.step(now=0.25) == 4
+    assert stream.ring.written == 64
+    first = stream.ring.latest(64)[0].copy()
+
+    engine.control_system.set_gain("A0", 3)
+    engine.step(now=0.5)
+    # The gain applies from the next block on, to the same stream: A0's gain was 1.
+    assert engine.stream("A0") is stream and stream.gain == 3
+    assert stream.ring.written == 128
+    expected = 3 * np.roll(engine._table(2, 256), -(stream._offset + 64), axis=1)[:, :64]
+    assert np.allclose(stream.ring.latest(64)[0], expected)
+    assert np.allclose(stream.ring.latest(128)[0][:, :64], first)
+
+
+def test_an_engine_that_falls_behind_drops_blocks(engine):
+    engine.sync(now=0.0)
+    engine.step(now=10.0)
+    stream = engine.stream("A0")
+    # max_lag=0.25 s at 256 Hz allows 3 blocks of 32 samples, the rest of the 80 due blocks are dropped.
+    assert (stream.produced_blocks, stream.dropped_blocks) == (3, 77)
+    assert engine.stats()["dropped_blocks"] == 2 * 77
+
+
+def test_changing_sampling_rate_or_sensors_restarts_the_stream(engine):
+    engine.sync(now=0.0)
+    stream = engine.stream("A0")
+    engine.control_system.set_sampling_rate("A0", 512)
+    engine.sync(now=1.0)
+    restarted = engine.stream("A0")
+    assert restarted is not stream and restarted.sampling_rate == 512 and restarted.started == 1.0
+
+    engine.control_system.remove_sensor_from_amplifier("A0", "S0-1")
+    engine.sync(now=2.0)
+    assert [channel for channel, _ in engine.stream("A0").channels] == ["S0-0"]
+    engine.control_system.remove_amplifier("A0")
+    engine.sync(now=3.0)
+    assert engine.stream("A0") is None
@@ -0,0 +1,200 @@
+import asyncio
+import functools
+import importlib
+import json
+import os
+
+import pytest
+
+from tests.conftest import make_amplifier, make_sensor
+
+AMPLIFIERS = [f"A{i:03d}" for i in range(25)]
+
+
+def load_api(module_name, directory):
+    """Imports an API module with its snapshot and journal in directory, and adds AMPLIFIERS to its fleet."""
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            for name in ("EEG_DATABASE", "EEG_DRIVER", "EEG_AUTOSAVE_CHANGES", "EEG_AUTOSAVE_SECONDS"):
+                monkeypatch.delenv(name, raising=False)
+            module = importlib.import_module(module_name)
+    finally:
+        os.chdir(cwd)
+    module.control_system.add_amplifiers([make_amplifier(serial_number) for serial_number in AMPLIFIERS])
+    return module
+
+
+def flask_client(module):
+    client = module.app.test_client()
+
+    def send(method, path, body=None, headers=()):
+        response = client.open(path, method=method, json=body, headers=dict(headers))
+        return response.status_code, response.headers.get("ETag"), response.get_data()
+    return send
+
+
+def asgi_client(module):
+    async def request(method, path, body, headers):
+        path, _, query = path.partition("?")
+        scope = {"type": "http", "method": method, "path": path, "raw_path": path.encode(),
+                 "query_string": query.encode(), "root_path": "", "scheme": "http", "http_version": "1.1",
+                 "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+                 "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+        start, chunks, received = {}, [], []
+
+        async def receive():
+            if received:
+                # Only a disconnect would come next; the app stops waiting for it once it has answered.
+                await asyncio.Event().wait()
+            received.append(True)
+            return {"type": "http.request", "body": b"" if body is None else json.dumps(body).encode(),
+                    "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            else:
+                chunks.append(message.get("body", b""))
+        await module.app(scope, receive, send)
+        etag = dict(start.get("headers", [])).get(b"etag")
+        return start["status"], etag and etag.decode(), b"".join(chunks)
+
+    def send(method, path, body=None, headers=()):
+        return asyncio.run(request(method, path, body, headers))
+    return send
+
+
+@pytest.fixture(scope="module", params=["flask", "asgi"])
+def api(request, tmp_path_factory):
+    """
+    Returns (module, send) for one of the two API servers,
+    where send(method, path, body, headers) returns (status, ETag, body).
+    """
+    if request.param == "flask":
+        module = load_api("control_system_api", tmp_path_factory.mktemp("flask"))
+        return module, flask_client(module)
+    module = load_api("control_system_asgi", tmp_path_factory.mktemp("asgi"))
+    return module, asgi_client(module)
+
+
+def amplifier_json(serial_number):
+    return {"serial_number": serial_number, "model_string": "eego mini", "manufacturer": "ANT Neuro",
+            "next_maintenance": "01-01-2030", "sampling_rate": 256, "gain": 10}
+
+
+def test_bulk_add_reports_every_item_in_order(api):
+    module, send = api
+    status, _, body = send("POST", "/api/amplifiers/bulk", {"amplifiers": [
+        amplifier_json("B0"), amplifier_json("B0"), {"serial_number": "B1"}, amplifier_json("B2")]})
+    try:
+        assert status == 200
+        body = json.loads(body)
+        assert (body["succeeded"], body["failed"]) == (2, 2)
+        assert [result.get("status") for result in body["results"]] == ["added", None, None, "added"]
+        assert body["results"][2] == {"serial_number": "B1", "error": "Missing parameter: 'model_string'"}
+        assert module.control_system.find_amplifier("B2") is not None
+    finally:
+        module.control_system.remove_amplifier("B0")
+        module.control_system.remove_amplifier("B2")
+
+
+def test_bulk_settings_apply_to_serial_numbers_or_a_filter(api):
+    module, send = api
+    status, _, body = send("PUT", "/api/amplifiers/bulk/settings",
+                           {"serial_numbers": [AMPLIFIERS[0], "missing"], "gain": 20, "power": "on"})
+    assert status == 200
+    assert [result.get("error") for result in json.loads(body)["results"]] == [None, "Amplifier not found."]
+    amplifier = module.control_system.find_amplifier(AMPLIFIERS[0])
+    assert (amplifier.gain, amplifier.is_on) == (20, True)
+
+    status, _, body = send("PUT", "/api/amplifiers/bulk/settings", {"filter": {"serial_number": "A01"}, "gain": 30})
+    assert (status, json.loads(body)["succeeded"]) == (200, 10)
+    assert {module.control_system.find_amplifier(f"A01{i}").gain for i in range(10)} == {30}
+
+
+def test_an_invalid_bulk_setting_changes_nothing(api):
+    module, send = api
+    status, _, body = send("PUT", "/api/amplifiers/bulk/settings", {"serial_numbers": AMPLIFIERS, "gain": 500})
+    assert status == 400 and "error" in json.loads(body)
+    assert 500 not in {amp.gain for amp in module.control_system.list_amplifiers()}
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("PUT", "/api/amplifiers/bulk/settings", []),
+    ("PUT", "/api/amplifiers/bulk/settings", {"gain": 20}),
+    ("PUT", "/api/amplifiers/bulk/settings", {"serial_numbers": "A000", "gain": 20}),
+    ("PUT", "/api/amplifiers/bulk/settings", {"filter": "A000", "gain": 20}),
+    ("POST", "/api/amplifiers/bulk", []),
+    ("POST", "/api/sensors/bulk", []),
+    ("POST", "/api/amplifiers/sensors/bulk", []),
+    ("POST", "/api/amplifiers/sensors/bulk", {"assignments": [{"amplifier_serial": "A000"}]}),
+    ("POST", "/api/sensors", {"serial_number": "S0"}),
+])
+def test_malformed_bodies_are_rejected(api, method, path, body):
+    module, send = api
+    assert send(method, path, body)[0] == 400
+
+
+def test_cursor_pages_through_the_fleet_in_order(api):
+    module, send = api
+    get = functools.partial(send, "GET")
+    seen, cursor = [], None
+    while True:
+        status, _, body = get("/api/amplifiers?limit=10" + (f"&cursor={cursor}" if cursor else ""))
+        assert status == 200
+        page = json.loads(body)
+        seen += [amp["serial_number"] for amp in page["amplifiers"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == AMPLIFIERS
+
+
+def test_cursor_survives_removing_the_amplifier_it_points_after(api):
+    module, send = api
+    get = functools.partial(send, "GET")
+    page = json.loads(get("/api/amplifiers?limit=5")[2])
+    module.control_system.remove_amplifier(AMPLIFIERS[4])
+    try:
+        rest = json.loads(get(f"/api/amplifiers?limit=5&cursor={page['next_cursor']}")[2])
+        assert [amp["serial_number"] for amp in rest["amplifiers"]] == AMPLIFIERS[5:10]
+    finally:
+        module.control_system.add_amplifier(make_amplifier(AMPLIFIERS[4]))
+
+
+@pytest.mark.parametrize("query", ["?limit=0", "?cursor=!!"])
+def test_bad_page_parameters_are_rejected(api, query):
+    module, send = api
+    get = functools.partial(send, "GET")
+    assert get("/api/amplifiers" + query)[0] == 400
+
+
+def test_unchanged_fleet_answers_304(api):
+    module, send = api
+    get = functools.partial(send, "GET")
+    status, etag, body = get("/api/amplifiers")
+    assert status == 200 and etag
+    assert [amp["serial_number"] for amp in json.loads(body)] == AMPLIFIERS
+    status, same, body = get("/api/amplifiers", headers=[("If-None-Match", etag)])
+    assert (status, same, body) == (304, etag, b"")
+    # A page and a stream of the same state are different representations, with different tags.
+    assert get("/api/amplifiers?format=ndjson")[1] not in (None, etag)
+
+    module.control_system.set_gain(AMPLIFIERS[0], 55)
+    status, changed, body = get("/api/amplifiers", headers=[("If-None-Match", etag)])
+    assert status == 200 and changed != etag
+    assert json.loads(body)[0]["gain"] == 55
+
+
+def test_attaching_answers_404_for_a_missing_device_and_409_for_a_taken_sensor(api):
+    module, send = api
+    module.control_system.add_sensor(make_sensor("AT-S"))
+    path = f"/api/amplifiers/{AMPLIFIERS[1]}/sensors"
+    assert send("POST", path, {"sensor_serial": "AT-S"})[0] == 201
+    assert send("POST", path, {"sensor_serial": "AT-S"})[0] == 409
+    assert send("POST", f"/api/amplifiers/{AMPLIFIERS[2]}/sensors", {"sensor_serial": "AT-S"})[0] == 409
+    assert send("POST", path, {"sensor_serial": "missing"})[0] == 404
+    assert send("POST", "/api/amplifiers/missing/sensors", {"sensor_serial": "AT-S"})[0] == 404
+    assert module.control_system.find_sensor_owner("AT-S").serial_number == AMPLIFIERS[1]
@@ -0,0 +1,43 @@
+import copy
+import json
+import subprocess
+import sys
+
+from benchmarks.api import REPOSITORY
+
+
+def suite(*args):
+    return subprocess.run([sys.executable, "-m", "benchmarks.suite", *args], cwd=REPOSITORY, capture_output=True,
+                          text=True, timeout=300)
+
+
+def write(path, report):
+    path.write_text(json.dumps(report))
+    return str(path)
+
+
+def test_run_writes_a_result_for_every_case_and_compare_flags_regressions(tmp_path):
+    output = tmp_path / "baseline.json"
+    result = suite("run", "--sizes", "20", "--operations", "5", "--heavy-operations", "1", "--output", str(output))
+    assert result.returncode == 0, result.stderr
+    report = json.loads(output.read_text())
+    assert report["meta"]["sizes"] == [20]
+    names = [case["name"] for case in report["results"]]
+    assert "find_amplifier" in names and "GET /api/amplifiers?limit=100" in names
+    assert len(names) == len(set(names))
+    for case in report["results"]:
+        assert case["size"] == 20 and case["operations"] >= 1
+        assert case["p50_us"] <= case["p95_us"] <= case["max_us"]
+
+    same = suite("compare", str(output), str(output))
+    assert same.returncode == 0 and "0 regressions" in same.stdout
+
+    report["results"][1]["peak_mb"] = 0.1
+    changed = copy.deepcopy(report)
+    changed["results"][0]["p50_us"] *= 2
+    # Growth below the noise floor is not a memory regression, whatever the ratio.
+    changed["results"][1]["peak_mb"] = 0.6
+    changed = suite("compare", write(tmp_path / "baseline.json", report), write(tmp_path / "change.json", changed))
+    assert changed.returncode == 1
+    assert "1 regression " in changed.stdout
+    assert "REGRESSION: slower" in next(line for line in changed.stdout.splitlines() if names[0] in line)
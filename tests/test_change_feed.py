@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from change_feed import ChangeFeed
+from control_system import EEGControlSystem
+from api_common import change_stream, changes_since, feed_position
+from tests.conftest import make_amplifier
+
+
+def test_mutations_are_published_in_order():
+    control_system = EEGControlSystem()
+    control_system.add_amplifier(make_amplifier("A0"))
+    control_system.set_gain("A0", 20)
+    control_system.remove_amplifier("A0")
+
+    events, resync = control_system.changes.since(0)
+    assert not resync
+    assert [(event["sequence"], event["op"]) for event in events] == [
+        (1, "add_amplifier"), (2, "gain"), (3, "remove_amplifier")]
+    assert events[1]["gain"] == 20
+    assert control_system.changes.since(1, limit=1)[0] == events[1:2]
+    assert control_system.changes.since(3) == ([], False)
+
+
+def test_a_subscriber_that_fell_behind_must_resync():
+    feed = ChangeFeed(capacity=3)
+    for i in range(5):
+        feed.publish("gain", ("A0", i))
+    # Events 1 and 2 were dropped; reading on from 2 still works, from 1 it does not.
+    assert [event["gain"] for event in feed.since(2)[0]] == [2, 3, 4]
+    assert feed.since(1) == ([], True)
+    assert feed.since(6) == ([], True)
+
+
+def test_positions_from_another_epoch_call_for_a_resync():
+    feed = ChangeFeed()
+    feed.publish("gain", ("A0", 1))
+    assert feed_position(feed) == 1
+    assert feed_position(feed, since="0", epoch=feed.epoch) == 0
+    assert feed_position(feed, last_event_id=f"{feed.epoch}:0") == 0
+    assert feed_position(feed, last_event_id="other:0") is None
+    with pytest.raises(ValueError):
+        feed_position(feed, since="-1")
+
+    body, status = changes_since(feed, None, 10)
+    assert (status, body["resync"], body["latest"]) == (410, True, 1)
+    body, status = changes_since(feed, 0, 10)
+    assert (status, [event["sequence"] for event in body["events"]], body["next_since"]) == (200, [1], 1)
+
+
+def test_change_stream_sends_events_with_resumable_ids():
+    feed = ChangeFeed()
+    feed.publish("gain", ("A0", 1))
+    stream = change_stream(feed, 0)
+    assert next(stream).startswith("retry:")
+    assert next(stream).startswith(f"id: {feed.epoch}:1\nevent: change\n")
+    # Caught up: the stream hands back the sequence number to wait after.
+    assert next(stream) == 1
+    assert list(change_stream(feed, None))[-1].startswith("event: resync")
+
+
+def test_wait_returns_once_an_event_is_published():
+    feed = ChangeFeed()
+    assert not feed.wait(0, timeout=0.01)
+    threading.Timer(0.05, feed.publish, ("gain", ("A0", 1))).start()
+    assert feed.wait(0, timeout=5)
+
+
+def test_listeners_added_and_removed_concurrently_are_all_kept():
+    feed = ChangeFeed()
+    calls = []
+    listeners = [lambda i=i: calls.append(i) for i in range(400)]
+    keep, drop = listeners[::2], listeners[1::2]
+    for listener in drop:
+        feed.add_listener(listener)
+
+    def churn(offset):
+        for listener in keep[offset::4]:
+            feed.add_listener(listener)
+        for listener in drop[offset::4]:
+            feed.remove_listener(listener)
+    threads = [threading.Thread(target=churn, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    feed.publish("gain", ("A0", 1))
+    assert sorted(calls) == list(range(0, 400, 2))
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from commands import CommandDispatcher
+from control_system import EEGControlSystem
+from drivers import AmplifierDriver, SimulatedDriver
+from tests.conftest import make_amplifier
+
+
+def start_dispatcher(driver, amplifiers=1, **options):
+    control_system = EEGControlSystem()
+    for i in range(amplifiers):
+        control_system.add_amplifier(make_amplifier(f"A{i}"))
+    dispatcher = CommandDispatcher(control_system, driver, **options)
+    dispatcher.start()
+    return dispatcher
+
+
+def test_commands_sent_meanwhile_are_coalesced_into_one_round_trip():
+    dispatcher = start_dispatcher(SimulatedDriver(latency=0.2))
+    try:
+        first = dispatcher.set_gain("A0", 20)
+        while first.state == "queued":
+            time.sleep(0.001)
+        later = [dispatcher.set_gain("A0", 30), dispatcher.set_sampling_rate("A0", 512), dispatcher.set_gain("A0", 40)]
+        # Nothing changes before the amplifier confirms.
+        assert dispatcher.control_system.find_amplifier("A0").gain == 10
+        assert all(command.wait(5) for command in [first] + later)
+    finally:
+        dispatcher.stop()
+    assert [command.state for command in [first] + later] == ["applied", "superseded", "applied", "applied"]
+    assert dispatcher.round_trips == 2
+    amplifier = dispatcher.control_system.find_amplifier("A0")
+    assert (amplifier.gain, amplifier.sampling_rate) == (40, 512)
+    assert dispatcher.get(first.id) is first and first.completed >= first.submitted
+
+
+def test_power_toggles_follow_the_commands_queued_before_them():
+    dispatcher = start_dispatcher(SimulatedDriver(latency=0.05))
+    try:
+        on = dispatcher.toggle_power("A0")
+        assert dispatcher.toggle_power("A0", expected=False) is False
+        off = dispatcher.toggle_power("A0", expected=True)
+        assert on.settings == {"power": True} and off.settings == {"power": False}
+        assert on.wait(5) and off.wait(5)
+    finally:
+        dispatcher.stop()
+    assert dispatcher.control_system.find_amplifier("A0").is_on is False
+
+
+def test_a_failed_round_trip_changes_nothing():
+    dispatcher = start_dispatcher(SimulatedDriver(latency=0.01, failure_rate=1.0))
+    try:
+        command = dispatcher.set_gain("A0", 20)
+        assert command.wait(5)
+    finally:
+        dispatcher.stop()
+    assert command.state == "failed" and "did not acknowledge" in command.error
+    assert command.to_dict()["error"] == command.error
+    assert dispatcher.control_system.find_amplifier("A0").gain == 10
+
+
+def test_amplifiers_are_sent_to_concurrently_up_to_the_limit():
+    driver = SimulatedDriver(latency=0.05)
+    dispatcher = start_dispatcher(driver, amplifiers=12, max_in_flight=4)
+    try:
+        results = dispatcher.update_amplifiers([f"A{i}" for i in range(12)] + ["missing"], gain=20, power=True)
+        assert results[-1] == {"serial_number": "missing", "error": "Amplifier not found."}
+
+        async def wait_all():
+            return await asyncio.gather(*(dispatcher.get(result["command"]).wait_async(5) for result in results[:-1]))
+        assert all(asyncio.run(wait_all()))
+    finally:
+        dispatcher.stop()
+    assert driver.max_in_flight == 4 and driver.round_trips == 12
+    assert {(amp.gain, amp.is_on) for amp in dispatcher.control_system.list_amplifiers()} == {(20, True)}
+
+
+def test_invalid_commands_are_refused_up_front():
+    dispatcher = CommandDispatcher(EEGControlSystem(), SimulatedDriver())
+    dispatcher.control_system.add_amplifier(make_amplifier("A0"))
+    with pytest.raises(RuntimeError):
+        dispatcher.set_gain("A0", 20)
+    dispatcher.start()
+    try:
+        with pytest.raises(ValueError):
+            dispatcher.set_gain("A0", 500)
+        with pytest.raises(ValueError):
+            dispatcher.update_amplifiers(["A0"], sampling_rate=3)
+        assert dispatcher.set_gain("missing", 20) is None
+        assert dispatcher.toggle_power("missing") is None
+        assert dispatcher.submitted == 0
+    finally:
+        dispatcher.stop()
+    with pytest.raises(TypeError):
+        AmplifierDriver()
@@ -0,0 +1,54 @@
+import pickle
+
+import pytest
+
+from amplifier import Amplifier
+from compact_registry import CompactRegistry
+from control_system import EEGControlSystem
+from tests.conftest import fleet_state, make_amplifier, make_sensor, populate
+
+
+def test_registry_holds_the_same_fleet_as_plain_objects():
+    compact = populate(EEGControlSystem(registry=CompactRegistry()), amplifiers=4)
+    plain = populate(EEGControlSystem(), amplifiers=4)
+    assert fleet_state(compact) == fleet_state(plain)
+
+    compact.remove_sensor_from_amplifier("A1", "S1-0")
+    plain.remove_sensor_from_amplifier("A1", "S1-0")
+    assert fleet_state(compact) == fleet_state(plain)
+    assert compact._sensor_owner.get("S1-0") is None and compact._sensor_owner["S1-1"] == "A1"
+
+
+def test_non_integer_gain_is_stored():
+    control_system = EEGControlSystem(registry=CompactRegistry())
+    control_system.add_amplifier(make_amplifier("A0", gain=2.5))
+    assert control_system.amplifiers["A0"].gain == 2.5
+    control_system.set_gain("A0", 7)
+    assert control_system.amplifiers["A0"].gain == 7 and isinstance(control_system.amplifiers["A0"].gain, int)
+
+
+def test_view_of_a_removed_device_does_not_read_the_device_in_its_row():
+    control_system = EEGControlSystem(registry=CompactRegistry())
+    control_system.add_amplifier(make_amplifier("A0"))
+    control_system.add_sensor(make_sensor("S0"))
+    amplifier, sensor = control_system.amplifiers["A0"], control_system.sensors["S0"]
+
+    control_system.remove_amplifier("A0")
+    del control_system.sensors["S0"]
+    control_system.add_amplifier(make_amplifier("A1"))
+    control_system.add_sensor(make_sensor("S1"))
+    # The new devices reuse the freed rows.
+    assert control_system.amplifiers["A1"]._row == amplifier._row
+    with pytest.raises(KeyError):
+        amplifier.serial_number
+    with pytest.raises(KeyError):
+        sensor.tag
+    assert amplifier != control_system.amplifiers["A1"]
+
+
+def test_views_pickle_as_plain_devices():
+    control_system = populate(EEGControlSystem(registry=CompactRegistry()), amplifiers=1)
+    copy = pickle.loads(pickle.dumps(control_system.amplifiers["A0"]))
+    assert type(copy) is Amplifier
+    assert (copy.serial_number, copy.gain, copy.is_on) == ("A0", 1, True)
+    assert [sensor.serial_number for sensor in copy.sensors] == ["S0-0", "S0-1"]
@@ -0,0 +1,62 @@
+import pytest
+
+from control_system import EEGControlSystem
+from tests.conftest import make_amplifier, make_sensor
+
+
+@pytest.fixture
+def control_system():
+    control_system = EEGControlSystem()
+    for serial_number in ("A0", "A1"):
+        control_system.add_amplifier(make_amplifier(serial_number))
+    for serial_number in ("S0", "S1"):
+        control_system.add_sensor(make_sensor(serial_number))
+    control_system.add_sensor_to_amplifier("A0", "S0")
+    return control_system
+
+
+def test_devices_are_found_by_serial_number(control_system):
+    assert control_system.find_amplifier("A1").serial_number == "A1"
+    assert control_system.find_sensor("S1").serial_number == "S1"
+    assert control_system.find_amplifier("missing") is None
+    assert control_system.find_sensor("missing") is None
+    assert control_system.find_sensor_owner("S0").serial_number == "A0"
+    assert control_system.find_sensor_owner("S1") is None
+
+
+def test_duplicate_serial_numbers_are_rejected(control_system):
+    with pytest.raises(ValueError):
+        control_system.add_amplifier(make_amplifier("A0"))
+    with pytest.raises(ValueError):
+        control_system.add_sensor(make_sensor("S0"))
+    assert len(control_system.list_amplifiers()) == 2
+
+
+def test_an_attached_sensor_stays_with_its_amplifier(control_system):
+    control_system.add_sensor_to_amplifier("A1", "S0")
+    assert control_system.find_sensor_owner("S0").serial_number == "A0"
+    assert [sensor.serial_number for sensor in control_system.find_amplifier("A1").sensors] == []
+
+    control_system.remove_sensor_from_amplifier("A0", "S0")
+    assert control_system.find_sensor_owner("S0") is None
+    control_system.add_sensor_to_amplifier("A1", "S0")
+    assert control_system.find_sensor_owner("S0").serial_number == "A1"
+
+
+def test_removing_an_amplifier_frees_its_sensors(control_system):
+    control_system.remove_amplifier("A0")
+    assert control_system.find_amplifier("A0") is None
+    assert control_system.find_sensor_owner("S0") is None
+    assert control_system.find_sensor("S0") is not None
+    control_system.add_sensor_to_amplifier("A1", "S0")
+    assert control_system.find_sensor_owner("S0").serial_number == "A1"
+
+
+def test_loading_a_pickle_rebuilds_the_indexes(control_system, tmp_path):
+    filename = str(tmp_path / "fleet.pkl")
+    control_system.save_state(filename)
+    loaded = EEGControlSystem()
+    loaded.load_state(filename)
+    assert sorted(amp.serial_number for amp in loaded.list_amplifiers()) == ["A0", "A1"]
+    assert loaded.find_sensor_owner("S0").serial_number == "A0"
+    assert loaded.find_sensor("S1") is not None
@@ -0,0 +1,73 @@
+import pytest
+
+from control_system import EEGControlSystem
+from journal import Journal
+from tests.conftest import fleet_state, make_amplifier, populate
+
+
+@pytest.fixture
+def journaled(tmp_path):
+    """Returns a function building a journaled control system over the snapshot and journal in tmp_path."""
+    def build():
+        control_system = EEGControlSystem(journal=Journal(str(tmp_path / "fleet.journal")))
+        control_system.load_state(str(tmp_path / "fleet.pkl"))
+        return control_system
+    return build
+
+
+def test_replay_restores_unsaved_changes(journaled):
+    control_system = populate(journaled())
+    control_system.set_gain("A1", 42)
+    control_system.remove_sensor_from_amplifier("A0", "S0-1")
+    control_system.update_maintenance_date(control_system.find_amplifier("A2"), "2031-05-04")
+    expected = fleet_state(control_system)
+    control_system.journal.close()
+
+    restarted = journaled()
+    assert fleet_state(restarted) == expected
+    assert restarted.find_sensor_owner("S0-1") is None
+
+
+def test_torn_final_record_is_ignored(journaled, tmp_path):
+    control_system = populate(journaled(), amplifiers=1)
+    expected = fleet_state(control_system)
+    control_system.journal.close()
+    with open(tmp_path / "fleet.journal", "a") as f:
+        f.write('["gain", "A0", 9')
+
+    restarted = journaled()
+    assert fleet_state(restarted) == expected
+    restarted.set_gain("A0", 7)
+    restarted.journal.close()
+    assert journaled().find_amplifier("A0").gain == 7
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(journaled):
+    control_system = populate(journaled())
+    control_system.compact()
+    control_system.wait_for_snapshot()
+    assert control_system.snapshot.succeeded
+    generation = control_system.journal.generation
+    control_system.add_amplifier(make_amplifier("A9"))
+    control_system.set_gain("A9", 99)
+    expected = fleet_state(control_system)
+    control_system.journal.close()
+
+    restarted = journaled()
+    # Only the two changes made after the snapshot are replayed on top of it, not the whole history.
+    assert restarted.journal.generation == generation
+    assert restarted.journal.records == 2
+    assert fleet_state(restarted) == expected
+
+
+def test_compaction_starts_after_compact_after_records(journaled):
+    control_system = journaled()
+    control_system.journal.compact_after = 10
+    populate(control_system, amplifiers=4)
+    control_system.wait_for_snapshot()
+    assert control_system.snapshot is not None
+    # The records before the snapshot were folded into it.
+    assert control_system.journal.records < control_system.fleet_version
+    expected = fleet_state(control_system)
+    control_system.journal.close()
+    assert fleet_state(journaled()) == expected
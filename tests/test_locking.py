@@ -0,0 +1,174 @@
+from collections import Counter
+import random
+import threading
+
+import pytest
+
+from control_system import EEGControlSystem
+from locking import ReadWriteLock
+from tests.conftest import make_amplifier, make_sensor
+
+THREADS = 8
+
+
+def contend(lock, side):
+    """Starts a thread that takes and releases one side ("read" or "write") of the lock. Returns it once it is done or waiting."""
+    thread = threading.Thread(target=lambda: (getattr(lock, f"acquire_{side}")(), getattr(lock, f"release_{side}")()))
+    thread.start()
+    thread.join(0.2)
+    return thread
+
+
+def finishes(thread):
+    thread.join(5)
+    return not thread.is_alive()
+
+
+def test_read_lock_is_reentrant_and_shared():
+    lock = ReadWriteLock()
+    with lock.read:
+        with lock.read:
+            assert lock.held()
+        assert lock.held()
+        assert finishes(contend(lock, "read"))
+        writer = contend(lock, "write")
+        assert writer.is_alive()
+    assert not lock.held()
+    assert finishes(writer)
+
+
+def test_write_lock_is_reentrant_and_admits_reads():
+    lock = ReadWriteLock()
+    with lock.write:
+        with lock.write:
+            with lock.read:
+                assert lock.held()
+        assert lock.held()
+        reader = contend(lock, "read")
+        assert reader.is_alive()
+    assert not lock.held()
+    assert finishes(reader)
+
+
+def test_upgrading_a_read_lock_raises():
+    lock = ReadWriteLock()
+    with lock.read:
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    assert finishes(contend(lock, "write"))
+
+
+def test_waiting_writer_goes_before_new_readers():
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    writer = contend(lock, "write")
+    assert writer.is_alive()
+    reader = contend(lock, "read")
+    assert reader.is_alive()
+    lock.release_read()
+    assert finishes(writer) and finishes(reader)
+
+
+def run_threads(targets):
+    """Runs each target(random generator) in its own thread and re-raises the first error any of them hit."""
+    errors = []
+
+    def guarded(target, seed):
+        try:
+            target(random.Random(seed))
+        except BaseException as e:
+            errors.append(e)
+    threads = [threading.Thread(target=guarded, args=(target, seed)) for seed, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert not any(thread.is_alive() for thread in threads)
+    if errors:
+        raise errors[0]
+
+
+def test_concurrent_changes_are_neither_lost_nor_seen_half_done():
+    control_system = EEGControlSystem()
+    amplifiers = [f"AMP{i:02d}" for i in range(10)]
+    for serial_number in amplifiers:
+        control_system.add_amplifier(make_amplifier(serial_number))
+    toggles = Counter()
+    counted = threading.Lock()
+
+    def toggle(rng):
+        for _ in range(300):
+            serial_number = rng.choice(amplifiers)
+            control_system.toggle_power(serial_number)
+            with counted:
+                toggles[serial_number] += 1
+
+    def restructure(rng):
+        # Each thread adds, wires up and removes devices of its own.
+        prefix = f"T{rng.random()}"
+        for i in range(30):
+            amplifier, sensor = f"{prefix}-A{i}", f"{prefix}-S{i}"
+            control_system.add_amplifier(make_amplifier(amplifier))
+            control_system.add_sensor(make_sensor(sensor))
+            control_system.add_sensor_to_amplifier(amplifier, sensor)
+            if rng.random() < 0.5:
+                control_system.remove_sensor_from_amplifier(amplifier, sensor)
+                control_system.add_sensor_to_amplifier(rng.choice(amplifiers), sensor)
+            control_system.remove_amplifier(amplifier)
+
+    def read(rng):
+        for _ in range(100):
+            serials = [amp.serial_number for amp in control_system.iter_amplifiers(chunk_size=7)]
+            assert serials == sorted(serials) and len(serials) == len(set(serials))
+            assert [amp.serial_number for amp in control_system.filter_amplifiers(serial_number="AMP")] == amplifiers
+
+    run_threads([toggle] * (THREADS // 2) + [restructure] * (THREADS // 4) + [read] * (THREADS // 4))
+
+    assert {amp.serial_number: amp.is_on for amp in control_system.list_amplifiers()} == \
+        {serial_number: toggles[serial_number] % 2 == 1 for serial_number in amplifiers}
+    for amplifier in control_system.list_amplifiers():
+        for sensor in amplifier.sensors:
+            assert control_system.find_sensor_owner(sensor.serial_number) is amplifier
+    owned = [sensor for sensor in control_system.sensors if control_system.find_sensor_owner(sensor) is not None]
+    assert len(owned) == sum(len(amp.sensors) for amp in control_system.list_amplifiers())
+
+
+def takes_at_once(lock, side):
+    """Returns True if another thread can take one side of the lock without waiting."""
+    result = []
+
+    def attempt():
+        taken = getattr(lock, f"try_{side}")()
+        if taken:
+            getattr(lock, f"release_{side}")()
+        result.append(taken)
+    thread = threading.Thread(target=attempt)
+    thread.start()
+    assert finishes(thread)
+    return result[0]
+
+
+def test_try_read_and_try_write_nest_like_the_blocking_calls():
+    lock = ReadWriteLock()
+    assert lock.try_write() and lock.try_write() and lock.try_read()
+    lock.release_read()
+    lock.release_write()
+    assert not takes_at_once(lock, "read")
+    lock.release_write()
+    assert lock.try_read() and lock.try_read()
+    assert not lock.try_write()
+    lock.release_read()
+    assert not takes_at_once(lock, "write")
+    assert takes_at_once(lock, "read")
+    lock.release_read()
+    assert takes_at_once(lock, "write")
+
+
+def test_try_read_does_not_pass_a_waiting_writer():
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    writer = contend(lock, "write")
+    assert not takes_at_once(lock, "read")
+    lock.release_read()
+    assert finishes(writer)
+    assert takes_at_once(lock, "read")
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+import pytest
+
+from control_system import EEGControlSystem
+from maintenance_index import maintenance_ordinal
+from sqlite_registry import SQLiteRegistry
+from tests.conftest import make_amplifier, make_sensor
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def control_system(request, tmp_path):
+    registry = SQLiteRegistry(str(tmp_path / "fleet.db")) if request.param == "sqlite" else None
+    control_system = EEGControlSystem(registry=registry)
+    control_system.add_amplifier(make_amplifier("A0", next_maintenance="15-03-2030"))
+    control_system.add_amplifier(make_amplifier("A1", next_maintenance="2030-01-10"))
+    control_system.add_amplifier(make_amplifier("A2", next_maintenance="not a date"))
+    control_system.add_sensor(make_sensor("S0", next_maintenance="01-02-2030"))
+    control_system.add_sensor(make_sensor("S1", next_maintenance="01-01-2040"))
+    return control_system
+
+
+def due(control_system, **query):
+    return [(when.isoformat(), device_type, device.serial_number)
+            for when, device_type, device in control_system.maintenance_due(**query)]
+
+
+def test_dates_in_either_format_are_read():
+    assert maintenance_ordinal("15-03-2030") == maintenance_ordinal("2030-03-15") == date(2030, 3, 15).toordinal()
+    assert maintenance_ordinal("not a date") == 0
+
+
+def test_devices_due_before_a_date_come_soonest_first(control_system):
+    assert due(control_system, before="01-04-2030") == [
+        ("2030-01-10", "amplifier", "A1"), ("2030-02-01", "sensor", "S0"), ("2030-03-15", "amplifier", "A0")]
+    assert due(control_system, before=date(2030, 2, 1)) == [("2030-01-10", "amplifier", "A1")]
+    with pytest.raises(ValueError):
+        control_system.maintenance_due(before="soon")
+
+
+def test_due_list_follows_changes(control_system):
+    later = (date.today() + timedelta(days=10)).strftime("%d-%m-%Y")
+    assert control_system.update_maintenance_date(control_system.find_sensor("S1"), later)
+    control_system.remove_amplifier("A1")
+    assert due(control_system, within_days=10) == [((date.today() + timedelta(days=10)).isoformat(), "sensor", "S1")]
+    assert [serial for _, _, serial in due(control_system, before="01-04-2030")] == ["S1", "S0", "A0"]
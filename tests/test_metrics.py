@@ -0,0 +1,99 @@
+import pytest
+
+from compact_registry import CompactRegistry
+from control_system import EEGControlSystem
+from metrics import Registry
+from sqlite_registry import SQLiteRegistry
+from tests.conftest import populate
+
+
+def samples(text):
+    """Returns {sample name with labels: value} for the sample lines of a rendering."""
+    return {line.rpartition(" ")[0]: line.rpartition(" ")[2] for line in text.splitlines() if not line.startswith("#")}
+
+
+def test_registry_renders_the_text_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("method", "route"))
+    requests.labels("GET", '/a"b').inc()
+    requests.labels("GET", '/a"b').inc(2)
+    registry.gauge("queue", "Queued items.").set_function(lambda: 7)
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(seconds)
+
+    text = registry.render()
+    assert "# HELP requests_total Requests.\n# TYPE requests_total counter" in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert samples(text) == {
+        'requests_total{method="GET",route="/a\\"b"}': "3",
+        "queue": "7",
+        'latency_seconds_bucket{le="0.1"}': "1",
+        'latency_seconds_bucket{le="1"}': "3",
+        'latency_seconds_bucket{le="+Inf"}': "4",
+        "latency_seconds_sum": "4.05",
+        "latency_seconds_count": "4",
+    }
+
+
+def test_misuse_is_rejected():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("method",))
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Again.")
+    with pytest.raises(ValueError):
+        requests.labels("GET", "/")
+    with pytest.raises(ValueError):
+        requests.labels("GET").inc(-1)
+    with pytest.raises(AttributeError):
+        requests.inc()
+
+
+def fleet_gauges(control_system):
+    values = samples(control_system.metrics.render())
+    return {name: int(values[name]) for name in ("eeg_amplifiers", "eeg_amplifiers_on", "eeg_sensors",
+                                                 "eeg_sensors_attached")}
+
+
+@pytest.fixture(params=["memory", "compact", "sqlite"])
+def control_system(request, tmp_path):
+    registry = {"memory": lambda: None, "compact": CompactRegistry,
+                "sqlite": lambda: SQLiteRegistry(str(tmp_path / "fleet.db"))}[request.param]()
+    # A0 and A2 are on.
+    return populate(EEGControlSystem(registry=registry), amplifiers=3)
+
+
+def test_gauges_follow_the_fleet(control_system):
+    assert fleet_gauges(control_system) == {"eeg_amplifiers": 3, "eeg_amplifiers_on": 2, "eeg_sensors": 6,
+                                            "eeg_sensors_attached": 6}
+    control_system.set_power("A1", True)
+    control_system.remove_sensor_from_amplifier("A1", "S1-0")
+    assert fleet_gauges(control_system) == {"eeg_amplifiers": 3, "eeg_amplifiers_on": 3, "eeg_sensors": 6,
+                                            "eeg_sensors_attached": 5}
+
+
+def test_removing_a_powered_amplifier_updates_the_gauges(control_system):
+    control_system.remove_amplifier("A0")
+    assert fleet_gauges(control_system) == {"eeg_amplifiers": 2, "eeg_amplifiers_on": 1, "eeg_sensors": 6,
+                                            "eeg_sensors_attached": 4}
+    # The sensors of A0 are free again.
+    control_system.add_sensor_to_amplifier("A1", "S0-0")
+    assert fleet_gauges(control_system)["eeg_sensors_attached"] == 5
+
+
+def test_operations_are_timed(control_system):
+    values = samples(control_system.metrics.render())
+    assert values['eeg_operation_seconds_count{operation="add_amplifier"}'] == "3"
+    assert values['eeg_operation_seconds_count{operation="add_sensor_to_amplifier"}'] == "6"
+
+
+@pytest.mark.parametrize("snapshot_format", ["pickle", "columnar"])
+def test_powered_count_survives_a_snapshot(tmp_path, snapshot_format):
+    filename = str(tmp_path / "fleet.snapshot")
+    populate(EEGControlSystem(), amplifiers=5).save_state(filename, snapshot_format)
+    control_system = EEGControlSystem()
+    control_system.load_state(filename)
+    assert fleet_gauges(control_system)["eeg_amplifiers_on"] == 3
+    control_system.set_power("A0", False)
+    control_system.remove_amplifier("A2")
+    assert fleet_gauges(control_system)["eeg_amplifiers_on"] == 1
@@ -0,0 +1,56 @@
+import pytest
+
+from control_system import EEGControlSystem
+from sqlite_registry import SQLiteRegistry
+from tests.conftest import fleet_state, make_amplifier, make_sensor
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def control_system(request, tmp_path):
+    registry = SQLiteRegistry(str(tmp_path / "fleet.db")) if request.param == "sqlite" else None
+    control_system = EEGControlSystem(registry=registry)
+    control_system.add_amplifier(make_amplifier("A0"))
+    control_system.add_amplifier(make_amplifier("A1"))
+    for tag in ("Fz", "Cz", "Pz"):
+        for cap in range(2):
+            control_system.add_sensor(make_sensor(f"{tag}-{cap}", tag=tag))
+    control_system.add_sensor_to_amplifier("A1", "Cz-1")
+    return control_system
+
+
+def serials(sensors):
+    return [sensor.serial_number for sensor in sensors]
+
+
+def test_sensors_are_listed_by_tag(control_system):
+    assert serials(control_system.sensors_by_tag("Cz")) == ["Cz-0", "Cz-1"]
+    assert serials(control_system.sensors_by_tag("Cz", assigned=True)) == ["Cz-1"]
+    assert serials(control_system.sensors_by_tag("Cz", assigned=False)) == ["Cz-0"]
+    assert control_system.sensors_by_tag("O1") == []
+    assert control_system.amplifier_layout("A1") == {"Cz": ["Cz-1"]}
+    assert control_system.amplifier_layout("missing") is None
+
+
+def test_montage_is_applied_in_one_pass(control_system):
+    control_system.add_sensor_to_amplifier("A0", "Pz-0")
+    result = control_system.apply_montage("A0", {"Fz": "Fz-0", "Cz": ["Cz-0"], "Pz": "Pz-0"})
+    assert result == {"attached": ["Fz-0", "Cz-0"], "detached": []}
+    assert control_system.amplifier_layout("A0") == {"Pz": ["Pz-0"], "Fz": ["Fz-0"], "Cz": ["Cz-0"]}
+    assert serials(control_system.sensors_by_tag("Fz", assigned=True)) == ["Fz-0"]
+
+    result = control_system.apply_montage("A0", {"Fz": ["Fz-0", "Fz-1"]}, replace=True)
+    assert result == {"attached": ["Fz-1"], "detached": ["Pz-0", "Cz-0"]}
+    assert control_system.amplifier_layout("A0") == {"Fz": ["Fz-0", "Fz-1"]}
+    assert control_system.find_sensor_owner("Pz-0") is None
+    assert control_system.apply_montage("missing", {}) is None
+
+
+def test_an_invalid_montage_changes_nothing(control_system):
+    before = fleet_state(control_system)
+    with pytest.raises(ValueError) as raised:
+        control_system.apply_montage("A0", {"Fz": ["Fz-0", "Fz-0"], "Cz": "Cz-1", "Pz": ["Fz-1", "missing"]})
+    message = str(raised.value)
+    for problem in ("Fz-0 is listed more than once", "Cz-1 is already attached to Amplifier A1",
+                    "Fz-1 is tagged Fz, not Pz", "missing not found"):
+        assert problem in message
+    assert fleet_state(control_system) == before
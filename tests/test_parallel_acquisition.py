@@ -0,0 +1,64 @@
+from multiprocessing import shared_memory
+import time
+
+import numpy as np
+import pytest
+
+from control_system import EEGControlSystem
+from parallel_acquisition import ParallelAcquisition
+from tests.conftest import populate
+
+
+def eventually(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def acquisition():
+    # A0, A2, A4 and A6 are on.
+    control_system = populate(EEGControlSystem(), amplifiers=8)
+    acquisition = ParallelAcquisition(control_system, workers=2)
+    # Streams synced before the start are handed to the workers as they come up.
+    acquisition.sync()
+    acquisition.start()
+    try:
+        yield acquisition
+    finally:
+        acquisition.stop()
+
+
+def test_workers_fill_rings_this_process_reads(acquisition):
+    serials = ["A0", "A2", "A4", "A6"]
+    assert sorted(stream.serial_number for stream in acquisition.streams()) == serials
+    assert {acquisition.stream(serial_number).worker for serial_number in serials} == {0, 1}
+    eventually(lambda: all(acquisition.stream(serial_number).produced_blocks >= 8 for serial_number in serials))
+    for serial_number in serials:
+        samples, end = acquisition.stream(serial_number).ring.latest(256)
+        assert samples.shape == (2, 256) and end >= 256
+        assert np.isfinite(samples).all() and np.abs(samples).max() > 0
+    assert acquisition.stats()["channels"] == 8
+
+
+def test_changes_reach_the_workers_without_a_restart(acquisition):
+    control_system = acquisition.control_system
+    stream = acquisition.stream("A0")
+    eventually(lambda: stream.produced_blocks > 0)
+
+    control_system.set_gain("A0", 50)
+    acquisition.sync()
+    assert acquisition.stream("A0") is stream
+    eventually(lambda: stream.gain == 50 and stream.gains[-1][0] > 0)
+    first = stream.gains[-1][0]
+    eventually(lambda: stream.ring.written > first + 64)
+    before, after = stream.gain_at(first - 1), stream.gain_at(first)
+    assert (before, after) == (1, 50)
+
+    segment = stream.ring.shm.name
+    control_system.set_power("A0", False)
+    acquisition.sync()
+    assert acquisition.stream("A0") is None
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(segment)
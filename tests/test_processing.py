@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+
+from acquisition import AcquisitionEngine
+from control_system import EEGControlSystem
+from processing import BlockFilter, FilterDesign, SignalPipeline, _run_sections
+from tests.conftest import populate
+
+
+def test_block_filter_matches_the_sample_by_sample_cascade():
+    sections = FilterDesign().sections(256)
+    block_filter = BlockFilter(sections, 32)
+    signal = np.random.default_rng(1).normal(size=(3, 128)).astype(np.float32)
+
+    state = np.zeros((3, block_filter.order), dtype=np.float32)
+    blocks = []
+    for offset in range(0, 128, 32):
+        output, state = block_filter(signal[:, offset:offset + 32], state)
+        blocks.append(output)
+    expected = [_run_sections(sections, [0.0] * block_filter.order, channel)[0] for channel in signal.tolist()]
+    assert np.allclose(np.hstack(blocks), expected, atol=1e-4)
+
+
+def test_notch_removes_mains_and_keeps_eeg():
+    design = FilterDesign(dc_cutoff=None, band=None, decimation=1)
+    block_filter = BlockFilter(design.sections(256), 256)
+    t = np.arange(256 * 4) / 256
+
+    def remaining(frequency):
+        signal = np.sin(2 * math.pi * frequency * t).astype(np.float32)[np.newaxis]
+        state = np.zeros((1, block_filter.order), dtype=np.float32)
+        for offset in range(0, len(t), 256):
+            output, state = block_filter(signal[:, offset:offset + 256], state)
+        # Amplitude over the last second, once the filter has settled.
+        return np.abs(output).max()
+    assert remaining(50.0) < 0.05
+    assert remaining(10.0) > 0.9
+
+
+def run_pipeline(gain_change):
+    control_system = populate(EEGControlSystem(), amplifiers=1)
+    engine = AcquisitionEngine(control_system, block_size=32, clock=lambda: 0.0)
+    pipeline = SignalPipeline(engine, FilterDesign(decimation=2))
+    engine.sync(now=0.0)
+    pipeline.process()
+    for tick in range(1, 9):
+        if tick == 4 and gain_change:
+            control_system.set_gain("A0", 8)
+        engine.step(now=tick * 0.25)
+        pipeline.process()
+    return pipeline.output("A0").latest(10 ** 6)[0], pipeline.pipeline("A0")
+
+
+def test_output_is_normalized_by_the_gain_of_every_sample():
+    steady, _ = run_pipeline(gain_change=False)
+    changed, pipeline = run_pipeline(gain_change=True)
+    assert pipeline.stream.gain == 8 and pipeline.processed_samples == 512
+    # 512 input samples decimated by 2.
+    assert steady.shape == (2, 256)
+    assert np.allclose(steady, changed, atol=1e-3)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from acquisition import AcquisitionEngine
+from control_system import EEGControlSystem
+from recording import Recorder, Recording, RecordingWriter, recording_metadata
+from tests.conftest import make_amplifier, populate
+
+BLOCK = 4
+
+
+def write_recording(filename, blocks):
+    """Writes a 2-channel recording at 8 Hz from (first sample, number of blocks) runs; sample s holds (s, -s)."""
+    amplifier = make_amplifier("A0", sampling_rate=8)
+    metadata = recording_metadata(amplifier, [("S0", "Fz"), ("S1", "Cz")])
+    writer = RecordingWriter(filename, metadata, block_size=BLOCK)
+    for first, count in blocks:
+        numbers = np.arange(first, first + count * BLOCK, dtype=np.float32)
+        writer.append(np.column_stack([numbers, -numbers]), first)
+    writer.close()
+    return Recording(filename)
+
+
+def test_window_maps_seconds_to_samples(tmp_path):
+    recording = write_recording(str(tmp_path / "rec.eegr"), [(16, 6)])
+    assert recording.duration == 3.0
+    assert recording.window(1.0, 1.5)[:, 0].tolist() == [24, 25, 26, 27]
+    assert recording.window(0.5, 1.0, channels=["S1"])[:, 0].tolist() == [-20, -21, -22, -23]
+    assert recording.window(0.0, 0.25, channels=slice(0, 1)).shape == (2, 1)
+    assert recording.channel_indices("Cz") == [1]
+    # A window is a view of the mapped file, not a copy.
+    assert not recording.window(0.0, 3.0).flags.owndata
+
+
+def test_gaps_are_skipped(tmp_path):
+    recording = write_recording(str(tmp_path / "rec.eegr"), [(0, 2), (16, 2)])
+    assert recording.index.tolist() == [0, 4, 16, 20]
+    assert recording.duration == 3.0
+    # 1 s to 2.5 s after the start: samples 8..19, of which only 16..19 were recorded.
+    assert recording.window(1.0, 2.5)[:, 0].tolist() == [16, 17, 18, 19]
+
+
+def test_appends_must_be_whole_blocks_in_order(tmp_path):
+    writer = RecordingWriter(str(tmp_path / "rec.eegr"), recording_metadata(make_amplifier("A0"), [("S0", "Fz")]),
+                             block_size=BLOCK)
+    writer.append(np.zeros((BLOCK, 1)), 8)
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((BLOCK - 1, 1)), 12)
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((BLOCK, 1)), 4)
+    writer.close()
+
+
+def test_reader_sees_blocks_appended_later(tmp_path):
+    filename = str(tmp_path / "rec.eegr")
+    write_recording(filename, [])
+    recording = Recording(filename)
+    assert recording.duration == 0.0 and recording.window(0.0, 1.0).shape == (0, 2)
+    with open(filename, 'ab') as data, open(filename + ".idx", 'ab') as index:
+        data.write(np.arange(BLOCK * 2, dtype="<f4").tobytes())
+        index.write(np.array([0], dtype="<u8").tobytes())
+    recording.refresh()
+    assert recording.window(0.0, 1.0)[:, 1].tolist() == [1, 3, 5, 7]
+
+
+def test_recorder_saves_what_the_engine_produces(tmp_path):
+    control_system = populate(EEGControlSystem(), amplifiers=1)
+    engine = AcquisitionEngine(control_system, block_size=32, clock=lambda: 0.0)
+    engine.sync(now=0.0)
+    recorder = Recorder(engine, "A0", str(tmp_path / "A0.eegr"))
+    engine.step(now=0.25)
+    assert recorder.record_available() == 64
+    engine.step(now=0.5)
+    recorder.record_available()
+    recorder.writer.close()
+
+    recording = Recording(str(tmp_path / "A0.eegr"))
+    assert recording.channels == engine.stream("A0").channels
+    assert np.array_equal(recording.window(0.0, 0.5), engine.stream("A0").ring.latest(128)[0].T)
+    with pytest.raises(ValueError):
+        Recorder(engine, "missing", str(tmp_path / "missing.eegr"))
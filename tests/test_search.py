@@ -0,0 +1,41 @@
+import random
+
+from amplifier import Amplifier
+from control_system import EEGControlSystem
+from search_index import TrigramIndex
+
+
+def test_index_finds_substrings_ignoring_case():
+    index = TrigramIndex()
+    index.add("A0", "eego mini")
+    index.add("A1", "eego sports")
+    index.add("A2", "NeurOne")
+    assert index.search("EEGO") == {"A0", "A1"}
+    assert index.search("o sp") == {"A1"}
+    # Queries shorter than a trigram fall back to scanning the distinct values.
+    assert index.search("ne") == {"A2"}
+    assert index.search("mini sports") == set()
+
+    index.remove("A0", "eego mini")
+    assert index.search("mini") == set()
+    assert index.search("eego") == {"A1"}
+
+
+def test_filter_matches_a_linear_scan():
+    control_system = EEGControlSystem()
+    generator = random.Random(7)
+    models, manufacturers = ["eego mini", "eego sports", "NeurOne Tesla"], ["ANT Neuro", "Bittium"]
+    for i in range(300):
+        control_system.add_amplifier(Amplifier(f"SN{i:04d}", generator.choice(models), generator.choice(manufacturers),
+                                               "01-01-2030", 256, 10))
+    for i in range(0, 300, 3):
+        control_system.remove_amplifier(f"SN{i:04d}")
+    amplifiers = control_system.list_amplifiers()
+
+    for criteria in [{"serial_number": "01"}, {"model_string": "EEGO"}, {"manufacturer": "ant", "model_string": "s"},
+                     {"serial_number": "SN00", "manufacturer": "bittium"}, {"model_string": "missing"}]:
+        expected = sorted(amp.serial_number for amp in amplifiers
+                          if all(query.lower() in getattr(amp, field).lower() for field, query in criteria.items()))
+        assert [amp.serial_number for amp in control_system.filter_amplifiers(**criteria)] == expected
+    assert len(control_system.search_amplifiers("neurone", "model_string")) == \
+        sum("NeurOne" in amp.model_string for amp in amplifiers)
@@ -0,0 +1,41 @@
+import json
+
+import serialization
+from control_system import EEGControlSystem
+from serialization import FragmentCache
+from tests.conftest import make_amplifier
+
+
+def test_fragment_is_reserialized_only_after_a_change():
+    control_system = EEGControlSystem()
+    control_system.add_amplifier(make_amplifier("A0"))
+    fragments = FragmentCache(control_system)
+    amplifier = control_system.amplifiers["A0"]
+
+    first = fragments.fragment(amplifier)
+    assert fragments.fragment(amplifier) is first
+    control_system.set_gain("A0", 20)
+    assert json.loads(fragments.fragment(amplifier))["gain"] == 20
+
+
+def test_readded_amplifier_gets_a_new_fragment():
+    control_system = EEGControlSystem()
+    control_system.add_amplifier(make_amplifier("A0", gain=10))
+    fragments = FragmentCache(control_system)
+    fragments.fragment(control_system.amplifiers["A0"])
+
+    control_system.remove_amplifier("A0")
+    control_system.add_amplifier(make_amplifier("A0", gain=30))
+    assert json.loads(fragments.fragment(control_system.amplifiers["A0"]))["gain"] == 30
+
+
+def test_fragments_of_removed_amplifiers_are_swept(monkeypatch):
+    monkeypatch.setattr(serialization, "SWEEP_MINIMUM", 8)
+    control_system = EEGControlSystem()
+    fragments = FragmentCache(control_system)
+    # Removed without going through the cache, as a bulk change or a replayed journal would.
+    for i in range(100):
+        control_system.add_amplifier(make_amplifier(f"A{i}"))
+        fragments.fragment(control_system.amplifiers[f"A{i}"])
+        control_system.remove_amplifier(f"A{i}")
+    assert len(fragments) <= 8
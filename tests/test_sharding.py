@@ -0,0 +1,174 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from sharding import REPOSITORY, shard_of, start_shards, stop_shards, wait_until_listening
+
+SHARDS = 3
+
+
+def free_ports(count):
+    """Returns the first of count consecutive ports that are free now."""
+    while True:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            first = probe.getsockname()[1]
+        if first + count > 65535:
+            continue
+        try:
+            for port in range(first, first + count):
+                with socket.socket() as probe:
+                    probe.bind(("127.0.0.1", port))
+        except OSError:
+            continue
+        return first
+
+
+@pytest.fixture(scope="module")
+def router(tmp_path_factory):
+    """Starts SHARDS shards and a router in front of them. Returns (router URL, shard URLs)."""
+    first = free_ports(SHARDS + 1)
+    processes, urls = start_shards(SHARDS, str(tmp_path_factory.mktemp("shards")), port=first + 1,
+                                   output=subprocess.DEVNULL)
+    try:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "shard_router:app", "--app-dir", REPOSITORY, "--port", str(first),
+             "--log-level", "warning"],
+            env=dict(os.environ, EEG_SHARDS=",".join(urls)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_listening("127.0.0.1", first, process)
+            yield f"http://127.0.0.1:{first}", urls
+        finally:
+            process.terminate()
+            process.wait(10)
+    finally:
+        stop_shards(processes)
+
+
+def call(base, method, path, body=None):
+    """Sends one request. Returns (status, decoded JSON body)."""
+    request = Request(base + path, method=method, data=json.dumps(body).encode() if body is not None else None,
+                      headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(request, timeout=10) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+def serial_on(shard, prefix):
+    """Returns the first serial number prefix<n> that lives on the given shard."""
+    return next(f"{prefix}{n}" for n in range(1000) if shard_of(f"{prefix}{n}", SHARDS) == shard)
+
+
+def add_amplifier(base, serial_number):
+    assert call(base, "POST", "/api/amplifiers", {
+        "serial_number": serial_number, "model_string": "eego mini", "manufacturer": "ANT Neuro",
+        "next_maintenance": "01-01-2030", "sampling_rate": 256, "gain": 10})[0] == 201
+
+
+def add_sensor(base, serial_number, tag="O1"):
+    assert call(base, "POST", "/api/sensors", {
+        "serial_number": serial_number, "model_string": "Ag/AgCl", "manufacturer": "ANT Neuro",
+        "next_maintenance": "01-01-2030", "tag": tag})[0] == 201
+
+
+def attach(base, amplifier_serial, sensor_serial):
+    return call(base, "POST", f"/api/amplifiers/{amplifier_serial}/sensors", {"sensor_serial": sensor_serial})
+
+
+def layout(base, amplifier_serial):
+    status, body = call(base, "GET", f"/api/amplifiers/{amplifier_serial}/layout")
+    return body["layout"] if status == 200 else None
+
+
+def test_attach_across_shards_claims_the_sensor(router):
+    base, shards = router
+    amplifier, other = serial_on(0, "AT-A"), serial_on(2, "AT-B")
+    sensor = serial_on(1, "AT-S")
+    add_amplifier(base, amplifier)
+    add_amplifier(base, other)
+    add_sensor(base, sensor, tag="Cz")
+
+    assert attach(base, amplifier, sensor)[0] == 201
+    assert layout(base, amplifier) == {"Cz": [sensor]}
+    # The sensor's shard knows the sensor is taken, so no other amplifier can have it.
+    assert attach(base, other, sensor)[0] == 409
+    assert attach(base, amplifier, sensor)[0] == 409
+    assert layout(base, other) == {}
+    # Shadows are never listed.
+    listed = [amp["serial_number"] for amp in call(base, "GET", "/api/amplifiers")[1]]
+    assert sorted(listed) == sorted([amplifier, other])
+
+
+def test_release_across_shards_frees_the_sensor(router):
+    base, shards = router
+    amplifier, other = serial_on(0, "RL-A"), serial_on(2, "RL-B")
+    sensor = serial_on(1, "RL-S")
+    add_amplifier(base, amplifier)
+    add_amplifier(base, other)
+    add_sensor(base, sensor)
+    assert attach(base, amplifier, sensor)[0] == 201
+
+    assert call(base, "DELETE", f"/api/amplifiers/{amplifier}/sensors/{sensor}")[0] == 200
+    assert layout(base, amplifier) == {}
+    assert attach(base, other, sensor)[0] == 201
+    assert layout(base, other) == {"O1": [sensor]}
+
+
+def test_failed_attach_leaves_no_shadows(router):
+    base, shards = router
+    amplifier, sensor = serial_on(0, "FA-A"), serial_on(1, "FA-S")
+    add_amplifier(base, amplifier)
+    add_sensor(base, sensor)
+
+    assert attach(base, serial_on(2, "FA-MISSING"), sensor) == (404, {"error": "Amplifier not found."})
+    assert attach(base, amplifier, serial_on(1, "FA-MISSING")) == (404, {"error": "Sensor not found."})
+    status, body = call(base, "POST", "/api/amplifiers/sensors/bulk", {"assignments": [
+        {"amplifier_serial": amplifier, "sensor_serial": sensor},
+        {"amplifier_serial": serial_on(2, "FA-B"), "sensor_serial": sensor},
+    ]})
+    assert [result.get("status") for result in body["results"]] == ["attached", None]
+    # Only the attached pair's shadow amplifier is left on the sensor's shard.
+    assert layout(shards[1], amplifier) == {"O1": [sensor]}
+    assert layout(shards[1], serial_on(2, "FA-B")) is None
+    assert layout(shards[1], serial_on(2, "FA-MISSING")) is None
+
+
+def test_removing_an_attached_sensor_detaches_it_everywhere(router):
+    base, shards = router
+    amplifier, sensor = serial_on(0, "RM-A"), serial_on(1, "RM-S")
+    add_amplifier(base, amplifier)
+    add_sensor(base, sensor)
+    assert attach(base, amplifier, sensor)[0] == 201
+
+    assert call(base, "DELETE", f"/api/sensors/{sensor}")[0] == 200
+    assert layout(base, amplifier) == {}
+    assert call(base, "GET", f"/api/sensors/{sensor}")[0] == 404
+    assert call(shards[0], "GET", f"/api/sensors/{sensor}")[0] == 404
+
+
+def test_bulk_settings_by_filter_reach_every_shard(router):
+    base, shards = router
+    amplifiers = [serial_on(shard, "BS-A") for shard in range(SHARDS)]
+    for amplifier in amplifiers:
+        add_amplifier(base, amplifier)
+
+    status, body = call(base, "PUT", "/api/amplifiers/bulk/settings",
+                        {"filter": {"serial_number": "BS-A"}, "gain": 20})
+    assert status == 200 and body["succeeded"] == SHARDS
+    status, found = call(base, "GET", "/api/amplifiers/search?serial_number=BS-A")
+    assert sorted(amp["serial_number"] for amp in found) == sorted(amplifiers)
+    assert {amp["gain"] for amp in found} == {20}
+
+
+@pytest.mark.parametrize("body", [[], {"filter": "BS-A"}, {"serial_numbers": "BS-A"}, {"gain": 20}])
+def test_malformed_bulk_settings_are_rejected(router, body):
+    base, shards = router
+    assert call(base, "PUT", "/api/amplifiers/bulk/settings", body)[0] == 400
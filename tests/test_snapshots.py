@@ -0,0 +1,55 @@
+import pytest
+
+from columnar_snapshot import LazyDeviceMap, is_columnar_snapshot
+from control_system import EEGControlSystem
+from tests.conftest import fleet_state, make_amplifier, make_sensor, populate
+
+
+def reloaded(filename):
+    control_system = EEGControlSystem()
+    control_system.load_state(filename)
+    return control_system
+
+
+@pytest.mark.parametrize("snapshot_format", ["pickle", "columnar"])
+def test_round_trip(tmp_path, snapshot_format):
+    control_system = populate(EEGControlSystem(), amplifiers=5, sensors_per_amplifier=3)
+    control_system.add_sensor(make_sensor("S-free", tag="occipital"))
+    control_system.set_sampling_rate("A3", 1024)
+    filename = str(tmp_path / "fleet.snapshot")
+    control_system.save_state(filename, snapshot_format)
+    assert is_columnar_snapshot(filename) == (snapshot_format == "columnar")
+
+    loaded = reloaded(filename)
+    assert loaded.snapshot_format == snapshot_format
+    assert isinstance(loaded.amplifiers, LazyDeviceMap) == (snapshot_format == "columnar")
+    assert fleet_state(loaded) == fleet_state(control_system)
+    assert loaded.find_sensor_owner("S2-1").serial_number == "A2"
+    assert [sensor.serial_number for sensor in loaded.sensors_by_tag("occipital", assigned=False)] == ["S-free"]
+    assert loaded.search_amplifiers("A3")[0].sampling_rate == 1024
+
+
+def test_changes_to_a_columnar_snapshot_survive_the_next_save(tmp_path):
+    control_system = populate(EEGControlSystem(), amplifiers=4)
+    control_system.save_state(str(tmp_path / "first.snapshot"), "columnar")
+
+    loaded = reloaded(str(tmp_path / "first.snapshot"))
+    loaded.set_gain("A1", 77)
+    loaded.remove_amplifier("A2")
+    loaded.add_amplifier(make_amplifier("A8"))
+    loaded.add_sensor_to_amplifier("A8", "S2-0")
+    loaded.set_power("A0", False)
+    for snapshot_format in ("columnar", "pickle"):
+        filename = str(tmp_path / f"second.{snapshot_format}")
+        loaded.save_state(filename, snapshot_format)
+        assert fleet_state(reloaded(filename)) == fleet_state(loaded)
+    assert reloaded(str(tmp_path / "second.columnar")).find_amplifier("A1").gain == 77
+
+
+
+def test_loading_a_missing_file_keeps_the_open_snapshot(tmp_path):
+    filename = str(tmp_path / "fleet.snapshot")
+    populate(EEGControlSystem(), amplifiers=2).save_state(filename, "columnar")
+    loaded = reloaded(filename)
+    loaded.load_state(str(tmp_path / "missing.snapshot"))
+    assert loaded.find_amplifier("A1").gain == 2
@@ -0,0 +1,98 @@
+import multiprocessing
+
+import pytest
+
+from control_system import EEGControlSystem
+from sqlite_registry import SQLiteRegistry
+from tests.conftest import fleet_state, make_amplifier, make_sensor
+
+WORKERS = 4
+CHANGES = 100
+
+
+def open_fleet(filename):
+    return EEGControlSystem(registry=SQLiteRegistry(filename))
+
+
+def change_gains(filename, worker):
+    """Changes the gain of the shared amplifier CHANGES times, and adds an amplifier of its own."""
+    control_system = open_fleet(filename)
+    for change in range(CHANGES):
+        control_system.set_gain("SHARED", (worker * CHANGES + change) % 100 + 1)
+    control_system.add_amplifier(make_amplifier(f"W{worker}"))
+    control_system.registry.close()
+
+
+def claim_sensor(filename, worker):
+    """Tries to attach the shared sensor to the worker's amplifier."""
+    control_system = open_fleet(filename)
+    control_system.add_sensor_to_amplifier(f"W{worker}", "SENSOR")
+    control_system.registry.close()
+
+
+def run_workers(target, *args):
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=target, args=(*args, worker)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+
+def test_processes_sharing_a_database_lose_no_updates(tmp_path):
+    filename = str(tmp_path / "fleet.db")
+    control_system = open_fleet(filename)
+    control_system.add_amplifier(make_amplifier("SHARED"))
+    version = control_system.find_amplifier("SHARED").version
+    tag = control_system.state_tag()
+
+    run_workers(change_gains, filename)
+
+    assert control_system.find_amplifier("SHARED").version == version + WORKERS * CHANGES
+    assert sorted(amp.serial_number for amp in control_system.list_amplifiers()) == \
+        ["SHARED"] + [f"W{worker}" for worker in range(WORKERS)]
+    assert control_system.state_tag() != tag
+    assert fleet_state(open_fleet(filename)) == fleet_state(control_system)
+
+
+def test_only_one_process_attaches_a_contended_sensor(tmp_path):
+    filename = str(tmp_path / "fleet.db")
+    control_system = open_fleet(filename)
+    for worker in range(WORKERS):
+        control_system.add_amplifier(make_amplifier(f"W{worker}"))
+    control_system.add_sensor(make_sensor("SENSOR"))
+
+    run_workers(claim_sensor, filename)
+
+    owner = control_system.find_sensor_owner("SENSOR")
+    assert [sensor.serial_number for sensor in owner.sensors] == ["SENSOR"]
+    assert [amp.serial_number for amp in control_system.list_amplifiers() if amp.sensors] == [owner.serial_number]
+
+
+def test_a_view_reads_its_row_once_and_writes_through(tmp_path):
+    control_system = open_fleet(str(tmp_path / "fleet.db"))
+    control_system.add_amplifier(make_amplifier("A0"))
+    statements = []
+    control_system.registry._connection.set_trace_callback(statements.append)
+
+    amplifier = control_system.registry.amplifiers["A0"]
+    assert (amplifier.gain, amplifier.sampling_rate, amplifier.is_on, amplifier.model_string) == \
+        (10, 256, False, "eego mini")
+    assert len(statements) == 1
+
+    amplifier.set_gain(20)
+    assert open_fleet(str(tmp_path / "fleet.db")).find_amplifier("A0").gain == 20
+    del statements[:]
+    version = amplifier.version
+    assert (amplifier.gain, amplifier.version) == (20, version)
+    assert len(statements) == 1
+
+
+def test_writing_to_a_removed_device_raises_key_error(tmp_path):
+    control_system = open_fleet(str(tmp_path / "fleet.db"))
+    control_system.add_amplifier(make_amplifier("A0"))
+    amplifier = control_system.registry.amplifiers["A0"]
+    control_system.remove_amplifier("A0")
+    with pytest.raises(KeyError):
+        amplifier.set_gain(20)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from acquisition import AcquisitionEngine
+from control_system import EEGControlSystem
+from streaming import StreamReader, decode_frame, decode_header, encode_header, stream_samples
+from tests.conftest import populate
+
+
+@pytest.fixture
+def engine():
+    engine = AcquisitionEngine(populate(EEGControlSystem(), amplifiers=1), block_size=32, ring_seconds=1.0,
+                               clock=lambda: 0.0)
+    engine.sync(now=0.0)
+    return engine
+
+
+def frames(reader):
+    """Returns (first sample, samples, lost) of every frame the reader has ready."""
+    result = []
+    while True:
+        frame = reader.read_frame()
+        if frame is None:
+            return result
+        first, samples, lost, end = decode_frame(frame, len(reader.stream.channels))
+        assert end == len(frame)
+        result.append((first, samples, lost))
+
+
+def test_header_describes_the_stream(engine):
+    stream = engine.stream("A0")
+    data = encode_header(stream, 2) + b"rest"
+    header, size = decode_header(data)
+    assert data[size:] == b"rest"
+    assert header == {"serial_number": "A0", "sampling_rate": 256, "decimation": 2,
+                      "channels": [{"serial_number": "S0-0", "tag": "T0"}, {"serial_number": "S0-1", "tag": "T1"}]}
+    assert decode_header(data[:size - 1]) is None
+    with pytest.raises(ValueError):
+        decode_header(b"NOPE" + data[4:])
+
+
+def test_frames_carry_the_ring_samples_in_order(engine):
+    stream = engine.stream("A0")
+    reader = StreamReader(stream, max_frame_samples=48)
+    assert reader.read_frame() is None
+    engine.step(now=0.25)
+
+    received = frames(reader)
+    assert [(first, len(samples), lost) for first, samples, lost in received] == [(0, 48, 0), (48, 16, 0)]
+    assert np.array_equal(np.vstack([samples for _, samples, _ in received]).T, stream.ring.latest(64)[0])
+
+
+def test_decimation_and_lost_samples(engine):
+    stream = engine.stream("A0")
+    reader = StreamReader(stream, decimation=4)
+    engine.step(now=0.25)
+    [(first, samples, lost)] = frames(reader)
+    assert (first, lost) == (0, 0)
+    assert np.array_equal(samples.T, stream.ring.latest(64)[0][:, ::4])
+
+    # The ring keeps one second; a reader that sleeps through more is told what it missed.
+    for tick in range(1, 10):
+        engine.step(now=0.25 + tick * 0.25)
+    [(first, samples, lost)] = frames(reader)
+    assert first == stream.ring.written - stream.ring.capacity and lost == first - 64
+    assert reader.lost == lost
+
+
+def test_stream_ends_when_the_amplifier_stops(engine):
+    items = stream_samples(engine, "A0", poll=0)
+    header, _ = decode_header(next(items))
+    assert header["serial_number"] == "A0"
+    engine.control_system.set_power("A0", False)
+    engine.sync(now=0.0)
+    assert list(items) == []
+    assert list(stream_samples(engine, "A1")) == []